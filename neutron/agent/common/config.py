@@ -31,6 +31,16 @@ ROOT_HELPER_OPTS = [
                help=_('Root helper application.')),
 ]
 
+ROOT_HELPER_DAEMON_OPTS = [
+    cfg.StrOpt('root_helper_daemon',
+               help=_("Command starting neutron-rootwrap-daemon, e.g. "
+                      "'sudo neutron-rootwrap-daemon "
+                      "/etc/neutron/rootwrap.conf'. When set, the commands "
+                      "run as root are sent to this long lived process "
+                      "instead of starting the root helper for each of "
+                      "them.")),
+]
+
 AGENT_STATE_OPTS = [
     cfg.FloatOpt('report_interval', default=30,
                  help=_('Seconds between nodes reporting state to server; '
@@ -80,6 +90,7 @@ def register_root_helper(conf):
     # The first call is to ensure backward compatibility
     conf.register_opts(ROOT_HELPER_OPTS)
     conf.register_opts(ROOT_HELPER_OPTS, 'AGENT')
+    conf.register_opts(ROOT_HELPER_DAEMON_OPTS, 'AGENT')
 
 
 def register_agent_state_opts_helper(conf):
@@ -16,6 +16,7 @@
 #    under the License.
 
 import os
+import time
 
 import eventlet
 import netaddr
@@ -25,7 +26,9 @@ from neutron.agent.common import config
 from neutron.agent.linux import dhcp
 from neutron.agent.linux import external_process
 from neutron.agent.linux import interface
+from neutron.agent.linux import ip_lib
 from neutron.agent.linux import ovs_lib  # noqa
+from neutron.agent.metadata import shared_proxy
 from neutron.agent import rpc as agent_rpc
 from neutron.common import constants
 from neutron.common import exceptions
@@ -43,6 +46,9 @@ from neutron import service as neutron_service
 
 LOG = logging.getLogger(__name__)
 
+NETWORKS_DIGEST_VERSION = '1.5'
+RELOAD_ALLOCATIONS = 'reload_allocations'
+
 
 class DhcpAgent(manager.Manager):
     OPTS = [
@@ -58,19 +64,40 @@ class DhcpAgent(manager.Manager):
                            "dedicated network. Requires "
                            "enable_isolated_metadata = True")),
         cfg.IntOpt('num_sync_threads', default=4,
-                   help=_('Number of threads to use during sync process.')),
+                   help=_('Number of threads to use during sync process '
+                          'and to process the events of different '
+                          'networks.')),
+        cfg.IntOpt('sync_networks_page_size', default=100,
+                   help=_('Number of networks whose details are requested '
+                          'with a single call during sync process.')),
         cfg.StrOpt('metadata_proxy_socket',
                    default='$state_path/metadata_proxy',
                    help=_('Location of Metadata Proxy UNIX domain '
                           'socket')),
+        cfg.BoolOpt('metadata_proxy_shared', default=False,
+                    help=_("Serve the metadata requests of all the "
+                           "namespaces of the host with a single proxy "
+                           "process.")),
+        cfg.StrOpt('metadata_proxy_control_socket',
+                   default='$state_path/metadata_proxy_control',
+                   help=_('Location of the UNIX domain socket of the shared '
+                          'metadata proxy.')),
     ]
 
     def __init__(self, host=None):
         super(DhcpAgent, self).__init__(host=host)
         self.needs_resync = False
+        self.use_networks_digest = True
         self.conf = cfg.CONF
         self.cache = NetworkCache()
+        self.network_queue = NetworkActionQueue(self.conf.num_sync_threads,
+                                                self._action_failed)
         self.root_helper = config.get_root_helper(self.conf)
+        self.shared_metadata_proxy = None
+        if self.conf.metadata_proxy_shared:
+            self.shared_metadata_proxy = (
+                shared_proxy.SharedMetadataProxyClient(
+                    self.conf, self.root_helper, constants.AGENT_TYPE_DHCP))
         self.dhcp_driver_cls = importutils.import_class(self.conf.dhcp_driver)
         ctx = context.get_admin_context_without_session()
         self.plugin_rpc = DhcpPluginApi(topics.PLUGIN,
@@ -142,33 +169,79 @@ class DhcpAgent(manager.Manager):
                 LOG.exception(_('Unable to %(action)s dhcp for %(net_id)s.')
                               % {'net_id': network.id, 'action': action})
 
+    def _action_failed(self):
+        self.needs_resync = True
+
     @utils.synchronized('dhcp-agent')
     def sync_state(self):
         """Sync the local DHCP state with Neutron."""
         LOG.info(_('Synchronizing state'))
-        pool = eventlet.GreenPool(cfg.CONF.num_sync_threads)
         known_network_ids = set(self.cache.get_network_ids())
 
         try:
-            active_networks = self.plugin_rpc.get_active_networks_info()
-            active_network_ids = set(network.id for network in active_networks)
+            digests = self._get_active_networks_digest()
+            if digests is None:
+                active_networks = self.plugin_rpc.get_active_networks_info()
+                active_network_ids = set(network.id
+                                         for network in active_networks)
+                networks_pages = [active_networks]
+            else:
+                active_network_ids = set(digests)
+                networks_pages = self._get_changed_networks(digests)
+            # The networks are configured by the network queue, so that they
+            # are not configured at the same time as events are processed
             for deleted_id in known_network_ids - active_network_ids:
-                try:
-                    self.disable_dhcp_helper(deleted_id)
-                except Exception:
-                    self.needs_resync = True
-                    LOG.exception(_('Unable to sync network state on deleted '
-                                    'network %s'), deleted_id)
-
-            for network in active_networks:
-                pool.spawn(self.safe_configure_dhcp_for_network, network)
-            pool.waitall()
+                self.network_queue.put(deleted_id, 'disable',
+                                       self.disable_dhcp_helper, deleted_id)
+
+            # The networks of a page are configured while the next page is
+            # requested
+            for networks in networks_pages:
+                for network in networks:
+                    self.network_queue.put(
+                        network.id, 'configure',
+                        self.safe_configure_dhcp_for_network, network)
+            self.network_queue.wait()
             LOG.info(_('Synchronizing state complete'))
 
         except Exception:
             self.needs_resync = True
             LOG.exception(_('Unable to sync network state.'))
 
+    def _get_active_networks_digest(self):
+        """Return a dict of active network id -> digest.
+
+        None is returned when the plugin does not support digests.
+        """
+        if self.use_networks_digest:
+            try:
+                networks = self.plugin_rpc.get_active_networks_digest()
+                return dict((network['id'], network['digest'])
+                            for network in networks)
+            except common.UnsupportedRpcVersion:
+                pass
+            except common.RemoteError as e:
+                if e.exc_type != 'UnsupportedRpcVersion':
+                    raise
+            LOG.info(_("get_active_networks_digest is not supported by the "
+                       "plugin, falling back to get_active_networks_info"))
+            self.use_networks_digest = False
+
+    def _get_changed_networks(self, digests):
+        """Yield pages of the networks whose digest changed.
+
+        The other networks are up to date in the cache.
+        """
+        changed_ids = sorted(network_id
+                             for network_id, digest in digests.iteritems()
+                             if self.cache.get_digest(network_id) != digest)
+        LOG.debug(_('%(changed)d of %(total)d networks changed'),
+                  {'changed': len(changed_ids), 'total': len(digests)})
+        page_size = max(self.conf.sync_networks_page_size, 1)
+        for i in range(0, len(changed_ids), page_size):
+            yield self.plugin_rpc.get_networks_info(
+                changed_ids[i:i + page_size])
+
     def _periodic_resync_helper(self):
         """Resync the dhcp state at the configured interval."""
         while True:
@@ -252,31 +325,48 @@ class DhcpAgent(manager.Manager):
         else:
             self.disable_dhcp_helper(network.id)
 
+    def reload_allocations_helper(self, network_id):
+        """Reload the allocations of a network from the cache."""
+        network = self.cache.get_network_by_id(network_id)
+        if network:
+            self.call_driver(
+                'reload_allocations', network,
+                changed_ports=self.cache.pop_changed_ports(network_id))
+
+    # The notification handlers only update the cache, the DHCP servers are
+    # updated by the network queue.
+
     @utils.synchronized('dhcp-agent')
     def network_create_end(self, context, payload):
         """Handle the network.create.end notification event."""
         network_id = payload['network']['id']
-        self.enable_dhcp_helper(network_id)
+        self.network_queue.put(network_id, 'enable',
+                               self.enable_dhcp_helper, network_id)
 
     @utils.synchronized('dhcp-agent')
     def network_update_end(self, context, payload):
         """Handle the network.update.end notification event."""
         network_id = payload['network']['id']
         if payload['network']['admin_state_up']:
-            self.enable_dhcp_helper(network_id)
+            self.network_queue.put(network_id, 'enable',
+                                   self.enable_dhcp_helper, network_id)
         else:
-            self.disable_dhcp_helper(network_id)
+            self.network_queue.put(network_id, 'disable',
+                                   self.disable_dhcp_helper, network_id)
 
     @utils.synchronized('dhcp-agent')
     def network_delete_end(self, context, payload):
         """Handle the network.delete.end notification event."""
-        self.disable_dhcp_helper(payload['network_id'])
+        network_id = payload['network_id']
+        self.network_queue.put(network_id, 'disable',
+                               self.disable_dhcp_helper, network_id)
 
     @utils.synchronized('dhcp-agent')
     def subnet_update_end(self, context, payload):
         """Handle the subnet.update.end notification event."""
         network_id = payload['subnet']['network_id']
-        self.refresh_dhcp_helper(network_id)
+        self.network_queue.put(network_id, 'refresh',
+                               self.refresh_dhcp_helper, network_id)
 
     # Use the update handler for the subnet create event.
     subnet_create_end = subnet_update_end
@@ -287,7 +377,8 @@ class DhcpAgent(manager.Manager):
         subnet_id = payload['subnet_id']
         network = self.cache.get_network_by_subnet_id(subnet_id)
         if network:
-            self.refresh_dhcp_helper(network.id)
+            self.network_queue.put(network.id, 'refresh',
+                                   self.refresh_dhcp_helper, network.id)
 
     @utils.synchronized('dhcp-agent')
     def port_update_end(self, context, payload):
@@ -296,7 +387,9 @@ class DhcpAgent(manager.Manager):
         network = self.cache.get_network_by_id(updated_port.network_id)
         if network:
             self.cache.put_port(updated_port)
-            self.call_driver('reload_allocations', network)
+            self.network_queue.put(network.id, RELOAD_ALLOCATIONS,
+                                   self.reload_allocations_helper,
+                                   network.id)
 
     # Use the update handler for the port create event.
     port_create_end = port_update_end
@@ -308,7 +401,9 @@ class DhcpAgent(manager.Manager):
         if port:
             network = self.cache.get_network_by_id(port.network_id)
             self.cache.remove_port(port)
-            self.call_driver('reload_allocations', network)
+            self.network_queue.put(network.id, RELOAD_ALLOCATIONS,
+                                   self.reload_allocations_helper,
+                                   network.id)
 
     def enable_isolated_metadata_proxy(self, network):
 
@@ -316,6 +411,7 @@ class DhcpAgent(manager.Manager):
         # or all the networks connected via a router
         # to the one passed as a parameter
         neutron_lookup_param = '--network_id=%s' % network.id
+        router_id = None
         meta_cidr = netaddr.IPNetwork(dhcp.METADATA_DEFAULT_CIDR)
         has_metadata_subnet = any(netaddr.IPNetwork(s.cidr) in meta_cidr
                                   for s in network.subnets)
@@ -333,8 +429,8 @@ class DhcpAgent(manager.Manager):
                                 {'port_num': len(router_ports),
                                  'port_id': router_ports[0].id,
                                  'router_id': router_ports[0].device_id})
-                neutron_lookup_param = ('--router_id=%s' %
-                                        router_ports[0].device_id)
+                router_id = router_ports[0].device_id
+                neutron_lookup_param = '--router_id=%s' % router_id
 
         def callback(pid_file):
             metadata_proxy_socket = cfg.CONF.metadata_proxy_socket
@@ -353,9 +449,19 @@ class DhcpAgent(manager.Manager):
             network.id,
             self.root_helper,
             network.namespace)
+        if self.shared_metadata_proxy:
+            # A proxy started for the network alone would hold the port
+            pm.disable()
+            self.shared_metadata_proxy.add(
+                network.namespace, dhcp.METADATA_PORT,
+                network_id=None if router_id else network.id,
+                router_id=router_id)
+            return
         pm.enable(callback)
 
     def disable_isolated_metadata_proxy(self, network):
+        if self.shared_metadata_proxy:
+            self.shared_metadata_proxy.remove(network.namespace)
         pm = external_process.ProcessManager(
             self.conf,
             network.id,
@@ -364,6 +470,91 @@ class DhcpAgent(manager.Manager):
         pm.disable()
 
 
+class NetworkActionQueue(object):
+    """Run the actions queued for each network in the background.
+
+    The actions of a network run in order in a single greenthread, and at
+    most num_threads networks are processed at once. The actions queued
+    while a network is busy are coalesced before they run: identical
+    actions run once, and reloading the allocations is skipped when any
+    other action, which fully updates the DHCP server, is pending.
+    """
+
+    def __init__(self, num_threads, error_callback=None):
+        self.pool = eventlet.GreenPool(num_threads)
+        self.error_callback = error_callback
+        # network id -> list of (name, func, args, queue time)
+        self.pending = {}
+        self.busy = set()
+        self.max_latency = 0
+
+    def put(self, network_id, name, func, *args):
+        """Queue func(*args), identified by name, for a network."""
+        self.pending.setdefault(network_id, []).append(
+            (name, func, args, time.time()))
+        if network_id not in self.busy:
+            self.busy.add(network_id)
+            self.pool.spawn_n(self._process, network_id)
+
+    def wait(self):
+        """Wait until all the queued actions have run."""
+        self.pool.waitall()
+
+    @staticmethod
+    def coalesce(actions):
+        if any(action[0] != RELOAD_ALLOCATIONS for action in actions):
+            actions = [action for action in actions
+                       if action[0] != RELOAD_ALLOCATIONS]
+        # Identical actions run once, in the place of the last one
+        names = set()
+        coalesced = []
+        for action in reversed(actions):
+            if action[0] not in names:
+                names.add(action[0])
+                coalesced.append(action)
+        coalesced.reverse()
+        return coalesced
+
+    def _process(self, network_id):
+        try:
+            while True:
+                actions = self.pending.pop(network_id, None)
+                if not actions:
+                    break
+                coalesced = self.coalesce(actions)
+                for name, func, args, queued in coalesced:
+                    try:
+                        func(*args)
+                    except Exception:
+                        LOG.exception(_('Unable to %(action)s network '
+                                        '%(net_id)s'),
+                                      {'action': name, 'net_id': network_id})
+                        if self.error_callback:
+                            self.error_callback()
+                latency = time.time() - actions[0][3]
+                self.max_latency = max(self.max_latency, latency)
+                LOG.debug(_('Processed %(events)d events of network '
+                            '%(net_id)s with %(actions)d actions in '
+                            '%(latency).3f seconds'),
+                          {'events': len(actions), 'net_id': network_id,
+                           'actions': len(coalesced), 'latency': latency})
+        finally:
+            self.busy.discard(network_id)
+
+    def get_state(self):
+        """Return the queue depth and the maximum event latency.
+
+        The latency is the longest time, since the previous call, between
+        the queuing of an event and the end of its processing.
+        """
+        queued = sum(len(actions) for actions in self.pending.itervalues())
+        state = {'queued_network_events': queued,
+                 'busy_networks': len(self.busy),
+                 'max_network_event_latency': round(self.max_latency, 3)}
+        self.max_latency = 0
+        return state
+
+
 class DhcpPluginApi(proxy.RpcProxy):
     """Agent side of the dhcp rpc API.
 
@@ -371,6 +562,8 @@ class DhcpPluginApi(proxy.RpcProxy):
         1.0 - Initial version.
         1.1 - Added get_active_networks_info, create_dhcp_port,
               and update_dhcp_port methods.
+        1.5 - Added get_active_networks_digest and get_networks_info
+              (ML2 only).
 
     """
 
@@ -391,6 +584,24 @@ class DhcpPluginApi(proxy.RpcProxy):
                              topic=self.topic)
         return [dhcp.NetModel(self.use_namespaces, n) for n in networks]
 
+    def get_active_networks_digest(self):
+        """Make a remote process call to retrieve the network digests."""
+        return self.call(self.context,
+                         self.make_msg('get_active_networks_digest',
+                                       host=self.host),
+                         topic=self.topic,
+                         version=NETWORKS_DIGEST_VERSION)
+
+    def get_networks_info(self, network_ids):
+        """Make a remote process call to retrieve info of networks."""
+        networks = self.call(self.context,
+                             self.make_msg('get_networks_info',
+                                           network_ids=network_ids,
+                                           host=self.host),
+                             topic=self.topic,
+                             version=NETWORKS_DIGEST_VERSION)
+        return [dhcp.NetModel(self.use_namespaces, n) for n in networks]
+
     def get_network_info(self, network_id):
         """Make a remote process call to retrieve network info."""
         network = self.call(self.context,
@@ -459,6 +670,12 @@ class NetworkCache(object):
         self.cache = {}
         self.subnet_lookup = {}
         self.port_lookup = {}
+        # network id -> digest of the network as returned by the plugin,
+        # cleared as soon as the cached network is modified
+        self.digests = {}
+        # network id -> ids of the ports put or removed since the last
+        # reload of the allocations of the network
+        self.changed_ports = {}
 
     def get_network_ids(self):
         return self.cache.keys()
@@ -472,11 +689,26 @@ class NetworkCache(object):
     def get_network_by_port_id(self, port_id):
         return self.cache.get(self.port_lookup.get(port_id))
 
+    def get_digest(self, network_id):
+        return self.digests.get(network_id)
+
+    def pop_changed_ports(self, network_id):
+        """Return and forget the ids of the ports changed in a network.
+
+        None is returned for a network which is not cached.
+        """
+        changed_ports = self.changed_ports.get(network_id)
+        if changed_ports is not None:
+            self.changed_ports[network_id] = set()
+        return changed_ports
+
     def put(self, network):
         if network.id in self.cache:
             self.remove(self.cache[network.id])
 
         self.cache[network.id] = network
+        self.digests[network.id] = getattr(network, 'digest', None)
+        self.changed_ports[network.id] = set()
 
         for subnet in network.subnets:
             self.subnet_lookup[subnet.id] = network.id
@@ -486,6 +718,8 @@ class NetworkCache(object):
 
     def remove(self, network):
         del self.cache[network.id]
+        self.digests.pop(network.id, None)
+        self.changed_ports.pop(network.id, None)
 
         for subnet in network.subnets:
             del self.subnet_lookup[subnet.id]
@@ -503,6 +737,8 @@ class NetworkCache(object):
             network.ports.append(port)
 
         self.port_lookup[port.id] = network.id
+        self.digests.pop(network.id, None)
+        self.changed_ports.setdefault(network.id, set()).add(port.id)
 
     def remove_port(self, port):
         network = self.get_network_by_port_id(port.id)
@@ -511,6 +747,8 @@ class NetworkCache(object):
             if network.ports[index] == port:
                 del network.ports[index]
                 del self.port_lookup[port.id]
+                self.digests.pop(network.id, None)
+                self.changed_ports.setdefault(network.id, set()).add(port.id)
                 break
 
     def get_port_by_id(self, port_id):
@@ -559,6 +797,8 @@ class DhcpAgentWithStateReport(DhcpAgent):
         try:
             self.agent_state.get('configurations').update(
                 self.cache.get_state())
+            self.agent_state.get('configurations').update(
+                self.network_queue.get_state())
             ctx = context.get_admin_context_without_session()
             self.state_rpc.report_state(ctx, self.agent_state, self.use_call)
             self.use_call = False
@@ -592,6 +832,7 @@ def register_options():
     config.register_root_helper(cfg.CONF)
     cfg.CONF.register_opts(dhcp.OPTS)
     cfg.CONF.register_opts(interface.OPTS)
+    cfg.CONF.register_opts(ip_lib.OPTS)
 
 
 def main():
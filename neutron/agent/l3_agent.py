@@ -13,7 +13,14 @@
 #    under the License.
 #
 
+import collections
+import heapq
+import itertools
+import os
+import time
+
 import eventlet
+from eventlet import event
 import netaddr
 from oslo.config import cfg
 
@@ -21,8 +28,10 @@ from neutron.agent.common import config
 from neutron.agent.linux import external_process
 from neutron.agent.linux import interface
 from neutron.agent.linux import ip_lib
+from neutron.agent.linux import ip_netlink
 from neutron.agent.linux import iptables_manager
 from neutron.agent.linux import ovs_lib  # noqa
+from neutron.agent.metadata import shared_proxy
 from neutron.agent import rpc as agent_rpc
 from neutron.common import constants as l3_constants
 from neutron.common import topics
@@ -35,7 +44,6 @@ from neutron.openstack.common import lockutils
 from neutron.openstack.common import log as logging
 from neutron.openstack.common import loopingcall
 from neutron.openstack.common import periodic_task
-from neutron.openstack.common import processutils
 from neutron.openstack.common.rpc import common as rpc_common
 from neutron.openstack.common.rpc import proxy
 from neutron.openstack.common import service
@@ -48,6 +56,11 @@ INTERNAL_DEV_PREFIX = 'qr-'
 EXTERNAL_DEV_PREFIX = 'qg-'
 RPC_LOOP_INTERVAL = 1
 FLOATING_IP_CIDR_SUFFIX = '/32'
+# Priorities of the router updates, the lowest value is processed first
+PRIORITY_RPC = 0
+PRIORITY_SYNC_ROUTERS_TASK = 1
+# Action of an update removing a router from the agent
+DELETE_ROUTER = 'delete'
 
 
 class L3PluginApi(proxy.RpcProxy):
@@ -57,6 +70,8 @@ class L3PluginApi(proxy.RpcProxy):
         1.0 - Initial version.
         1.1 - Floating IP operational status updates
 
+    Plugins ignoring the revisions given to sync_routers return full
+    routers instead of deltas.
     """
 
     BASE_RPC_API_VERSION = '1.0'
@@ -66,11 +81,16 @@ class L3PluginApi(proxy.RpcProxy):
             topic=topic, default_version=self.BASE_RPC_API_VERSION)
         self.host = host
 
-    def get_routers(self, context, router_ids=None):
-        """Make a remote process call to retrieve the sync data for routers."""
+    def get_routers(self, context, router_ids=None, revisions=None):
+        """Make a remote process call to retrieve the sync data for routers.
+
+        revisions maps router ids to the revision known by the agent, from
+        which the plugin may return a delta instead of the full router.
+        """
         return self.call(context,
                          self.make_msg('sync_routers', host=self.host,
-                                       router_ids=router_ids),
+                                       router_ids=router_ids,
+                                       revisions=revisions),
                          topic=self.topic)
 
     def get_external_network_id(self, context):
@@ -104,6 +124,10 @@ class RouterInfo(object):
         self._snat_action = None
         self.internal_ports = []
         self.floating_ips = set()
+        # floating ip id -> (floating ip, fixed ip) of its NAT rules
+        self.floating_ip_nat_rules = {}
+        # Revision of the router when it was last successfully processed
+        self.revision = None
         self.root_helper = root_helper
         self.use_namespaces = use_namespaces
         # Invoke the setter for establishing initial SNAT action
@@ -142,6 +166,198 @@ class RouterInfo(object):
         self._snat_action = None
 
 
+class RouterUpdate(object):
+    """An update of a router to process.
+
+    router holds the router data fetched from the plugin at timestamp, or
+    None if action is DELETE_ROUTER.
+    """
+
+    def __init__(self, router_id, priority, action=None, router=None,
+                 timestamp=None):
+        self.router_id = router_id
+        self.priority = priority
+        self.action = action
+        self.router = router
+        self.timestamp = timestamp or time.time()
+
+    def merge(self, update):
+        """Merge a later update of the router into this one.
+
+        The most recent data is kept, with the highest priority.
+        """
+        self.priority = min(self.priority, update.priority)
+        if update.timestamp >= self.timestamp:
+            self.action = update.action
+            self.router = update.router
+            self.timestamp = update.timestamp
+
+
+class RouterProcessingQueue(object):
+    """Process the router updates in priority order.
+
+    At most num_workers routers are processed at once, and a router is
+    only processed by one worker at a time. The updates of a router queued
+    while it waits or is being processed are merged into one, and updates
+    older than the data last processed for a router are dropped.
+    """
+
+    def __init__(self, num_workers, process_func, error_callback=None):
+        self.pool = eventlet.GreenPool(num_workers)
+        self.process_func = process_func
+        self.error_callback = error_callback
+        # router id -> RouterUpdate
+        self.pending = {}
+        self.busy = set()
+        # router id -> timestamp of the last update processed
+        self.timestamps = {}
+        # (priority, sequence number, router id) of the pending routers
+        self._heap = []
+        self._sequence = itertools.count()
+
+    def add(self, update):
+        pending = self.pending.get(update.router_id)
+        if pending is None:
+            self.pending[update.router_id] = update
+        else:
+            priority = pending.priority
+            pending.merge(update)
+            if pending.priority == priority:
+                # Already in the heap with this priority
+                return
+        if update.router_id not in self.busy:
+            self._push(update.router_id)
+            self._start_workers()
+
+    def wait(self):
+        """Wait until all the queued updates have been processed."""
+        self.pool.waitall()
+
+    def forget(self, router_id):
+        """Forget the time of the last update processed of a removed router.
+        """
+        self.timestamps.pop(router_id, None)
+
+    def _push(self, router_id):
+        heapq.heappush(self._heap, (self.pending[router_id].priority,
+                                    next(self._sequence), router_id))
+
+    def _next_update(self):
+        """Pop the most urgent update of a router which is not busy."""
+        while self._heap:
+            priority, _seq, router_id = heapq.heappop(self._heap)
+            update = self.pending.get(router_id)
+            if (update is None or update.priority != priority or
+                router_id in self.busy):
+                # Stale entry, the router was processed or requeued since
+                continue
+            del self.pending[router_id]
+            self.busy.add(router_id)
+            return update
+
+    def _start_workers(self):
+        while self.pool.free():
+            update = self._next_update()
+            if update is None:
+                break
+            self.pool.spawn_n(self._worker, update)
+
+    def _worker(self, update):
+        while update:
+            self._process(update)
+            self.busy.discard(update.router_id)
+            if update.router_id in self.pending:
+                self._push(update.router_id)
+            update = self._next_update()
+
+    def _process(self, update):
+        router_id = update.router_id
+        try:
+            if update.timestamp < self.timestamps.get(router_id, 0):
+                LOG.debug(_('Skipping outdated update of router %s'),
+                          router_id)
+            else:
+                self.timestamps[router_id] = update.timestamp
+                self.process_func(update)
+        except Exception:
+            LOG.exception(_('Failed to process router %s'), router_id)
+            if self.error_callback:
+                self.error_callback()
+
+    def __len__(self):
+        return len(self.pending)
+
+
+class NamespaceCollector(object):
+    """Destroy router namespaces in the background.
+
+    At most num_workers namespaces are destroyed at once, and at most rate
+    of them are started per second (no limit if rate is 0), so that a large
+    cleanup does not delay the processing of the routers.
+    """
+
+    def __init__(self, num_workers, rate, destroy_func):
+        self.pool = eventlet.GreenPool(num_workers)
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.destroy_func = destroy_func
+        self.pending = collections.OrderedDict()
+        # namespace -> event sent once it is destroyed
+        self.busy = {}
+        self.destroyed = 0
+        self.failed = 0
+        self._dispatcher = None
+
+    def add(self, namespace):
+        if namespace in self.pending or namespace in self.busy:
+            return
+        self.pending[namespace] = None
+        if self._dispatcher is None:
+            self._dispatcher = eventlet.spawn(self._dispatch)
+
+    def cancel(self, namespace):
+        """Cancel the destruction of namespace, or wait until it is over."""
+        self.pending.pop(namespace, None)
+        done = self.busy.get(namespace)
+        if done is not None:
+            done.wait()
+
+    def wait(self):
+        """Wait until all the queued namespaces have been destroyed."""
+        while self._dispatcher is not None:
+            self._dispatcher.wait()
+        self.pool.waitall()
+
+    def stats(self):
+        return {'pending': len(self.pending) + len(self.busy),
+                'destroyed': self.destroyed,
+                'failed': self.failed}
+
+    def _dispatch(self):
+        try:
+            while self.pending:
+                namespace = self.pending.popitem(last=False)[0]
+                self.busy[namespace] = event.Event()
+                # Blocks while all the workers are busy
+                self.pool.spawn_n(self._destroy, namespace)
+                if self.interval:
+                    eventlet.sleep(self.interval)
+        finally:
+            self._dispatcher = None
+
+    def _destroy(self, namespace):
+        try:
+            self.destroy_func(namespace)
+            self.destroyed += 1
+        except Exception:
+            LOG.exception(_('Failed to destroy namespace %s'), namespace)
+            self.failed += 1
+        finally:
+            self.busy.pop(namespace).send()
+        if not self.pending and not self.busy:
+            LOG.info(_('Namespace cleanup done: %(destroyed)d destroyed, '
+                       '%(failed)d failed'), self.stats())
+
+
 class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
     """Manager for L3NatAgent
 
@@ -185,6 +401,23 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
                    default='$state_path/metadata_proxy',
                    help=_('Location of Metadata Proxy UNIX domain '
                           'socket')),
+        cfg.BoolOpt('metadata_proxy_shared', default=False,
+                    help=_("Serve the metadata requests of all the "
+                           "namespaces of the host with a single proxy "
+                           "process.")),
+        cfg.StrOpt('metadata_proxy_control_socket',
+                   default='$state_path/metadata_proxy_control',
+                   help=_('Location of the UNIX domain socket of the shared '
+                          'metadata proxy.')),
+        cfg.IntOpt('router_processing_workers', default=8,
+                   help=_("Number of routers processed concurrently.")),
+        cfg.IntOpt('namespace_cleanup_workers', default=4,
+                   help=_("Number of router namespaces destroyed "
+                          "concurrently in the background.")),
+        cfg.FloatOpt('namespace_cleanup_rate', default=10,
+                     help=_("Maximum number of router namespaces whose "
+                            "destruction starts per second, 0 for no "
+                            "limit.")),
     ]
 
     def __init__(self, host, conf=None):
@@ -214,6 +447,19 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
         self.updated_routers = set()
         self.removed_routers = set()
         self.sync_progress = False
+        self.router_queue = RouterProcessingQueue(
+            self.conf.router_processing_workers,
+            self._process_router_update, self._router_update_failed)
+        self.namespace_collector = NamespaceCollector(
+            self.conf.namespace_cleanup_workers,
+            self.conf.namespace_cleanup_rate,
+            self._destroy_stale_router_namespace)
+
+        self.shared_metadata_proxy = None
+        if self.conf.metadata_proxy_shared:
+            self.shared_metadata_proxy = (
+                shared_proxy.SharedMetadataProxyClient(
+                    self.conf, self.root_helper, l3_constants.AGENT_TYPE_L3))
 
         self._clean_stale_namespaces = self.conf.use_namespaces
 
@@ -267,20 +513,26 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
 
         The argumenet router_namespaces is a list of stale router namespaces
 
+        They are destroyed in the background by self.namespace_collector.
         As some stale router namespaces may not be able to be deleted, only
         one attempt will be made to delete them.
         """
         for ns in router_namespaces:
-            if self.conf.enable_metadata_proxy:
-                self._destroy_metadata_proxy(ns[len(NS_PREFIX):], ns)
-
-            try:
-                self._destroy_router_namespace(ns)
-            except RuntimeError:
-                LOG.exception(_('Failed to destroy stale router namespace '
-                                '%s'), ns)
+            self.namespace_collector.add(ns)
         self._clean_stale_namespaces = False
 
+    def _destroy_stale_router_namespace(self, ns):
+        router_id = ns[len(NS_PREFIX):]
+        if router_id in self.router_info:
+            # The router was added back since
+            return
+        # Checked without forking 'ip netns list' for each namespace
+        if not os.path.exists(os.path.join(ip_netlink.NETNS_DIR, ns)):
+            return
+        if self.conf.enable_metadata_proxy:
+            self._destroy_metadata_proxy(router_id, ns)
+        self._destroy_router_namespace(ns)
+
     def _destroy_router_namespace(self, namespace):
         ns_ip = ip_lib.IPWrapper(self.root_helper, namespace=namespace)
         for d in ns_ip.get_devices(exclude_loopback=True):
@@ -339,6 +591,7 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
                         self.conf.use_namespaces, router)
         self.router_info[router_id] = ri
         if self.conf.use_namespaces:
+            self.namespace_collector.cancel(ri.ns_name)
             self._create_router_namespace(ri)
         for c, r in self.metadata_filter_rules():
             ri.iptables_manager.ipv4['filter'].add_rule(c, r)
@@ -350,10 +603,14 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
             self._spawn_metadata_proxy(ri.router_id, ri.ns_name)
 
     def _router_removed(self, router_id):
+        self.router_queue.forget(router_id)
         ri = self.router_info.get(router_id)
         if ri is None:
             LOG.warn(_("Info for router %s were not found. "
                        "Skipping router removal"), router_id)
+            if self.conf.use_namespaces:
+                # Its namespace may have been left over by a previous run
+                self.namespace_collector.add(NS_PREFIX + router_id)
             return
         ri.router['gw_port'] = None
         ri.router[l3_constants.INTERFACE_KEY] = []
@@ -367,9 +624,20 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
         if self.conf.enable_metadata_proxy:
             self._destroy_metadata_proxy(ri.router_id, ri.ns_name)
         del self.router_info[router_id]
-        self._destroy_router_namespace(ri.ns_name)
+        if self.conf.use_namespaces:
+            self.namespace_collector.add(ri.ns_name)
+        else:
+            self._destroy_router_namespace(ri.ns_name)
 
     def _spawn_metadata_proxy(self, router_id, ns_name):
+        if self.shared_metadata_proxy:
+            # A proxy started for the router alone would hold the port
+            external_process.ProcessManager(
+                self.conf, router_id, self.root_helper, ns_name).disable()
+            self.shared_metadata_proxy.add(ns_name, self.conf.metadata_port,
+                                           router_id=router_id)
+            return
+
         def callback(pid_file):
             metadata_proxy_socket = cfg.CONF.metadata_proxy_socket
             proxy_cmd = ['neutron-ns-metadata-proxy',
@@ -391,6 +659,8 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
         pm.enable(callback)
 
     def _destroy_metadata_proxy(self, router_id, ns_name):
+        if self.shared_metadata_proxy:
+            self.shared_metadata_proxy.remove(ns_name)
         pm = external_process.ProcessManager(
             self.conf,
             router_id,
@@ -538,19 +808,23 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
     def process_router_floating_ip_nat_rules(self, ri):
         """Configure NAT rules for the router's floating IPs.
 
-        Configures iptables rules for the floating ips of the given router
+        Only the rules of the floating IPs added, removed or remapped since
+        the rules were last configured are changed.
         """
-        # Clear out all iptables rules for floating ips
-        ri.iptables_manager.ipv4['nat'].clear_rules_by_tag('floating_ip')
-
-        # Loop once to ensure that floating ips are configured.
-        for fip in ri.router.get(l3_constants.FLOATINGIP_KEY, []):
-            # Rebuild iptables rules for the floating ip.
-            fixed = fip['fixed_ip_address']
-            fip_ip = fip['floating_ip_address']
-            for chain, rule in self.floating_forward_rules(fip_ip, fixed):
-                ri.iptables_manager.ipv4['nat'].add_rule(chain, rule,
-                                                         tag='floating_ip')
+        nat = ri.iptables_manager.ipv4['nat']
+        floating_ips = dict(
+            (fip['id'], (fip['floating_ip_address'], fip['fixed_ip_address']))
+            for fip in ri.router.get(l3_constants.FLOATINGIP_KEY, []))
+        for fip_id, addresses in ri.floating_ip_nat_rules.items():
+            if floating_ips.get(fip_id) != addresses:
+                for chain, rule in self.floating_forward_rules(*addresses):
+                    nat.remove_rule(chain, rule)
+                del ri.floating_ip_nat_rules[fip_id]
+        for fip_id, addresses in floating_ips.iteritems():
+            if fip_id not in ri.floating_ip_nat_rules:
+                for chain, rule in self.floating_forward_rules(*addresses):
+                    nat.add_rule(chain, rule, tag='floating_ip')
+                ri.floating_ip_nat_rules[fip_id] = addresses
 
         ri.iptables_manager.apply()
 
@@ -566,6 +840,9 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
                                  namespace=ri.ns_name)
         existing_cidrs = set([addr['cidr'] for addr in device.addr.list()])
         new_cidrs = set()
+        # The addresses are added and removed with a single ip command
+        batch = ip_lib.IpBatch(self.root_helper, namespace=ri.ns_name)
+        added_fips = []
 
         # Loop once to ensure that floating ips are configured.
         for fip in ri.router.get(l3_constants.FLOATINGIP_KEY, []):
@@ -576,21 +853,10 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
 
             if ip_cidr not in existing_cidrs:
                 net = netaddr.IPNetwork(ip_cidr)
-                try:
-                    device.addr.add(net.version, ip_cidr, str(net.broadcast))
-                except (processutils.UnknownArgumentError,
-                        processutils.ProcessExecutionError):
-                    # any exception occurred here should cause the floating IP
-                    # to be set in error state
-                    fip_statuses[fip['id']] = (
-                        l3_constants.FLOATINGIP_STATUS_ERROR)
-                    LOG.warn(_("Unable to configure IP address for "
-                               "floating IP: %s"), fip['id'])
-                    continue
-                # As GARP is processed in a distinct thread the call below
-                # won't raise an exception to be handled.
-                self._send_gratuitous_arp_packet(
-                    ri, interface_name, fip_ip)
+                # Only queued: failures are handled once the batch is run
+                device.addr.add(net.version, ip_cidr, str(net.broadcast),
+                                batch=batch)
+                added_fips.append((fip, ip_cidr))
             fip_statuses[fip['id']] = (
                 l3_constants.FLOATINGIP_STATUS_ACTIVE)
 
@@ -598,7 +864,31 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
         for ip_cidr in existing_cidrs - new_cidrs:
             if ip_cidr.endswith(FLOATING_IP_CIDR_SUFFIX):
                 net = netaddr.IPNetwork(ip_cidr)
-                device.addr.delete(net.version, ip_cidr)
+                device.addr.delete(net.version, ip_cidr, batch=batch)
+
+        try:
+            batch.execute()
+        except RuntimeError:
+            # The other commands of the batch were run, find out which
+            # floating IPs are not configured
+            LOG.warn(_("Unable to update the floating IP addresses of "
+                       "router %s"), ri.router_id)
+            configured_cidrs = set(addr['cidr']
+                                   for addr in device.addr.list())
+            for fip, ip_cidr in added_fips:
+                if ip_cidr not in configured_cidrs:
+                    fip_statuses[fip['id']] = (
+                        l3_constants.FLOATINGIP_STATUS_ERROR)
+                    LOG.warn(_("Unable to configure IP address for "
+                               "floating IP: %s"), fip['id'])
+
+        for fip, ip_cidr in added_fips:
+            if (fip_statuses[fip['id']] ==
+                l3_constants.FLOATINGIP_STATUS_ACTIVE):
+                # As GARP is processed in a distinct thread the call below
+                # won't raise an exception to be handled.
+                self._send_gratuitous_arp_packet(
+                    ri, interface_name, fip['floating_ip_address'])
         return fip_statuses
 
     def _get_ex_gw_port(self, ri):
@@ -748,14 +1038,24 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
         LOG.debug(_('Got router added to agent :%r'), payload)
         self.routers_updated(context, payload)
 
-    def _process_routers(self, routers, all_routers=False):
-        pool = eventlet.GreenPool()
+    def _process_routers(self, routers, all_routers=False, timestamp=None):
+        """Queue the updates of routers fetched from the plugin.
+
+        The updates of a full sync, when all_routers is True, have a lower
+        priority than the updates notified by the plugin. timestamp is the
+        time the routers were fetched at.
+        """
         if (self.conf.external_network_bridge and
             not ip_lib.device_exists(self.conf.external_network_bridge)):
             LOG.error(_("The external network bridge '%s' does not exist"),
                       self.conf.external_network_bridge)
             return
 
+        if all_routers:
+            priority = PRIORITY_SYNC_ROUTERS_TASK
+        else:
+            priority = PRIORITY_RPC
+        timestamp = timestamp or time.time()
         target_ex_net_id = self._fetch_external_net_id()
         # if routers are all the routers we have (They are from router sync on
         # starting or when error occurs during running), we seek the
@@ -763,7 +1063,8 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
         # If routers are from server side notification, we seek them
         # from subset of incoming routers and ones we have now.
         if all_routers:
-            prev_router_ids = set(self.router_info)
+            prev_router_ids = (set(self.router_info) |
+                               set(self.router_queue.pending))
         else:
             prev_router_ids = set(self.router_info) & set(
                 [router['id'] for router in routers])
@@ -784,15 +1085,67 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
                 if (ex_net_id != self._fetch_external_net_id(force=True)):
                     continue
             cur_router_ids.add(r['id'])
-            if r['id'] not in self.router_info:
-                self._router_added(r['id'], r)
-            ri = self.router_info[r['id']]
-            ri.router = r
-            pool.spawn_n(self.process_router, ri)
+            self.router_queue.add(RouterUpdate(r['id'], priority, router=r,
+                                               timestamp=timestamp))
         # identify and remove routers that no longer exist
         for router_id in prev_router_ids - cur_router_ids:
-            pool.spawn_n(self._router_removed, router_id)
-        pool.waitall()
+            self.router_queue.add(RouterUpdate(router_id, priority,
+                                               action=DELETE_ROUTER,
+                                               timestamp=timestamp))
+
+    def _process_router_update(self, update):
+        """Apply an update of the router queue."""
+        if update.action == DELETE_ROUTER:
+            self._router_removed(update.router_id)
+            return
+        router = update.router
+        ri = self.router_info.get(update.router_id)
+        if router.get('delta'):
+            router = self._apply_router_delta(ri, router)
+            if router is None:
+                return
+        if ri is None:
+            self._router_added(update.router_id, router)
+            ri = self.router_info[update.router_id]
+        elif ri.revision and ri.revision == router.get('revision'):
+            LOG.debug(_("Router %s is unchanged"), update.router_id)
+            return
+        ri.revision = None
+        ri.router = router
+        self.process_router(ri)
+        ri.revision = router.get('revision')
+
+    def _apply_router_delta(self, ri, delta):
+        """Return the router resulting from a delta returned by the plugin.
+
+        None is returned, and the router is fetched again in full, if the
+        delta is not from the revision of the router known by the agent.
+        """
+        if ri is None or ri.revision != delta['base_revision']:
+            LOG.debug(_("Router %s changed since its delta was requested, "
+                        "fetching it again"), delta['id'])
+            if ri is not None:
+                ri.revision = None
+            self.updated_routers.add(delta['id'])
+            return
+        delta_keys = (l3_constants.INTERFACE_KEY, l3_constants.FLOATINGIP_KEY)
+        removed_keys = [key + l3_constants.REMOVED_KEY_SUFFIX
+                        for key in delta_keys]
+        router = dict((key, value) for key, value in delta.iteritems()
+                      if key not in removed_keys and
+                      key not in ('delta', 'base_revision'))
+        for key, removed_key in zip(delta_keys, removed_keys):
+            removed = set(delta[removed_key])
+            changed = dict((item['id'], item) for item in delta[key])
+            items = [changed.pop(item['id'], item)
+                     for item in ri.router.get(key, [])
+                     if item['id'] not in removed]
+            router[key] = items + changed.values()
+        return router
+
+    def _router_update_failed(self):
+        # The failed routers are processed again by a full sync
+        self.fullsync = True
 
     @lockutils.synchronized('l3-agent', 'neutron-')
     def _rpc_loop(self):
@@ -805,14 +1158,22 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
                       len(self.updated_routers))
             if self.updated_routers:
                 router_ids = list(self.updated_routers)
+                # Only the changes of the routers known by the agent are
+                # returned by the plugin
+                revisions = dict(
+                    (router_id, self.router_info[router_id].revision)
+                    for router_id in router_ids
+                    if router_id in self.router_info and
+                    self.router_info[router_id].revision)
+                timestamp = time.time()
                 routers = self.plugin_rpc.get_routers(
-                    self.context, router_ids)
+                    self.context, router_ids, revisions=revisions)
 
                 fetched = set([r['id'] for r in routers])
                 self.removed_routers.update(self.updated_routers - fetched)
                 self.updated_routers.clear()
 
-                self._process_routers(routers)
+                self._process_routers(routers, timestamp=timestamp)
             self._process_router_delete()
             LOG.debug(_("RPC loop successfully completed"))
         except Exception:
@@ -822,7 +1183,8 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
     def _process_router_delete(self):
         current_removed_routers = list(self.removed_routers)
         for router_id in current_removed_routers:
-            self._router_removed(router_id)
+            self.router_queue.add(RouterUpdate(router_id, PRIORITY_RPC,
+                                               action=DELETE_ROUTER))
             self.removed_routers.remove(router_id)
 
     def _router_ids(self):
@@ -842,11 +1204,13 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
             router_ids = self._router_ids()
             self.updated_routers.clear()
             self.removed_routers.clear()
+            timestamp = time.time()
             routers = self.plugin_rpc.get_routers(
                 context, router_ids)
 
             LOG.debug(_('Processing :%r'), routers)
-            self._process_routers(routers, all_routers=True)
+            self._process_routers(routers, all_routers=True,
+                                  timestamp=timestamp)
             self.fullsync = False
             LOG.debug(_("_sync_routers_task successfully completed"))
         except rpc_common.RPCException:
@@ -865,18 +1229,23 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
     def after_start(self):
         LOG.info(_("L3 agent started"))
 
-    def _update_routing_table(self, ri, operation, route):
-        cmd = ['ip', 'route', operation, 'to', route['destination'],
-               'via', route['nexthop']]
+    def _update_routing_table(self, ri, operation, route, batch=None):
+        args = [operation, 'to', route['destination'],
+                'via', route['nexthop']]
+        if batch is not None:
+            batch.add('route', *args)
+            return
         ip_wrapper = ip_lib.IPWrapper(self.root_helper,
                                       namespace=ri.ns_name)
-        ip_wrapper.netns.execute(cmd, check_exit_code=False)
+        ip_wrapper.netns.execute(['ip', 'route'] + args,
+                                 check_exit_code=False)
 
     def routes_updated(self, ri):
         new_routes = ri.router['routes']
         old_routes = ri.routes
         adds, removes = common_utils.diff_list_of_dict(old_routes,
                                                        new_routes)
+        batch = ip_lib.IpBatch(self.root_helper, namespace=ri.ns_name)
         for route in adds:
             LOG.debug(_("Added route entry is '%s'"), route)
             # remove replaced route from deleted route
@@ -884,10 +1253,16 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
                 if route['destination'] == del_route['destination']:
                     removes.remove(del_route)
             #replace success even if there is no existing route
-            self._update_routing_table(ri, 'replace', route)
+            self._update_routing_table(ri, 'replace', route, batch)
         for route in removes:
             LOG.debug(_("Removed route entry is '%s'"), route)
-            self._update_routing_table(ri, 'delete', route)
+            self._update_routing_table(ri, 'delete', route, batch)
+        try:
+            batch.execute()
+        except RuntimeError:
+            # As before batching, failed route updates are ignored
+            LOG.debug(_("Failed to update some routes of router %s"),
+                      ri.router_id)
         ri.routes = new_routes
 
 
@@ -938,6 +1313,8 @@ class L3NATAgentWithStateReport(L3NATAgent):
         configurations['ex_gw_ports'] = num_ex_gw_ports
         configurations['interfaces'] = num_interfaces
         configurations['floating_ips'] = num_floating_ips
+        configurations['namespace_cleanup'] = (
+            self.namespace_collector.stats())
         try:
             self.state_rpc.report_state(self.context, self.agent_state,
                                         self.use_call)
@@ -969,6 +1346,7 @@ def main(manager='neutron.agent.l3_agent.L3NATAgentWithStateReport'):
     config.register_root_helper(conf)
     conf.register_opts(interface.OPTS)
     conf.register_opts(external_process.OPTS)
+    conf.register_opts(ip_lib.OPTS)
     conf(project='neutron')
     config.setup_logging(conf)
     server = neutron_service.Service.create(
@@ -32,6 +32,7 @@ from neutron.agent.linux import ip_lib
 from neutron.agent.linux import utils
 from neutron.common import constants
 from neutron.common import exceptions
+from neutron.openstack.common import excutils
 from neutron.openstack.common import importutils
 from neutron.openstack.common import jsonutils
 from neutron.openstack.common import log as logging
@@ -76,6 +77,11 @@ METADATA_PORT = 80
 WIN2k3_STATIC_DNS = 249
 NS_PREFIX = 'qdhcp-'
 
+# Lines a port adds to the dnsmasq hosts and addn_hosts files, and the
+# (ip_address, mac_address) leases it is given
+PortEntries = collections.namedtuple('PortEntries',
+                                     ['hosts', 'addn_hosts', 'leases'])
+
 
 class DictModel(object):
     """Convert dict into an object that provides attribute access to values."""
@@ -134,8 +140,12 @@ class DhcpBase(object):
         """Boolean representing the running state of the DHCP server."""
 
     @abc.abstractmethod
-    def reload_allocations(self):
-        """Force the DHCP server to reload the assignment database."""
+    def reload_allocations(self, changed_ports=None):
+        """Force the DHCP server to reload the assignment database.
+
+        changed_ports is the set of ids of the ports added, updated or
+        deleted since the previous reload, or None if it is not known.
+        """
 
     @classmethod
     def existing_dhcp_networks(cls, conf, root_helper):
@@ -262,6 +272,28 @@ class DhcpLocalProcess(DhcpBase):
         pass
 
 
+class HostsIndex(object):
+    """In-memory copy of the dnsmasq config files of a network.
+
+    ports maps the id of a port to its PortEntries, and contents the kind
+    of a config file to the content last written to it.
+    """
+
+    def __init__(self):
+        self.ports = {}
+        self.contents = {}
+
+    def leases(self, port_ids=None):
+        """Return the leases of the ports port_ids, or of all the ports."""
+        if port_ids is None:
+            port_ids = self.ports.keys()
+        leases = set()
+        for port_id in port_ids:
+            if port_id in self.ports:
+                leases.update(self.ports[port_id].leases)
+        return leases
+
+
 class Dnsmasq(DhcpLocalProcess):
     # The ports that need to be opened when security policies are active
     # on the Neutron port used for DHCP.  These are provided as a convenience
@@ -276,6 +308,13 @@ class Dnsmasq(DhcpLocalProcess):
     NEUTRON_RELAY_SOCKET_PATH_KEY = 'NEUTRON_RELAY_SOCKET_PATH'
     MINIMUM_VERSION = 2.59
 
+    # The config files rewritten by reload_allocations
+    RELOADED_FILES = ('host', 'addn_hosts', 'opts')
+
+    # network id -> HostsIndex. The agent creates a driver for each action,
+    # so the indexes are shared by all the instances.
+    _indexes = {}
+
     @classmethod
     def check_version(cls):
         ver = 0
@@ -311,6 +350,8 @@ class Dnsmasq(DhcpLocalProcess):
         env = {
             self.NEUTRON_NETWORK_ID_KEY: self.network.id,
         }
+        # The config files are written from scratch
+        self._indexes.pop(self.network.id, None)
 
         cmd = [
             'dnsmasq',
@@ -378,8 +419,17 @@ class Dnsmasq(DhcpLocalProcess):
                                       self.network.namespace)
         ip_wrapper.netns.execute(cmd)
 
-    def reload_allocations(self):
-        """Rebuild the dnsmasq config and signal the dnsmasq to reload."""
+    def _remove_config_files(self):
+        self._indexes.pop(self.network.id, None)
+        super(Dnsmasq, self)._remove_config_files()
+
+    def reload_allocations(self, changed_ports=None):
+        """Rebuild the dnsmasq config and signal the dnsmasq to reload.
+
+        When changed_ports is given only the entries of these ports are
+        built again. The config files whose content did not change are not
+        written, and dnsmasq is not signaled if none of them changed.
+        """
 
         # If all subnets turn off dhcp, kill the process.
         if not self._enable_dhcp():
@@ -388,17 +438,118 @@ class Dnsmasq(DhcpLocalProcess):
                         'turned off DHCP: %s'), self.network.id)
             return
 
-        self._release_unused_leases()
-        self._output_hosts_file()
-        self._output_addn_hosts_file()
-        self._output_opts_file()
-        if self.active:
-            cmd = ['kill', '-HUP', self.pid]
-            utils.execute(cmd, self.root_helper)
+        try:
+            self._release_unused_leases(changed_ports)
+            changed = self._update_conf_files()
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                # The files may not match the index anymore
+                self._indexes.pop(self.network.id, None)
+
+        if changed:
+            if self.active:
+                cmd = ['kill', '-HUP', self.pid]
+                utils.execute(cmd, self.root_helper)
+            else:
+                LOG.debug(_('Pid %d is stale, relaunching dnsmasq'), self.pid)
+            LOG.debug(_('Reloading allocations for network: %s'),
+                      self.network.id)
         else:
-            LOG.debug(_('Pid %d is stale, relaunching dnsmasq'), self.pid)
-        LOG.debug(_('Reloading allocations for network: %s'), self.network.id)
-        self.device_manager.update(self.network)
+            LOG.debug(_('Allocations for network %s did not change'),
+                      self.network.id)
+        if changed or changed_ports is None:
+            self.device_manager.update(self.network)
+
+    def _update_conf_files(self):
+        """Write the reloaded config files whose content changed.
+
+        Returns the kinds of the files written.
+        """
+        index = self._get_index()
+        contents = {'host': self._get_hosts_content('hosts'),
+                    'addn_hosts': self._get_hosts_content('addn_hosts'),
+                    'opts': self._get_opts_content()}
+        changed = [kind for kind in self.RELOADED_FILES
+                   if index.contents.get(kind) != contents[kind]]
+        for kind in changed:
+            self._write_conf_file(kind, contents[kind])
+        return changed
+
+    def _write_conf_file(self, kind, content):
+        name = self.get_conf_file_name(kind)
+        utils.replace_file(name, content)
+        self._get_index().contents[kind] = content
+        return name
+
+    def _get_index(self):
+        """Return the index of the network, built if needed."""
+        index = self._indexes.get(self.network.id)
+        if index is None:
+            index = self._indexes[self.network.id] = HostsIndex()
+            self._index_ports(index)
+        return index
+
+    def _index_ports(self, index, port_ids=None):
+        """Build the entries of the ports port_ids, or of all the ports."""
+        if port_ids is None:
+            index.ports = dict((port.id, self._get_port_entries(port))
+                               for port in self.network.ports)
+            return
+        ports = dict((port.id, port) for port in self.network.ports)
+        for port_id in port_ids:
+            port = ports.get(port_id)
+            if port is None:
+                index.ports.pop(port_id, None)
+            else:
+                index.ports[port_id] = self._get_port_entries(port)
+
+    def _get_port_entries(self, port):
+        hosts = []
+        addn_hosts = []
+        leases = set()
+        for (alloc, hostname, name) in self._iter_port_hosts(port):
+            set_tag = ''
+            # (dzyu) Check if it is legal ipv6 address, if so, need wrap
+            # it with '[]' to let dnsmasq to distinguish MAC address from
+            # IPv6 address.
+            ip_address = alloc.ip_address
+            if netaddr.valid_ipv6(ip_address):
+                ip_address = '[%s]' % ip_address
+
+            LOG.debug(_('Adding %(mac)s : %(name)s : %(ip)s'),
+                      {"mac": port.mac_address, "name": name,
+                       "ip": ip_address})
+
+            if getattr(port, 'extra_dhcp_opts', False):
+                if self.version >= self.MINIMUM_VERSION:
+                    set_tag = 'set:'
+
+                hosts.append('%s,%s,%s,%s%s\n' %
+                             (port.mac_address, name, ip_address,
+                              set_tag, port.id))
+            else:
+                hosts.append('%s,%s,%s\n' %
+                             (port.mac_address, name, ip_address))
+
+            # It is compulsory to write the `fqdn` before the `hostname` in
+            # order to obtain it in PTR responses.
+            addn_hosts.append('%s\t%s %s\n' %
+                              (alloc.ip_address, name, hostname))
+            leases.add((alloc.ip_address, port.mac_address))
+        return PortEntries(''.join(hosts), ''.join(addn_hosts),
+                           frozenset(leases))
+
+    def _get_hosts_content(self, field):
+        """Join the field of the entries of the ports, in the ports order."""
+        index = self._get_index()
+        entries = []
+        for port in self.network.ports:
+            port_entries = index.ports.get(port.id)
+            if port_entries is None:
+                port_entries = self._get_port_entries(port)
+                index.ports[port.id] = port_entries
+            entries.append(getattr(port_entries, field))
+        return ''.join(entries)
 
     def _iter_hosts(self):
         """Iterate over hosts.
@@ -412,12 +563,17 @@ class Dnsmasq(DhcpLocalProcess):
         )
         """
         for port in self.network.ports:
-            for alloc in port.fixed_ips:
-                hostname = 'host-%s' % alloc.ip_address.replace(
-                    '.', '-').replace(':', '-')
-                fqdn = '%s.%s' % (hostname, self.conf.dhcp_domain)
+            for (alloc, hostname, fqdn) in self._iter_port_hosts(port):
                 yield (port, alloc, hostname, fqdn)
 
+    def _iter_port_hosts(self, port):
+        """Iterate over the (alloc, host_name, name) hosts of a port."""
+        for alloc in port.fixed_ips:
+            hostname = 'host-%s' % alloc.ip_address.replace(
+                '.', '-').replace(':', '-')
+            fqdn = '%s.%s' % (hostname, self.conf.dhcp_domain)
+            yield (alloc, hostname, fqdn)
+
     def _output_hosts_file(self):
         """Writes a dnsmasq compatible dhcp hosts file.
 
@@ -434,35 +590,10 @@ class Dnsmasq(DhcpLocalProcess):
         should receive a dhcp lease, the hosts resolution in itself is
         defined by the `_output_addn_hosts_file` method.
         """
-        buf = six.StringIO()
         filename = self.get_conf_file_name('host')
 
         LOG.debug(_('Building host file: %s'), filename)
-        for (port, alloc, hostname, name) in self._iter_hosts():
-            set_tag = ''
-            # (dzyu) Check if it is legal ipv6 address, if so, need wrap
-            # it with '[]' to let dnsmasq to distinguish MAC address from
-            # IPv6 address.
-            ip_address = alloc.ip_address
-            if netaddr.valid_ipv6(ip_address):
-                ip_address = '[%s]' % ip_address
-
-            LOG.debug(_('Adding %(mac)s : %(name)s : %(ip)s'),
-                      {"mac": port.mac_address, "name": name,
-                       "ip": ip_address})
-
-            if getattr(port, 'extra_dhcp_opts', False):
-                if self.version >= self.MINIMUM_VERSION:
-                    set_tag = 'set:'
-
-                buf.write('%s,%s,%s,%s%s\n' %
-                          (port.mac_address, name, ip_address,
-                           set_tag, port.id))
-            else:
-                buf.write('%s,%s,%s\n' %
-                          (port.mac_address, name, ip_address))
-
-        utils.replace_file(filename, buf.getvalue())
+        self._write_conf_file('host', self._get_hosts_content('hosts'))
         LOG.debug(_('Done building host file %s'), filename)
         return filename
 
@@ -475,14 +606,22 @@ class Dnsmasq(DhcpLocalProcess):
                     leases.add((host[2], host[0]))
         return leases
 
-    def _release_unused_leases(self):
-        filename = self.get_conf_file_name('host')
-        old_leases = self._read_hosts_file_leases(filename)
+    def _release_unused_leases(self, changed_ports=None):
+        """Update the index of the ports and release the leases it lost.
 
-        new_leases = set()
-        for port in self.network.ports:
-            for alloc in port.fixed_ips:
-                new_leases.add((alloc.ip_address, port.mac_address))
+        Only the leases of changed_ports are looked at when it is given and
+        the network is indexed. Otherwise the hosts file is read when the
+        network is not indexed yet, e.g. after a restart of the agent.
+        """
+        index = self._indexes.get(self.network.id)
+        if index is None:
+            filename = self.get_conf_file_name('host')
+            old_leases = self._read_hosts_file_leases(filename)
+            new_leases = self._get_index().leases()
+        else:
+            old_leases = index.leases(changed_ports)
+            self._index_ports(index, changed_ports)
+            new_leases = index.leases(changed_ports)
 
         for ip, mac in old_leases - new_leases:
             self._release_lease(mac, ip)
@@ -497,18 +636,15 @@ class Dnsmasq(DhcpLocalProcess):
         Each line in this file is in the same form as a standard /etc/hosts
         file.
         """
-        buf = six.StringIO()
-        for (port, alloc, hostname, fqdn) in self._iter_hosts():
-            # It is compulsory to write the `fqdn` before the `hostname` in
-            # order to obtain it in PTR responses.
-            buf.write('%s\t%s %s\n' % (alloc.ip_address, fqdn, hostname))
-        addn_hosts = self.get_conf_file_name('addn_hosts')
-        utils.replace_file(addn_hosts, buf.getvalue())
-        return addn_hosts
+        return self._write_conf_file('addn_hosts',
+                                     self._get_hosts_content('addn_hosts'))
 
     def _output_opts_file(self):
         """Write a dnsmasq compatible options file."""
+        return self._write_conf_file('opts', self._get_opts_content())
 
+    def _get_opts_content(self):
+        """Return the content of the dnsmasq options file."""
         if self.conf.enable_isolated_metadata:
             subnet_to_interface_ip = self._make_subnet_interface_ip_map()
 
@@ -580,9 +716,7 @@ class Dnsmasq(DhcpLocalProcess):
                                                    'dns-server',
                                                    ','.join(ips)))
 
-        name = self.get_conf_file_name('opts')
-        utils.replace_file(name, '\n'.join(options))
-        return name
+        return '\n'.join(options)
 
     def _make_subnet_interface_ip_map(self):
         ip_dev = ip_lib.IPDevice(
@@ -17,6 +17,7 @@
 import netaddr
 from oslo.config import cfg
 
+from neutron.agent.linux import ip_netlink
 from neutron.agent.linux import utils
 from neutron.common import exceptions
 
@@ -25,6 +26,12 @@ OPTS = [
     cfg.BoolOpt('ip_lib_force_root',
                 default=False,
                 help=_('Force ip_lib calls to use the root helper')),
+    cfg.BoolOpt('ip_lib_use_netlink',
+                default=False,
+                help=_('Read the devices, addresses and routes with '
+                       'netlink instead of running ip. Only root can read '
+                       'them in other namespaces this way, ip is still run '
+                       'otherwise.')),
 ]
 
 
@@ -34,6 +41,9 @@ LOOPBACK_DEVNAME = 'lo'
 VLAN_INTERFACE_DETAIL = ['vlan protocol 802.1q',
                          'vlan protocol 802.1Q',
                          'vlan id']
+# Keys of the link address in the output of 'ip link', by device type
+LINK_ADDRESS_KEYS = {ip_netlink.ARPHRD_ETHER: 'link/ether',
+                     ip_netlink.ARPHRD_LOOPBACK: 'link/loopback'}
 
 
 class SubProcessBase(object):
@@ -46,6 +56,15 @@ class SubProcessBase(object):
             # Only callers that need to force use of the root helper
             # need to register the option.
             self.force_root = False
+        try:
+            self.use_netlink = cfg.CONF.ip_lib_use_netlink
+        except cfg.NoSuchOptError:
+            self.use_netlink = False
+
+    def _use_netlink(self):
+        # Commands forced to use the root helper may not run on this host
+        return (self.use_netlink and not self.force_root and
+                ip_netlink.can_query(self.namespace))
 
     def _run(self, options, command, args):
         if self.namespace:
@@ -91,6 +110,11 @@ class IPWrapper(SubProcessBase):
         return IPDevice(name, self.root_helper, self.namespace)
 
     def get_devices(self, exclude_loopback=False):
+        if self._use_netlink():
+            return [IPDevice(link['name'], self.root_helper, self.namespace)
+                    for link in ip_netlink.get_links(self.namespace)
+                    if not (exclude_loopback and
+                            link['name'] == LOOPBACK_DEVNAME)]
         retval = []
         output = self._execute(['o', 'd'], 'link', ('list',),
                                self.root_helper, self.namespace)
@@ -184,6 +208,42 @@ class IPWrapper(SubProcessBase):
         return [l.strip() for l in output.split('\n')]
 
 
+class IpBatch(SubProcessBase):
+    """Run several ip commands with a single 'ip -batch' process.
+
+    The commands are queued by add(), or by passing the batch to the
+    IPDevice commands supporting it, and run as root by execute(). In
+    batch mode ip infers the family of the commands from their addresses.
+    """
+
+    def __init__(self, root_helper=None, namespace=None):
+        super(IpBatch, self).__init__(root_helper=root_helper,
+                                      namespace=namespace)
+        self.commands = []
+
+    def add(self, command, *args):
+        self.commands.append(' '.join([command] + [str(a) for a in args]))
+
+    def execute(self):
+        """Run the queued commands and clear the batch.
+
+        All the commands are run even if some of them fail, RuntimeError is
+        raised after if any failed.
+        """
+        commands, self.commands = self.commands, []
+        if not commands:
+            return
+        if not self.root_helper:
+            raise exceptions.SudoRequired()
+        if self.namespace:
+            ip_cmd = ['ip', 'netns', 'exec', self.namespace, 'ip']
+        else:
+            ip_cmd = ['ip']
+        return utils.execute(ip_cmd + ['-force', '-batch', '-'],
+                             root_helper=self.root_helper,
+                             process_input='\n'.join(commands) + '\n')
+
+
 class IPDevice(SubProcessBase):
     def __init__(self, name, root_helper=None, namespace=None):
         super(IPDevice, self).__init__(root_helper=root_helper,
@@ -212,6 +272,10 @@ class IpCommandBase(object):
         return self._parent._run(kwargs.get('options', []), self.COMMAND, args)
 
     def _as_root(self, *args, **kwargs):
+        batch = kwargs.get('batch')
+        if batch is not None:
+            batch.add(self.COMMAND, *args)
+            return
         return self._parent._as_root(kwargs.get('options', []),
                                      self.COMMAND,
                                      args,
@@ -223,6 +287,14 @@ class IpDeviceCommandBase(IpCommandBase):
     def name(self):
         return self._parent.name
 
+    def _get_link(self):
+        """Return the device as read with netlink."""
+        link = ip_netlink.get_link(self.name, self._parent.namespace)
+        if link is None:
+            raise ip_netlink.NetlinkError(
+                _('Device "%s" does not exist.') % self.name)
+        return link
+
 
 class IpLinkCommand(IpDeviceCommandBase):
     COMMAND = 'link'
@@ -279,8 +351,23 @@ class IpLinkCommand(IpDeviceCommandBase):
 
     @property
     def attributes(self):
+        if self._parent._use_netlink():
+            return self._get_netlink_attributes()
         return self._parse_line(self._run('show', self.name, options='o'))
 
+    def _get_netlink_attributes(self):
+        """Return the attributes of the device as parsed from ip."""
+        link = self._get_link()
+        retval = dict((key, link[key])
+                      for key in ('mtu', 'qdisc', 'state', 'qlen', 'alias')
+                      if key in link)
+        address_key = LINK_ADDRESS_KEYS.get(link['type'])
+        if address_key and 'address' in link:
+            retval[address_key] = link['address']
+            if 'broadcast' in link:
+                retval['brd'] = link['broadcast']
+        return retval
+
     def _parse_line(self, value):
         if not value:
             return {}
@@ -297,7 +384,7 @@ class IpLinkCommand(IpDeviceCommandBase):
 class IpAddrCommand(IpDeviceCommandBase):
     COMMAND = 'addr'
 
-    def add(self, ip_version, cidr, broadcast, scope='global'):
+    def add(self, ip_version, cidr, broadcast, scope='global', batch=None):
         self._as_root('add',
                       cidr,
                       'brd',
@@ -306,14 +393,16 @@ class IpAddrCommand(IpDeviceCommandBase):
                       scope,
                       'dev',
                       self.name,
-                      options=[ip_version])
+                      options=[ip_version],
+                      batch=batch)
 
-    def delete(self, ip_version, cidr):
+    def delete(self, ip_version, cidr, batch=None):
         self._as_root('del',
                       cidr,
                       'dev',
                       self.name,
-                      options=[ip_version])
+                      options=[ip_version],
+                      batch=batch)
 
     def flush(self):
         self._as_root('flush', self.name)
@@ -322,6 +411,10 @@ class IpAddrCommand(IpDeviceCommandBase):
         if filters is None:
             filters = []
 
+        if (self._parent._use_netlink() and
+                set(filters) <= set(['permanent'])):
+            return self._netlink_list(scope, to, 'permanent' in filters)
+
         retval = []
 
         if scope:
@@ -357,6 +450,29 @@ class IpAddrCommand(IpDeviceCommandBase):
                                dynamic=('dynamic' == parts[-1])))
         return retval
 
+    def _netlink_list(self, scope=None, to=None, permanent=False):
+        link = self._get_link()
+        retval = []
+        for address in ip_netlink.get_addresses(link['index'],
+                                                self._parent.namespace):
+            if scope and address['scope'] != scope:
+                continue
+            if permanent and address['dynamic']:
+                continue
+            ip_network = netaddr.IPNetwork(address['cidr'])
+            if to and ip_network.ip not in netaddr.IPNetwork(to):
+                continue
+            if address['ip_version'] == 6:
+                broadcast = '::'
+            else:
+                broadcast = address['broadcast'] or str(ip_network.broadcast)
+            retval.append(dict(cidr=address['cidr'],
+                               broadcast=broadcast,
+                               scope=address['scope'],
+                               ip_version=address['ip_version'],
+                               dynamic=address['dynamic']))
+        return retval
+
 
 class IpRouteCommand(IpDeviceCommandBase):
     COMMAND = 'route'
@@ -380,6 +496,9 @@ class IpRouteCommand(IpDeviceCommandBase):
         if filters is None:
             filters = []
 
+        if self._parent._use_netlink() and not filters:
+            return self._netlink_get_gateway(scope)
+
         retval = None
 
         if scope:
@@ -400,6 +519,18 @@ class IpRouteCommand(IpDeviceCommandBase):
 
         return retval
 
+    def _netlink_get_gateway(self, scope=None):
+        link = self._get_link()
+        for route in ip_netlink.get_routes(namespace=self._parent.namespace):
+            if (route['dst'] == 'default' and route['gateway'] and
+                    route['oif'] == link['index'] and
+                    route['table'] == ip_netlink.RT_TABLE_MAIN and
+                    (not scope or route['scope'] == scope)):
+                retval = dict(gateway=route['gateway'])
+                if route['metric'] is not None:
+                    retval.update(metric=route['metric'])
+                return retval
+
     def pullup_route(self, interface_name):
         """Ensures that the route entry for the interface is before all
         others on the same subnet.
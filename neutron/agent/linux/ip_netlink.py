@@ -0,0 +1,329 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Queries of network devices, addresses and routes with rtnetlink.
+
+Reading them from a netlink socket avoids forking an ip process, and
+parsing its output, for each query. Changes are still made by running ip
+as root. Querying another network namespace requires entering it with
+setns(), which only root can do.
+"""
+
+import contextlib
+import ctypes
+import errno
+import os
+import socket
+import struct
+
+NETLINK_ROUTE = 0
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+
+RTM_NEWLINK = 16
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_GETROUTE = 26
+
+IFLA_ADDRESS = 1
+IFLA_BROADCAST = 2
+IFLA_IFNAME = 3
+IFLA_MTU = 4
+IFLA_QDISC = 6
+IFLA_TXQLEN = 13
+IFLA_OPERSTATE = 16
+IFLA_IFALIAS = 20
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_BROADCAST = 4
+IFA_FLAGS = 8
+IFA_F_PERMANENT = 0x80
+
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PRIORITY = 6
+RTA_TABLE = 15
+RT_TABLE_MAIN = 254
+
+ARPHRD_ETHER = 1
+ARPHRD_LOOPBACK = 772
+
+OPERSTATES = ('UNKNOWN', 'NOTPRESENT', 'DOWN', 'LOWERLAYERDOWN', 'TESTING',
+              'DORMANT', 'UP')
+SCOPES = {0: 'global', 200: 'site', 253: 'link', 254: 'host', 255: 'nowhere'}
+IP_VERSIONS = {socket.AF_INET: 4, socket.AF_INET6: 6}
+
+CLONE_NEWNET = 0x40000000
+NETNS_DIR = '/var/run/netns'
+RECV_SIZE = 65536
+
+_NLMSGHDR = struct.Struct('=IHHII')
+_RTATTR = struct.Struct('=HH')
+_IFINFOMSG = struct.Struct('=BxHiII')
+_IFADDRMSG = struct.Struct('=BBBBI')
+_RTMSG = struct.Struct('=BBBBBBBBI')
+_U32 = struct.Struct('=I')
+_ERROR = struct.Struct('=i')
+
+
+class NetlinkError(RuntimeError):
+    """A netlink query failed.
+
+    This is a RuntimeError, like the errors of the ip commands, so that
+    the callers of ip_lib handle both the same way.
+    """
+
+    def __init__(self, message, errno=None):
+        super(NetlinkError, self).__init__(message)
+        self.errno = errno
+
+
+def can_query(namespace=None):
+    """Whether the devices of namespace can be queried with netlink."""
+    return not namespace or os.geteuid() == 0
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def _pack_attr(attr_type, data):
+    length = _RTATTR.size + len(data)
+    return (_RTATTR.pack(length, attr_type) + data +
+            '\0' * (_align(length) - length))
+
+
+def _parse_attrs(data, offset):
+    attrs = {}
+    while offset + _RTATTR.size <= len(data):
+        length, attr_type = _RTATTR.unpack_from(data, offset)
+        if length < _RTATTR.size:
+            break
+        attrs[attr_type] = data[offset + _RTATTR.size:offset + length]
+        offset += _align(length)
+    return attrs
+
+
+def _to_str(data):
+    return data.rstrip('\0')
+
+
+def _to_int(data):
+    return _U32.unpack(data[:_U32.size])[0]
+
+
+def _to_mac(data):
+    return ':'.join('%02x' % ord(c) for c in data)
+
+
+def _setns(fd):
+    libc = ctypes.CDLL('libc.so.6', use_errno=True)
+    if libc.setns(fd, CLONE_NEWNET):
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+
+@contextlib.contextmanager
+def in_namespace(namespace):
+    """Run the calling thread in namespace for the duration of the block.
+
+    The sockets created in the block stay in namespace.
+    """
+    if not namespace:
+        yield
+        return
+    own_fd = os.open('/proc/self/ns/net', os.O_RDONLY)
+    try:
+        fd = os.open(os.path.join(NETNS_DIR, namespace), os.O_RDONLY)
+        try:
+            _setns(fd)
+        finally:
+            os.close(fd)
+        try:
+            yield
+        finally:
+            _setns(own_fd)
+    finally:
+        os.close(own_fd)
+
+
+def _request(namespace, msg_type, payload, dump=True):
+    """Send a request and return the (type, data) of the replies."""
+    try:
+        # A netlink socket stays bound to the namespace it was created in
+        with in_namespace(namespace):
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                 NETLINK_ROUTE)
+    except (OSError, socket.error) as e:
+        raise NetlinkError(_("Cannot query namespace %(ns)s: %(err)s") %
+                           {'ns': namespace, 'err': e},
+                           getattr(e, 'errno', None))
+    flags = NLM_F_REQUEST | (NLM_F_DUMP if dump else 0)
+    replies = []
+    try:
+        sock.bind((0, 0))
+        sock.send(_NLMSGHDR.pack(_NLMSGHDR.size + len(payload), msg_type,
+                                 flags, 1, 0) + payload)
+        while True:
+            data = sock.recv(RECV_SIZE)
+            offset = 0
+            while offset + _NLMSGHDR.size <= len(data):
+                length, reply_type = _NLMSGHDR.unpack_from(data, offset)[:2]
+                body = data[offset + _NLMSGHDR.size:offset + length]
+                offset += _align(length)
+                if reply_type == NLMSG_DONE:
+                    return replies
+                if reply_type == NLMSG_ERROR:
+                    error = -_ERROR.unpack_from(body)[0]
+                    if error:
+                        raise NetlinkError(
+                            _("Netlink request failed: %s") %
+                            os.strerror(error), error)
+                    return replies
+                replies.append((reply_type, body))
+            if not dump:
+                return replies
+    except socket.error as e:
+        raise NetlinkError(_("Netlink request failed: %s") % e, e.errno)
+    finally:
+        sock.close()
+
+
+def _parse_link(data):
+    family, link_type, index, flags, change = _IFINFOMSG.unpack_from(data)
+    attrs = _parse_attrs(data, _IFINFOMSG.size)
+    link = {'index': index,
+            'name': _to_str(attrs.get(IFLA_IFNAME, '')),
+            'type': link_type,
+            'flags': flags}
+    if IFLA_ADDRESS in attrs:
+        link['address'] = _to_mac(attrs[IFLA_ADDRESS])
+    if IFLA_BROADCAST in attrs:
+        link['broadcast'] = _to_mac(attrs[IFLA_BROADCAST])
+    if IFLA_MTU in attrs:
+        link['mtu'] = _to_int(attrs[IFLA_MTU])
+    if IFLA_QDISC in attrs:
+        link['qdisc'] = _to_str(attrs[IFLA_QDISC])
+    if IFLA_TXQLEN in attrs:
+        link['qlen'] = _to_int(attrs[IFLA_TXQLEN])
+    if IFLA_OPERSTATE in attrs:
+        state = ord(attrs[IFLA_OPERSTATE][0])
+        link['state'] = (OPERSTATES[state] if state < len(OPERSTATES)
+                         else str(state))
+    if IFLA_IFALIAS in attrs:
+        link['alias'] = _to_str(attrs[IFLA_IFALIAS])
+    return link
+
+
+def get_links(namespace=None):
+    """Return the devices of a namespace.
+
+    Each device is a dict with the keys index, name, type (ARPHRD_*),
+    flags and, when the device has them, address, broadcast, mtu, qdisc,
+    qlen, state and alias.
+    """
+    replies = _request(namespace, RTM_GETLINK, _IFINFOMSG.pack(0, 0, 0, 0, 0))
+    return [_parse_link(data) for reply_type, data in replies
+            if reply_type == RTM_NEWLINK]
+
+
+def get_link(name, namespace=None):
+    """Return the device name as returned by get_links, or None."""
+    payload = (_IFINFOMSG.pack(0, 0, 0, 0, 0) +
+               _pack_attr(IFLA_IFNAME, name + '\0'))
+    try:
+        replies = _request(namespace, RTM_GETLINK, payload, dump=False)
+    except NetlinkError as e:
+        if e.errno == errno.ENODEV:
+            return
+        raise
+    for reply_type, data in replies:
+        if reply_type == RTM_NEWLINK:
+            return _parse_link(data)
+
+
+def get_addresses(index=None, namespace=None):
+    """Return the IP addresses of a namespace, or of its device index.
+
+    Each address is a dict with the keys index, ip_version, cidr,
+    broadcast (None if not set), scope and dynamic.
+    """
+    replies = _request(namespace, RTM_GETADDR, _IFADDRMSG.pack(0, 0, 0, 0, 0))
+    addresses = []
+    for reply_type, data in replies:
+        if reply_type != RTM_NEWADDR:
+            continue
+        family, prefixlen, flags, scope, addr_index = _IFADDRMSG.unpack_from(
+            data)
+        if index is not None and addr_index != index:
+            continue
+        attrs = _parse_attrs(data, _IFADDRMSG.size)
+        address = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+        if address is None or family not in IP_VERSIONS:
+            continue
+        if IFA_FLAGS in attrs:
+            flags = _to_int(attrs[IFA_FLAGS])
+        broadcast = attrs.get(IFA_BROADCAST)
+        addresses.append({
+            'index': addr_index,
+            'ip_version': IP_VERSIONS[family],
+            'cidr': '%s/%s' % (socket.inet_ntop(family, address), prefixlen),
+            'broadcast': (socket.inet_ntop(family, broadcast)
+                          if broadcast else None),
+            'scope': SCOPES.get(scope, str(scope)),
+            'dynamic': not flags & IFA_F_PERMANENT})
+    return addresses
+
+
+def get_routes(family=socket.AF_INET, namespace=None):
+    """Return the routes of a namespace.
+
+    Each route is a dict with the keys dst ('default' or a CIDR), gateway
+    (None if the route has none), oif (0 if the route has none), metric
+    (None if not set), table and scope.
+    """
+    replies = _request(namespace, RTM_GETROUTE,
+                       _RTMSG.pack(family, 0, 0, 0, 0, 0, 0, 0, 0))
+    routes = []
+    for reply_type, data in replies:
+        if reply_type != RTM_NEWROUTE:
+            continue
+        (route_family, dst_len, src_len, tos, table, protocol, scope,
+         route_type, flags) = _RTMSG.unpack_from(data)
+        attrs = _parse_attrs(data, _RTMSG.size)
+        if RTA_TABLE in attrs:
+            table = _to_int(attrs[RTA_TABLE])
+        if RTA_DST in attrs:
+            dst = '%s/%s' % (socket.inet_ntop(route_family, attrs[RTA_DST]),
+                             dst_len)
+        else:
+            dst = 'default'
+        gateway = attrs.get(RTA_GATEWAY)
+        routes.append({
+            'dst': dst,
+            'gateway': (socket.inet_ntop(route_family, gateway)
+                        if gateway else None),
+            'oif': _to_int(attrs[RTA_OIF]) if RTA_OIF in attrs else 0,
+            'metric': (_to_int(attrs[RTA_PRIORITY])
+                       if RTA_PRIORITY in attrs else None),
+            'table': table,
+            'scope': SCOPES.get(scope, str(scope))})
+    return routes
@@ -0,0 +1,80 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from neutron.agent.linux import utils as linux_utils
+from neutron.common import constants
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+# Maximum length of an ipset name
+MAX_NAME_LEN = 31
+IPSET_FAMILY = {constants.IPv4: 'inet',
+                constants.IPv6: 'inet6'}
+
+
+def get_name(prefix, ethertype):
+    """Return the name of the set holding prefix members of ethertype."""
+    return ('%s%s' % (ethertype, prefix))[:MAX_NAME_LEN]
+
+
+class IpsetManager(object):
+    """Wrapper for ipset.
+
+    Keeps track of the members of the sets it manages so that membership
+    changes are applied in place, with a single 'ipset restore' carrying
+    only the added and removed members.
+    """
+
+    def __init__(self, root_helper=None):
+        self.root_helper = root_helper
+        # name -> set of members
+        self.ipsets = {}
+
+    def set_members(self, name, ethertype, members):
+        """Create the set name if needed and update its members."""
+        members = set(members)
+        current = self.ipsets.get(name)
+        commands = []
+        if current is None:
+            # The set may be left over by a previous run of the agent
+            commands.append('create %s hash:net family %s -exist' %
+                            (name, IPSET_FAMILY[ethertype]))
+            commands.append('flush %s' % name)
+            current = set()
+        commands += ['add %s %s' % (name, member)
+                     for member in sorted(members - current)]
+        commands += ['del %s %s' % (name, member)
+                     for member in sorted(current - members)]
+        if commands:
+            self._restore(commands)
+        self.ipsets[name] = members
+
+    def destroy(self, name):
+        """Destroy the set name, which must not be referenced anymore."""
+        try:
+            self._execute(['ipset', 'destroy', name])
+        except RuntimeError:
+            LOG.warn(_("Failed to destroy ipset %s"), name)
+            return
+        self.ipsets.pop(name, None)
+
+    def _restore(self, commands):
+        self._execute(['ipset', 'restore', '-exist'],
+                      process_input='\n'.join(commands) + '\n')
+
+    def _execute(self, cmd, process_input=None):
+        return linux_utils.execute(cmd, root_helper=self.root_helper,
+                                   process_input=process_input)
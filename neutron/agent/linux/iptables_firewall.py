@@ -19,12 +19,15 @@ import netaddr
 from oslo.config import cfg
 
 from neutron.agent import firewall
+from neutron.agent.linux import ipset_manager
 from neutron.agent.linux import iptables_manager
 from neutron.common import constants
 from neutron.openstack.common import log as logging
 
 
 LOG = logging.getLogger(__name__)
+cfg.CONF.import_opt('enable_ipset', 'neutron.agent.securitygroups_rpc',
+                    group='SECURITYGROUP')
 SG_CHAIN = 'sg-chain'
 INGRESS_DIRECTION = 'ingress'
 EGRESS_DIRECTION = 'egress'
@@ -33,6 +36,8 @@ CHAIN_NAME_PREFIX = {INGRESS_DIRECTION: 'i',
                      EGRESS_DIRECTION: 'o',
                      SPOOF_FILTER: 's'}
 LINUX_DEV_LEN = 14
+IPSET_DIRECTION = {INGRESS_DIRECTION: 'src',
+                   EGRESS_DIRECTION: 'dst'}
 
 
 class IptablesFirewallDriver(firewall.FirewallDriver):
@@ -44,11 +49,19 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         self.iptables = iptables_manager.IptablesManager(
             root_helper=cfg.CONF.AGENT.root_helper,
             use_ipv6=True)
+        # Rules allowing the members of a remote group match an ipset
+        # holding the member IPs instead of being repeated per member
+        self.enable_ipset = cfg.CONF.SECURITYGROUP.enable_ipset
+        self.ipset = ipset_manager.IpsetManager(
+            root_helper=cfg.CONF.AGENT.root_helper)
+        self._ipset_names = set()
         # list of port which has security group
         self.filtered_ports = {}
         self._add_fallback_chain_v4v6()
         self._defer_apply = False
         self._pre_defer_filtered_ports = None
+        # Cleared while deferring if only remote group members changed
+        self._chains_changed = False
 
     @property
     def ports(self):
@@ -60,7 +73,7 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         self.filtered_ports[port['device']] = port
         # each security group has it own chains
         self._setup_chains()
-        self.iptables.apply()
+        self._apply()
 
     def update_port_filter(self, port):
         LOG.debug(_("Updating device (%s) filter"), port['device'])
@@ -68,10 +81,18 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
             LOG.info(_('Attempted to update port filter which is not '
                        'filtered %s'), port['device'])
             return
+        if (self.enable_ipset and self._only_members_changed(
+                self.filtered_ports[port['device']], port)):
+            LOG.debug(_("Only remote group members of device (%s) "
+                        "changed, updating ipsets"), port['device'])
+            self.filtered_ports[port['device']] = port
+            if not self._defer_apply:
+                self._update_ipsets(self.filtered_ports)
+            return
         self._remove_chains()
         self.filtered_ports[port['device']] = port
         self._setup_chains()
-        self.iptables.apply()
+        self._apply()
 
     def remove_port_filter(self, port):
         LOG.debug(_("Removing device (%s) filter"), port['device'])
@@ -82,7 +103,13 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         self._remove_chains()
         self.filtered_ports.pop(port['device'], None)
         self._setup_chains()
+        self._apply()
+
+    def _apply(self):
+        if self._defer_apply:
+            return
         self.iptables.apply()
+        self._remove_unused_ipsets()
 
     def _setup_chains(self):
         """Setup ingress and egress chain for a port."""
@@ -96,9 +123,13 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
             self._setup_chain(port, EGRESS_DIRECTION)
             self.iptables.ipv4['filter'].add_rule(SG_CHAIN, '-j ACCEPT')
             self.iptables.ipv6['filter'].add_rule(SG_CHAIN, '-j ACCEPT')
+        if self.enable_ipset:
+            # The sets must exist before the rules referring to them
+            self._update_ipsets(ports)
 
     def _remove_chains(self):
         """Remove ingress and egress chain for a port."""
+        self._chains_changed = True
         if not self._defer_apply:
             self._remove_chains_apply(self.filtered_ports)
 
@@ -258,6 +289,11 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         # for ipv6, iptables6 command is used
         ipv4_sg_rules, ipv6_sg_rules = self._split_sgr_by_ethertype(
             security_group_rules)
+        if self.enable_ipset:
+            ipv4_sg_rules = self._convert_member_rules_to_ipset(
+                ipv4_sg_rules)
+            ipv6_sg_rules = self._convert_member_rules_to_ipset(
+                ipv6_sg_rules)
         ipv4_iptables_rule = []
         ipv6_iptables_rule = []
         if direction == EGRESS_DIRECTION:
@@ -297,6 +333,7 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
                                    rule.get('protocol'),
                                    rule.get('port_range_min'),
                                    rule.get('port_range_max'))
+            args += self._ipset_arg(rule)
             args += ['-j RETURN']
             iptables_rules += [' '.join(args)]
 
@@ -344,6 +381,86 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
                     '--%ss' % direction,
                     '%s:%s' % (port_range_min, port_range_max)]
 
+    def _ipset_arg(self, rule):
+        ipset_name = rule.get('ipset')
+        if not ipset_name:
+            return []
+        return ['-m set --match-set', ipset_name,
+                IPSET_DIRECTION[rule['direction']]]
+
+    def _get_ipset_member(self, rule):
+        """Return the ipset name and member a rule expands to, if any.
+
+        Rules allowing a remote group are expanded per member IP by the
+        plugin. A /0 member, which ipset does not support, is left as a
+        plain rule.
+        """
+        remote_group_id = rule.get('remote_group_id')
+        ip_prefix = rule.get(constants.DIRECTION_IP_PREFIX[rule['direction']])
+        if (not remote_group_id or not ip_prefix or
+                not netaddr.IPNetwork(ip_prefix).prefixlen):
+            return None, None
+        return (ipset_manager.get_name(remote_group_id, rule['ethertype']),
+                ip_prefix)
+
+    def _convert_member_rules_to_ipset(self, security_group_rules):
+        """Replace the rules expanded per member by one ipset rule."""
+        rules = []
+        seen = set()
+        for rule in security_group_rules:
+            ipset_name, member = self._get_ipset_member(rule)
+            if not ipset_name:
+                rules.append(rule)
+                continue
+            ipset_rule = dict(rule, ipset=ipset_name)
+            del ipset_rule[constants.DIRECTION_IP_PREFIX[rule['direction']]]
+            key = tuple(sorted(ipset_rule.items()))
+            if key not in seen:
+                seen.add(key)
+                rules.append(ipset_rule)
+        return rules
+
+    def _update_ipsets(self, ports):
+        members = {}
+        for port in ports.values():
+            for rule in port.get('security_group_rules', []):
+                ipset_name, member = self._get_ipset_member(rule)
+                if ipset_name:
+                    members.setdefault(
+                        (ipset_name, rule['ethertype']), set()).add(member)
+        for (ipset_name, ethertype), ipset_members in members.iteritems():
+            self.ipset.set_members(ipset_name, ethertype, ipset_members)
+        self._ipset_names = set(name for name, ethertype in members)
+
+    def _remove_unused_ipsets(self):
+        if not self.enable_ipset:
+            return
+        for ipset_name in set(self.ipset.ipsets) - self._ipset_names:
+            self.ipset.destroy(ipset_name)
+
+    def _get_port_filter_key(self, port):
+        """Return what the chains of a port are built from.
+
+        Remote group members are left out, as they are held by ipsets.
+        """
+        port = dict(port)
+        port.pop('security_group_source_groups', None)
+        rules = set()
+        for rule in port.pop('security_group_rules', []):
+            rule = dict(rule)
+            if rule.get('ethertype') == constants.IPv6:
+                if rule.get('protocol') == 'icmp':
+                    rule['protocol'] = 'icmpv6'
+            ipset_name, member = self._get_ipset_member(rule)
+            if ipset_name:
+                del rule[constants.DIRECTION_IP_PREFIX[rule['direction']]]
+            rules.add(tuple(sorted(rule.items())))
+        return port, rules
+
+    def _only_members_changed(self, old_port, new_port):
+        return (self._get_port_filter_key(old_port) ==
+                self._get_port_filter_key(new_port))
+
     def _ip_prefix_arg(self, direction, ip_prefix):
         #NOTE (nati) : source_group_id is converted to list of source_
         # ip_prefix in server side
@@ -360,14 +477,20 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
             self.iptables.defer_apply_on()
             self._pre_defer_filtered_ports = dict(self.filtered_ports)
             self._defer_apply = True
+            self._chains_changed = False
 
     def filter_defer_apply_off(self):
         if self._defer_apply:
             self._defer_apply = False
-            self._remove_chains_apply(self._pre_defer_filtered_ports)
+            if self.enable_ipset and not self._chains_changed:
+                # Only remote group members changed, the chains are kept
+                self._update_ipsets(self.filtered_ports)
+            else:
+                self._remove_chains_apply(self._pre_defer_filtered_ports)
+                self._setup_chains_apply(self.filtered_ports)
             self._pre_defer_filtered_ports = None
-            self._setup_chains_apply(self.filtered_ports)
             self.iptables.defer_apply_off()
+            self._remove_unused_ipsets()
 
 
 class OVSHybridIptablesFirewallDriver(IptablesFirewallDriver):
@@ -24,6 +24,8 @@
 import inspect
 import os
 
+from oslo.config import cfg
+
 from neutron.agent.linux import utils as linux_utils
 from neutron.common import utils
 from neutron.openstack.common import lockutils
@@ -31,6 +33,14 @@ from neutron.openstack.common import log as logging
 
 LOG = logging.getLogger(__name__)
 
+iptables_opts = [
+    cfg.BoolOpt('iptables_noflush_apply', default=False,
+                help=_("Once the rules have been applied in full, only "
+                       "apply the chains that changed since, with "
+                       "iptables-restore --noflush.")),
+]
+cfg.CONF.register_opts(iptables_opts, 'AGENT')
+
 
 # NOTE(vish): Iptables supports chain names of up to 28 characters,  and we
 #             add up to 12 characters to binary_name which is used as a prefix,
@@ -55,6 +65,27 @@ def get_chain_name(chain_name, wrap=True):
         return chain_name[:MAX_CHAIN_LEN_NOWRAP]
 
 
+def _strip_packets_bytes(line):
+    # strip any [packet:byte] counts at start or end of lines
+    if line.startswith(':'):
+        # it's a chain, for example, ":neutron-billing - [0:0]"
+        line = line.split(':')[1]
+        line = line.split(' - [', 1)[0]
+    elif line.startswith('['):
+        # it's a rule, for example, "[0:0] -A neutron-billing..."
+        line = line.split('] ', 1)[1]
+    line = line.strip()
+    return line
+
+
+def _index_lines(lines):
+    """Map the chains and rules of lines to the last line defining them."""
+    index = {}
+    for line in lines:
+        index[_strip_packets_bytes(line)] = line
+    return index
+
+
 class IptablesRule(object):
     """An iptables rule.
 
@@ -273,7 +304,7 @@ class IptablesManager(object):
 
     def __init__(self, _execute=None, state_less=False,
                  root_helper=None, use_ipv6=False, namespace=None,
-                 binary_name=binary_name):
+                 binary_name=binary_name, noflush_apply=None):
         if _execute:
             self.execute = _execute
         else:
@@ -284,6 +315,12 @@ class IptablesManager(object):
         self.namespace = namespace
         self.iptables_apply_deferred = False
         self.wrap_name = binary_name[:16]
+        if noflush_apply is None:
+            noflush_apply = cfg.CONF.AGENT.iptables_noflush_apply
+        self.noflush_apply = noflush_apply
+        # Rules of the wrapped chains as last applied, per command and
+        # table, used to only apply the chains that changed since
+        self.applied_state = {}
 
         self.ipv4 = {'filter': IptablesTable(binary_name=self.wrap_name)}
         self.ipv6 = {'filter': IptablesTable(binary_name=self.wrap_name)}
@@ -377,29 +414,114 @@ class IptablesManager(object):
         same component of Nova, and replace them with our current set of
         rules. This happens atomically, thanks to iptables-restore.
 
+        With noflush_apply, once the rules have been applied that way, only
+        the wrapped chains which changed since are applied.
         """
         s = [('iptables', self.ipv4)]
         if self.use_ipv6:
             s += [('ip6tables', self.ipv6)]
 
         for cmd, tables in s:
-            args = ['%s-save' % (cmd,), '-c']
-            if self.namespace:
-                args = ['ip', 'netns', 'exec', self.namespace] + args
-            all_tables = self.execute(args, root_helper=self.root_helper)
-            all_lines = all_tables.split('\n')
-            for table_name, table in tables.iteritems():
-                start, end = self._find_table(all_lines, table_name)
-                all_lines[start:end] = self._modify_rules(
-                    all_lines[start:end], table, table_name)
-
-            args = ['%s-restore' % (cmd,), '-c']
-            if self.namespace:
-                args = ['ip', 'netns', 'exec', self.namespace] + args
-            self.execute(args, process_input='\n'.join(all_lines),
-                         root_helper=self.root_helper)
+            # Forget the applied state first, so that a failure leads to a
+            # full apply next time
+            applied_state = self.applied_state.pop(cmd, None)
+            state = dict((table_name, self._get_table_state(table))
+                         for table_name, table in tables.iteritems())
+            if (self.noflush_apply and
+                    self._can_apply_changed_chains(tables, applied_state,
+                                                   state)):
+                self._apply_changed_chains(cmd, applied_state, state)
+            else:
+                self._apply_all_tables(cmd, tables)
+            self.applied_state[cmd] = state
         LOG.debug(_("IPTablesManager.apply completed with success"))
 
+    def _get_args(self, args):
+        if self.namespace:
+            args = ['ip', 'netns', 'exec', self.namespace] + args
+        return args
+
+    def _apply_all_tables(self, cmd, tables):
+        args = self._get_args(['%s-save' % (cmd,), '-c'])
+        all_tables = self.execute(args, root_helper=self.root_helper)
+        all_lines = all_tables.split('\n')
+        for table_name, table in tables.iteritems():
+            start, end = self._find_table(all_lines, table_name)
+            all_lines[start:end] = self._modify_rules(
+                all_lines[start:end], table, table_name)
+
+        args = self._get_args(['%s-restore' % (cmd,), '-c'])
+        self.execute(args, process_input='\n'.join(all_lines),
+                     root_helper=self.root_helper)
+
+    def _get_table_state(self, table):
+        """Return the rules of each wrapped chain and the unwrapped rules.
+
+        The rules of a chain are ordered and deduplicated the way
+        _modify_rules writes them.
+        """
+        chains = dict(('%s-%s' % (self.wrap_name, name), ([], []))
+                      for name in table.chains)
+        unwrapped_rules = []
+        for rule in table.rules:
+            if not rule.wrap:
+                unwrapped_rules.append((str(rule), rule.top))
+                continue
+            top_rules, bottom_rules = chains['%s-%s' % (self.wrap_name,
+                                                        rule.chain)]
+            (top_rules if rule.top else bottom_rules).append(str(rule))
+        wrapped = {}
+        for name, (top_rules, bottom_rules) in chains.iteritems():
+            seen = set()
+            rules = []
+            # The last occurrence of a duplicated rule is kept
+            for rule in reversed(top_rules + bottom_rules):
+                if rule not in seen:
+                    seen.add(rule)
+                    rules.append(rule)
+            rules.reverse()
+            wrapped[name] = tuple(rules)
+        unwrapped = (frozenset(table.unwrapped_chains),
+                     tuple(unwrapped_rules))
+        return wrapped, unwrapped
+
+    def _can_apply_changed_chains(self, tables, applied_state, state):
+        if applied_state is None:
+            return False
+        for table_name, table in tables.iteritems():
+            # Unwrapped chains are shared with the other components and
+            # the removals are only tracked for them, they need a full
+            # apply
+            if (table.remove_chains or table.remove_rules or
+                    table_name not in applied_state or
+                    applied_state[table_name][1] != state[table_name][1]):
+                return False
+        return True
+
+    def _apply_changed_chains(self, cmd, applied_state, state):
+        lines = []
+        for table_name, (chains, unwrapped) in state.iteritems():
+            applied_chains = applied_state[table_name][0]
+            changed = sorted(name for name, rules in chains.iteritems()
+                             if applied_chains.get(name) != rules)
+            removed = sorted(name for name in applied_chains
+                             if name not in chains)
+            if not changed and not removed:
+                continue
+            lines.append('*%s' % table_name)
+            # With --noflush, declaring an existing chain flushes it
+            lines += [':%s - [0:0]' % name for name in changed + removed]
+            for name in changed:
+                lines += chains[name]
+            lines += ['-X %s' % name for name in removed]
+            lines.append('COMMIT')
+        if not lines:
+            LOG.debug(_("No %s chain changed, nothing to apply"), cmd)
+            return
+        args = self._get_args(['%s-restore' % (cmd,), '--noflush'])
+        self.execute(args, process_input='\n'.join(lines) + '\n',
+                     root_helper=self.root_helper)
+
     def _find_table(self, lines, table_name):
         if len(lines) < 3:
             # length only <2 when fake iptables
@@ -452,6 +574,12 @@ class IptablesManager(object):
 
         rules_index = self._find_rules_index(new_filter)
 
+        # Chains and rules are looked up by their text without the
+        # [packet:byte] counts, through indexes of the current lines
+        old_index = _index_lines(old_filter)
+        new_index = _index_lines(new_filter)
+        ours = set()
+
         all_chains = [':%s' % name for name in unwrapped_chains]
         all_chains += [':%s-%s' % (self.wrap_name, name) for name in chains]
 
@@ -460,20 +588,14 @@ class IptablesManager(object):
         our_chains = []
         for chain in all_chains:
             chain_str = str(chain).strip()
-
-            orig_filter = [s for s in old_filter if chain_str in s.strip()]
-            dup_filter = [s for s in new_filter if chain_str in s.strip()]
-            new_filter = [s for s in new_filter if chain_str not in s.strip()]
+            key = _strip_packets_bytes(chain_str)
+            ours.add(key)
 
             # if no old or duplicates, use original chain
-            if orig_filter:
-                # grab the last entry, if there is one
-                old = orig_filter[-1]
-                chain_str = str(old).strip()
-            elif dup_filter:
-                # grab the last entry, if there is one
-                dup = dup_filter[-1]
-                chain_str = str(dup).strip()
+            if key in old_index:
+                chain_str = old_index[key]
+            elif key in new_index:
+                chain_str = new_index[key]
             else:
                 # add-on the [packet:bytes]
                 chain_str += ' - [0:0]'
@@ -488,22 +610,18 @@ class IptablesManager(object):
             rule_str = str(rule).strip()
             # Further down, we weed out duplicates from the bottom of the
             # list, so here we remove the dupes ahead of time.
-
-            orig_filter = [s for s in old_filter if rule_str in s.strip()]
-            dup_filter = [s for s in new_filter if rule_str in s.strip()]
-            new_filter = [s for s in new_filter if rule_str not in s.strip()]
+            key = rule_str
+            duplicated = key in new_index and key not in ours
+            ours.add(key)
 
             # if no old or duplicates, use original rule
-            if orig_filter:
-                # grab the last entry, if there is one
-                old = orig_filter[-1]
-                rule_str = str(old).strip()
-            elif dup_filter:
-                # grab the last entry, if there is one
-                dup = dup_filter[-1]
-                rule_str = str(dup).strip()
-                # backup one index so we write the array correctly
-                rules_index -= 1
+            if key in old_index:
+                rule_str = old_index[key]
+            elif key in new_index:
+                rule_str = new_index[key]
+                if duplicated:
+                    # backup one index so we write the array correctly
+                    rules_index -= 1
             else:
                 # add-on the [packet:bytes]
                 rule_str = '[0:0] ' + rule_str
@@ -516,21 +634,11 @@ class IptablesManager(object):
 
         our_rules += bot_rules
 
+        new_filter = [line for line in new_filter
+                      if _strip_packets_bytes(line) not in ours]
         new_filter[rules_index:rules_index] = our_rules
         new_filter[rules_index:rules_index] = our_chains
 
-        def _strip_packets_bytes(line):
-            # strip any [packet:byte] counts at start or end of lines
-            if line.startswith(':'):
-                # it's a chain, for example, ":neutron-billing - [0:0]"
-                line = line.split(':')[1]
-                line = line.split(' - [', 1)[0]
-            elif line.startswith('['):
-                # it's a rule, for example, "[0:0] -A neutron-billing..."
-                line = line.split('] ', 1)[1]
-            line = line.strip()
-            return line
-
         seen_chains = set()
 
         def _weed_out_duplicate_chains(line):
@@ -558,21 +666,23 @@ class IptablesManager(object):
             # Leave it alone
             return True
 
+        rules_to_remove = {}
+        for rule in remove_rules:
+            rules_to_remove.setdefault(
+                _strip_packets_bytes(str(rule)), []).append(rule)
+
         def _weed_out_removes(line):
             # We need to find exact matches here
             if line.startswith(':'):
                 line = _strip_packets_bytes(line)
-                for chain in remove_chains:
-                    if chain == line:
-                        remove_chains.remove(chain)
-                        return False
+                if line in remove_chains:
+                    remove_chains.remove(line)
+                    return False
             elif line.startswith('['):
                 line = _strip_packets_bytes(line)
-                for rule in remove_rules:
-                    rule_str = _strip_packets_bytes(str(rule))
-                    if rule_str == line:
-                        remove_rules.remove(rule)
-                        return False
+                if rules_to_remove.get(line):
+                    remove_rules.remove(rules_to_remove[line].pop(0))
+                    return False
 
             # Leave it alone
             return True
@@ -14,12 +14,14 @@
 #    under the License.
 
 import distutils.version as dist_version
+import json
 import os
 import re
 
 from oslo.config import cfg
 
 from neutron.agent.linux import ip_lib
+from neutron.agent.linux import ovsdb_client
 from neutron.agent.linux import utils
 from neutron.common import exceptions
 from neutron.openstack.common import excutils
@@ -35,11 +37,27 @@ OPTS = [
     cfg.IntOpt('ovs_vsctl_timeout',
                default=DEFAULT_OVS_VSCTL_TIMEOUT,
                help=_('Timeout in seconds for ovs-vsctl commands')),
+    cfg.StrOpt('ovsdb_interface',
+               default='vsctl',
+               choices=['vsctl', 'native'],
+               help=_("The interface used to read and update the OVS "
+                      "database: 'vsctl' runs an ovs-vsctl command per "
+                      "operation, 'native' keeps a JSON-RPC connection "
+                      "to ovsdb-server open.")),
+    cfg.StrOpt('ovsdb_connection',
+               default='tcp:127.0.0.1:6640',
+               help=_("The connection to ovsdb-server used by the native "
+                      "interface, 'tcp:IP:PORT' or 'unix:PATH'. "
+                      "ovsdb-server must listen on it, e.g. with "
+                      "'ovs-vsctl set-manager ptcp:6640:127.0.0.1'.")),
 ]
 cfg.CONF.register_opts(OPTS)
 
 LOG = logging.getLogger(__name__)
 
+# Tables whose records are identified by their name column
+OVSDB_NAMED_TABLES = ('Bridge', 'Port', 'Interface')
+
 
 class VifPort:
     def __init__(self, port_name, ofport, vif_id, vif_mac, switch):
@@ -56,11 +74,38 @@ class VifPort:
                 self.switch.br_name)
 
 
+class PortSnapshot(object):
+    """Ports of a bridge, as read at once from the OVS database.
+
+    It answers the lookups of OVSBridge an agent makes while processing
+    the ports found in an iteration, without querying the database again.
+    """
+
+    def __init__(self, vif_ports=None, port_tags=None):
+        # vif id -> VifPort, for the VIF ports having a valid ofport
+        self.vif_ports = vif_ports or {}
+        # port name -> tag, for all the ports
+        self.port_tags = port_tags or {}
+
+    def get_vif_port_set(self):
+        return set(self.vif_ports)
+
+    def get_port_tag_dict(self):
+        return dict(self.port_tags)
+
+    def get_vif_port_by_id(self, port_id):
+        return self.vif_ports.get(port_id)
+
+
 class BaseOVS(object):
 
     def __init__(self, root_helper):
         self.root_helper = root_helper
         self.vsctl_timeout = cfg.CONF.ovs_vsctl_timeout
+        self.ovsdb = None
+        if cfg.CONF.ovsdb_interface == 'native':
+            self.ovsdb = ovsdb_client.get_connection(
+                cfg.CONF.ovsdb_connection, self.vsctl_timeout)
 
     def run_vsctl(self, args, check_error=False):
         full_args = ["ovs-vsctl", "--timeout=%d" % self.vsctl_timeout] + args
@@ -74,6 +119,21 @@ class BaseOVS(object):
                 if not check_error:
                     ctxt.reraise = False
 
+    def run_ovsdb(self, *operations, **kwargs):
+        """Run operations in one transaction of the native connection."""
+        try:
+            return self.ovsdb.transact(*operations)
+        except Exception as e:
+            with excutils.save_and_reraise_exception() as ctxt:
+                LOG.error(_("Unable to run OVSDB transaction %(ops)s. "
+                            "Exception: %(exception)s"),
+                          {'ops': operations, 'exception': e})
+                if not kwargs.get('check_error'):
+                    ctxt.reraise = False
+
+    def _use_ovsdb(self, table):
+        return self.ovsdb is not None and table in OVSDB_NAMED_TABLES
+
     def add_bridge(self, bridge_name):
         self.run_vsctl(["--", "--may-exist", "add-br", bridge_name])
         return OVSBridge(bridge_name, self.root_helper)
@@ -151,13 +211,42 @@ class OVSBridge(BaseOVS):
                         port_name])
 
     def set_db_attribute(self, table_name, record, column, value):
+        if (self._use_ovsdb(table_name) and
+                self._ovsdb_update(table_name, record, column, value)):
+            return
         args = ["set", table_name, record, "%s=%s" % (column, value)]
         self.run_vsctl(args)
 
     def clear_db_attribute(self, table_name, record, column):
+        if (self._use_ovsdb(table_name) and
+                self._ovsdb_update(table_name, record, column, None)):
+            return
         args = ["clear", table_name, record, column]
         self.run_vsctl(args)
 
+    def _ovsdb_update(self, table, record, column, value):
+        """Update a column with the native interface.
+
+        Return False if the update failed, and must be made with ovs-vsctl
+        instead.
+        """
+        try:
+            row = {column: self.ovsdb.encode_value(table, column, value)}
+            results = self.ovsdb.transact(
+                ovsdb_client.update(table, row, [['name', '==', record]]))
+        except Exception as e:
+            LOG.warn(_("Unable to update %(table)s %(record)s column "
+                       "%(column)s through OVSDB, using ovs-vsctl. "
+                       "Exception: %(exception)s"),
+                     {'table': table, 'record': record, 'column': column,
+                      'exception': e})
+            return False
+        if not results[0].get('count'):
+            LOG.error(_("Unable to update %(table)s %(record)s column "
+                        "%(column)s: no such record"),
+                      {'table': table, 'record': record, 'column': column})
+        return True
+
     def run_ofctl(self, cmd, args, process_input=None):
         full_args = ["ovs-ofctl", cmd, self.br_name] + args
         try:
@@ -244,6 +333,11 @@ class OVSBridge(BaseOVS):
         return self.get_port_ofport(local_name)
 
     def db_get_map(self, table, record, column, check_error=False):
+        if self._use_ovsdb(table):
+            value = self._ovsdb_get(table, record, column, check_error)
+            if value is None:
+                return {}
+            return ovsdb_client.to_vsctl_map(value)
         output = self.run_vsctl(["get", table, record, column], check_error)
         if output:
             output_str = output.rstrip("\n\r")
@@ -251,10 +345,25 @@ class OVSBridge(BaseOVS):
         return {}
 
     def db_get_val(self, table, record, column, check_error=False):
+        if self._use_ovsdb(table):
+            value = self._ovsdb_get(table, record, column, check_error)
+            if value is not None:
+                return ovsdb_client.to_vsctl_str(value)
+            return
         output = self.run_vsctl(["get", table, record, column], check_error)
         if output:
             return output.rstrip("\n\r")
 
+    def _ovsdb_get(self, table, record, column, check_error):
+        results = self.run_ovsdb(
+            ovsdb_client.select(table, [column], [['name', '==', record]]),
+            check_error=check_error)
+        if results and results[0]['rows']:
+            return results[0]['rows'][0][column]
+        if results:
+            LOG.debug(_("No %(table)s record named %(record)s"),
+                      {'table': table, 'record': record})
+
     def db_str_to_map(self, full_str):
         list = full_str.strip("{}").split(", ")
         ret = {}
@@ -266,6 +375,9 @@ class OVSBridge(BaseOVS):
         return ret
 
     def get_port_name_list(self):
+        if self.ovsdb is not None:
+            port_rows, _iface_rows = self._get_bridge_rows([], [])
+            return sorted(row['name'] for row in port_rows)
         res = self.run_vsctl(["list-ports", self.br_name], check_error=True)
         if res:
             return res.strip().split("\n")
@@ -285,67 +397,126 @@ class OVSBridge(BaseOVS):
                             "Exception: %(exception)s"),
                           {'cmd': args, 'exception': e})
 
+    def _get_bridge_rows(self, port_columns, iface_columns):
+        """Return the Port and Interface rows of the bridge.
+
+        The bridge, all the ports and all the interfaces are read at once,
+        with a single ovs-vsctl command or OVSDB transaction, and the rows
+        not belonging to the bridge are filtered out. As with 'ovs-vsctl
+        list-ports', the local port of the bridge is left out.
+
+        Rows are dicts of the OVSDB JSON encoded values of the columns,
+        which always include '_uuid' and 'name'.
+        """
+        port_columns = _add_columns(['_uuid', 'name', 'interfaces'],
+                                    port_columns)
+        iface_columns = _add_columns(['_uuid', 'name'], iface_columns)
+        if self.ovsdb is not None:
+            results = self.run_ovsdb(
+                ovsdb_client.select('Bridge', ['ports'],
+                                    [['name', '==', self.br_name]]),
+                ovsdb_client.select('Port', port_columns),
+                ovsdb_client.select('Interface', iface_columns),
+                check_error=True)
+            bridges, ports, ifaces = [result['rows'] for result in results]
+        else:
+            args = ['--format=json',
+                    '--', '--columns=ports', 'list', 'Bridge', self.br_name,
+                    '--', '--columns=%s' % ','.join(port_columns),
+                    'list', 'Port',
+                    '--', '--columns=%s' % ','.join(iface_columns),
+                    'list', 'Interface']
+            result = self.run_vsctl(args, check_error=True)
+            tables = _loads_json_stream(result)
+            bridges, ports, ifaces = [
+                [dict(zip(columns, data)) for data in table['data']]
+                for columns, table in zip(
+                    (['ports'], port_columns, iface_columns), tables)]
+        if not bridges:
+            raise RuntimeError(_("Bridge %s not found") % self.br_name)
+        bridge_ports = set(ovsdb_client.to_list(bridges[0]['ports']))
+        ports = [row for row in ports
+                 if (ovsdb_client.to_python(row['_uuid']) in bridge_ports and
+                     row['name'] != self.br_name)]
+        bridge_ifaces = set()
+        for row in ports:
+            bridge_ifaces.update(ovsdb_client.to_list(row['interfaces']))
+        ifaces = [row for row in ifaces
+                  if ovsdb_client.to_python(row['_uuid']) in bridge_ifaces]
+        return ports, ifaces
+
+    def _get_vif_id(self, external_ids):
+        if "attached-mac" not in external_ids:
+            return
+        if "iface-id" in external_ids:
+            return external_ids["iface-id"]
+        if "xs-vif-uuid" in external_ids:
+            # if this is a xenserver and iface-id is not automatically
+            # synced to OVS from XAPI, we grab it from XAPI directly
+            return self.get_xapi_iface_id(external_ids["xs-vif-uuid"])
+
+    def _get_ready_vif_ports(self, iface_rows):
+        """Return the VifPorts of the interfaces which are ready, by id."""
+        vif_ports = {}
+        for row in iface_rows:
+            # Do not consider VIFs which aren't yet ready
+            # This can happen when ofport values are either [] or ["set", []]
+            # We will therefore consider only integer values for ofport
+            ofport = row['ofport']
+            if not isinstance(ofport, int):
+                LOG.warn(_("Found not yet ready openvswitch port: %s"), row)
+            elif ofport <= 0:
+                LOG.warn(_("Found failed openvswitch port: %s"), row)
+            else:
+                external_ids = ovsdb_client.to_python(row['external_ids'])
+                vif_id = self._get_vif_id(external_ids)
+                if vif_id:
+                    vif_ports[vif_id] = VifPort(row['name'], ofport, vif_id,
+                                                external_ids["attached-mac"],
+                                                self)
+        return vif_ports
+
+    def _get_port_tags(self, port_rows):
+        port_tags = {}
+        for row in port_rows:
+            # 'tag' can be [u'set', []] or an integer
+            tag = row['tag']
+            if isinstance(tag, list):
+                tag = tag[1]
+            port_tags[row['name']] = tag
+        return port_tags
+
     # returns a VIF object for each VIF port
     def get_vif_ports(self):
         edge_ports = []
-        port_names = self.get_port_name_list()
-        for name in port_names:
-            external_ids = self.db_get_map("Interface", name, "external_ids",
-                                           check_error=True)
-            ofport = self.db_get_val("Interface", name, "ofport",
-                                     check_error=True)
-            if "iface-id" in external_ids and "attached-mac" in external_ids:
-                p = VifPort(name, ofport, external_ids["iface-id"],
-                            external_ids["attached-mac"], self)
-                edge_ports.append(p)
-            elif ("xs-vif-uuid" in external_ids and
-                  "attached-mac" in external_ids):
-                # if this is a xenserver and iface-id is not automatically
-                # synced to OVS from XAPI, we grab it from XAPI directly
-                iface_id = self.get_xapi_iface_id(external_ids["xs-vif-uuid"])
-                p = VifPort(name, ofport, iface_id,
+        _port_rows, iface_rows = self._get_bridge_rows(
+            [], ['external_ids', 'ofport'])
+        for row in iface_rows:
+            external_ids = ovsdb_client.to_python(row['external_ids'])
+            vif_id = self._get_vif_id(external_ids)
+            if vif_id:
+                # ofport is returned as printed by ovs-vsctl get
+                ofport = ovsdb_client.to_vsctl_str(row['ofport'])
+                p = VifPort(row['name'], ofport, vif_id,
                             external_ids["attached-mac"], self)
                 edge_ports.append(p)
 
         return edge_ports
 
+    def get_port_snapshot(self):
+        """Return a PortSnapshot of the ports of the bridge.
+
+        The cost does not depend on the number of ports: their names, tags,
+        ofports and external ids are all read with a single ovs-vsctl
+        command or OVSDB transaction.
+        """
+        port_rows, iface_rows = self._get_bridge_rows(
+            ['tag'], ['external_ids', 'ofport'])
+        return PortSnapshot(self._get_ready_vif_ports(iface_rows),
+                            self._get_port_tags(port_rows))
+
     def get_vif_port_set(self):
-        port_names = self.get_port_name_list()
-        edge_ports = set()
-        args = ['--format=json', '--', '--columns=name,external_ids,ofport',
-                'list', 'Interface']
-        result = self.run_vsctl(args, check_error=True)
-        if not result:
-            return edge_ports
-        for row in jsonutils.loads(result)['data']:
-            name = row[0]
-            if name not in port_names:
-                continue
-            external_ids = dict(row[1][1])
-            # Do not consider VIFs which aren't yet ready
-            # This can happen when ofport values are either [] or ["set", []]
-            # We will therefore consider only integer values for ofport
-            ofport = row[2]
-            try:
-                int_ofport = int(ofport)
-            except (ValueError, TypeError):
-                LOG.warn(_("Found not yet ready openvswitch port: %s"), row)
-            else:
-                if int_ofport > 0:
-                    if ("iface-id" in external_ids and
-                        "attached-mac" in external_ids):
-                        edge_ports.add(external_ids['iface-id'])
-                    elif ("xs-vif-uuid" in external_ids and
-                          "attached-mac" in external_ids):
-                        # if this is a xenserver and iface-id is not
-                        # automatically synced to OVS from XAPI, we grab it
-                        # from XAPI directly
-                        iface_id = self.get_xapi_iface_id(
-                            external_ids["xs-vif-uuid"])
-                        edge_ports.add(iface_id)
-                else:
-                    LOG.warn(_("Found failed openvswitch port: %s"), row)
-        return edge_ports
+        return self.get_port_snapshot().get_vif_port_set()
 
     def get_port_tag_dict(self):
         """Get a dict of port names and associated vlan tags.
@@ -358,26 +529,18 @@ class OVSBridge(BaseOVS):
              u'tapce5318ff-78': 1,
              u'tape1400310-e6': 1}
 
-        The TAG ID is only available in the "Port" table and is not available
-        in the "Interface" table queried by the get_vif_port_set() method.
-
         """
-        port_names = self.get_port_name_list()
-        args = ['--format=json', '--', '--columns=name,tag', 'list', 'Port']
-        result = self.run_vsctl(args, check_error=True)
-        port_tag_dict = {}
-        if not result:
-            return port_tag_dict
-        for name, tag in jsonutils.loads(result)['data']:
-            if name not in port_names:
-                continue
-            # 'tag' can be [u'set', []] or an integer
-            if isinstance(tag, list):
-                tag = tag[1]
-            port_tag_dict[name] = tag
-        return port_tag_dict
+        return self.get_port_snapshot().get_port_tag_dict()
 
     def get_vif_port_by_id(self, port_id):
+        if self.ovsdb is not None:
+            try:
+                _port_rows, iface_rows = self._get_bridge_rows(
+                    [], ['external_ids', 'ofport'])
+            except Exception as e:
+                LOG.warn(_("Unable to read interfaces. Exception: %s"), e)
+                return
+            return self._get_ready_vif_ports(iface_rows).get(port_id)
         args = ['--format=json', '--', '--columns=external_ids,name,ofport',
                 'find', 'Interface',
                 'external_ids:iface-id="%s"' % port_id]
@@ -439,6 +602,22 @@ class OVSBridge(BaseOVS):
             raise Exception(msg)
 
 
+def _add_columns(columns, extra_columns):
+    return columns + [c for c in extra_columns if c not in columns]
+
+
+def _loads_json_stream(output):
+    """Decode the JSON documents printed one after the other by vsctl."""
+    decoder = json.JSONDecoder()
+    documents = []
+    output = output.strip()
+    while output:
+        document, end = decoder.raw_decode(output)
+        documents.append(document)
+        output = output[end:].lstrip()
+    return documents
+
+
 def get_bridge_for_iface(root_helper, iface):
     args = ["ovs-vsctl", "--timeout=%d" % cfg.CONF.ovs_vsctl_timeout,
             "iface-to-br", iface]
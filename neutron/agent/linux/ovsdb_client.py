@@ -0,0 +1,293 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Minimal OVSDB JSON-RPC client (RFC 7047).
+
+A single connection to ovsdb-server is kept open and shared by all the
+bridges of an agent, so that reading or updating the database does not
+fork an ovs-vsctl process per operation. Several operations can be sent
+in one transaction.
+"""
+
+import re
+import socket
+import threading
+
+from neutron.common import exceptions
+from neutron.openstack.common import jsonutils
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_SCHEMA = 'Open_vSwitch'
+RECV_SIZE = 65536
+
+# Strings ovs-vsctl prints without quotes
+_BARE_STRING_RE = re.compile(r'^[a-zA-Z_][a-zA-Z0-9_]*$')
+# Characters delimiting the JSON messages received from ovsdb-server
+_JSON_DELIMITER_RE = re.compile(r'[][{}"\\]')
+
+
+class OvsdbError(exceptions.NeutronException):
+    message = _("OVSDB request failed: %(error)s")
+
+
+def to_python(value):
+    """Decode an OVSDB JSON value into python types.
+
+    Sets are returned as lists, maps as dicts and UUIDs as strings.
+    """
+    if isinstance(value, list) and len(value) == 2:
+        kind, data = value
+        if kind == 'set':
+            return [to_python(v) for v in data]
+        if kind == 'map':
+            return dict((to_python(k), to_python(v)) for k, v in data)
+        if kind in ('uuid', 'named-uuid'):
+            return data
+    return value
+
+
+def to_list(value):
+    """Decode an OVSDB set, which may be encoded as a single atom."""
+    value = to_python(value)
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def _atom_to_str(atom):
+    if isinstance(atom, bool):
+        return 'true' if atom else 'false'
+    if isinstance(atom, basestring):
+        if _BARE_STRING_RE.match(atom) and atom not in ('true', 'false'):
+            return atom
+        return jsonutils.dumps(atom)
+    return str(atom)
+
+
+def to_vsctl_str(value):
+    """Format an OVSDB JSON value the way 'ovs-vsctl get' prints it."""
+    value = to_python(value)
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join('%s=%s' % (_atom_to_str(k), _atom_to_str(v))
+                                  for k, v in sorted(value.items()))
+    if isinstance(value, list):
+        return '[%s]' % ', '.join(_atom_to_str(v) for v in value)
+    return _atom_to_str(value)
+
+
+def to_vsctl_map(value):
+    """Decode an OVSDB map into a dict of strings, as parsed from vsctl."""
+    return dict((k, v if isinstance(v, basestring) else _atom_to_str(v))
+                for k, v in to_python(value).iteritems())
+
+
+def _message_end(data):
+    """Return the end of the JSON message data starts with.
+
+    None is returned if the message was not fully received yet.
+    """
+    depth = 0
+    in_string = False
+    escaped = -1
+    for match in _JSON_DELIMITER_RE.finditer(data):
+        pos = match.start()
+        char = data[pos]
+        if pos == escaped:
+            continue
+        if in_string:
+            if char == '\\':
+                escaped = pos + 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '[{':
+            depth += 1
+        elif char in ']}':
+            depth -= 1
+            if not depth:
+                return pos + 1
+
+
+class Connection(object):
+    """Persistent JSON-RPC connection to ovsdb-server.
+
+    :param connection: 'tcp:IP:PORT' or 'unix:PATH'
+    :param timeout: timeout in seconds of a request
+    """
+
+    def __init__(self, connection, timeout, schema_name=DEFAULT_SCHEMA):
+        self.connection = connection
+        self.timeout = timeout
+        self.schema_name = schema_name
+        self.schema = None
+        self._sock = None
+        self._buffer = ''
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        proto, _sep, address = self.connection.partition(':')
+        if proto == 'tcp':
+            host, _sep, port = address.rpartition(':')
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            address = (host, int(port))
+        elif proto == 'unix':
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            raise OvsdbError(error=_("unsupported connection %s") %
+                             self.connection)
+        sock.settimeout(self.timeout)
+        sock.connect(address)
+        self._sock = sock
+        self._buffer = ''
+        if self.schema is None:
+            self.schema = self._call('get_schema', [self.schema_name])
+
+    def close(self):
+        if self._sock:
+            try:
+                self._sock.close()
+            except socket.error:
+                pass
+        self._sock = None
+
+    def _send(self, msg):
+        self._sock.sendall(jsonutils.dumps(msg))
+
+    def _recv(self):
+        while True:
+            data = self._buffer.lstrip()
+            end = _message_end(data)
+            if end:
+                self._buffer = data[end:]
+                return jsonutils.loads(data[:end])
+            chunk = self._sock.recv(RECV_SIZE)
+            if not chunk:
+                raise socket.error(_("Connection closed by ovsdb-server"))
+            self._buffer = data + chunk
+
+    def _call(self, method, params):
+        self._next_id += 1
+        msg_id = self._next_id
+        self._send({'method': method, 'params': params, 'id': msg_id})
+        while True:
+            msg = self._recv()
+            if msg.get('method') == 'echo':
+                self._send({'result': msg.get('params'), 'error': None,
+                            'id': msg.get('id')})
+            elif msg.get('id') == msg_id:
+                if msg.get('error'):
+                    raise OvsdbError(error=msg['error'])
+                return msg.get('result')
+            # Anything else (e.g. update notifications) is ignored
+
+    def call(self, method, params):
+        """Send a request and wait for its result.
+
+        The connection is (re)established if needed, and a request failing
+        on a stale connection is retried once on a new one.
+        """
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if not self._sock:
+                        self._connect()
+                    return self._call(method, params)
+                except (socket.error, socket.timeout, ValueError) as e:
+                    # A malformed message leaves the stream unusable too
+                    self.close()
+                    if attempt:
+                        raise OvsdbError(error=e)
+                    LOG.debug(_("OVSDB connection %(conn)s failed: %(err)s, "
+                                "reconnecting"),
+                              {'conn': self.connection, 'err': e})
+
+    def transact(self, *operations):
+        """Run operations in one transaction and return their results."""
+        results = self.call('transact',
+                            [self.schema_name] + list(operations))
+        for result in results:
+            if result and 'error' in result:
+                raise OvsdbError(error='%s: %s' % (result['error'],
+                                                   result.get('details')))
+        return results
+
+    def column_type(self, table, column):
+        """Return the schema type of a column as a dict.
+
+        The dict has 'key', 'min' and 'max' entries, and 'value' for maps.
+        """
+        if self.schema is None:
+            # The schema is fetched when connecting
+            self.call('echo', [])
+        col_type = self.schema['tables'][table]['columns'][column]['type']
+        if not isinstance(col_type, dict):
+            col_type = {'key': col_type}
+        col_type = dict(col_type)
+        col_type.setdefault('min', 1)
+        col_type.setdefault('max', 1)
+        for part in ('key', 'value'):
+            if isinstance(col_type.get(part), dict):
+                col_type[part] = col_type[part]['type']
+        return col_type
+
+    def encode_value(self, table, column, value):
+        """Encode a value given as to 'ovs-vsctl set' for a column.
+
+        Only columns holding a single atom can be set, and None clears a
+        column holding an optional value, a set or a map.
+        """
+        col_type = self.column_type(table, column)
+        if value is None:
+            if col_type['min'] != 0:
+                raise OvsdbError(error=_("column %s can not be cleared") %
+                                 column)
+            return ['map' if 'value' in col_type else 'set', []]
+        if 'value' in col_type or col_type['max'] != 1:
+            raise OvsdbError(error=_("setting column %s is not supported") %
+                             column)
+        key_type = col_type['key']
+        if key_type == 'integer':
+            return int(value)
+        if key_type == 'real':
+            return float(value)
+        if key_type == 'boolean':
+            return str(value).lower() == 'true'
+        if key_type == 'uuid':
+            return ['uuid', value]
+        return value.strip('"')
+
+
+def select(table, columns, where=None):
+    return {'op': 'select', 'table': table, 'where': where or [],
+            'columns': columns}
+
+
+def update(table, row, where):
+    return {'op': 'update', 'table': table, 'where': where, 'row': row}
+
+
+_connections = {}
+
+
+def get_connection(connection, timeout):
+    """Return the connection shared by all the callers of a process."""
+    conn = _connections.get(connection)
+    if conn is None:
+        conn = _connections[connection] = Connection(connection, timeout)
+    return conn
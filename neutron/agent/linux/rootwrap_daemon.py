@@ -0,0 +1,330 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Long lived root helper.
+
+Running a command as root with 'sudo neutron-rootwrap' starts a python
+interpreter for every command. When the root_helper_daemon option is set,
+an agent instead starts neutron-rootwrap-daemon once, with that command,
+and sends it the commands to run over a unix socket. The daemon creates
+the socket in a directory of its own, and gives it to the user who ran
+it with sudo.
+
+The daemon checks the commands against the rootwrap filters, like
+neutron-rootwrap. The commands given to 'ip netns exec' are run by the
+daemon directly in the network namespace, without forking 'ip'. Unlike
+'ip netns exec', /sys is not remounted and /etc/netns is not bind mounted
+for them.
+"""
+
+import ctypes
+import json
+import os
+import shlex
+import signal
+import socket
+import SocketServer
+import subprocess
+import sys
+import tempfile
+import threading
+
+from oslo.rootwrap import filters
+from oslo.rootwrap import wrapper
+from six import moves
+
+from neutron.common import exceptions
+from neutron.common import utils
+from neutron.openstack.common import excutils
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+# Exit codes of neutron-rootwrap
+RC_UNAUTHORIZED = 99
+RC_NOCOMMAND = 98
+RC_NOEXECFOUND = 96
+
+CLONE_NEWNET = 0x40000000
+NETNS_DIR = '/var/run/netns'
+READY = 'READY'
+RECV_SIZE = 65536
+
+
+class RootwrapDaemonError(exceptions.NeutronException):
+    message = _("Root helper daemon request failed: %(error)s")
+
+
+class RootwrapDaemonResponseError(exceptions.NeutronException):
+    message = _("No response to a root helper daemon request, the command "
+                "may have run: %(error)s")
+
+
+# Data is exchanged as JSON, in which any byte string can be represented
+# once decoded as latin-1
+def _decode(data):
+    return data.decode('latin-1') if data is not None else None
+
+
+def _encode(data):
+    return data.encode('latin-1') if data is not None else None
+
+
+def _enter_namespace(namespace):
+    """Move the calling process to a namespace created by 'ip netns add'."""
+    libc = ctypes.CDLL('libc.so.6', use_errno=True)
+    fd = os.open(os.path.join(NETNS_DIR, namespace), os.O_RDONLY)
+    try:
+        if libc.setns(fd, CLONE_NEWNET):
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+    finally:
+        os.close(fd)
+
+
+class RootwrapDaemon(object):
+    """Runs the commands allowed by the rootwrap filters."""
+
+    def __init__(self, filter_list, exec_dirs):
+        self.filter_list = filter_list
+        self.exec_dirs = exec_dirs
+
+    def _get_command(self, userargs):
+        """Return the namespace, command and environment to run userargs."""
+        filtermatch = wrapper.match_filter(self.filter_list, userargs,
+                                           exec_dirs=self.exec_dirs)
+        namespace = None
+        if isinstance(filtermatch, filters.IpNetnsExecFilter):
+            namespace = userargs[3]
+            if '/' in namespace or namespace in ('.', '..'):
+                raise wrapper.NoFilterMatched()
+            run_as = filtermatch.run_as
+            userargs = filtermatch.exec_args(userargs)
+            leaf_filters = [f for f in self.filter_list
+                            if f.run_as == run_as and
+                            not isinstance(f, filters.ChainingFilter)]
+            filtermatch = wrapper.match_filter(leaf_filters, userargs,
+                                               exec_dirs=self.exec_dirs)
+        return (namespace,
+                filtermatch.get_command(userargs, exec_dirs=self.exec_dirs),
+                filtermatch.get_environment(userargs))
+
+    def run_command(self, userargs, process_input=None):
+        """Run a command and return its exit code, stdout and stderr.
+
+        Commands not allowed by the filters get the exit code and error of
+        neutron-rootwrap.
+        """
+        try:
+            namespace, command, env = self._get_command(userargs)
+        except wrapper.FilterMatchNotExecutable as e:
+            return (RC_NOEXECFOUND, '',
+                    'Executable not found: %s (filter match = %s)\n' %
+                    (e.match.exec_path, e.match.name))
+        except wrapper.NoFilterMatched:
+            return (RC_UNAUTHORIZED, '',
+                    'Unauthorized command: %s (no filter matched)\n' %
+                    ' '.join(userargs))
+
+        def preexec():
+            signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+            if namespace:
+                _enter_namespace(namespace)
+
+        try:
+            obj = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   preexec_fn=preexec, close_fds=True,
+                                   env=env)
+        except OSError as e:
+            if namespace:
+                return (1, '', 'Cannot open network namespace "%s": %s\n' %
+                        (namespace, e.strerror))
+            return 1, '', '%s: %s\n' % (command[0], e.strerror)
+        stdout, stderr = obj.communicate(process_input)
+        return obj.returncode, stdout, stderr
+
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        request = json.loads(self.rfile.read())
+        returncode, stdout, stderr = self.server.daemon.run_command(
+            [_encode(arg) for arg in request['cmd']],
+            _encode(request.get('process_input')))
+        self.wfile.write(json.dumps({'returncode': returncode,
+                                     'stdout': _decode(stdout),
+                                     'stderr': _decode(stderr)}))
+
+
+class RootwrapServer(SocketServer.ThreadingMixIn,
+                     SocketServer.UnixStreamServer):
+    """Serves the requests of an agent, each one in its own thread.
+
+    The socket is created in a new directory, which only the daemon can
+    write to, so that no path given by the agent is ever bound or removed.
+    The socket is given to the user who ran the daemon with sudo, the
+    agent.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, daemon):
+        self.daemon = daemon
+        self.socket_dir = tempfile.mkdtemp(prefix='neutron-rootwrap-')
+        os.chmod(self.socket_dir, 0o711)
+        SocketServer.UnixStreamServer.__init__(
+            self, os.path.join(self.socket_dir, 'rootwrap.sock'),
+            _RequestHandler)
+
+    def server_bind(self):
+        SocketServer.UnixStreamServer.server_bind(self)
+        os.chmod(self.server_address, 0o600)
+        os.chown(self.server_address,
+                 int(os.environ.get('SUDO_UID', os.getuid())),
+                 int(os.environ.get('SUDO_GID', os.getgid())))
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        os.rmdir(self.socket_dir)
+
+
+def main():
+    """neutron-rootwrap-daemon <rootwrap config file>
+
+    The daemon prints READY and the path of its socket once it accepts
+    requests, and exits when its standard input is closed.
+    """
+    if len(sys.argv) != 2:
+        sys.stderr.write('Usage: %s <rootwrap config file>\n' % sys.argv[0])
+        sys.exit(RC_NOCOMMAND)
+    config_file = sys.argv[1]
+    rawconfig = moves.configparser.RawConfigParser()
+    rawconfig.read(config_file)
+    config = wrapper.RootwrapConfig(rawconfig)
+
+    daemon = RootwrapDaemon(wrapper.load_filters(config.filters_path),
+                            config.exec_dirs)
+    server = RootwrapServer(daemon)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    sys.stdout.write('%s %s\n' % (READY, server.server_address))
+    sys.stdout.flush()
+    try:
+        sys.stdin.read()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class RootwrapDaemonClient(object):
+    """Runs commands as root with a neutron-rootwrap-daemon.
+
+    The daemon is started with daemon_cmd for the first command, and again
+    if it died or failed to answer a request.
+    """
+
+    def __init__(self, daemon_cmd):
+        self.daemon_cmd = daemon_cmd
+        self.socket_path = None
+        self._process = None
+        self._lock = threading.Lock()
+
+    def _start_daemon(self):
+        cmd = shlex.split(self.daemon_cmd)
+        LOG.debug(_("Starting root helper daemon: %s"), cmd)
+        self._process = utils.subprocess_popen(cmd, stdin=subprocess.PIPE,
+                                               stdout=subprocess.PIPE)
+        ready = self._process.stdout.readline().split()
+        if len(ready) != 2 or ready[0] != READY:
+            raise RuntimeError(_("%s did not start") % self.daemon_cmd)
+        self.socket_path = ready[1]
+
+    def _stop_daemon(self):
+        if self._process:
+            # The daemon exits, and removes its socket, when its standard
+            # input is closed
+            self._process.stdin.close()
+            self._process = None
+        self.socket_path = None
+
+    def _get_socket_path(self):
+        with self._lock:
+            if not self._process or self._process.poll() is not None:
+                self._stop_daemon()
+                try:
+                    self._start_daemon()
+                except (OSError, RuntimeError) as e:
+                    self._stop_daemon()
+                    raise RootwrapDaemonError(error=e)
+            return self.socket_path
+
+    def _request(self, socket_path, request):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            try:
+                sock.connect(socket_path)
+                sock.sendall(json.dumps(request))
+            except socket.error as e:
+                # The daemon can not have read a whole request
+                raise RootwrapDaemonError(error=e)
+            try:
+                sock.shutdown(socket.SHUT_WR)
+                chunks = []
+                while True:
+                    chunk = sock.recv(RECV_SIZE)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+                return json.loads(''.join(chunks))
+            except (socket.error, ValueError) as e:
+                raise RootwrapDaemonResponseError(error=e)
+        finally:
+            sock.close()
+
+    def execute(self, cmd, process_input=None):
+        """Run cmd as root and return its exit code, stdout and stderr.
+
+        RootwrapDaemonError is raised if the command was not sent to the
+        daemon, and RootwrapDaemonResponseError if it was sent but its
+        result was not received.
+        """
+        socket_path = self._get_socket_path()
+        request = {'cmd': [_decode(arg) for arg in cmd],
+                   'process_input': _decode(process_input)}
+        try:
+            response = self._request(socket_path, request)
+        except (RootwrapDaemonError, RootwrapDaemonResponseError):
+            with excutils.save_and_reraise_exception():
+                with self._lock:
+                    if self.socket_path == socket_path:
+                        self._stop_daemon()
+        return (response['returncode'], _encode(response['stdout']),
+                _encode(response['stderr']))
+
+
+_clients = {}
+
+
+def get_client(daemon_cmd):
+    """Return the client shared by all the callers of a process."""
+    client = _clients.get(daemon_cmd)
+    if client is None:
+        client = _clients[daemon_cmd] = RootwrapDaemonClient(daemon_cmd)
+    return client
@@ -26,7 +26,9 @@ import tempfile
 
 from eventlet.green import subprocess
 from eventlet import greenthread
+from oslo.config import cfg
 
+from neutron.agent.linux import rootwrap_daemon
 from neutron.common import utils
 from neutron.openstack.common import excutils
 from neutron.openstack.common import log as logging
@@ -59,20 +61,56 @@ def create_process(cmd, root_helper=None, addl_env=None):
     return obj, cmd
 
 
+def _get_root_helper_daemon():
+    try:
+        return cfg.CONF.AGENT.root_helper_daemon
+    except cfg.NoSuchOptError:
+        return None
+
+
+def _execute_with_daemon(cmd, root_helper_daemon, process_input):
+    """Run cmd with the root helper daemon.
+
+    None is returned if cmd could not be sent to the daemon, for cmd to be
+    run with the root helper instead. A command sent to the daemon is never
+    run again, even if its result was lost.
+    """
+    cmd = map(str, cmd)
+    LOG.debug(_("Running command with the root helper daemon: %s"), cmd)
+    client = rootwrap_daemon.get_client(root_helper_daemon)
+    try:
+        return client.execute(cmd, process_input)
+    except rootwrap_daemon.RootwrapDaemonError as e:
+        LOG.warn(_("%(error)s, running %(cmd)s with the root helper"),
+                 {'error': e, 'cmd': cmd})
+    except rootwrap_daemon.RootwrapDaemonResponseError as e:
+        raise RuntimeError(_("\nCommand: %(cmd)s\n%(error)s") %
+                           {'cmd': cmd, 'error': e})
+
+
 def execute(cmd, root_helper=None, process_input=None, addl_env=None,
             check_exit_code=True, return_stderr=False):
     try:
-        obj, cmd = create_process(cmd, root_helper=root_helper,
-                                  addl_env=addl_env)
-        _stdout, _stderr = (process_input and
-                            obj.communicate(process_input) or
-                            obj.communicate())
-        obj.stdin.close()
+        result = None
+        root_helper_daemon = root_helper and _get_root_helper_daemon()
+        if root_helper_daemon:
+            result = _execute_with_daemon(cmd, root_helper_daemon,
+                                          process_input)
+        if result:
+            returncode, _stdout, _stderr = result
+        else:
+            obj, cmd = create_process(cmd, root_helper=root_helper,
+                                      addl_env=addl_env)
+            _stdout, _stderr = (process_input and
+                                obj.communicate(process_input) or
+                                obj.communicate())
+            obj.stdin.close()
+            returncode = obj.returncode
         m = _("\nCommand: %(cmd)s\nExit code: %(code)s\nStdout: %(stdout)r\n"
-              "Stderr: %(stderr)r") % {'cmd': cmd, 'code': obj.returncode,
+              "Stderr: %(stderr)r") % {'cmd': cmd, 'code': returncode,
                                        'stdout': _stdout, 'stderr': _stderr}
         LOG.debug(m)
-        if obj.returncode and check_exit_code:
+        if returncode and check_exit_code:
             raise RuntimeError(m)
     finally:
         # NOTE(termie): this appears to be necessary to let the subprocess
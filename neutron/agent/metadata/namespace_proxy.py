@@ -20,6 +20,7 @@ import httplib
 import socket
 
 import eventlet
+from eventlet import pools
 import httplib2
 from oslo.config import cfg
 import six.moves.urllib.parse as urlparse
@@ -33,6 +34,9 @@ from neutron import wsgi
 
 LOG = logging.getLogger(__name__)
 
+# Maximum number of connections kept open to the metadata agent
+HTTP_POOL_SIZE = 64
+
 
 class UnixDomainHTTPConnection(httplib.HTTPConnection):
     """Connection class for HTTP over UNIX domain socket."""
@@ -48,6 +52,12 @@ class UnixDomainHTTPConnection(httplib.HTTPConnection):
         self.sock.connect(cfg.CONF.metadata_proxy_socket)
 
 
+def new_http_pool():
+    """Return a pool of HTTP clients, each one keeping its connection."""
+    return pools.Pool(max_size=HTTP_POOL_SIZE,
+                      create=lambda: httplib2.Http())
+
+
 class NetworkMetadataProxyHandler(object):
     """Proxy AF_INET metadata request through Unix Domain socket.
 
@@ -55,9 +65,10 @@ class NetworkMetadataProxyHandler(object):
     accessible within the isolated tenant context.
     """
 
-    def __init__(self, network_id=None, router_id=None):
+    def __init__(self, network_id=None, router_id=None, http_pool=None):
         self.network_id = network_id
         self.router_id = router_id
+        self.http_pool = http_pool or new_http_pool()
 
         if network_id is None and router_id is None:
             msg = _('network_id and router_id are None. One must be provided.')
@@ -96,13 +107,13 @@ class NetworkMetadataProxyHandler(object):
             query_string,
             ''))
 
-        h = httplib2.Http()
-        resp, content = h.request(
-            url,
-            method=method,
-            headers=headers,
-            body=body,
-            connection_type=UnixDomainHTTPConnection)
+        with self.http_pool.item() as h:
+            resp, content = h.request(
+                url,
+                method=method,
+                headers=headers,
+                body=body,
+                connection_type=UnixDomainHTTPConnection)
 
         if resp.status == 200:
             LOG.debug(resp)
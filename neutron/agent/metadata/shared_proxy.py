@@ -0,0 +1,358 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Metadata proxy shared by the routers and networks of a host.
+
+Instead of a neutron-ns-metadata-proxy process per router or network, a
+single neutron-shared-metadata-proxy serves the metadata requests of all
+the namespaces registered by the agents of the host. It opens a listening
+socket in each namespace, after entering it with setns(), and forwards the
+requests tagged with the router or network id to the metadata agent over
+a pool of persistent connections.
+
+The agents register their namespaces over a unix socket, the control
+socket, and start the proxy when it is not running. A proxy does not start
+when another one is listening on the control socket.
+"""
+
+import errno
+import json
+import os
+import socket
+import stat
+import threading
+
+import eventlet
+import eventlet.wsgi
+from oslo.config import cfg
+
+from neutron.agent.common import config as agent_config
+from neutron.agent.linux import daemon
+from neutron.agent.linux import external_process
+from neutron.agent.linux import ip_netlink
+from neutron.agent.metadata import namespace_proxy
+from neutron.common import config
+from neutron.common import exceptions
+from neutron.common import utils
+from neutron.openstack.common import lockutils
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+# Name of the process in the pid files
+SHARED_PROXY_UUID = 'shared-metadata-proxy'
+RECV_SIZE = 65536
+# The control socket may not be ready yet when the proxy was just started
+CONNECT_RETRIES = 50
+CONNECT_INTERVAL = 0.1
+
+
+class SharedMetadataProxyError(exceptions.NeutronException):
+    message = _("Shared metadata proxy request failed: %(error)s")
+
+
+def _recv_all(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(RECV_SIZE)
+        if not chunk:
+            return ''.join(chunks)
+        chunks.append(chunk)
+
+
+class SharedMetadataProxy(object):
+    """Serves the metadata requests of many namespaces.
+
+    A request on the control socket is a JSON object, either
+    {"action": "add", "namespace": ..., "port": ..., "router_id": ... (or
+    "network_id"), "owner": ...}, {"action": "remove", "namespace": ...} or
+    {"action": "sync", "owner": ..., "registrations": [add requests]}. The
+    response holds the error of the request, or null, and the pid of the
+    proxy.
+
+    The owner identifies the agent which registered a namespace, so that a
+    sync only drops the namespaces of that agent.
+    """
+
+    def __init__(self, control_socket):
+        self.control_socket = control_socket
+        self.http_pool = namespace_proxy.new_http_pool()
+        # namespace -> (registration, listening socket, server thread)
+        self.servers = {}
+
+    def add(self, namespace, port, network_id=None, router_id=None,
+            owner=None):
+        registration = {'port': port, 'network_id': network_id,
+                        'router_id': router_id, 'owner': owner}
+        server = self.servers.get(namespace)
+        if server is not None:
+            if server[0] == registration:
+                return
+            self.remove(namespace)
+        handler = namespace_proxy.NetworkMetadataProxyHandler(
+            network_id, router_id, self.http_pool)
+        with ip_netlink.in_namespace(namespace):
+            sock = eventlet.listen(('0.0.0.0', port))
+        thread = eventlet.spawn(eventlet.wsgi.server, sock, handler,
+                                log=logging.WritableLogger(LOG))
+        self.servers[namespace] = (registration, sock, thread)
+        LOG.debug(_("Serving metadata in namespace %(ns)s on port "
+                    "%(port)s"), {'ns': namespace, 'port': port})
+
+    def remove(self, namespace):
+        server = self.servers.pop(namespace, None)
+        if server is not None:
+            registration, sock, thread = server
+            thread.kill()
+            sock.close()
+            LOG.debug(_("Stopped serving metadata in namespace %s"),
+                      namespace)
+
+    def sync(self, owner, registrations):
+        """Serve all the registrations of owner, and none of its others.
+
+        The namespaces which owner registered before it restarted and are
+        not in registrations anymore are removed.
+        """
+        namespaces = set(request['namespace'] for request in registrations)
+        for namespace, server in self.servers.items():
+            if server[0]['owner'] == owner and namespace not in namespaces:
+                self.remove(namespace)
+        errors = []
+        for request in registrations:
+            try:
+                self._add(request)
+            except Exception as e:
+                LOG.exception(_("Failed to register namespace %s"),
+                              request['namespace'])
+                errors.append('%s: %s' % (request['namespace'], e))
+        if errors:
+            raise SharedMetadataProxyError(error='; '.join(errors))
+
+    def _add(self, request):
+        self.add(request['namespace'], request['port'],
+                 network_id=request.get('network_id'),
+                 router_id=request.get('router_id'),
+                 owner=request.get('owner'))
+
+    def handle(self, request):
+        action = request.get('action')
+        if action == 'add':
+            self._add(request)
+        elif action == 'remove':
+            self.remove(request['namespace'])
+        elif action == 'sync':
+            self.sync(request.get('owner'), request['registrations'])
+        else:
+            raise ValueError(_("Unknown action %s") % action)
+
+    def _serve_control(self, conn):
+        try:
+            error = None
+            try:
+                request = _recv_all(conn)
+                if not request:
+                    # A starting proxy checking whether this one is alive
+                    return
+                self.handle(json.loads(request))
+            except Exception as e:
+                LOG.exception(_("Failed to handle control request"))
+                error = str(e)
+            conn.sendall(json.dumps({'error': error, 'pid': os.getpid()}))
+        finally:
+            conn.close()
+
+    def _listen_control(self):
+        try:
+            mode = os.lstat(self.control_socket).st_mode
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        else:
+            # The path is given by the agents: never replace anything but
+            # the socket of a previous proxy
+            if not stat.S_ISSOCK(mode):
+                raise SharedMetadataProxyError(
+                    error=_("%s exists and is not a socket") %
+                    self.control_socket)
+            # Replacing the socket of a live proxy would orphan it
+            if self._control_socket_in_use():
+                raise SharedMetadataProxyError(
+                    error=_("Another proxy is listening on %s") %
+                    self.control_socket)
+            os.unlink(self.control_socket)
+        sock = eventlet.listen(self.control_socket, family=socket.AF_UNIX)
+        # Only the agents, which own the directory, may register namespaces
+        dir_stat = os.stat(os.path.dirname(self.control_socket))
+        os.chown(self.control_socket, dir_stat.st_uid, dir_stat.st_gid)
+        os.chmod(self.control_socket, 0o600)
+        return sock
+
+    def _control_socket_in_use(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.control_socket)
+        except socket.error as e:
+            if e.errno != errno.ECONNREFUSED:
+                raise
+            return False
+        finally:
+            sock.close()
+        return True
+
+    def run(self):
+        sock = self._listen_control()
+        while True:
+            conn, _addr = sock.accept()
+            eventlet.spawn_n(self._serve_control, conn)
+
+
+class SharedMetadataProxyClient(object):
+    """Registers the namespaces of an agent with the shared proxy.
+
+    The proxy is started if it is not running. When the agent first talks
+    to the proxy, or the proxy was restarted, the agent sends all its
+    registrations, so that the proxy also drops the namespaces the agent
+    registered before it restarted. owner identifies the agent.
+    """
+
+    def __init__(self, conf, root_helper, owner):
+        self.conf = conf
+        self.root_helper = root_helper
+        self.owner = owner
+        # namespace -> add request
+        self.registrations = {}
+        self._proxy_pid = None
+        self._lock = threading.Lock()
+
+    def _process_manager(self):
+        return external_process.ProcessManager(self.conf, SHARED_PROXY_UUID,
+                                               self.root_helper)
+
+    def _ensure_proxy(self):
+        def callback(pid_file):
+            proxy_cmd = ['neutron-shared-metadata-proxy',
+                         '--pid_file=%s' % pid_file,
+                         '--metadata_proxy_socket=%s' %
+                         self.conf.metadata_proxy_socket,
+                         '--control_socket=%s' %
+                         self.conf.metadata_proxy_control_socket,
+                         '--state_path=%s' % self.conf.state_path]
+            proxy_cmd.extend(agent_config.get_log_args(
+                cfg.CONF, 'neutron-shared-metadata-proxy.log'))
+            return proxy_cmd
+
+        # The L3 and DHCP agents of the host share the proxy
+        with lockutils.lock(SHARED_PROXY_UUID, utils.SYNCHRONIZED_PREFIX,
+                            True):
+            self._process_manager().enable(callback)
+
+    def _request(self, request):
+        path = self.conf.metadata_proxy_control_socket
+        for attempt in range(CONNECT_RETRIES):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(path)
+                break
+            except socket.error as e:
+                sock.close()
+                if (e.errno not in (errno.ENOENT, errno.ECONNREFUSED) or
+                        attempt == CONNECT_RETRIES - 1):
+                    raise SharedMetadataProxyError(error=e)
+                eventlet.sleep(CONNECT_INTERVAL)
+        try:
+            sock.sendall(json.dumps(request))
+            sock.shutdown(socket.SHUT_WR)
+            return json.loads(_recv_all(sock))
+        except (socket.error, ValueError) as e:
+            raise SharedMetadataProxyError(error=e)
+        finally:
+            sock.close()
+
+    def _call(self, request):
+        self._ensure_proxy()
+        response = self._request(request)
+        if response['pid'] != self._proxy_pid:
+            # The agent or the proxy was (re)started since the last request
+            self._proxy_pid = response['pid']
+            sync = self._request({'action': 'sync', 'owner': self.owner,
+                                  'registrations':
+                                  self.registrations.values()})
+            if sync['error']:
+                LOG.error(_("Failed to sync the registrations with the "
+                            "shared metadata proxy: %s"), sync['error'])
+        if response['error']:
+            raise SharedMetadataProxyError(error=response['error'])
+
+    def add(self, namespace, port, network_id=None, router_id=None):
+        """Serve the metadata requests of namespace received on port."""
+        request = {'action': 'add', 'namespace': namespace, 'port': port,
+                   'network_id': network_id, 'router_id': router_id,
+                   'owner': self.owner}
+        with self._lock:
+            self.registrations[namespace] = request
+            self._call(request)
+
+    def remove(self, namespace):
+        with self._lock:
+            self.registrations.pop(namespace, None)
+            if not self._process_manager().active:
+                return
+            try:
+                self._call({'action': 'remove', 'namespace': namespace})
+            except SharedMetadataProxyError:
+                LOG.exception(_("Failed to unregister namespace %s from the "
+                                "shared metadata proxy"), namespace)
+
+
+class SharedProxyDaemon(daemon.Daemon):
+    def __init__(self, pidfile, control_socket):
+        super(SharedProxyDaemon, self).__init__(pidfile,
+                                                uuid=SHARED_PROXY_UUID)
+        self.control_socket = control_socket
+
+    def run(self):
+        SharedMetadataProxy(self.control_socket).run()
+
+
+def main():
+    eventlet.monkey_patch()
+    opts = [
+        cfg.StrOpt('control_socket',
+                   default='$state_path/metadata_proxy_control',
+                   help=_('Location of the UNIX domain socket on which the '
+                          'agents register their namespaces.')),
+        cfg.StrOpt('pid_file',
+                   help=_('Location of pid file of this process.')),
+        cfg.BoolOpt('daemonize',
+                    default=True,
+                    help=_('Run as daemon.')),
+        cfg.StrOpt('metadata_proxy_socket',
+                   default='$state_path/metadata_proxy',
+                   help=_('Location of Metadata Proxy UNIX domain '
+                          'socket'))
+    ]
+
+    cfg.CONF.register_cli_opts(opts)
+    # Don't get the default configuration file
+    cfg.CONF(project='neutron', default_config_files=[])
+    config.setup_logging(cfg.CONF)
+    utils.log_opt_values(LOG)
+    proxy = SharedProxyDaemon(cfg.CONF.pid_file, cfg.CONF.control_socket)
+
+    if cfg.CONF.daemonize:
+        proxy.start()
+    else:
+        proxy.run()
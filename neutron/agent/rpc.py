@@ -21,12 +21,16 @@ from neutron.common import topics
 
 from neutron.openstack.common import log as logging
 from neutron.openstack.common import rpc
+from neutron.openstack.common.rpc import common as rpc_common
 from neutron.openstack.common.rpc import proxy
 from neutron.openstack.common import timeutils
 
 
 LOG = logging.getLogger(__name__)
 
+DEVICES_DETAILS_LIST_VERSION = '1.3'
+UPDATE_DEVICE_LIST_VERSION = '1.4'
+
 
 def create_consumers(dispatcher, prefix, topic_details):
     """Create agent RPC consumers.
@@ -79,6 +83,8 @@ class PluginApi(proxy.RpcProxy):
 
     API version history:
         1.0 - Initial version.
+        1.3 - get_devices_details_list (ML2 only).
+        1.4 - update_device_list (ML2 only).
 
     '''
 
@@ -87,6 +93,8 @@ class PluginApi(proxy.RpcProxy):
     def __init__(self, topic):
         super(PluginApi, self).__init__(
             topic=topic, default_version=self.BASE_RPC_API_VERSION)
+        self.use_devices_details_list = True
+        self.use_update_device_list = True
 
     def get_device_details(self, context, device, agent_id):
         return self.call(context,
@@ -94,6 +102,31 @@ class PluginApi(proxy.RpcProxy):
                                        agent_id=agent_id),
                          topic=self.topic)
 
+    def get_devices_details_list(self, context, devices, agent_id):
+        """Return the details of devices, in the order of devices.
+
+        The details are requested with a single call, or with a call per
+        device from plugins not supporting get_devices_details_list.
+        """
+        if self.use_devices_details_list:
+            try:
+                return self.call(context,
+                                 self.make_msg('get_devices_details_list',
+                                               devices=devices,
+                                               agent_id=agent_id),
+                                 topic=self.topic,
+                                 version=DEVICES_DETAILS_LIST_VERSION)
+            except rpc_common.UnsupportedRpcVersion:
+                pass
+            except rpc_common.RemoteError as e:
+                if e.exc_type != 'UnsupportedRpcVersion':
+                    raise
+            LOG.info(_("get_devices_details_list is not supported by the "
+                       "plugin, falling back to get_device_details"))
+            self.use_devices_details_list = False
+        return [self.get_device_details(context, device, agent_id)
+                for device in devices]
+
     def update_device_down(self, context, device, agent_id, host=None):
         return self.call(context,
                          self.make_msg('update_device_down', device=device,
@@ -106,6 +139,53 @@ class PluginApi(proxy.RpcProxy):
                                        agent_id=agent_id, host=host),
                          topic=self.topic)
 
+    def update_device_list(self, context, devices_up, devices_down,
+                           agent_id, host=None):
+        """Report devices up and devices down in a single call.
+
+        Returns a dict with the 'devices_up' and 'devices_down' updated
+        and the 'failed_devices_up' and 'failed_devices_down', which should
+        be reported again. Plugins not supporting update_device_list get a
+        call per device.
+        """
+        if self.use_update_device_list:
+            try:
+                return self.call(context,
+                                 self.make_msg('update_device_list',
+                                               devices_up=devices_up,
+                                               devices_down=devices_down,
+                                               agent_id=agent_id,
+                                               host=host),
+                                 topic=self.topic,
+                                 version=UPDATE_DEVICE_LIST_VERSION)
+            except rpc_common.UnsupportedRpcVersion:
+                pass
+            except rpc_common.RemoteError as e:
+                if e.exc_type != 'UnsupportedRpcVersion':
+                    raise
+            LOG.info(_("update_device_list is not supported by the plugin, "
+                       "falling back to update_device_up and "
+                       "update_device_down"))
+            self.use_update_device_list = False
+        result = {'devices_up': [], 'failed_devices_up': [],
+                  'devices_down': [], 'failed_devices_down': []}
+        for device in devices_up:
+            try:
+                self.update_device_up(context, device, agent_id, host)
+            except Exception:
+                LOG.exception(_("Failed to update device %s up"), device)
+                result['failed_devices_up'].append(device)
+            else:
+                result['devices_up'].append(device)
+        for device in devices_down:
+            try:
+                result['devices_down'].append(self.update_device_down(
+                    context, device, agent_id, host))
+            except Exception:
+                LOG.exception(_("Failed to update device %s down"), device)
+                result['failed_devices_down'].append(device)
+        return result
+
     def tunnel_sync(self, context, tunnel_ip, tunnel_type=None):
         return self.call(context,
                          self.make_msg('tunnel_sync', tunnel_ip=tunnel_ip,
@@ -16,14 +16,19 @@
 #    under the License.
 #
 
+import netaddr
 from oslo.config import cfg
 
+from neutron.common import constants
 from neutron.common import topics
 from neutron.openstack.common import importutils
 from neutron.openstack.common import log as logging
+from neutron.openstack.common.rpc import common as rpc_common
 
 LOG = logging.getLogger(__name__)
 SG_RPC_VERSION = "1.1"
+# Version of the plugin rpc api providing security_group_info_for_devices
+SG_INFO_RPC_VERSION = "1.2"
 
 security_group_opts = [
     cfg.StrOpt(
@@ -36,7 +41,14 @@ security_group_opts = [
         help=_(
             'Controls whether the neutron security group API is enabled '
             'in the server. It should be false when using no security '
-            'groups or using the nova security group API.'))
+            'groups or using the nova security group API.')),
+    cfg.BoolOpt(
+        'enable_ipset',
+        default=False,
+        help=_(
+            'Use ipset to match the members of remote security groups in '
+            'the iptables firewall drivers, instead of one rule per member '
+            'IP.'))
 ]
 cfg.CONF.register_opts(security_group_opts, 'SECURITYGROUP')
 
@@ -85,6 +97,15 @@ class SecurityGroupServerRpcApiMixin(object):
                          version=SG_RPC_VERSION,
                          topic=self.topic)
 
+    def security_group_info_for_devices(self, context, devices):
+        LOG.debug(_("Get security group information "
+                    "for devices via rpc %r"), devices)
+        return self.call(context,
+                         self.make_msg('security_group_info_for_devices',
+                                       devices=devices),
+                         version=SG_INFO_RPC_VERSION,
+                         topic=self.topic)
+
 
 class SecurityGroupAgentRpcCallbackMixin(object):
     """A mix-in that enable SecurityGroup agent
@@ -152,13 +173,67 @@ class SecurityGroupAgentRpcMixin(object):
         self.devices_to_refilter = set()
         # Flag raised when a global refresh is needed
         self.global_refresh_firewall = False
+        # Cleared when the plugin does not support
+        # security_group_info_for_devices
+        self.use_sg_info_rpc = True
+
+    def _security_group_rules_for_devices(self, device_ids):
+        if self.use_sg_info_rpc:
+            try:
+                info = self.plugin_rpc.security_group_info_for_devices(
+                    self.context, device_ids)
+                return self._expand_security_group_info(info)
+            except rpc_common.UnsupportedRpcVersion:
+                pass
+            except rpc_common.RemoteError as e:
+                if e.exc_type != 'UnsupportedRpcVersion':
+                    raise
+            LOG.info(_("security_group_info_for_devices is not supported "
+                       "by the plugin, falling back to "
+                       "security_group_rules_for_devices"))
+            self.use_sg_info_rpc = False
+        return self.plugin_rpc.security_group_rules_for_devices(
+            self.context, device_ids)
+
+    def _expand_security_group_info(self, info):
+        """Build the rules of each device from security group information.
+
+        Rules referring to a remote group are expanded into one rule per
+        member IP, as done by security_group_rules_for_devices.
+        """
+        devices = info['devices']
+        for device in devices.values():
+            fixed_ips = device.get('fixed_ips', [])
+            rules = []
+            for sg_id in device.get('security_groups', []):
+                for rule in info['security_groups'].get(sg_id, []):
+                    remote_group_id = rule.get('remote_group_id')
+                    if not remote_group_id:
+                        rules.append(rule.copy())
+                        continue
+                    device['security_group_source_groups'].append(
+                        remote_group_id)
+                    direction_ip_prefix = constants.DIRECTION_IP_PREFIX[
+                        rule['direction']]
+                    member_ips = info['sg_member_ips'].get(
+                        remote_group_id, {}).get(rule['ethertype'], [])
+                    for ip in member_ips:
+                        if ip in fixed_ips:
+                            continue
+                        ip_rule = rule.copy()
+                        ip_rule[direction_ip_prefix] = str(
+                            netaddr.IPNetwork(ip).cidr)
+                        rules.append(ip_rule)
+            # The provider rules come last, as with the other rpc
+            device['security_group_rules'] = (
+                rules + device['security_group_rules'])
+        return devices
 
     def prepare_devices_filter(self, device_ids):
         if not device_ids:
             return
         LOG.info(_("Preparing filters for devices %s"), device_ids)
-        devices = self.plugin_rpc.security_group_rules_for_devices(
-            self.context, list(device_ids))
+        devices = self._security_group_rules_for_devices(list(device_ids))
         with self.firewall.defer_apply():
             for device in devices.values():
                 self.firewall.prepare_port_filter(device)
@@ -220,8 +295,7 @@ class SecurityGroupAgentRpcMixin(object):
             if not device_ids:
                 LOG.info(_("No ports here to refresh firewall"))
                 return
-        devices = self.plugin_rpc.security_group_rules_for_devices(
-            self.context, device_ids)
+        devices = self._security_group_rules_for_devices(device_ids)
         with self.firewall.defer_apply():
             for device in devices.values():
                 LOG.debug(_("Update port filter for %s"), device['device'])
@@ -28,6 +28,7 @@ from neutron.api.v2 import resource as wsgi_resource
 from neutron.common import constants as const
 from neutron.common import exceptions
 from neutron.notifiers import nova
+from neutron.openstack.common import excutils
 from neutron.openstack.common import log as logging
 from neutron.openstack.common.notifier import api as notifier_api
 from neutron import policy
@@ -126,7 +127,7 @@ class Controller(object):
                                     % self._plugin.__class__.__name__)
         return getattr(self._plugin, native_sorting_attr_name, False)
 
-    def _is_visible(self, context, attr_name, data):
+    def _is_visible(self, context, attr_name, data, checker=None):
         action = "%s:%s" % (self._plugin_handlers[self.SHOW], attr_name)
         # Optimistically init authz_check to True
         authz_check = True
@@ -134,8 +135,9 @@ class Controller(object):
             attr = (attributes.RESOURCE_ATTRIBUTE_MAP
                     [self._collection].get(attr_name))
             if attr and attr.get('enforce_policy'):
-                authz_check = policy.check_if_exists(
-                    context, action, data)
+                if checker is None:
+                    checker = policy.PolicyChecker(context)
+                authz_check = checker.check_if_exists(action, data)
         except KeyError:
             # The extension was not configured for adding its resources
             # to the global resource attribute map. Policy check should
@@ -153,13 +155,13 @@ class Controller(object):
         attr_val = self._attr_info.get(attr_name)
         return attr_val and attr_val['is_visible'] and authz_check
 
-    def _view(self, context, data, fields_to_strip=None):
+    def _view(self, context, data, fields_to_strip=None, checker=None):
         # make sure fields_to_strip is iterable
         if not fields_to_strip:
             fields_to_strip = []
 
         return dict(item for item in data.iteritems()
-                    if (self._is_visible(context, item[0], data) and
+                    if (self._is_visible(context, item[0], data, checker) and
                         item[0] not in fields_to_strip))
 
     def _do_field_list(self, original_fields):
@@ -235,20 +237,30 @@ class Controller(object):
         obj_list = obj_getter(request.context, **kwargs)
         obj_list = sorting_helper.sort(obj_list)
         obj_list = pagination_helper.paginate(obj_list)
+        # The credentials are prepared once for all the objects
+        checker = policy.PolicyChecker(request.context)
         # Check authz
         if do_authz:
             # FIXME(salvatore-orlando): obj_getter might return references to
             # other resources. Must check authZ on them too.
             # Omit items from list that should not be visible
-            obj_list = [obj for obj in obj_list
-                        if policy.check(request.context,
-                                        self._plugin_handlers[self.SHOW],
-                                        obj,
-                                        plugin=self._plugin)]
-        collection = {self._collection:
-                      [self._view(request.context, obj,
-                                  fields_to_strip=fields_to_add)
-                       for obj in obj_list]}
+            obj_list = (obj for obj in obj_list
+                        if checker.check(self._plugin_handlers[self.SHOW],
+                                         obj))
+
+        def views(objs):
+            for obj in objs:
+                yield self._view(request.context, obj,
+                                 fields_to_strip=fields_to_add,
+                                 checker=checker)
+
+        if not getattr(pagination_helper, 'limit', None):
+            # The views are built as the response is written, instead of
+            # being held in memory along with their JSON
+            return {self._collection: views(obj_list)}
+        # The links of a page depend on the objects visible in it
+        obj_list = list(obj_list)
+        collection = {self._collection: list(views(obj_list))}
         pagination_links = pagination_helper.get_links(obj_list)
         if pagination_links:
             collection[self._collection + "_links"] = pagination_links
@@ -360,72 +372,79 @@ class Controller(object):
         if self._collection in body:
             # Have to account for bulk create
             items = body[self._collection]
-            deltas = {}
-            bulk = True
         else:
             items = [body]
-            bulk = False
         # Ensure policy engine is initialized
         policy.init()
+        deltas = {}
         for item in items:
             self._validate_network_tenant_ownership(request,
                                                     item[self._resource])
             policy.enforce(request.context,
                            action,
                            item[self._resource])
-            try:
-                tenant_id = item[self._resource]['tenant_id']
-                count = quota.QUOTAS.count(request.context, self._resource,
-                                           self._plugin, self._collection,
-                                           tenant_id)
-                if bulk:
-                    delta = deltas.get(tenant_id, 0) + 1
-                    deltas[tenant_id] = delta
-                else:
-                    delta = 1
-                kwargs = {self._resource: count + delta}
-            except exceptions.QuotaResourceUnknown as e:
-                # We don't want to quota this resource
-                LOG.debug(e)
-            else:
-                quota.QUOTAS.limit_check(request.context,
-                                         item[self._resource]['tenant_id'],
-                                         **kwargs)
-
-        def notify(create_result):
-            notifier_method = self._resource + '.create.end'
-            notifier_api.notify(request.context,
-                                self._publisher_id,
-                                notifier_method,
-                                notifier_api.CONF.default_notification_level,
-                                create_result)
-            self._send_dhcp_notification(request.context,
-                                         create_result,
-                                         notifier_method)
-            return create_result
+            tenant_id = item[self._resource]['tenant_id']
+            deltas[tenant_id] = deltas.get(tenant_id, 0) + 1
+        # The quota of each tenant is checked once, whatever the number of
+        # its objects in the request
+        reservations = []
+        try:
+            for tenant_id, delta in deltas.iteritems():
+                reservations.append(quota.QUOTAS.make_reservation(
+                    request.context, tenant_id, {self._resource: delta},
+                    self._plugin, self._collection, tenant_id))
+        except exceptions.QuotaResourceUnknown as e:
+            # We don't want to quota this resource
+            LOG.debug(e)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                for reservation_id in reservations:
+                    quota.QUOTAS.cancel_reservation(request.context,
+                                                    reservation_id)
+
+        try:
+            create_result = self._create(request, body, action, parent_id)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                for reservation_id in reservations:
+                    quota.QUOTAS.cancel_reservation(request.context,
+                                                    reservation_id)
+        for reservation_id in reservations:
+            quota.QUOTAS.commit_reservation(request.context, reservation_id)
+
+        notifier_method = self._resource + '.create.end'
+        notifier_api.notify(request.context,
+                            self._publisher_id,
+                            notifier_method,
+                            notifier_api.CONF.default_notification_level,
+                            create_result)
+        self._send_dhcp_notification(request.context,
+                                     create_result,
+                                     notifier_method)
+        return create_result
 
+    def _create(self, request, body, action, parent_id):
         kwargs = {self._parent_id_name: parent_id} if parent_id else {}
         if self._collection in body and self._native_bulk:
             # plugin does atomic bulk create operations
             obj_creator = getattr(self._plugin, "%s_bulk" % action)
             objs = obj_creator(request.context, body, **kwargs)
-            return notify({self._collection: [self._view(request.context, obj)
-                                              for obj in objs]})
+            return {self._collection: [self._view(request.context, obj)
+                                       for obj in objs]}
         else:
             obj_creator = getattr(self._plugin, action)
             if self._collection in body:
                 # Emulate atomic bulk behavior
                 objs = self._emulate_bulk_create(obj_creator, request,
                                                  body, parent_id)
-                return notify({self._collection: objs})
+                return {self._collection: objs}
             else:
                 kwargs.update({self._resource: body})
                 obj = obj_creator(request.context, **kwargs)
 
                 self._nova_notifier.send_network_change(
                     action, {}, {self._resource: obj})
-                return notify({self._resource: self._view(request.context,
-                                                          obj)})
+                return {self._resource: self._view(request.context, obj)}
 
     def delete(self, request, id, **kwargs):
         """Deletes the specified entity."""
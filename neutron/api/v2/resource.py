@@ -26,6 +26,7 @@ import webob.exc
 
 from neutron.api.v2 import attributes
 from neutron.common import exceptions
+from neutron.openstack.common import excutils
 from neutron.openstack.common import gettextutils
 from neutron.openstack.common import log as logging
 from neutron import wsgi
@@ -136,6 +137,13 @@ def Resource(controller, faults=None, deserializers=None, serializers=None):
             raise webob.exc.HTTPInternalServerError(**kwargs)
 
         status = action_status.get(action, 200)
+        if wsgi.is_streamed(result):
+            # The collections of lists are serialized as they are written
+            return webob.Response(request=request, status=status,
+                                  content_type=content_type,
+                                  app_iter=_log_errors(
+                                      serializer.serialize_iter(result),
+                                      action))
         body = serializer.serialize(result)
         # NOTE(jkoelker) Comply with RFC2616 section 9.7
         if status == 204:
@@ -148,6 +156,16 @@ def Resource(controller, faults=None, deserializers=None, serializers=None):
     return resource
 
 
+def _log_errors(chunks, action):
+    # The status of the response is already sent when the errors occur
+    try:
+        for chunk in chunks:
+            yield chunk
+    except Exception:
+        with excutils.save_and_reraise_exception():
+            LOG.exception(_('%s failed'), action)
+
+
 def translate(translatable, locale):
     """Translates the object to the given locale.
 
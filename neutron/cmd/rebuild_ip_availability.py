@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Repair script recomputing the IP availability ranges of subnets from
+their current IP allocations.
+
+"""
+
+from oslo.config import cfg
+
+from neutron.common import config
+from neutron import context
+from neutron.db import api as db
+from neutron.db import db_base_plugin_v2
+from neutron.db import models_v2
+from neutron.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+cli_opts = [
+    cfg.MultiStrOpt('subnet',
+                    default=[],
+                    help=_("Only rebuild the ranges of this subnet; may be "
+                           "given several times. All subnets are rebuilt "
+                           "by default.")),
+]
+
+
+def rebuild_subnets(cxt, subnet_ids=None):
+    query = cxt.session.query(models_v2.Subnet)
+    if subnet_ids:
+        query = query.filter(models_v2.Subnet.id.in_(subnet_ids))
+    subnets = [{'id': s['id']} for s in query]
+    for subnet in subnets:
+        # One transaction per subnet keeps the locks short-lived
+        with cxt.session.begin(subtransactions=True):
+            db_base_plugin_v2.NeutronDbPluginV2._rebuild_availability_ranges(
+                cxt, [subnet])
+    return len(subnets)
+
+
+def main():
+    cfg.CONF.register_cli_opts(cli_opts)
+    cfg.CONF(project='neutron')
+    config.setup_logging(cfg.CONF)
+
+    db.configure_db()
+    count = rebuild_subnets(context.get_admin_context(),
+                            cfg.CONF.subnet or None)
+    LOG.info(_("Rebuilt IP availability ranges of %d subnets"), count)
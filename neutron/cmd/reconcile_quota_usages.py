@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Cron script reconciling the quota usages tracked by the
+TrackedDbQuotaDriver with the resource tables.
+
+"""
+
+from oslo.config import cfg
+
+from neutron.common import config
+from neutron import context
+from neutron.db import quota_db
+from neutron import manager
+from neutron.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+cli_opts = [
+    cfg.MultiStrOpt('tenant',
+                    default=[],
+                    help=_("Only reconcile the usages of this tenant; may "
+                           "be given several times. All tenants are "
+                           "reconciled by default.")),
+]
+
+
+def main():
+    cfg.CONF.register_cli_opts(cli_opts)
+    cfg.CONF(project='neutron')
+    config.setup_logging(cfg.CONF)
+
+    # Loading the plugins registers the resources they track
+    manager.NeutronManager.get_plugin()
+    count = quota_db.TrackedDbQuotaDriver().reconcile_usages(
+        context.get_admin_context(), cfg.CONF.tenant or None)
+    LOG.info(_("Reconciled the quota usages of %d tenants"), count)
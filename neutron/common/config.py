@@ -69,6 +69,16 @@ core_opts = [
                help=_("Maximum number of host routes per subnet")),
     cfg.IntOpt('max_fixed_ips_per_port', default=5,
                help=_("Maximum number of fixed ips per port")),
+    cfg.StrOpt('ip_allocation_strategy', default='locking',
+               choices=['locking', 'optimistic'],
+               help=_("How addresses are picked from the availability "
+                      "ranges of a subnet. 'locking' locks the first range "
+                      "of the subnet, 'optimistic' picks a random address "
+                      "from a random range and claims it with a "
+                      "compare-and-swap update")),
+    cfg.IntOpt('ip_allocation_retries', default=10,
+               help=_("Number of compare-and-swap attempts per subnet when "
+                      "ip_allocation_strategy is 'optimistic'")),
     cfg.IntOpt('dhcp_lease_duration', default=86400,
                deprecated_name='dhcp_lease_time',
                help=_("DHCP lease duration")),
@@ -36,6 +36,9 @@ DEVICE_OWNER_DHCP = "network:dhcp"
 
 FLOATINGIP_KEY = '_floatingips'
 INTERFACE_KEY = '_interfaces'
+# Suffix of the keys listing the ids of the interfaces and floating IPs
+# removed from a router, in the router deltas sent to the L3 agents
+REMOVED_KEY_SUFFIX = '_removed'
 METERING_LABEL_KEY = '_metering_labels'
 
 IPv4 = 'IPv4'
@@ -102,6 +105,10 @@ PROTO_NUM_ICMP = 1
 PROTO_NUM_ICMP_V6 = 58
 PROTO_NUM_UDP = 17
 
+# Key of the remote IP prefix of the security group rules of each direction
+DIRECTION_IP_PREFIX = {'ingress': 'source_ip_prefix',
+                       'egress': 'dest_ip_prefix'}
+
 # List of ICMPv6 types that should be allowed by default:
 # Multicast Listener Query (130),
 # Multicast Listener Report (131),
@@ -205,6 +205,16 @@ class CommonDbMixin(object):
             return getattr(self, '_get_%s' % resource)(context, marker)
         return None
 
+    def _get_marker_resource(self, context, model, limit, marker):
+        """Return the marker object of a model.
+
+        For the plugins looking up their objects by model with
+        _get_resource(context, model, id) rather than with _get_<resource>.
+        """
+        if limit and marker:
+            return self._get_resource(context, model, marker)
+        return None
+
 
 class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                         CommonDbMixin):
@@ -334,18 +344,66 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                   {'ip_address': ip_address,
                    'network_id': network_id,
                    'subnet_id': subnet_id})
-        context.session.query(models_v2.IPAllocation).filter_by(
+        deleted = context.session.query(models_v2.IPAllocation).filter_by(
             network_id=network_id,
             ip_address=ip_address,
             subnet_id=subnet_id).delete()
+        if deleted:
+            NeutronDbPluginV2._release_ip(context, subnet_id, ip_address)
 
     @staticmethod
-    def _generate_ip(context, subnets):
-        try:
-            return NeutronDbPluginV2._try_generate_ip(context, subnets)
-        except n_exc.IpAddressGenerationFailure:
-            NeutronDbPluginV2._rebuild_availability_ranges(context, subnets)
+    def _release_ip(context, subnet_id, ip_address):
+        """Return a freed IP address to the availability ranges.
 
+        The address is merged with the ranges ending right before it and
+        starting right after it, so the cost does not depend on the size of
+        the allocation pool.
+        """
+        ip = netaddr.IPAddress(ip_address)
+        pool_qry = context.session.query(
+            models_v2.IPAllocationPool).options(
+                orm.noload('available_ranges'))
+        for pool in pool_qry.filter_by(subnet_id=subnet_id):
+            first = netaddr.IPAddress(pool['first_ip'])
+            last = netaddr.IPAddress(pool['last_ip'])
+            if first <= ip <= last:
+                break
+        else:
+            # Addresses outside of the allocation pools (e.g. fixed IPs
+            # requested explicitly) never come from an availability range
+            return
+
+        range_qry = context.session.query(
+            models_v2.IPAvailabilityRange).filter_by(
+                allocation_pool_id=pool['id']).with_lockmode('update')
+        before = after = None
+        if ip > first:
+            before = range_qry.filter_by(last_ip=str(ip - 1)).first()
+        if ip < last:
+            after = range_qry.filter_by(first_ip=str(ip + 1)).first()
+
+        LOG.debug(_("Releasing IP %(ip_address)s to allocation pool "
+                    "%(pool)s"), {'ip_address': ip_address, 'pool': pool})
+        if before and after:
+            before['last_ip'] = after['last_ip']
+            context.session.delete(after)
+        elif before:
+            before['last_ip'] = ip_address
+        elif after:
+            after['first_ip'] = ip_address
+        else:
+            context.session.add(models_v2.IPAvailabilityRange(
+                allocation_pool_id=pool['id'],
+                first_ip=ip_address,
+                last_ip=ip_address))
+
+    @staticmethod
+    def _generate_ip(context, subnets):
+        # Released addresses go back to the availability ranges
+        # as soon as they are freed, so running out of ranges means the
+        # subnets are exhausted. Ranges that went out of sync with the
+        # allocations can be repaired offline with
+        # neutron-rebuild-ip-availability.
         return NeutronDbPluginV2._try_generate_ip(context, subnets)
 
     @staticmethod
@@ -355,6 +413,9 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
         The IP address will be generated from one of the subnets defined on
         the network.
         """
+        if cfg.CONF.ip_allocation_strategy == 'optimistic':
+            return NeutronDbPluginV2._try_generate_ip_optimistic(context,
+                                                                 subnets)
         range_qry = context.session.query(
             models_v2.IPAvailabilityRange).join(
                 models_v2.IPAllocationPool).with_lockmode('update')
@@ -382,8 +443,102 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
             return {'ip_address': ip_address, 'subnet_id': subnet['id']}
         raise n_exc.IpAddressGenerationFailure(net_id=subnets[0]['network_id'])
 
+    @staticmethod
+    def _try_generate_ip_optimistic(context, subnets):
+        """Generate an IP address without locking the availability ranges.
+
+        A random address is picked from a random availability range of the
+        subnet and claimed with an UPDATE conditioned on the range still
+        having the bounds that were read. Concurrent allocations therefore
+        spread over the ranges of the subnet instead of queueing on the
+        first one.
+
+        A lost race is retried with a locking read of the ranges. A plain
+        read would return the same snapshot again within the transaction
+        under MySQL's REPEATABLE READ isolation, while a locking read
+        returns the latest committed ranges.
+        """
+        range_qry = context.session.query(
+            models_v2.IPAvailabilityRange.allocation_pool_id,
+            models_v2.IPAvailabilityRange.first_ip,
+            models_v2.IPAvailabilityRange.last_ip).join(
+                models_v2.IPAllocationPool)
+        for subnet in subnets:
+            qry = range_qry.filter_by(subnet_id=subnet['id'])
+            for attempt in range(cfg.CONF.ip_allocation_retries):
+                if attempt:
+                    qry = qry.with_lockmode('update')
+                ranges = qry.all()
+                if not ranges:
+                    LOG.debug(_("All IPs from subnet %(subnet_id)s "
+                                "(%(cidr)s) allocated"),
+                              {'subnet_id': subnet['id'],
+                               'cidr': subnet['cidr']})
+                    break
+                pool_id, first_ip, last_ip = random.choice(ranges)
+                ip_address = NeutronDbPluginV2._claim_ip_from_range(
+                    context, pool_id, first_ip, last_ip)
+                if ip_address:
+                    LOG.debug(_("Allocated IP - %(ip_address)s from "
+                                "%(first_ip)s to %(last_ip)s"),
+                              {'ip_address': ip_address,
+                               'first_ip': first_ip,
+                               'last_ip': last_ip})
+                    return {'ip_address': ip_address,
+                            'subnet_id': subnet['id']}
+                LOG.debug(_("Availability range %(first_ip)s - %(last_ip)s "
+                            "changed concurrently, retrying (attempt "
+                            "%(attempt)s)"),
+                          {'first_ip': first_ip, 'last_ip': last_ip,
+                           'attempt': attempt + 1})
+        raise n_exc.IpAddressGenerationFailure(net_id=subnets[0]['network_id'])
+
+    @staticmethod
+    def _claim_ip_from_range(context, pool_id, first_ip, last_ip):
+        """Compare-and-swap a random address out of an availability range.
+
+        Returns the claimed address, or None if the range no longer has the
+        bounds first_ip - last_ip because another allocation won the race.
+        """
+        first = netaddr.IPAddress(first_ip)
+        last = netaddr.IPAddress(last_ip)
+        ip = first + random.randint(0, int(last) - int(first))
+        cas_qry = context.session.query(
+            models_v2.IPAvailabilityRange).filter_by(
+                allocation_pool_id=pool_id,
+                first_ip=first_ip,
+                last_ip=last_ip)
+        if first == last:
+            updated = cas_qry.delete(synchronize_session=False)
+        elif ip == first:
+            updated = cas_qry.update({'first_ip': str(ip + 1)},
+                                     synchronize_session=False)
+        elif ip == last:
+            updated = cas_qry.update({'last_ip': str(ip - 1)},
+                                     synchronize_session=False)
+        else:
+            # Split into two ranges; the upper half can only be inserted
+            # once the lower half has been successfully claimed
+            updated = cas_qry.update({'last_ip': str(ip - 1)},
+                                     synchronize_session=False)
+            if updated:
+                context.session.add(models_v2.IPAvailabilityRange(
+                    allocation_pool_id=pool_id,
+                    first_ip=str(ip + 1),
+                    last_ip=last_ip))
+        if not updated:
+            return
+        return str(ip)
+
     @staticmethod
     def _rebuild_availability_ranges(context, subnets):
+        """Recompute the availability ranges from the allocations.
+
+        This is expensive for large pools and is not used while allocating
+        addresses; it is meant as a repair tool for ranges which went out of
+        sync with the allocations.
+        """
+        range_qry = context.session.query(models_v2.IPAvailabilityRange)
         ip_qry = context.session.query(
             models_v2.IPAllocation).with_lockmode('update')
         # PostgreSQL does not support select...for update with an outer join.
@@ -401,6 +556,9 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                                         for i in ip_qry_results])
 
             for pool in pool_qry.filter_by(subnet_id=subnet['id']):
+                # Drop the current ranges, they are written again below
+                range_qry.filter_by(allocation_pool_id=pool['id']).delete()
+
                 # Create a set of all addresses in the pool
                 poolset = netaddr.IPSet(netaddr.iter_iprange(pool['first_ip'],
                                                              pool['last_ip']))
@@ -618,17 +776,19 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
 
         # Check if the IP's to add are OK
         to_add = self._test_fixed_ips_for_port(context, network_id, new_ips)
+        if to_add:
+            LOG.debug(_("Port update. Adding %s"), to_add)
+            network = self._get_network(context, network_id)
+            ips = self._allocate_fixed_ips(context, network, to_add)
+
+        # Release the removed IPs only once the new ones are allocated, so
+        # that they are not handed back to this port
         for ip in original_ips:
             LOG.debug(_("Port update. Hold %s"), ip)
             NeutronDbPluginV2._delete_ip_allocation(context,
                                                     network_id,
                                                     ip['subnet_id'],
                                                     ip['ip_address'])
-
-        if to_add:
-            LOG.debug(_("Port update. Adding %s"), to_add)
-            network = self._get_network(context, network_id)
-            ips = self._allocate_fixed_ips(context, network, to_add)
         return ips, prev_ips
 
     def _allocate_ips_for_port(self, context, network, port):
@@ -1011,7 +1171,8 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
 
             # clean up subnets
             subnets_qry = context.session.query(models_v2.Subnet)
-            subnets_qry.filter_by(network_id=id).delete()
+            for subnet in subnets_qry.filter_by(network_id=id):
+                context.session.delete(subnet)
             context.session.delete(network)
 
     def get_network(self, context, id, fields=None):
@@ -1460,7 +1621,17 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                  enable_eagerloads(False).filter_by(id=id))
         if not context.is_admin:
             query = query.filter_by(tenant_id=context.tenant_id)
-        query.delete()
+        ip_qry = (context.session.query(models_v2.IPAllocation).
+                  filter(models_v2.IPAllocation.port_id.in_(
+                      query.with_entities(models_v2.Port.id))))
+        for ip in ip_qry:
+            NeutronDbPluginV2._release_ip(context, ip['subnet_id'],
+                                          ip['ip_address'])
+        # Deleted with the ORM rather than with query.delete(), so that the
+        # mapper events, like those tracking the quota usages, are triggered
+        port = query.first()
+        if port:
+            context.session.delete(port)
 
     def get_port(self, context, id, fields=None):
         port = self._get_port(context, id)
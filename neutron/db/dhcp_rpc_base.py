@@ -13,6 +13,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+
 from oslo.config import cfg
 
 from neutron.api.v2 import attributes
@@ -23,12 +25,25 @@ from neutron.extensions import portbindings
 from neutron import manager
 from neutron.openstack.common.db import exception as db_exc
 from neutron.openstack.common import excutils
+from neutron.openstack.common import jsonutils
 from neutron.openstack.common import log as logging
 
 
 LOG = logging.getLogger(__name__)
 
 
+def get_network_digest(network):
+    """Return a digest of a network and of its subnets and ports.
+
+    The digest changes whenever an attribute of the network, of one of its
+    subnets or of one of its ports changes.
+    """
+    network = dict(network,
+                   subnets=sorted(network['subnets'], key=lambda s: s['id']),
+                   ports=sorted(network['ports'], key=lambda p: p['id']))
+    return hashlib.sha1(jsonutils.dumps(network, sort_keys=True)).hexdigest()
+
+
 class DhcpRpcCallbackMixin(object):
     """A mix-in that enable DHCP agent support in plugin implementations."""
 
@@ -90,18 +105,55 @@ class DhcpRpcCallbackMixin(object):
         host = kwargs.get('host')
         LOG.debug(_('get_active_networks_info from %s'), host)
         networks = self._get_active_networks(context, **kwargs)
+        return self._add_networks_info(context, networks)
+
+    def _add_networks_info(self, context, networks):
+        """Add their DHCP enabled subnets and their ports to networks."""
         plugin = manager.NeutronManager.get_plugin()
         filters = {'network_id': [network['id'] for network in networks]}
         ports = plugin.get_ports(context, filters=filters)
         filters['enable_dhcp'] = [True]
         subnets = plugin.get_subnets(context, filters=filters)
 
+        networks_by_id = {}
         for network in networks:
-            network['subnets'] = [subnet for subnet in subnets
-                                  if subnet['network_id'] == network['id']]
-            network['ports'] = [port for port in ports
-                                if port['network_id'] == network['id']]
+            network['subnets'] = []
+            network['ports'] = []
+            networks_by_id[network['id']] = network
+        for subnet in subnets:
+            networks_by_id[subnet['network_id']]['subnets'].append(subnet)
+        for port in ports:
+            networks_by_id[port['network_id']]['ports'].append(port)
+
+        return networks
 
+    def get_active_networks_digest(self, context, **kwargs):
+        """Return the id and the digest of the active networks.
+
+        An agent only needs to request with get_networks_info the networks
+        whose digest differs from the one of the network it has configured.
+        """
+        host = kwargs.get('host')
+        LOG.debug(_('get_active_networks_digest from %s'), host)
+        networks = self._add_networks_info(
+            context, self._get_active_networks(context, **kwargs))
+        return [{'id': network['id'], 'digest': get_network_digest(network)}
+                for network in networks]
+
+    def get_networks_info(self, context, **kwargs):
+        """Return the networks with their subnets, ports and digest."""
+        network_ids = kwargs.get('network_ids') or []
+        host = kwargs.get('host')
+        LOG.debug(_('get_networks_info for %(count)d networks from '
+                    '%(host)s'), {'count': len(network_ids), 'host': host})
+        if not network_ids:
+            return []
+        plugin = manager.NeutronManager.get_plugin()
+        networks = self._add_networks_info(
+            context, plugin.get_networks(context,
+                                         filters={'id': network_ids}))
+        for network in networks:
+            network['digest'] = get_network_digest(network)
         return networks
 
     def get_network_info(self, context, **kwargs):
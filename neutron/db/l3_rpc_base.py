@@ -13,6 +13,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+import hashlib
+
 from oslo.config import cfg
 
 from neutron.common import constants
@@ -28,20 +31,116 @@ from neutron.plugins.common import constants as plugin_constants
 
 LOG = logging.getLogger(__name__)
 
+l3_rpc_opts = [
+    cfg.IntOpt('router_delta_cache_size', default=1000,
+               help=_("Number of routers whose last state sent to an L3 "
+                      "agent is kept, so that only the changes of their "
+                      "interfaces and floating IPs are sent next time. "
+                      "The states are kept by each RPC worker. 0 disables "
+                      "the deltas.")),
+]
+cfg.CONF.register_opts(l3_rpc_opts)
+
+# Keys of the router lists sent as deltas
+DELTA_KEYS = (constants.INTERFACE_KEY, constants.FLOATINGIP_KEY)
+
+
+def get_router_digest(router):
+    """Return a digest of a router and of its interfaces and floating IPs.
+
+    The digest is the revision of the router sent to the L3 agents.
+    """
+    router = dict(router)
+    for key in DELTA_KEYS:
+        router[key] = sorted(router.get(key, []), key=lambda i: i['id'])
+    return hashlib.sha1(jsonutils.dumps(router, sort_keys=True)).hexdigest()
+
+
+def make_router_delta(base_router, router):
+    """Return the changes of a router since base_router.
+
+    The delta holds all the attributes of the router but only the added or
+    modified interfaces and floating IPs, the ids of the removed ones being
+    listed under the key suffixed with REMOVED_KEY_SUFFIX.
+    """
+    delta = dict((key, value) for key, value in router.iteritems()
+                 if key not in DELTA_KEYS)
+    delta['delta'] = True
+    for key in DELTA_KEYS:
+        base_items = dict((item['id'], item)
+                          for item in base_router.get(key, []))
+        items = router.get(key, [])
+        delta[key] = [item for item in items
+                      if base_items.get(item['id']) != item]
+        item_ids = set(item['id'] for item in items)
+        delta[key + constants.REMOVED_KEY_SUFFIX] = [
+            item_id for item_id in base_items if item_id not in item_ids]
+    return delta
+
+
+class RouterDeltaCache(object):
+    """Keeps the last state of the routers sent to the L3 agents.
+
+    The least recently synced routers are dropped first. The cache is only
+    shared by the requests handled by the same process: other RPC workers
+    and servers send full routers to the agents whose revision they do not
+    know. The revisions being digests, the agents still skip the routers
+    which did not change.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        # router id -> (revision, router)
+        self._routers = collections.OrderedDict()
+
+    def get_delta(self, router, base_revision=None):
+        """Return router, or its delta from base_revision when known.
+
+        The revision of the router is added to the returned dict.
+        """
+        revision = get_router_digest(router)
+        cached = self._routers.pop(router['id'], None)
+        if self.size > 0:
+            self._routers[router['id']] = (revision, router)
+            while len(self._routers) > self.size:
+                self._routers.popitem(last=False)
+        if base_revision and cached and cached[0] == base_revision:
+            router = make_router_delta(cached[1], router)
+            router['base_revision'] = base_revision
+        else:
+            router = dict(router)
+        router['revision'] = revision
+        return router
+
 
 class L3RpcCallbackMixin(object):
     """A mix-in that enable L3 agent rpc support in plugin implementations."""
 
+    _router_delta_cache = None
+
+    def _get_router_deltas(self, routers, revisions):
+        if L3RpcCallbackMixin._router_delta_cache is None:
+            L3RpcCallbackMixin._router_delta_cache = RouterDeltaCache(
+                cfg.CONF.router_delta_cache_size)
+        cache = L3RpcCallbackMixin._router_delta_cache
+        return [cache.get_delta(router, revisions.get(router['id']))
+                for router in routers]
+
     def sync_routers(self, context, **kwargs):
         """Sync routers according to filters to a specific agent.
 
+        The routers of which the agent gives a revision in revisions are
+        returned as deltas from that revision, when the plugin still knows
+        it. Every returned router has a revision.
+
         @param context: contain user information
-        @param kwargs: host, router_ids
+        @param kwargs: host, router_ids, revisions
         @return: a list of routers
                  with their interfaces and floating_ips
         """
         router_ids = kwargs.get('router_ids')
         host = kwargs.get('host')
+        revisions = kwargs.get('revisions') or {}
         context = neutron_context.get_admin_context()
         l3plugin = manager.NeutronManager.get_service_plugins()[
             plugin_constants.L3_ROUTER_NAT]
@@ -61,6 +160,8 @@ class L3RpcCallbackMixin(object):
         if utils.is_extension_supported(
             plugin, constants.PORT_BINDING_EXT_ALIAS):
             self._ensure_host_set_on_ports(context, plugin, host, routers)
+        if routers:
+            routers = self._get_router_deltas(routers, revisions)
         LOG.debug(_("Routers returned to l3 agent:\n %s"),
                   jsonutils.dumps(routers, indent=5))
         return routers
@@ -13,11 +13,23 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import datetime
+
+from oslo.config import cfg
 import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy import func
 
 from neutron.common import exceptions
 from neutron.db import model_base
 from neutron.db import models_v2
+from neutron.openstack.common.db import exception as db_exc
+from neutron.openstack.common import log as logging
+from neutron.openstack.common import timeutils
+from neutron.openstack.common import uuidutils
+from neutron import quota
+
+LOG = logging.getLogger(__name__)
 
 
 class Quota(model_base.BASEV2, models_v2.HasId):
@@ -31,6 +43,64 @@ class Quota(model_base.BASEV2, models_v2.HasId):
     limit = sa.Column(sa.Integer)
 
 
+class QuotaUsage(model_base.BASEV2):
+    """Represent the number of objects of a resource owned by a tenant.
+
+    The usages are only kept by the TrackedDbQuotaDriver.
+    """
+    tenant_id = sa.Column(sa.String(255), primary_key=True)
+    resource = sa.Column(sa.String(255), primary_key=True)
+    in_use = sa.Column(sa.Integer, nullable=False, default=0)
+
+
+class Reservation(model_base.BASEV2):
+    """Represent the quota reserved by a request for new objects."""
+    id = sa.Column(sa.String(36), primary_key=True)
+    resource = sa.Column(sa.String(255), primary_key=True)
+    tenant_id = sa.Column(sa.String(255), index=True)
+    delta = sa.Column(sa.Integer, nullable=False)
+    expiration = sa.Column(sa.DateTime, nullable=False)
+
+
+# resource name -> model of its objects
+_TRACKED_MODELS = {}
+
+
+def _update_usage(connection, tenant_id, resource, delta):
+    if cfg.CONF.QUOTAS.quota_driver != quota.QUOTA_TRACKED_DRIVER:
+        return
+    usages = QuotaUsage.__table__
+    connection.execute(usages.update().
+                       where(usages.c.tenant_id == tenant_id).
+                       where(usages.c.resource == resource).
+                       values(in_use=usages.c.in_use + delta))
+
+
+def track_resource(resource, model):
+    """Keep track of the usages of a resource whose objects are in model.
+
+    Once the TrackedDbQuotaDriver counted the usage of a tenant, it is
+    updated in the transactions inserting and deleting its objects.
+    """
+    if resource in _TRACKED_MODELS:
+        return
+    _TRACKED_MODELS[resource] = model
+
+    def after_insert(mapper, connection, target):
+        _update_usage(connection, target.tenant_id, resource, 1)
+
+    def after_delete(mapper, connection, target):
+        _update_usage(connection, target.tenant_id, resource, -1)
+
+    event.listen(model, 'after_insert', after_insert)
+    event.listen(model, 'after_delete', after_delete)
+
+
+track_resource('network', models_v2.Network)
+track_resource('subnet', models_v2.Subnet)
+track_resource('port', models_v2.Port)
+
+
 class DbQuotaDriver(object):
     """Driver to perform necessary checks to enforce quotas and obtain quota
     information.
@@ -177,3 +247,172 @@ class DbQuotaDriver(object):
                  if quotas[key] >= 0 and quotas[key] < val]
         if overs:
             raise exceptions.OverQuota(overs=sorted(overs))
+
+
+class TrackedDbQuotaDriver(DbQuotaDriver):
+    """Quota driver keeping track of the usages of the tenants.
+
+    The usages of the resources registered with track_resource are counted
+    once per tenant, instead of for every request, and then kept up to
+    date with the objects. The other resources are still counted.
+
+    The quota of the objects being created is reserved until they are, so
+    that concurrent requests are not all allowed the last objects of a
+    tenant. Reservations left by failed servers expire.
+
+    The usages can be reconciled with the resource tables with the
+    neutron-reconcile-quota-usages command, as bulk deletes of objects
+    bypass their tracking.
+    """
+
+    def _get_usages(self, context, tenant_id, keys, count):
+        """Return the usages of the resources identified by keys.
+
+        The tracked usages are locked until the end of the transaction.
+        When a usage is not tracked yet, the objects of the tenant are
+        counted with a locking read before the usage is inserted: their
+        concurrent inserts and deletes wait for the usage to be committed,
+        instead of updating a usage which does not exist yet.
+        """
+        usages = {}
+        tracked = [key for key in keys if key in _TRACKED_MODELS]
+        if tracked:
+            query = context.session.query(QuotaUsage).filter(
+                QuotaUsage.tenant_id == tenant_id,
+                QuotaUsage.resource.in_(tracked)).with_lockmode('update')
+            usages.update((usage.resource, usage.in_use) for usage in query)
+        for key in keys:
+            if key in usages:
+                continue
+            if key in _TRACKED_MODELS:
+                usages[key] = self._count_objects(context, tenant_id, key,
+                                                  lockmode='read')
+                context.session.add(QuotaUsage(tenant_id=tenant_id,
+                                               resource=key,
+                                               in_use=usages[key]))
+            else:
+                usages[key] = count(key)
+        return usages
+
+    def _make_reservation(self, context, tenant_id, quotas, deltas, count):
+        now = timeutils.utcnow()
+        expiration = now + datetime.timedelta(
+            seconds=cfg.CONF.QUOTAS.reservation_expiration)
+        reservation_id = uuidutils.generate_uuid()
+        with context.session.begin(subtransactions=True):
+            usages = self._get_usages(context, tenant_id, deltas.keys(),
+                                      count)
+            reserved = dict(context.session.query(
+                Reservation.resource, func.sum(Reservation.delta)).filter(
+                    Reservation.tenant_id == tenant_id,
+                    Reservation.resource.in_(deltas.keys()),
+                    Reservation.expiration > now).group_by(
+                        Reservation.resource))
+            overs = [key for key, val in deltas.items()
+                     if quotas[key] >= 0 and
+                     quotas[key] < usages[key] + reserved.get(key, 0) + val]
+            if overs:
+                raise exceptions.OverQuota(overs=sorted(overs))
+            for key, val in deltas.items():
+                context.session.add(Reservation(id=reservation_id,
+                                                resource=key,
+                                                tenant_id=tenant_id,
+                                                delta=val,
+                                                expiration=expiration))
+        return reservation_id
+
+    def make_reservation(self, context, tenant_id, resources, deltas, count):
+        """Check and reserve the quota of new objects of a tenant.
+
+        :param context: The request context, for access checks.
+        :param tenant_id: The tenant_id to check the quota.
+        :param resources: A dictionary of the registered resources.
+        :param deltas: A dictionary of the numbers of new objects of each
+                       resource.
+        :param count: A callable returning the usage of a resource, for the
+                      resources whose usages are not tracked.
+        :return: The id of the reservation, or None if the quotas of the
+                 resources are unlimited.
+        """
+        unders = [key for key, val in deltas.items() if val < 0]
+        if unders:
+            raise exceptions.InvalidQuotaValue(unders=sorted(unders))
+        quotas = self._get_quotas(context, tenant_id, resources, deltas.keys())
+        deltas = dict((key, val) for key, val in deltas.items()
+                      if quotas[key] >= 0)
+        if not deltas:
+            return
+        try:
+            return self._make_reservation(context, tenant_id, quotas, deltas,
+                                          count)
+        except db_exc.DBDuplicateEntry:
+            # A concurrent request started tracking the usage first
+            return self._make_reservation(context, tenant_id, quotas, deltas,
+                                          count)
+
+    @staticmethod
+    def _delete_reservation(context, reservation_id):
+        with context.session.begin(subtransactions=True):
+            query = context.session.query(Reservation)
+            query.filter_by(id=reservation_id).delete()
+
+    def commit_reservation(self, context, reservation_id):
+        """Release the quota reserved once the objects are created.
+
+        Their usages were updated along with the objects.
+        """
+        self._delete_reservation(context, reservation_id)
+
+    def cancel_reservation(self, context, reservation_id):
+        """Release the quota reserved for objects which were not created."""
+        self._delete_reservation(context, reservation_id)
+
+    @staticmethod
+    def _count_objects(context, tenant_id, resource, lockmode=None):
+        model = _TRACKED_MODELS[resource]
+        query = context.session.query(func.count(model.tenant_id)).filter(
+            model.tenant_id == tenant_id)
+        if lockmode:
+            query = query.with_lockmode(lockmode)
+        return query.scalar()
+
+    def _reconcile_tenant_usages(self, context, tenant_id):
+        with context.session.begin(subtransactions=True):
+            usages = context.session.query(QuotaUsage).filter(
+                QuotaUsage.tenant_id == tenant_id,
+                QuotaUsage.resource.in_(_TRACKED_MODELS.keys())
+            ).with_lockmode('update')
+            for usage in usages:
+                in_use = self._count_objects(context, tenant_id,
+                                             usage.resource)
+                if usage.in_use != in_use:
+                    LOG.warning(_("Usage of %(resource)s by tenant "
+                                  "%(tenant_id)s was %(usage)s instead "
+                                  "of %(in_use)s"),
+                                {'resource': usage.resource,
+                                 'tenant_id': tenant_id,
+                                 'usage': usage.in_use,
+                                 'in_use': in_use})
+                    usage.in_use = in_use
+
+    def reconcile_usages(self, context, tenant_ids=None):
+        """Correct the usages which differ from the resource tables.
+
+        The usages of each tenant are locked and counted in their own
+        transaction, so that the creates and deletes of the other tenants
+        are not blocked. The expired reservations are deleted as well.
+
+        :param context: The request context, for access checks.
+        :param tenant_ids: The tenants whose usages are reconciled, all the
+                           tenants with usages by default.
+        :return: The number of tenants whose usages were reconciled.
+        """
+        with context.session.begin(subtransactions=True):
+            query = context.session.query(Reservation)
+            query.filter(Reservation.expiration <= timeutils.utcnow()).delete()
+        if not tenant_ids:
+            query = context.session.query(QuotaUsage.tenant_id).distinct()
+            tenant_ids = [tenant_id for tenant_id, in query]
+        for tenant_id in tenant_ids:
+            self._reconcile_tenant_usages(context, tenant_id)
+        return len(tenant_ids)
@@ -13,7 +13,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import itertools
+import weakref
+
 import netaddr
+from oslo.config import cfg
+from sqlalchemy import event
+from sqlalchemy import orm
 from sqlalchemy.orm import exc
 
 from neutron.common import constants as q_const
@@ -26,13 +32,111 @@ from neutron.openstack.common import log as logging
 
 LOG = logging.getLogger(__name__)
 
+security_group_rpc_opts = [
+    cfg.BoolOpt(
+        'cache_rpc_info',
+        default=False,
+        help=_(
+            'Cache the security group rules and members served to the L2 '
+            'agents in the server. Only effective when api_workers and '
+            'rpc_workers are 0, as the cache is invalidated by the API '
+            'process.')),
+]
+cfg.CONF.register_opts(security_group_rpc_opts, 'SECURITYGROUP')
 
 IP_MASK = {q_const.IPv4: 32,
            q_const.IPv6: 128}
 
 
-DIRECTION_IP_PREFIX = {'ingress': 'source_ip_prefix',
-                       'egress': 'dest_ip_prefix'}
+class SecurityGroupInfoCache(object):
+    """Cache of the security group data served to the agents.
+
+    Holds the compiled rules and the member IPs of each security group so
+    that agents resyncing the same groups do not recompute them on every
+    call. Entries are dropped by SecurityGroupServerRpcMixin when rules or
+    memberships change. Values read from the database are only stored if
+    no invalidation happened meanwhile, as tracked by a generation counter.
+    Changes made in a transaction only invalidate the entries once it is
+    committed: until then, the values read by other calls do not include
+    them.
+
+    The cache lives in the server process: it is only enabled when API and
+    RPC requests are served by the same process.
+    """
+
+    def __init__(self):
+        self.rules = {}
+        self.member_ips = {}
+        self.generation = 0
+        self._disabled_warned = False
+        # session -> invalidations waiting for the commit of its transaction
+        self._pending = weakref.WeakKeyDictionary()
+
+    @property
+    def enabled(self):
+        if not cfg.CONF.SECURITYGROUP.cache_rpc_info:
+            return False
+        if (getattr(cfg.CONF, 'api_workers', 0) or
+                getattr(cfg.CONF, 'rpc_workers', 0)):
+            if not self._disabled_warned:
+                LOG.warning(_("cache_rpc_info is ignored when api_workers "
+                              "or rpc_workers is set"))
+                self._disabled_warned = True
+            return False
+        return True
+
+    def get(self, store, keys):
+        """Return the cached values of keys and the list of missing keys."""
+        if not self.enabled:
+            return {}, list(keys)
+        found = {}
+        missing = []
+        for key in keys:
+            if key in store:
+                found[key] = store[key]
+            else:
+                missing.append(key)
+        return found, missing
+
+    def put(self, store, values, generation):
+        if self.enabled and generation == self.generation:
+            store.update(values)
+
+    def invalidate(self, security_group_ids=None, rules=True, members=True):
+        """Drop the entries of security_group_ids, or all entries."""
+        self.generation += 1
+        stores = []
+        if rules:
+            stores.append(self.rules)
+        if members:
+            stores.append(self.member_ips)
+        for store in stores:
+            if security_group_ids is None:
+                store.clear()
+                continue
+            for sg_id in security_group_ids:
+                store.pop(sg_id, None)
+
+    def invalidate_on_commit(self, session, security_group_ids=None,
+                             rules=True, members=True):
+        """Drop the entries once the transaction of session is committed."""
+        if session.transaction is None:
+            self.invalidate(security_group_ids, rules, members)
+        else:
+            self._pending.setdefault(session, []).append(
+                (security_group_ids, rules, members))
+
+    def after_commit(self, session):
+        for args in self._pending.pop(session, []):
+            self.invalidate(*args)
+
+    def after_rollback(self, session):
+        self._pending.pop(session, None)
+
+
+SG_INFO_CACHE = SecurityGroupInfoCache()
+event.listen(orm.Session, 'after_commit', SG_INFO_CACHE.after_commit)
+event.listen(orm.Session, 'after_rollback', SG_INFO_CACHE.after_rollback)
 
 
 class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
@@ -42,6 +146,8 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
         rule = self.create_security_group_rule_bulk_native(context,
                                                            bulk_rule)[0]
         sgids = [rule['security_group_id']]
+        SG_INFO_CACHE.invalidate_on_commit(context.session, sgids,
+                                           members=False)
         self.notifier.security_groups_rule_updated(context, sgids)
         return rule
 
@@ -51,6 +157,8 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
                       self).create_security_group_rule_bulk_native(
                           context, security_group_rule)
         sgids = set([r['security_group_id'] for r in rules])
+        SG_INFO_CACHE.invalidate_on_commit(context.session, sgids,
+                                           members=False)
         self.notifier.security_groups_rule_updated(context, list(sgids))
         return rules
 
@@ -58,9 +166,16 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
         rule = self.get_security_group_rule(context, sgrid)
         super(SecurityGroupServerRpcMixin,
               self).delete_security_group_rule(context, sgrid)
+        SG_INFO_CACHE.invalidate_on_commit(
+            context.session, [rule['security_group_id']], members=False)
         self.notifier.security_groups_rule_updated(context,
                                                    [rule['security_group_id']])
 
+    def delete_security_group(self, context, id):
+        super(SecurityGroupServerRpcMixin,
+              self).delete_security_group(context, id)
+        SG_INFO_CACHE.invalidate_on_commit(context.session, [id])
+
     def update_security_group_on_port(self, context, id, port,
                                       original_port, updated_port):
         """Update security groups on port.
@@ -97,6 +212,13 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
         is required and does not perform notification itself.
         It is because another changes for the port may require notification.
         """
+        # Any port update may change the addresses of the members, address
+        # pairs included, so the cached member IPs are dropped regardless
+        SG_INFO_CACHE.invalidate_on_commit(
+            context.session,
+            set(original_port.get(ext_sg.SECURITYGROUPS) or []) |
+            set(updated_port.get(ext_sg.SECURITYGROUPS) or []),
+            rules=False)
         need_notify = False
         if (original_port['fixed_ips'] != updated_port['fixed_ips'] or
             not utils.compare_elements(
@@ -119,8 +241,13 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
         if port['device_owner'] == q_const.DEVICE_OWNER_DHCP:
             self.notifier.security_groups_provider_updated(context)
         else:
+            security_groups = port.get(ext_sg.SECURITYGROUPS)
+            # The previous groups of an updated port are notified as well,
+            # so dropping the entries of the notified groups is enough
+            SG_INFO_CACHE.invalidate_on_commit(
+                context.session, security_groups or [], rules=False)
             self.notifier.security_groups_member_updated(
-                context, port.get(ext_sg.SECURITYGROUPS))
+                context, security_groups)
 
 
 class SecurityGroupServerRpcCallbackMixin(object):
@@ -138,7 +265,50 @@ class SecurityGroupServerRpcCallbackMixin(object):
         :returns: port correspond to the devices with security group rules
         """
         devices = kwargs.get('devices')
+        ports = self._get_ports_for_devices(devices)
+        return self._security_group_rules_for_ports(context, ports)
+
+    def security_group_info_for_devices(self, context, **kwargs):
+        """Return security group information for each port.
+
+        Unlike security_group_rules_for_devices, the rules of each security
+        group and the member IPs of each remote group are returned once,
+        instead of being expanded into the rules of every port:
+
+        {'security_groups': {sg_id: [rule, ...], ...},
+         'sg_member_ips': {sg_id: {'IPv4': [ip, ...], 'IPv6': [...]}, ...},
+         'devices': {port_id: port, ...}}
+
+        Each port lists its groups in 'security_groups' and only carries
+        the provider rules in 'security_group_rules'.
+
+        :params devices: list of devices
+        """
+        devices = kwargs.get('devices')
+        ports = self._get_ports_for_devices(devices)
+        sg_ids_by_port = self._select_sg_ids_for_ports(context, ports)
+        rules_by_sg = self._select_rules_for_security_groups(
+            context, set(itertools.chain(*sg_ids_by_port.values())))
+        remote_group_ids = set(
+            rule['remote_group_id']
+            for rules in rules_by_sg.values() for rule in rules
+            if rule.get('remote_group_id'))
+        ips = self._select_ips_for_remote_group(context, remote_group_ids)
+        sg_member_ips = {}
+        for remote_group_id, member_ips in ips.items():
+            ips_by_ethertype = sg_member_ips[remote_group_id] = {
+                q_const.IPv4: [], q_const.IPv6: []}
+            for ip in member_ips:
+                version = netaddr.IPNetwork(ip).version
+                ips_by_ethertype['IPv%s' % version].append(ip)
+        for port_id, port in ports.items():
+            port['security_groups'] = sg_ids_by_port[port_id]
+        self._apply_provider_rule(context, ports)
+        return {'security_groups': rules_by_sg,
+                'sg_member_ips': sg_member_ips,
+                'devices': ports}
 
+    def _get_ports_for_devices(self, devices):
         ports = {}
         for device in devices:
             port = self.get_port_from_device(device)
@@ -147,27 +317,78 @@ class SecurityGroupServerRpcCallbackMixin(object):
             if port['device_owner'].startswith('network:'):
                 continue
             ports[port['id']] = port
-        return self._security_group_rules_for_ports(context, ports)
+        return ports
 
-    def _select_rules_for_ports(self, context, ports):
+    def _select_sg_ids_for_ports(self, context, ports):
+        sg_ids_by_port = dict((port_id, []) for port_id in ports)
         if not ports:
-            return []
+            return sg_ids_by_port
         sg_binding_port = sg_db.SecurityGroupPortBinding.port_id
         sg_binding_sgid = sg_db.SecurityGroupPortBinding.security_group_id
 
-        sgr_sgid = sg_db.SecurityGroupRule.security_group_id
-
-        query = context.session.query(sg_db.SecurityGroupPortBinding,
-                                      sg_db.SecurityGroupRule)
-        query = query.join(sg_db.SecurityGroupRule,
-                           sgr_sgid == sg_binding_sgid)
+        query = context.session.query(sg_binding_port, sg_binding_sgid)
         query = query.filter(sg_binding_port.in_(ports.keys()))
-        return query.all()
+        for port_id, security_group_id in query:
+            sg_ids_by_port[port_id].append(security_group_id)
+        return sg_ids_by_port
+
+    def _make_rule_dict_for_agent(self, rule_in_db):
+        direction = rule_in_db['direction']
+        rule_dict = {
+            'security_group_id': rule_in_db['security_group_id'],
+            'direction': direction,
+            'ethertype': rule_in_db['ethertype'],
+        }
+        for key in ('protocol', 'port_range_min', 'port_range_max',
+                    'remote_ip_prefix', 'remote_group_id'):
+            if rule_in_db.get(key):
+                if key == 'remote_ip_prefix':
+                    direction_ip_prefix = (
+                        q_const.DIRECTION_IP_PREFIX[direction])
+                    rule_dict[direction_ip_prefix] = rule_in_db[key]
+                    continue
+                rule_dict[key] = rule_in_db[key]
+        return rule_dict
+
+    def _select_rules_for_security_groups(self, context, security_group_ids):
+        """Return the rules of each security group, as sent to the agents.
+
+        The rule lists are shared with the cache and must not be modified.
+        """
+        rules_by_sg, missing = SG_INFO_CACHE.get(SG_INFO_CACHE.rules,
+                                                 security_group_ids)
+        if not missing:
+            return rules_by_sg
+        generation = SG_INFO_CACHE.generation
+        rules_in_db = dict((sg_id, []) for sg_id in missing)
+        sgr_sgid = sg_db.SecurityGroupRule.security_group_id
+        query = context.session.query(sg_db.SecurityGroupRule)
+        query = query.filter(sgr_sgid.in_(missing))
+        for rule_in_db in query:
+            rules_in_db[rule_in_db['security_group_id']].append(
+                self._make_rule_dict_for_agent(rule_in_db))
+        SG_INFO_CACHE.put(SG_INFO_CACHE.rules, rules_in_db, generation)
+        rules_by_sg.update(rules_in_db)
+        return rules_by_sg
 
     def _select_ips_for_remote_group(self, context, remote_group_ids):
-        ips_by_group = {}
-        if not remote_group_ids:
+        """Return the IPs of the members of each remote group.
+
+        The IP lists are shared with the cache and must not be modified.
+        """
+        ips_by_group, missing = SG_INFO_CACHE.get(SG_INFO_CACHE.member_ips,
+                                                  remote_group_ids)
+        if not missing:
             return ips_by_group
+        generation = SG_INFO_CACHE.generation
+        ips_in_db = self._select_ips_for_remote_group_from_db(context,
+                                                              missing)
+        SG_INFO_CACHE.put(SG_INFO_CACHE.member_ips, ips_in_db, generation)
+        ips_by_group.update(ips_in_db)
+        return ips_by_group
+
+    def _select_ips_for_remote_group_from_db(self, context, remote_group_ids):
+        ips_by_group = {}
         for remote_group_id in remote_group_ids:
             ips_by_group[remote_group_id] = []
 
@@ -291,7 +512,7 @@ class SecurityGroupServerRpcCallbackMixin(object):
             for rule in port.get('security_group_rules'):
                 remote_group_id = rule.get('remote_group_id')
                 direction = rule.get('direction')
-                direction_ip_prefix = DIRECTION_IP_PREFIX[direction]
+                direction_ip_prefix = q_const.DIRECTION_IP_PREFIX[direction]
                 if not remote_group_id:
                     updated_rule.append(rule)
                     continue
@@ -351,24 +572,13 @@ class SecurityGroupServerRpcCallbackMixin(object):
             self._add_ingress_dhcp_rule(port, ips_dhcp)
 
     def _security_group_rules_for_ports(self, context, ports):
-        rules_in_db = self._select_rules_for_ports(context, ports)
-        for (binding, rule_in_db) in rules_in_db:
-            port_id = binding['port_id']
+        sg_ids_by_port = self._select_sg_ids_for_ports(context, ports)
+        rules_by_sg = self._select_rules_for_security_groups(
+            context, set(itertools.chain(*sg_ids_by_port.values())))
+        for port_id, sg_ids in sg_ids_by_port.items():
             port = ports[port_id]
-            direction = rule_in_db['direction']
-            rule_dict = {
-                'security_group_id': rule_in_db['security_group_id'],
-                'direction': direction,
-                'ethertype': rule_in_db['ethertype'],
-            }
-            for key in ('protocol', 'port_range_min', 'port_range_max',
-                        'remote_ip_prefix', 'remote_group_id'):
-                if rule_in_db.get(key):
-                    if key == 'remote_ip_prefix':
-                        direction_ip_prefix = DIRECTION_IP_PREFIX[direction]
-                        rule_dict[direction_ip_prefix] = rule_in_db[key]
-                        continue
-                    rule_dict[key] = rule_in_db[key]
-            port['security_group_rules'].append(rule_dict)
+            for sg_id in sg_ids:
+                port['security_group_rules'].extend(
+                    rule.copy() for rule in rules_by_sg[sg_id])
         self._apply_provider_rule(context, ports)
         return self._convert_remote_group_id_to_ip_prefix(context, ports)
@@ -895,18 +895,20 @@ class LinuxBridgeNeutronAgentRPC(sg_rpc.SecurityGroupAgentRpcMixin):
     def treat_devices_added(self, devices):
         resync = False
         self.prepare_devices_filter(devices)
-        for device in devices:
+        devices = list(devices)
+        try:
+            devices_details_list = self.plugin_rpc.get_devices_details_list(
+                self.context, devices, self.agent_id)
+        except Exception as e:
+            LOG.debug(_("Unable to get port details for "
+                        "%(devices)s: %(e)s"),
+                      {'devices': devices, 'e': e})
+            # Resync all the devices with the plugin
+            return True
+        devices_up = []
+        devices_down = []
+        for device, details in zip(devices, devices_details_list):
             LOG.debug(_("Port %s added"), device)
-            try:
-                details = self.plugin_rpc.get_device_details(self.context,
-                                                             device,
-                                                             self.agent_id)
-            except Exception as e:
-                LOG.debug(_("Unable to get port details for "
-                            "%(device)s: %(e)s"),
-                          {'device': device, 'e': e})
-                resync = True
-                continue
             if 'port_id' in details:
                 LOG.info(_("Port %(device)s updated. Details: %(details)s"),
                          {'device': device, 'details': details})
@@ -925,22 +927,27 @@ class LinuxBridgeNeutronAgentRPC(sg_rpc.SecurityGroupAgentRpcMixin):
                                                  details['physical_network'],
                                                  segmentation_id,
                                                  details['port_id']):
-
-                        # update plugin about port status
-                        self.plugin_rpc.update_device_up(self.context,
-                                                         device,
-                                                         self.agent_id,
-                                                         cfg.CONF.host)
+                        devices_up.append(device)
                     else:
-                        self.plugin_rpc.update_device_down(self.context,
-                                                           device,
-                                                           self.agent_id,
-                                                           cfg.CONF.host)
+                        devices_down.append(device)
                 else:
                     self.remove_port_binding(details['network_id'],
                                              details['port_id'])
             else:
                 LOG.info(_("Device %s not defined on plugin"), device)
+        if devices_up or devices_down:
+            # update plugin about the status of all the ports at once
+            try:
+                result = self.plugin_rpc.update_device_list(
+                    self.context, devices_up, devices_down, self.agent_id,
+                    cfg.CONF.host)
+            except Exception as e:
+                LOG.debug(_("Unable to update the status of %(devices)s: "
+                            "%(e)s"),
+                          {'devices': devices_up + devices_down, 'e': e})
+                return True
+            if result['failed_devices_up'] or result['failed_devices_down']:
+                resync = True
         return resync
 
     def treat_devices_removed(self, devices):
@@ -948,20 +955,23 @@ class LinuxBridgeNeutronAgentRPC(sg_rpc.SecurityGroupAgentRpcMixin):
         self.remove_devices_filter(devices)
         for device in devices:
             LOG.info(_("Attachment %s removed"), device)
-            try:
-                details = self.plugin_rpc.update_device_down(self.context,
-                                                             device,
-                                                             self.agent_id,
-                                                             cfg.CONF.host)
-            except Exception as e:
-                LOG.debug(_("port_removed failed for %(device)s: %(e)s"),
-                          {'device': device, 'e': e})
-                resync = True
-            if details['exists']:
-                LOG.info(_("Port %s updated."), device)
-            else:
-                LOG.debug(_("Device %s not defined on plugin"), device)
-            self.br_mgr.remove_empty_bridges()
+        try:
+            result = self.plugin_rpc.update_device_list(
+                self.context, [], list(devices), self.agent_id,
+                cfg.CONF.host)
+        except Exception as e:
+            LOG.debug(_("port_removed failed for %(devices)s: %(e)s"),
+                      {'devices': devices, 'e': e})
+            resync = True
+        else:
+            for details in result['devices_down']:
+                if details['exists']:
+                    LOG.info(_("Port %s updated."), details['device'])
+                else:
+                    LOG.debug(_("Device %s not defined on plugin"),
+                              details['device'])
+            resync = bool(result['failed_devices_down'])
+        self.br_mgr.remove_empty_bridges()
         return resync
 
     def daemon_loop(self):
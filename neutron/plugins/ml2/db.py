@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import sqlalchemy as sa
 from sqlalchemy.orm import exc
 
 from neutron.db import api as db_api
@@ -45,15 +46,31 @@ def add_network_segment(session, network_id, segment):
               'network_id': record.network_id})
 
 
+def _make_segment_dict(record):
+    return {api.ID: record.id,
+            api.NETWORK_TYPE: record.network_type,
+            api.PHYSICAL_NETWORK: record.physical_network,
+            api.SEGMENTATION_ID: record.segmentation_id}
+
+
 def get_network_segments(session, network_id):
     with session.begin(subtransactions=True):
         records = (session.query(models.NetworkSegment).
                    filter_by(network_id=network_id))
-        return [{api.ID: record.id,
-                 api.NETWORK_TYPE: record.network_type,
-                 api.PHYSICAL_NETWORK: record.physical_network,
-                 api.SEGMENTATION_ID: record.segmentation_id}
-                for record in records]
+        return [_make_segment_dict(record) for record in records]
+
+
+def get_networks_segments(session, network_ids):
+    """Return a dict of the segments of each network, in one query."""
+    segments = dict((network_id, []) for network_id in network_ids)
+    if not network_ids:
+        return segments
+    with session.begin(subtransactions=True):
+        records = (session.query(models.NetworkSegment).
+                   filter(models.NetworkSegment.network_id.in_(network_ids)))
+        for record in records:
+            segments[record.network_id].append(_make_segment_dict(record))
+    return segments
 
 
 def ensure_port_binding(session, port_id):
@@ -70,6 +87,23 @@ def ensure_port_binding(session, port_id):
         return record
 
 
+def ensure_port_bindings(session, port_ids):
+    """Return a dict of the bindings of ports, creating missing ones."""
+    if not port_ids:
+        return {}
+    with session.begin(subtransactions=True):
+        records = (session.query(models.PortBinding).
+                   filter(models.PortBinding.port_id.in_(port_ids)))
+        bindings = dict((record.port_id, record) for record in records)
+        for port_id in set(port_ids) - set(bindings):
+            record = models.PortBinding(
+                port_id=port_id,
+                vif_type=portbindings.VIF_TYPE_UNBOUND)
+            session.add(record)
+            bindings[port_id] = record
+        return bindings
+
+
 def get_port(session, port_id):
     """Get port record for update within transcation."""
 
@@ -87,6 +121,36 @@ def get_port(session, port_id):
             return
 
 
+def get_ports(session, port_ids):
+    """Get port records for update within transaction, in one query.
+
+    As with get_port, port ids may be truncated. Returns a dict of the port
+    records found by port id, as given.
+    """
+    full_ids = set(port_id for port_id in port_ids
+                   if uuidutils.is_uuid_like(port_id))
+    prefixes = set(port_ids) - full_ids
+    criteria = [models_v2.Port.id.startswith(prefix) for prefix in prefixes]
+    if full_ids:
+        criteria.append(models_v2.Port.id.in_(full_ids))
+    if not criteria:
+        return {}
+    with session.begin(subtransactions=True):
+        records = session.query(models_v2.Port).filter(sa.or_(*criteria))
+        ports = dict((record.id, record) for record in records)
+    result = dict((port_id, ports[port_id])
+                  for port_id in full_ids if port_id in ports)
+    for prefix in prefixes:
+        matches = [record for port_id, record in ports.iteritems()
+                   if port_id.startswith(prefix)]
+        if len(matches) == 1:
+            result[prefix] = matches[0]
+        elif matches:
+            LOG.error(_("Multiple ports have port_id starting with %s"),
+                      prefix)
+    return result
+
+
 def get_port_from_device_mac(device_mac):
     LOG.debug(_("get_port_from_device_mac() called for mac %s"), device_mac)
     session = db_api.get_session()
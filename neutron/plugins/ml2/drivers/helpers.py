@@ -0,0 +1,178 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Helpers shared by the type drivers backed by an allocation table.
+
+The vlan, gre and vxlan type drivers keep one row per segmentation id with
+an 'allocated' flag. The helpers below keep the work done on those tables
+set based: synchronization with the configured ranges runs a constant
+number of statements whatever the size of the ranges, and tenant segments
+are allocated with a compare-and-swap update instead of locking the first
+free row of the table.
+"""
+
+import random
+
+from six.moves import xrange
+import sqlalchemy as sa
+from sqlalchemy import orm
+
+from neutron.openstack.common import log
+
+LOG = log.getLogger(__name__)
+
+# Number of free rows read to pick a candidate from, and number of
+# compare-and-swap attempts before giving up on an allocation
+ALLOCATION_CANDIDATES = 16
+ALLOCATION_RETRIES = 10
+
+# Number of rows inserted per statement when populating the table
+SYNC_CHUNK_SIZE = 10000
+
+
+def _in_ranges(column, ranges):
+    return sa.or_(*[column.between(low, high) for low, high in ranges])
+
+
+def _merge_ranges(ranges):
+    merged = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], high)
+        else:
+            merged.append([low, high])
+    return merged
+
+
+def _missing_ranges(session, model, column, low, high, filters):
+    """Return the (first, last) bounds of the ids of low - high not in model.
+
+    The bounds of the gaps are the existing ids whose neighbour is missing,
+    which are found by the database, so that neither the existing ids nor
+    the ids of the range are enumerated.
+    """
+    pool_qry = session.query(column).filter_by(**filters).filter(
+        column.between(low, high))
+    if not pool_qry.first():
+        return [(low, high)]
+    neighbour = orm.aliased(model)
+    neighbour_qry = session.query(neighbour).filter_by(**filters)
+    neighbour_id = getattr(neighbour, column.key)
+    # Existing ids followed by a missing id start a gap, and existing ids
+    # preceded by a missing id end one
+    starts = [low] if not pool_qry.filter(column == low).first() else []
+    starts.extend(seg_id + 1 for seg_id, in pool_qry.filter(
+        column < high,
+        ~neighbour_qry.filter(neighbour_id == column + 1).exists()))
+    ends = [seg_id - 1 for seg_id, in pool_qry.filter(
+        column > low,
+        ~neighbour_qry.filter(neighbour_id == column - 1).exists())]
+    if not pool_qry.filter(column == high).first():
+        ends.append(high)
+    return zip(sorted(starts), sorted(ends))
+
+
+def sync_allocations(session, model, column, ranges, **filters):
+    """Synchronize an allocation table with the configured ranges.
+
+    Unallocated rows outside of the ranges are removed with a single
+    DELETE. The gaps of the ranges are computed by the database, and the
+    rows missing from them are inserted in chunks of SYNC_CHUNK_SIZE rows,
+    without loading any row as an ORM object.
+
+    :param model: allocation model, with an 'allocated' column
+    :param column: segmentation id column of the model
+    :param ranges: list of (min, max) tuples, bounds included
+    :param filters: extra column values identifying the rows of the pool,
+                    e.g. physical_network for VLANs
+    """
+    with session.begin(subtransactions=True):
+        pool_qry = session.query(model).filter_by(**filters)
+        stale_qry = pool_qry.filter_by(allocated=False)
+        if ranges:
+            stale_qry = stale_qry.filter(~_in_ranges(column, ranges))
+        removed = stale_qry.delete(synchronize_session=False)
+        if removed:
+            LOG.debug(_("Removed %(count)s %(table)s rows from pool"),
+                      {'count': removed, 'table': model.__tablename__})
+        if not ranges:
+            return
+
+        table = model.__table__
+        chunk = []
+        for low, high in _merge_ranges(ranges):
+            for first, last in _missing_ranges(session, model, column,
+                                               low, high, filters):
+                for seg_id in xrange(first, last + 1):
+                    row = dict(filters)
+                    row[column.key] = seg_id
+                    row['allocated'] = False
+                    chunk.append(row)
+                    if len(chunk) == SYNC_CHUNK_SIZE:
+                        session.execute(table.insert(), chunk)
+                        chunk = []
+        if chunk:
+            session.execute(table.insert(), chunk)
+
+
+def delete_unallocated(session, model, column, values):
+    """Remove unallocated rows whose column value is not in values."""
+    with session.begin(subtransactions=True):
+        qry = session.query(model).filter_by(allocated=False)
+        if values:
+            qry = qry.filter(~column.in_(values))
+        return qry.delete(synchronize_session=False)
+
+
+def allocate_free_segment(session, model, **filters):
+    """Allocate a free row of an allocation table.
+
+    A random row among the first ALLOCATION_CANDIDATES free ones is claimed
+    with an UPDATE conditioned on the row still being free, so concurrent
+    allocations do not end up with the same segment, and the first attempt
+    does not lock the rows it reads.
+
+    A lost race is retried with a locking read of the candidates. A plain
+    read would return the same snapshot again within the transaction under
+    MySQL's REPEATABLE READ isolation, while a locking read returns the
+    latest committed rows. Returns the allocated row, or None if the pool
+    is exhausted.
+    """
+    primary_keys = [c.name for c in model.__table__.primary_key]
+    free_qry = session.query(model).filter_by(allocated=False, **filters)
+    with session.begin(subtransactions=True):
+        for attempt in xrange(ALLOCATION_RETRIES):
+            if attempt:
+                free_qry = free_qry.with_lockmode('update')
+            candidates = free_qry.limit(ALLOCATION_CANDIDATES).all()
+            if not candidates:
+                return
+            alloc = random.choice(candidates)
+            raw_segment = dict((key, getattr(alloc, key))
+                               for key in primary_keys)
+            count = (session.query(model).
+                     filter_by(allocated=False, **raw_segment).
+                     update({'allocated': True}))
+            if count:
+                return alloc
+            LOG.debug(_("Segment %(segment)s of %(table)s allocated "
+                        "concurrently, retrying (attempt %(attempt)s)"),
+                      {'segment': raw_segment,
+                       'table': model.__tablename__,
+                       'attempt': attempt + 1})
+        LOG.warning(_("Unable to allocate a segment from %(table)s after "
+                      "%(retries)s attempts"),
+                    {'table': model.__tablename__,
+                     'retries': ALLOCATION_RETRIES})
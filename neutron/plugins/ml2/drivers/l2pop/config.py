@@ -24,6 +24,11 @@ l2_population_options = [
     cfg.IntOpt('agent_boot_time', default=180,
                help=_('Delay within which agent is expected to update '
                       'existing ports whent it restarts')),
+    cfg.FloatOpt('fdb_aggregation_interval', default=0.5,
+                 help=_('Seconds during which the fdb entries added or '
+                        'removed on all the agents are aggregated into a '
+                        'single message. 0 sends a message per port '
+                        'change')),
 ]
 
 cfg.CONF.register_opts(l2_population_options, "l2pop")
@@ -17,13 +17,44 @@
 # @author: Francois Eleouet, Orange
 # @author: Mathieu Rohon, Orange
 
+import eventlet
+from oslo.config import cfg
+
 from neutron.common import topics
 from neutron.openstack.common import log as logging
 from neutron.openstack.common.rpc import proxy
+from neutron.plugins.ml2.drivers.l2pop import config  # noqa
 
 
 LOG = logging.getLogger(__name__)
 
+# Fanout messages whose fdb entries can be merged with the entries of the
+# following messages of the same method
+AGGREGATED_METHODS = ('add_fdb_entries', 'remove_fdb_entries')
+
+
+def merge_fdb_entries(merged, seen, fdb_entries):
+    """Merge the fdb entries of an add or remove message into merged.
+
+    Both are dicts of network id -> {'segment_id', 'network_type', 'ports'},
+    where 'ports' maps an agent ip to a list of [mac, ip] entries. seen is
+    the set of the (network id, agent ip, mac, ip) already in merged; it is
+    updated along with merged, so that it is not rebuilt at every merge.
+    """
+    for network_id, network in fdb_entries.iteritems():
+        merged_network = merged.get(network_id)
+        if merged_network is None:
+            merged_network = merged[network_id] = dict(network, ports={})
+        merged_ports = merged_network['ports']
+        for agent_ip, entries in network['ports'].iteritems():
+            agent_entries = merged_ports.setdefault(agent_ip, [])
+            for entry in entries:
+                key = (network_id, agent_ip) + tuple(entry)
+                if key not in seen:
+                    seen.add(key)
+                    agent_entries.append(entry)
+    return merged
+
 
 class L2populationAgentNotifyAPI(proxy.RpcProxy):
     BASE_RPC_API_VERSION = '1.0'
@@ -35,8 +66,44 @@ class L2populationAgentNotifyAPI(proxy.RpcProxy):
         self.topic_l2pop_update = topics.get_topic_name(topic,
                                                         topics.L2POPULATION,
                                                         topics.UPDATE)
+        # [context, method, fdb_entries, seen entries] of the fanout
+        # messages waiting for the end of the aggregation interval, in order
+        self._pending_fanouts = []
+        self._flush_scheduled = False
 
     def _notification_fanout(self, context, method, fdb_entries):
+        interval = cfg.CONF.l2pop.fdb_aggregation_interval
+        if interval > 0 and method in AGGREGATED_METHODS:
+            self._aggregate_fanout(context, method, fdb_entries, interval)
+            return
+        # Do not send this message before the ones already waiting
+        self.flush_fanouts()
+        self._send_fanout(context, method, fdb_entries)
+
+    def _aggregate_fanout(self, context, method, fdb_entries, interval):
+        # Only consecutive messages of the same method are merged, so that
+        # the agents see the additions and removals in the order they
+        # happened
+        if self._pending_fanouts and self._pending_fanouts[-1][1] == method:
+            merge_fdb_entries(self._pending_fanouts[-1][2],
+                              self._pending_fanouts[-1][3], fdb_entries)
+        else:
+            seen = set()
+            self._pending_fanouts.append(
+                [context, method, merge_fdb_entries({}, seen, fdb_entries),
+                 seen])
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            eventlet.spawn_after(interval, self.flush_fanouts)
+
+    def flush_fanouts(self):
+        """Send the aggregated fanout messages now."""
+        pending, self._pending_fanouts = self._pending_fanouts, []
+        self._flush_scheduled = False
+        for context, method, fdb_entries, seen in pending:
+            self._send_fanout(context, method, fdb_entries)
+
+    def _send_fanout(self, context, method, fdb_entries):
         LOG.debug(_('Fanout notify l2population agents at %(topic)s '
                     'the message %(method)s with %(fdb_entries)s'),
                   {'topic': self.topic,
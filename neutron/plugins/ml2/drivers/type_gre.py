@@ -14,7 +14,6 @@
 #    under the License.
 
 from oslo.config import cfg
-from six.moves import xrange
 import sqlalchemy as sa
 from sqlalchemy.orm import exc as sa_exc
 
@@ -24,6 +23,7 @@ from neutron.db import model_base
 from neutron.openstack.common import log
 from neutron.plugins.common import constants as p_const
 from neutron.plugins.ml2 import driver_api as api
+from neutron.plugins.ml2.drivers import helpers
 from neutron.plugins.ml2.drivers import type_tunnel
 
 LOG = log.getLogger(__name__)
@@ -94,14 +94,10 @@ class GreTypeDriver(type_tunnel.TunnelTypeDriver):
 
     def allocate_tenant_segment(self, session):
         with session.begin(subtransactions=True):
-            alloc = (session.query(GreAllocation).
-                     filter_by(allocated=False).
-                     with_lockmode('update').
-                     first())
+            alloc = helpers.allocate_free_segment(session, GreAllocation)
             if alloc:
                 LOG.debug(_("Allocating gre tunnel id  %(gre_id)s"),
                           {'gre_id': alloc.gre_id})
-                alloc.allocated = True
                 return {api.NETWORK_TYPE: p_const.TYPE_GRE,
                         api.PHYSICAL_NETWORK: None,
                         api.SEGMENTATION_ID: alloc.gre_id}
@@ -131,7 +127,7 @@ class GreTypeDriver(type_tunnel.TunnelTypeDriver):
         """Synchronize gre_allocations table with configured tunnel ranges."""
 
         # determine current configured allocatable gres
-        gre_ids = set()
+        gre_id_ranges = []
         for gre_id_range in self.gre_id_ranges:
             tun_min, tun_max = gre_id_range
             if tun_max + 1 - tun_min > 1000000:
@@ -139,28 +135,11 @@ class GreTypeDriver(type_tunnel.TunnelTypeDriver):
                             "%(tun_min)s:%(tun_max)s"),
                           {'tun_min': tun_min, 'tun_max': tun_max})
             else:
-                gre_ids |= set(xrange(tun_min, tun_max + 1))
+                gre_id_ranges.append((tun_min, tun_max))
 
         session = db_api.get_session()
-        with session.begin(subtransactions=True):
-            # remove from table unallocated tunnels not currently allocatable
-            allocs = (session.query(GreAllocation).all())
-            for alloc in allocs:
-                try:
-                    # see if tunnel is allocatable
-                    gre_ids.remove(alloc.gre_id)
-                except KeyError:
-                    # it's not allocatable, so check if its allocated
-                    if not alloc.allocated:
-                        # it's not, so remove it from table
-                        LOG.debug(_("Removing tunnel %s from pool"),
-                                  alloc.gre_id)
-                        session.delete(alloc)
-
-            # add missing allocatable tunnels to table
-            for gre_id in sorted(gre_ids):
-                alloc = GreAllocation(gre_id=gre_id)
-                session.add(alloc)
+        helpers.sync_allocations(session, GreAllocation,
+                                 GreAllocation.gre_id, gre_id_ranges)
 
     def get_gre_allocation(self, session, gre_id):
         return session.query(GreAllocation).filter_by(gre_id=gre_id).first()
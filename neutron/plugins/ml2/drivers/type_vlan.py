@@ -16,7 +16,6 @@
 import sys
 
 from oslo.config import cfg
-from six.moves import xrange
 import sqlalchemy as sa
 
 from neutron.common import constants as q_const
@@ -28,6 +27,7 @@ from neutron.openstack.common import log
 from neutron.plugins.common import constants as p_const
 from neutron.plugins.common import utils as plugin_utils
 from neutron.plugins.ml2 import driver_api as api
+from neutron.plugins.ml2.drivers import helpers
 
 LOG = log.getLogger(__name__)
 
@@ -96,62 +96,22 @@ class VlanTypeDriver(api.TypeDriver):
     def _sync_vlan_allocations(self):
         session = db_api.get_session()
         with session.begin(subtransactions=True):
-            # get existing allocations for all physical networks
-            allocations = dict()
-            allocs = (session.query(VlanAllocation).
-                      with_lockmode('update'))
-            for alloc in allocs:
-                if alloc.physical_network not in allocations:
-                    allocations[alloc.physical_network] = set()
-                allocations[alloc.physical_network].add(alloc)
-
             # process vlan ranges for each configured physical network
             for (physical_network,
                  vlan_ranges) in self.network_vlan_ranges.items():
-                # determine current configured allocatable vlans for
-                # this physical network
-                vlan_ids = set()
-                for vlan_min, vlan_max in vlan_ranges:
-                    vlan_ids |= set(xrange(vlan_min, vlan_max + 1))
-
-                # remove from table unallocated vlans not currently
-                # allocatable
-                if physical_network in allocations:
-                    for alloc in allocations[physical_network]:
-                        try:
-                            # see if vlan is allocatable
-                            vlan_ids.remove(alloc.vlan_id)
-                        except KeyError:
-                            # it's not allocatable, so check if its allocated
-                            if not alloc.allocated:
-                                # it's not, so remove it from table
-                                LOG.debug(_("Removing vlan %(vlan_id)s on "
-                                            "physical network "
-                                            "%(physical_network)s from pool"),
-                                          {'vlan_id': alloc.vlan_id,
-                                           'physical_network':
-                                           physical_network})
-                                session.delete(alloc)
-                    del allocations[physical_network]
-
-                # add missing allocatable vlans to table
-                for vlan_id in sorted(vlan_ids):
-                    alloc = VlanAllocation(physical_network=physical_network,
-                                           vlan_id=vlan_id,
-                                           allocated=False)
-                    session.add(alloc)
+                helpers.sync_allocations(session, VlanAllocation,
+                                         VlanAllocation.vlan_id,
+                                         vlan_ranges,
+                                         physical_network=physical_network)
 
             # remove from table unallocated vlans for any unconfigured
             # physical networks
-            for allocs in allocations.itervalues():
-                for alloc in allocs:
-                    if not alloc.allocated:
-                        LOG.debug(_("Removing vlan %(vlan_id)s on physical "
-                                    "network %(physical_network)s from pool"),
-                                  {'vlan_id': alloc.vlan_id,
-                                   'physical_network':
-                                   alloc.physical_network})
-                        session.delete(alloc)
+            removed = helpers.delete_unallocated(
+                session, VlanAllocation, VlanAllocation.physical_network,
+                self.network_vlan_ranges.keys())
+            if removed:
+                LOG.debug(_("Removed %s vlans of unconfigured physical "
+                            "networks from pool"), removed)
 
     def get_type(self):
         return p_const.TYPE_VLAN
@@ -218,16 +178,12 @@ class VlanTypeDriver(api.TypeDriver):
 
     def allocate_tenant_segment(self, session):
         with session.begin(subtransactions=True):
-            alloc = (session.query(VlanAllocation).
-                     filter_by(allocated=False).
-                     with_lockmode('update').
-                     first())
+            alloc = helpers.allocate_free_segment(session, VlanAllocation)
             if alloc:
                 LOG.debug(_("Allocating vlan %(vlan_id)s on physical network "
                             "%(physical_network)s from pool"),
                           {'vlan_id': alloc.vlan_id,
                            'physical_network': alloc.physical_network})
-                alloc.allocated = True
                 return {api.NETWORK_TYPE: p_const.TYPE_VLAN,
                         api.PHYSICAL_NETWORK: alloc.physical_network,
                         api.SEGMENTATION_ID: alloc.vlan_id}
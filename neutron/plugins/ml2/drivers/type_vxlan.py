@@ -24,6 +24,7 @@ from neutron.db import model_base
 from neutron.openstack.common import log
 from neutron.plugins.common import constants as p_const
 from neutron.plugins.ml2 import driver_api as api
+from neutron.plugins.ml2.drivers import helpers
 from neutron.plugins.ml2.drivers import type_tunnel
 
 LOG = log.getLogger(__name__)
@@ -102,14 +103,10 @@ class VxlanTypeDriver(type_tunnel.TunnelTypeDriver):
 
     def allocate_tenant_segment(self, session):
         with session.begin(subtransactions=True):
-            alloc = (session.query(VxlanAllocation).
-                     filter_by(allocated=False).
-                     with_lockmode('update').
-                     first())
+            alloc = helpers.allocate_free_segment(session, VxlanAllocation)
             if alloc:
                 LOG.debug(_("Allocating vxlan tunnel vni %(vxlan_vni)s"),
                           {'vxlan_vni': alloc.vxlan_vni})
-                alloc.allocated = True
                 return {api.NETWORK_TYPE: p_const.TYPE_VXLAN,
                         api.PHYSICAL_NETWORK: None,
                         api.SEGMENTATION_ID: alloc.vxlan_vni}
@@ -141,35 +138,18 @@ class VxlanTypeDriver(type_tunnel.TunnelTypeDriver):
         """
 
         # determine current configured allocatable vnis
-        vxlan_vnis = set()
+        vxlan_vni_ranges = []
         for tun_min, tun_max in self.vxlan_vni_ranges:
             if tun_max + 1 - tun_min > MAX_VXLAN_VNI:
                 LOG.error(_("Skipping unreasonable VXLAN VNI range "
                             "%(tun_min)s:%(tun_max)s"),
                           {'tun_min': tun_min, 'tun_max': tun_max})
             else:
-                vxlan_vnis |= set(xrange(tun_min, tun_max + 1))
+                vxlan_vni_ranges.append((tun_min, tun_max))
 
         session = db_api.get_session()
-        with session.begin(subtransactions=True):
-            # remove from table unallocated tunnels not currently allocatable
-            allocs = session.query(VxlanAllocation)
-            for alloc in allocs:
-                try:
-                    # see if tunnel is allocatable
-                    vxlan_vnis.remove(alloc.vxlan_vni)
-                except KeyError:
-                    # it's not allocatable, so check if its allocated
-                    if not alloc.allocated:
-                        # it's not, so remove it from table
-                        LOG.debug(_("Removing tunnel %s from pool"),
-                                  alloc.vxlan_vni)
-                        session.delete(alloc)
-
-            # add missing allocatable tunnels to table
-            for vxlan_vni in sorted(vxlan_vnis):
-                alloc = VxlanAllocation(vxlan_vni=vxlan_vni)
-                session.add(alloc)
+        helpers.sync_allocations(session, VxlanAllocation,
+                                 VxlanAllocation.vxlan_vni, vxlan_vni_ranges)
 
     def get_vxlan_allocation(self, session, vxlan_vni):
         with session.begin(subtransactions=True):
@@ -190,6 +190,9 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
 
         # Keep track of int_br's device count for use by _report_state()
         self.int_br_device_count = 0
+        # Ports of int_br as read by the last scan_ports(), shared by the
+        # processing of the ports found by that scan
+        self.int_br_ports = None
 
         self.int_br = ovs_lib.OVSBridge(integ_br, self.root_helper)
         self.setup_rpc()
@@ -812,12 +815,14 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                 phys_veth.link.set_mtu(self.veth_mtu)
 
     def scan_ports(self, registered_ports, updated_ports=None):
-        cur_ports = self.int_br.get_vif_port_set()
+        self.int_br_ports = self.int_br.get_port_snapshot()
+        cur_ports = self.int_br_ports.get_vif_port_set()
         self.int_br_device_count = len(cur_ports)
         port_info = {'current': cur_ports}
         if updated_ports is None:
             updated_ports = set()
-        updated_ports.update(self.check_changed_vlans(registered_ports))
+        updated_ports.update(self.check_changed_vlans(
+            registered_ports, self.int_br_ports.get_port_tag_dict()))
         if updated_ports:
             # Some updated ports might have been removed in the
             # meanwhile, and therefore should not be processed.
@@ -838,13 +843,17 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         port_info['removed'] = registered_ports - cur_ports
         return port_info
 
-    def check_changed_vlans(self, registered_ports):
+    def check_changed_vlans(self, registered_ports, port_tags=None):
         """Return ports which have lost their vlan tag.
 
         The returned value is a set of port ids of the ports concerned by a
         vlan tag loss.
+
+        :param port_tags: the tags of the ports of the integration bridge,
+                          read from the bridge if not given.
         """
-        port_tags = self.int_br.get_port_tag_dict()
+        if port_tags is None:
+            port_tags = self.int_br.get_port_tag_dict()
         changed_ports = set()
         for lvm in self.local_vlan_map.values():
             for port in registered_ports:
@@ -947,9 +956,12 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
 
     def treat_devices_added_or_updated(self, devices):
         resync = False
+        # The devices were found by the last scan, whose snapshot of the
+        # bridge gives their ports without querying OVSDB for each of them
+        int_br_ports = self.int_br_ports or self.int_br
+        devices_ports = []
         for device in devices:
-            LOG.debug(_("Processing port %s"), device)
-            port = self.int_br.get_vif_port_by_id(device)
+            port = int_br_ports.get_vif_port_by_id(device)
             if not port:
                 # The port has disappeared and should not be processed
                 # There is no need to put the port DOWN in the plugin as
@@ -957,18 +969,24 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                 LOG.info(_("Port %s was not found on the integration bridge "
                            "and will therefore not be processed"), device)
                 continue
-            try:
-                # TODO(salv-orlando): Provide bulk API for retrieving
-                # details for all devices in one call
-                details = self.plugin_rpc.get_device_details(self.context,
-                                                             device,
-                                                             self.agent_id)
-            except Exception as e:
-                LOG.debug(_("Unable to get port details for "
-                            "%(device)s: %(e)s"),
-                          {'device': device, 'e': e})
-                resync = True
-                continue
+            devices_ports.append((device, port))
+        if not devices_ports:
+            return resync
+        try:
+            devices_details_list = self.plugin_rpc.get_devices_details_list(
+                self.context, [device for device, port in devices_ports],
+                self.agent_id)
+        except Exception as e:
+            LOG.debug(_("Unable to get port details for "
+                        "%(devices)s: %(e)s"),
+                      {'devices': devices, 'e': e})
+            # Resync all the devices with the plugin
+            return True
+        devices_up = []
+        devices_down = []
+        for (device, port), details in zip(devices_ports,
+                                           devices_details_list):
+            LOG.debug(_("Processing port %s"), device)
             if 'port_id' in details:
                 LOG.info(_("Port %(device)s updated. Details: %(details)s"),
                          {'device': device, 'details': details})
@@ -981,17 +999,28 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                 # update plugin about port status
                 if details.get('admin_state_up'):
                     LOG.debug(_("Setting status for %s to UP"), device)
-                    self.plugin_rpc.update_device_up(
-                        self.context, device, self.agent_id, cfg.CONF.host)
+                    devices_up.append(device)
                 else:
                     LOG.debug(_("Setting status for %s to DOWN"), device)
-                    self.plugin_rpc.update_device_down(
-                        self.context, device, self.agent_id, cfg.CONF.host)
+                    devices_down.append(device)
                 LOG.info(_("Configuration for device %s completed."), device)
             else:
                 LOG.warn(_("Device %s not defined on plugin"), device)
                 if (port and port.ofport != -1):
                     self.port_dead(port)
+        if devices_up or devices_down:
+            # The status of all the devices is reported with a single call
+            try:
+                result = self.plugin_rpc.update_device_list(
+                    self.context, devices_up, devices_down, self.agent_id,
+                    cfg.CONF.host)
+            except Exception as e:
+                LOG.debug(_("Unable to update the status of %(devices)s: "
+                            "%(e)s"),
+                          {'devices': devices_up + devices_down, 'e': e})
+                return True
+            if result['failed_devices_up'] or result['failed_devices_down']:
+                resync = True
         return resync
 
     def treat_ancillary_devices_added(self, devices):
@@ -1016,22 +1045,20 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         return resync
 
     def treat_devices_removed(self, devices):
-        resync = False
         self.sg_agent.remove_devices_filter(devices)
         for device in devices:
             LOG.info(_("Attachment %s removed"), device)
-            try:
-                self.plugin_rpc.update_device_down(self.context,
-                                                   device,
-                                                   self.agent_id,
-                                                   cfg.CONF.host)
-            except Exception as e:
-                LOG.debug(_("port_removed failed for %(device)s: %(e)s"),
-                          {'device': device, 'e': e})
-                resync = True
-                continue
-            self.port_unbound(device)
-        return resync
+        try:
+            result = self.plugin_rpc.update_device_list(
+                self.context, [], list(devices), self.agent_id,
+                cfg.CONF.host)
+        except Exception as e:
+            LOG.debug(_("port_removed failed for %(devices)s: %(e)s"),
+                      {'devices': devices, 'e': e})
+            return True
+        for details in result['devices_down']:
+            self.port_unbound(details['device'])
+        return bool(result['failed_devices_down'])
 
     def treat_ancillary_devices_removed(self, devices):
         resync = False
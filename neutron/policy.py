@@ -36,6 +36,12 @@ from neutron.openstack.common import policy
 LOG = logging.getLogger(__name__)
 _POLICY_PATH = None
 _POLICY_CACHE = {}
+# The compiled match rules, by match rule key, and the decisions of the
+# rules which only depend on the roles, by role set and match rule key.
+# They are valid for the rules (and the number of rules) in _COMPILED_FOR.
+_COMPILED_FOR = None
+_COMPILED_RULES = {}
+_ROLE_DECISIONS = {}
 ADMIN_CTX_POLICY = 'context_is_admin'
 # Maps deprecated 'extension' policies to new-style policies
 DEPRECATED_POLICY_MAP = {
@@ -314,14 +320,147 @@ class FieldCheck(policy.Check):
         return target_value == self.value
 
 
-def _prepare_check(context, action, target):
-    """Prepare rule, target, and credentials for the policy engine."""
-    # Compare with None to distinguish case in which target is {}
-    if target is None:
-        target = {}
-    match_rule = _build_match_rule(action, target)
-    credentials = context.to_dict()
-    return match_rule, target, credentials
+def _compile_rule(rule):
+    """Compile a tree of checks into a predicate.
+
+    The rules referenced by RuleChecks are resolved once, instead of at
+    every evaluation. Returns the predicate, and whether its result only
+    depends on the roles and admin flag of the credentials.
+    """
+    if isinstance(rule, policy.TrueCheck):
+        return (lambda target, creds: True), True
+    if isinstance(rule, policy.FalseCheck):
+        return (lambda target, creds: False), True
+    if isinstance(rule, policy.RuleCheck):
+        try:
+            return _compile_rule(policy._rules[rule.match])
+        except KeyError:
+            # We don't have any matching rule; fail closed
+            return (lambda target, creds: False), True
+    if isinstance(rule, policy.NotCheck):
+        predicate, role_only = _compile_rule(rule.rule)
+        return (lambda target, creds: not predicate(target, creds)), role_only
+    if isinstance(rule, (policy.AndCheck, policy.OrCheck)):
+        compiled = [_compile_rule(r) for r in rule.rules]
+        predicates = [c[0] for c in compiled]
+        role_only = all(c[1] for c in compiled)
+        if isinstance(rule, policy.AndCheck):
+            def predicate(target, creds):
+                for p in predicates:
+                    if not p(target, creds):
+                        return False
+                return True
+        else:
+            def predicate(target, creds):
+                for p in predicates:
+                    if p(target, creds):
+                        return True
+                return False
+        return predicate, role_only
+    if isinstance(rule, policy.RoleCheck):
+        return rule, True
+    if (type(rule) is policy.GenericCheck and rule.kind == 'is_admin' and
+            '%' not in rule.match):
+        return rule, True
+    return rule, False
+
+
+def _match_rule_key(action, target):
+    """Return what the match rule of action depends on in target.
+
+    None is returned when the match rule should not be cached.
+    """
+    resource, is_write = get_resource_and_action(action)
+    res_map = attributes.RESOURCE_ATTRIBUTE_MAP
+    if not is_write or resource not in res_map:
+        return action, ()
+    attrs = []
+    for attribute_name, attribute in res_map[resource].iteritems():
+        if ('enforce_policy' in attribute and
+            _is_attribute_explicitly_set(attribute_name, res_map[resource],
+                                         target)):
+            value = target[attribute_name]
+            validate = attribute.get('validate')
+            if (validate and any([k.startswith('type:dict') and v
+                                  for (k, v) in validate.iteritems()])):
+                # The sub-attributes present are checked as well
+                if not isinstance(value, dict):
+                    return
+                attrs.append((attribute_name, tuple(sorted(value))))
+            else:
+                attrs.append((attribute_name, ()))
+    return action, tuple(sorted(attrs))
+
+
+def _get_match_rule(action, target):
+    """Return the key, compiled predicate and role_only flag of a check."""
+    global _COMPILED_FOR
+    rules = policy._rules
+    if (_COMPILED_FOR is None or _COMPILED_FOR[0] is not rules or
+            _COMPILED_FOR[1] != len(rules or ())):
+        # The rules were changed since they were compiled
+        _COMPILED_RULES.clear()
+        _ROLE_DECISIONS.clear()
+        _COMPILED_FOR = (rules, len(rules or ()))
+    key = _match_rule_key(action, target)
+    if key is None:
+        predicate, role_only = _compile_rule(
+            _build_match_rule(action, target))
+        return None, predicate, False
+    compiled = _COMPILED_RULES.get(key)
+    if compiled is None:
+        compiled = _COMPILED_RULES[key] = _compile_rule(
+            _build_match_rule(action, target))
+    return (key,) + compiled
+
+
+class PolicyChecker(object):
+    """Checks actions in a context, e.g. for all the objects of a list.
+
+    The credentials of the context are prepared once. The decisions of
+    the rules which only depend on the roles (e.g. admin_only attributes)
+    are shared by all the contexts with the same roles.
+    """
+
+    def __init__(self, context):
+        self.credentials = context.to_dict()
+        roles = self.credentials.get('roles') or []
+        self._roles_key = (frozenset(role.lower() for role in roles),
+                           self.credentials.get('is_admin'))
+
+    def check(self, action, target):
+        """Verifies that the action is valid on the target.
+
+        :return: Returns True if access is permitted else False.
+        """
+        # Compare with None to distinguish case in which target is {}
+        if target is None:
+            target = {}
+        key, predicate, role_only = _get_match_rule(action, target)
+        if not role_only:
+            return predicate(target, self.credentials)
+        decision_key = (self._roles_key, key)
+        try:
+            return _ROLE_DECISIONS[decision_key]
+        except KeyError:
+            result = _ROLE_DECISIONS[decision_key] = predicate(
+                target, self.credentials)
+            return result
+
+    def check_if_exists(self, action, target):
+        """Verify if the action can be authorized.
+
+        :raises neutron.exceptions.PolicyRuleNotFound: if the action is not
+            defined in the policy engine.
+        """
+        # TODO(salvatore-orlando): Consider modifying oslo policy engine in
+        # order to allow to raise distinct exception when check fails and
+        # when policy is missing
+        # Raise if there's no match for requested action in the policy
+        # engine
+        if not policy._rules or action not in policy._rules:
+            raise exceptions.PolicyRuleNotFound(rule=action)
+        return self.check(action, target)
 
 
 def check(context, action, target, plugin=None):
@@ -338,7 +477,7 @@ def check(context, action, target, plugin=None):
 
     :return: Returns True if access is permitted else False.
     """
-    return policy.check(*(_prepare_check(context, action, target)))
+    return PolicyChecker(context).check(action, target)
 
 
 def check_if_exists(context, action, target):
@@ -348,13 +487,7 @@ def check_if_exists(context, action, target):
     context, and raise a PolicyRuleNotFound exception if the action is
     not defined in the policy engine.
     """
-    # TODO(salvatore-orlando): Consider modifying oslo policy engine in
-    # order to allow to raise distinct exception when check fails and
-    # when policy is missing
-    # Raise if there's no match for requested action in the policy engine
-    if not policy._rules or action not in policy._rules:
-        raise exceptions.PolicyRuleNotFound(rule=action)
-    return policy.check(*(_prepare_check(context, action, target)))
+    return PolicyChecker(context).check_if_exists(action, target)
 
 
 def enforce(context, action, target, plugin=None):
@@ -372,8 +505,7 @@ def enforce(context, action, target, plugin=None):
     :raises neutron.exceptions.PolicyNotAuthorized: if verification fails.
     """
 
-    rule, target, credentials = _prepare_check(context, action, target)
-    result = policy.check(rule, target, credentials, action=action)
+    result = PolicyChecker(context).check(action, target)
     if not result:
         LOG.debug(_("Failed policy check for '%s'"), action)
         raise exceptions.PolicyNotAuthorized(action=action)
@@ -28,6 +28,7 @@ from neutron.openstack.common import log as logging
 LOG = logging.getLogger(__name__)
 QUOTA_DB_MODULE = 'neutron.db.quota_db'
 QUOTA_DB_DRIVER = 'neutron.db.quota_db.DbQuotaDriver'
+QUOTA_TRACKED_DRIVER = 'neutron.db.quota_db.TrackedDbQuotaDriver'
 QUOTA_CONF_DRIVER = 'neutron.quota.ConfDriver'
 
 quota_opts = [
@@ -54,6 +55,11 @@ quota_opts = [
     cfg.StrOpt('quota_driver',
                default=QUOTA_DB_DRIVER,
                help=_('Default driver to use for quota checks')),
+    cfg.IntOpt('reservation_expiration',
+               default=600,
+               help=_('Seconds after which the quota reserved for a request '
+                      'is released if the request did not complete. Only '
+                      'used by the TrackedDbQuotaDriver.')),
 ]
 # Register the configuration options
 cfg.CONF.register_opts(quota_opts, 'QUOTAS')
@@ -221,7 +227,7 @@ class QuotaEngine(object):
         if self._driver is None:
             _driver_class = (self._driver_class or
                              cfg.CONF.QUOTAS.quota_driver)
-            if (_driver_class == QUOTA_DB_DRIVER and
+            if (_driver_class in (QUOTA_DB_DRIVER, QUOTA_TRACKED_DRIVER) and
                     QUOTA_DB_MODULE not in sys.modules):
                 # If quotas table is not loaded, force config quota driver.
                 _driver_class = QUOTA_CONF_DRIVER
@@ -299,6 +305,48 @@ class QuotaEngine(object):
         return self.get_driver().limit_check(context, tenant_id,
                                              self._resources, values)
 
+    def make_reservation(self, context, tenant_id, deltas, *args, **kwargs):
+        """Check and reserve the quota of new objects.
+
+        deltas is a dictionary of the numbers of objects of each resource
+        which are going to be created. Arguments following the deltas are
+        passed to the count functions of the resources, like those of
+        count().
+
+        Drivers which keep track of the usages reserve the quota, so that
+        concurrent requests cannot both be allowed the last objects, and
+        return the id of the reservation. It must be committed once the
+        objects are created, or cancelled if they are not. Other drivers
+        only check the counted usages with limit_check and return None.
+
+        :param context: The request context, for access checks.
+        :param tenant_id: The tenant_id to check the quota.
+        """
+        unknown = [name for name in deltas if name not in self._resources]
+        if unknown:
+            raise exceptions.QuotaResourceUnknown(unknown=sorted(unknown))
+
+        def count(resource):
+            return self.count(context, resource, *args, **kwargs)
+
+        driver = self.get_driver()
+        if hasattr(driver, 'make_reservation'):
+            return driver.make_reservation(context, tenant_id,
+                                           self._resources, deltas, count)
+        values = dict((name, count(name) + delta)
+                      for name, delta in deltas.iteritems())
+        driver.limit_check(context, tenant_id, self._resources, values)
+
+    def commit_reservation(self, context, reservation_id):
+        """Release a reservation once its objects are created."""
+        if reservation_id is not None:
+            self.get_driver().commit_reservation(context, reservation_id)
+
+    def cancel_reservation(self, context, reservation_id):
+        """Release a reservation whose objects were not created."""
+        if reservation_id is not None:
+            self.get_driver().cancel_reservation(context, reservation_id)
+
     @property
     def resources(self):
         return self._resources
@@ -317,7 +317,7 @@ class vArmourL3NATAgent(l3_agent.L3NATAgent,
         self.driver.init_l3(interface_name, [ex_gw_port['ip_cidr']],
                             namespace=ri.ns_name)
 
-    def _update_routing_table(self, ri, operation, route):
+    def _update_routing_table(self, ri, operation, route, batch=None):
         return
 
 
@@ -132,13 +132,19 @@ class VPNAgent(l3_agent.L3NATAgentWithStateReport):
         for device in self.devices:
             device.destroy_router(router_id)
 
-    def _process_routers(self, routers, all_routers=False):
+    def _process_routers(self, routers, all_routers=False, timestamp=None):
         """Router sync event.
 
-        This method overwrites parent class method.
+        This method overwrites parent class method. The parent class only
+        queues the routers, so the devices are synced once the queue has
+        processed them, and their namespaces and iptables managers are
+        ready. The routers are processed under the lock of the agent, so
+        no other router is processed during the sync.
         :param routers: list of routers
         """
-        super(VPNAgent, self)._process_routers(routers, all_routers)
+        super(VPNAgent, self)._process_routers(routers, all_routers,
+                                               timestamp)
+        self.router_queue.wait()
         for device in self.devices:
             device.sync(self.context, routers)
 
@@ -36,9 +36,19 @@ class VPNPlugin(vpn_db.VPNPluginDb):
     """
     supported_extension_aliases = ["vpnaas", "service-type"]
 
+    # This attribute specifies whether the plugin supports or not
+    # pagination and sorting operations. Name mangling is used in
+    # order to ensure it is qualified by class
+    __native_pagination_support = True
+    __native_sorting_support = True
+
 
 class VPNDriverPlugin(VPNPlugin, vpn_db.VPNPluginRpcDbMixin):
     """VpnPlugin which supports VPN Service Drivers."""
+
+    __native_pagination_support = True
+    __native_sorting_support = True
+
     #TODO(nati) handle ikepolicy and ipsecpolicy update usecase
     def __init__(self):
         super(VPNDriverPlugin, self).__init__()
@@ -0,0 +1,172 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import errno
+import socket
+import struct
+
+import mock
+
+from neutron.agent.linux import ip_netlink
+from neutron.tests import base
+
+
+def _attr(attr_type, data):
+    return ip_netlink._pack_attr(attr_type, data)
+
+
+def _message(msg_type, data):
+    length = ip_netlink._NLMSGHDR.size + len(data)
+    return (ip_netlink._NLMSGHDR.pack(length, msg_type, 2, 1, 0) + data +
+            '\0' * (ip_netlink._align(length) - length))
+
+
+def _done():
+    return _message(ip_netlink.NLMSG_DONE, struct.pack('=i', 0))
+
+
+def _error(error):
+    return _message(ip_netlink.NLMSG_ERROR, struct.pack('=i', -error))
+
+
+def _link(index, name, link_type=ip_netlink.ARPHRD_ETHER):
+    return _message(
+        ip_netlink.RTM_NEWLINK,
+        ip_netlink._IFINFOMSG.pack(0, link_type, index, 0, 0) +
+        _attr(ip_netlink.IFLA_IFNAME, name + '\0') +
+        _attr(ip_netlink.IFLA_ADDRESS, '\xfa\x16\x3e\x00\x00\x01') +
+        _attr(ip_netlink.IFLA_MTU, struct.pack('=I', 1500)) +
+        _attr(ip_netlink.IFLA_QDISC, 'noqueue\0') +
+        _attr(ip_netlink.IFLA_OPERSTATE, chr(6)))
+
+
+def _address(index, family, address, prefixlen, scope=0,
+             flags=ip_netlink.IFA_F_PERMANENT, broadcast=None):
+    data = (ip_netlink._IFADDRMSG.pack(family, prefixlen, flags, scope,
+                                       index) +
+            _attr(ip_netlink.IFA_ADDRESS, socket.inet_pton(family, address)))
+    if broadcast:
+        data += _attr(ip_netlink.IFA_BROADCAST,
+                      socket.inet_pton(family, broadcast))
+    return _message(ip_netlink.RTM_NEWADDR, data)
+
+
+def _route(oif, gateway=None, dst=None, dst_len=0, metric=None,
+           table=ip_netlink.RT_TABLE_MAIN):
+    data = (ip_netlink._RTMSG.pack(socket.AF_INET, dst_len, 0, 0, table, 0,
+                                   0, 1, 0) +
+            _attr(ip_netlink.RTA_OIF, struct.pack('=I', oif)))
+    if gateway:
+        data += _attr(ip_netlink.RTA_GATEWAY, socket.inet_aton(gateway))
+    if dst:
+        data += _attr(ip_netlink.RTA_DST, socket.inet_aton(dst))
+    if metric is not None:
+        data += _attr(ip_netlink.RTA_PRIORITY, struct.pack('=I', metric))
+    return _message(ip_netlink.RTM_NEWROUTE, data)
+
+
+class TestIpNetlink(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestIpNetlink, self).setUp()
+        self.sock = mock.Mock()
+        self.socket = mock.patch.object(socket, 'socket',
+                                        return_value=self.sock).start()
+
+    def test_get_links(self):
+        # A dump may be split over several reads
+        self.sock.recv.side_effect = [_link(1, 'lo', 772) + _link(2, 'tap1'),
+                                      _done()]
+        links = ip_netlink.get_links()
+        self.assertEqual(['lo', 'tap1'], [l['name'] for l in links])
+        self.assertEqual({'index': 2, 'name': 'tap1',
+                          'type': ip_netlink.ARPHRD_ETHER, 'flags': 0,
+                          'address': 'fa:16:3e:00:00:01', 'mtu': 1500,
+                          'qdisc': 'noqueue', 'state': 'UP'}, links[1])
+        self.socket.assert_called_once_with(socket.AF_NETLINK,
+                                            socket.SOCK_RAW,
+                                            ip_netlink.NETLINK_ROUTE)
+        sent = self.sock.send.call_args[0][0]
+        msg_type, flags = ip_netlink._NLMSGHDR.unpack_from(sent)[1:3]
+        self.assertEqual(ip_netlink.RTM_GETLINK, msg_type)
+        self.assertEqual(ip_netlink.NLM_F_REQUEST | ip_netlink.NLM_F_DUMP,
+                         flags)
+        self.sock.close.assert_called_once_with()
+
+    def test_get_link(self):
+        self.sock.recv.return_value = _link(2, 'tap1')
+        self.assertEqual('tap1', ip_netlink.get_link('tap1')['name'])
+        sent = self.sock.send.call_args[0][0]
+        self.assertIn('tap1\0', sent)
+
+    def test_get_link_missing(self):
+        self.sock.recv.return_value = _error(errno.ENODEV)
+        self.assertIsNone(ip_netlink.get_link('tap1'))
+
+    def test_request_error(self):
+        self.sock.recv.return_value = _error(errno.EPERM)
+        e = self.assertRaises(ip_netlink.NetlinkError, ip_netlink.get_links)
+        self.assertEqual(errno.EPERM, e.errno)
+        self.assertIsInstance(e, RuntimeError)
+
+    def test_get_addresses(self):
+        self.sock.recv.return_value = (
+            _address(2, socket.AF_INET, '10.0.0.1', 24,
+                     broadcast='10.0.0.255') +
+            _address(3, socket.AF_INET, '10.0.1.1', 24) +
+            _address(2, socket.AF_INET6, 'fe80::1', 64, scope=253,
+                     flags=0) +
+            _done())
+        self.assertEqual(
+            [{'index': 2, 'ip_version': 4, 'cidr': '10.0.0.1/24',
+              'broadcast': '10.0.0.255', 'scope': 'global',
+              'dynamic': False},
+             {'index': 2, 'ip_version': 6, 'cidr': 'fe80::1/64',
+              'broadcast': None, 'scope': 'link', 'dynamic': True}],
+            ip_netlink.get_addresses(2))
+
+    def test_get_routes(self):
+        self.sock.recv.return_value = (
+            _route(2, gateway='10.0.0.1', metric=10) +
+            _route(2, dst='10.0.0.0', dst_len=24) +
+            _done())
+        self.assertEqual(
+            [{'dst': 'default', 'gateway': '10.0.0.1', 'oif': 2,
+              'metric': 10, 'table': ip_netlink.RT_TABLE_MAIN,
+              'scope': 'global'},
+             {'dst': '10.0.0.0/24', 'gateway': None, 'oif': 2,
+              'metric': None, 'table': ip_netlink.RT_TABLE_MAIN,
+              'scope': 'global'}],
+            ip_netlink.get_routes())
+
+    def test_query_namespace(self):
+        self.sock.recv.return_value = _done()
+        with mock.patch.object(ip_netlink, 'in_namespace') as in_namespace:
+            ip_netlink.get_links('qrouter-1')
+        in_namespace.assert_called_once_with('qrouter-1')
+
+    def test_query_missing_namespace(self):
+        with mock.patch('os.open', side_effect=OSError(errno.ENOENT,
+                                                       'No such file')):
+            self.assertRaises(ip_netlink.NetlinkError,
+                              ip_netlink.get_links, 'qrouter-1')
+        self.assertFalse(self.socket.called)
+
+    def test_can_query(self):
+        with mock.patch('os.geteuid', return_value=1000):
+            self.assertTrue(ip_netlink.can_query())
+            self.assertFalse(ip_netlink.can_query('qrouter-1'))
+        with mock.patch('os.geteuid', return_value=0):
+            self.assertTrue(ip_netlink.can_query('qrouter-1'))
@@ -21,6 +21,7 @@ from oslo.config import cfg
 import testtools
 
 from neutron.agent.linux import ovs_lib
+from neutron.agent.linux import ovsdb_client
 from neutron.agent.linux import utils
 from neutron.common import exceptions
 from neutron.openstack.common import jsonutils
@@ -454,32 +455,79 @@ class OVS_Lib_Test(base.BaseTestCase):
         self.assertEqual(self.br.add_patch_port(pname, peer), ofport)
         tools.verify_mock_calls(self.execute, expected_calls_and_values)
 
+    def _encode_ovs_json(self, headings, data):
+        # See man ovs-vsctl(8) for the encoding details.
+        r = {"data": [],
+             "headings": headings}
+        for row in data:
+            ovs_row = []
+            r["data"].append(ovs_row)
+            for cell in row:
+                if isinstance(cell, (str, int, list)):
+                    ovs_row.append(cell)
+                elif isinstance(cell, dict):
+                    ovs_row.append(["map", cell.items()])
+                elif isinstance(cell, set):
+                    ovs_row.append(["set", cell])
+                else:
+                    raise TypeError('%r not int, str, list, set or dict' %
+                                    type(cell))
+        return jsonutils.dumps(r)
+
+    def _bridge_rows_call(self, port_columns, iface_columns, ports,
+                          other_ports=()):
+        """Return the expected call reading the ports of the bridge.
+
+        :param ports: list of (name, tag, external_ids, ofport) of the ports
+                      of the bridge, other_ports those of another bridge.
+        """
+        port_headings = ['_uuid', 'name', 'interfaces'] + port_columns
+        iface_headings = ['_uuid', 'name'] + iface_columns
+        port_data = []
+        iface_data = []
+        for i, (name, tag, external_ids, ofport) in enumerate(
+                list(ports) + list(other_ports)):
+            port_row = [['uuid', 'p%d' % i], name, ['uuid', 'i%d' % i]]
+            if port_columns:
+                port_row.append(tag)
+            port_data.append(port_row)
+            iface_data.append([['uuid', 'i%d' % i], name, external_ids,
+                               ofport])
+        # The local port of the bridge is left out
+        port_data.append([['uuid', 'local'], self.BR_NAME,
+                          ['uuid', 'local'], ['set', []]][:len(port_headings)])
+        iface_data.append([['uuid', 'local'], self.BR_NAME, {}, 65534])
+        bridge_ports = [['uuid', 'p%d' % i] for i in range(len(ports))]
+        bridge_ports.append(['uuid', 'local'])
+        output = '\n'.join([
+            self._encode_ovs_json(['ports'], [[['set', bridge_ports]]]),
+            self._encode_ovs_json(port_headings, port_data),
+            self._encode_ovs_json(iface_headings, iface_data)]) + '\n'
+        return (mock.call(["ovs-vsctl", self.TO, "--format=json",
+                           "--", "--columns=ports",
+                           "list", "Bridge", self.BR_NAME,
+                           "--", "--columns=%s" % ','.join(port_headings),
+                           "list", "Port",
+                           "--", "--columns=%s" % ','.join(iface_headings),
+                           "list", "Interface"],
+                          root_helper=self.root_helper),
+                output)
+
     def _test_get_vif_ports(self, is_xen=False):
         pname = "tap99"
-        ofport = "6"
         vif_id = uuidutils.generate_uuid()
         mac = "ca:fe:de:ad:be:ef"
 
         if is_xen:
-            external_ids = ('{xs-vif-uuid="%s", attached-mac="%s"}'
-                            % (vif_id, mac))
+            external_ids = {'xs-vif-uuid': vif_id, 'attached-mac': mac}
         else:
-            external_ids = ('{iface-id="%s", attached-mac="%s"}'
-                            % (vif_id, mac))
+            external_ids = {'iface-id': vif_id, 'attached-mac': mac}
 
         # Each element is a tuple of (expected mock call, return_value)
         expected_calls_and_values = [
-            (mock.call(["ovs-vsctl", self.TO, "list-ports", self.BR_NAME],
-                       root_helper=self.root_helper),
-             "%s\n" % pname),
-            (mock.call(["ovs-vsctl", self.TO, "get",
-                        "Interface", pname, "external_ids"],
-                       root_helper=self.root_helper),
-             external_ids),
-            (mock.call(["ovs-vsctl", self.TO, "get",
-                        "Interface", pname, "ofport"],
-                       root_helper=self.root_helper),
-             ofport),
+            self._bridge_rows_call([], ['external_ids', 'ofport'],
+                                   [(pname, None, external_ids, 6),
+                                    ('tun22', None, {}, 7)]),
         ]
         if is_xen:
             expected_calls_and_values.append(
@@ -493,63 +541,40 @@ class OVS_Lib_Test(base.BaseTestCase):
         ports = self.br.get_vif_ports()
         self.assertEqual(1, len(ports))
         self.assertEqual(ports[0].port_name, pname)
-        self.assertEqual(ports[0].ofport, ofport)
+        self.assertEqual(ports[0].ofport, "6")
         self.assertEqual(ports[0].vif_id, vif_id)
         self.assertEqual(ports[0].vif_mac, mac)
         self.assertEqual(ports[0].switch.br_name, self.BR_NAME)
         tools.verify_mock_calls(self.execute, expected_calls_and_values)
 
-    def _encode_ovs_json(self, headings, data):
-        # See man ovs-vsctl(8) for the encoding details.
-        r = {"data": [],
-             "headings": headings}
-        for row in data:
-            ovs_row = []
-            r["data"].append(ovs_row)
-            for cell in row:
-                if isinstance(cell, (str, int, list)):
-                    ovs_row.append(cell)
-                elif isinstance(cell, dict):
-                    ovs_row.append(["map", cell.items()])
-                elif isinstance(cell, set):
-                    ovs_row.append(["set", cell])
-                else:
-                    raise TypeError('%r not int, str, list, set or dict' %
-                                    type(cell))
-        return jsonutils.dumps(r)
-
     def _test_get_vif_port_set(self, is_xen):
         if is_xen:
             id_key = 'xs-vif-uuid'
         else:
             id_key = 'iface-id'
 
-        headings = ['name', 'external_ids']
-        data = [
+        ports = [
             # A vif port on this bridge:
-            ['tap99', {id_key: 'tap99id', 'attached-mac': 'tap99mac'}, 1],
+            ('tap99', 1, {id_key: 'tap99id', 'attached-mac': 'tap99mac'}, 1),
             # A vif port on this bridge not yet configured
-            ['tap98', {id_key: 'tap98id', 'attached-mac': 'tap98mac'}, []],
+            ('tap98', 1, {id_key: 'tap98id', 'attached-mac': 'tap98mac'}, []),
             # Another vif port on this bridge not yet configured
-            ['tap97', {id_key: 'tap97id', 'attached-mac': 'tap97mac'},
-             ['set', []]],
-
-            # A vif port on another bridge:
-            ['tap88', {id_key: 'tap88id', 'attached-mac': 'tap88id'}, 1],
+            ('tap97', 1, {id_key: 'tap97id', 'attached-mac': 'tap97mac'},
+             ['set', []]),
+            # A vif port on this bridge which failed
+            ('tap96', 1, {id_key: 'tap96id', 'attached-mac': 'tap96mac'}, -1),
             # Non-vif port on this bridge:
-            ['tun22', {}, 2],
+            ('tun22', set(), {}, 2),
+        ]
+        other_ports = [
+            # A vif port on another bridge:
+            ('tap88', 1, {id_key: 'tap88id', 'attached-mac': 'tap88id'}, 1),
         ]
 
         # Each element is a tuple of (expected mock call, return_value)
         expected_calls_and_values = [
-            (mock.call(["ovs-vsctl", self.TO, "list-ports", self.BR_NAME],
-                       root_helper=self.root_helper),
-             'tap99\ntun22'),
-            (mock.call(["ovs-vsctl", self.TO, "--format=json",
-                        "--", "--columns=name,external_ids,ofport",
-                        "list", "Interface"],
-                       root_helper=self.root_helper),
-             self._encode_ovs_json(headings, data)),
+            self._bridge_rows_call(['tag'], ['external_ids', 'ofport'],
+                                   ports, other_ports),
         ]
         tools.setup_mock_calls(self.execute, expected_calls_and_values)
 
@@ -576,61 +601,39 @@ class OVS_Lib_Test(base.BaseTestCase):
     def test_get_vif_port_set_xen(self):
         self._test_get_vif_port_set(True)
 
+    def _test_list_ports_error(self, func, *args, **kwargs):
+        self.execute.side_effect = RuntimeError()
+        self.assertRaises(RuntimeError, func, *args, **kwargs)
+        self.assertEqual(1, self.execute.call_count)
+
     def test_get_vif_ports_list_ports_error(self):
-        expected_calls_and_values = [
-            (mock.call(["ovs-vsctl", self.TO, "list-ports", self.BR_NAME],
-                       root_helper=self.root_helper),
-             RuntimeError()),
-        ]
-        tools.setup_mock_calls(self.execute, expected_calls_and_values)
-        self.assertRaises(RuntimeError, self.br.get_vif_ports)
-        tools.verify_mock_calls(self.execute, expected_calls_and_values)
+        self._test_list_ports_error(self.br.get_vif_ports)
 
     def test_get_vif_port_set_list_ports_error(self):
-        expected_calls_and_values = [
-            (mock.call(["ovs-vsctl", self.TO, "list-ports", self.BR_NAME],
-                       root_helper=self.root_helper),
-             RuntimeError()),
-        ]
-        tools.setup_mock_calls(self.execute, expected_calls_and_values)
-        self.assertRaises(RuntimeError, self.br.get_vif_port_set)
-        tools.verify_mock_calls(self.execute, expected_calls_and_values)
-
-    def test_get_vif_port_set_list_interface_error(self):
-        expected_calls_and_values = [
-            (mock.call(["ovs-vsctl", self.TO, "list-ports", self.BR_NAME],
-                       root_helper=self.root_helper),
-             'tap99\n'),
-            (mock.call(["ovs-vsctl", self.TO, "--format=json",
-                        "--", "--columns=name,external_ids,ofport",
-                        "list", "Interface"],
-                       root_helper=self.root_helper),
-             RuntimeError()),
-        ]
-        tools.setup_mock_calls(self.execute, expected_calls_and_values)
+        self._test_list_ports_error(self.br.get_vif_port_set)
+
+    def test_get_vif_port_set_bridge_not_found(self):
+        self.execute.return_value = '\n'.join(
+            [self._encode_ovs_json(['ports'], []),
+             self._encode_ovs_json(['_uuid', 'name', 'interfaces', 'tag'],
+                                   []),
+             self._encode_ovs_json(['_uuid', 'name', 'external_ids',
+                                    'ofport'], [])])
         self.assertRaises(RuntimeError, self.br.get_vif_port_set)
-        tools.verify_mock_calls(self.execute, expected_calls_and_values)
 
     def test_get_port_tag_dict(self):
-        headings = ['name', 'tag']
-        data = [
-            ['int-br-eth2', set()],
-            ['patch-tun', set()],
-            ['qr-76d9e6b6-21', 1],
-            ['tapce5318ff-78', 1],
-            ['tape1400310-e6', 1],
+        ports = [
+            ('int-br-eth2', set(), {}, 1),
+            ('patch-tun', set(), {}, 2),
+            ('qr-76d9e6b6-21', 1, {}, 3),
+            ('tapce5318ff-78', 1, {}, 4),
+            ('tape1400310-e6', 1, {}, 5),
         ]
 
         # Each element is a tuple of (expected mock call, return_value)
         expected_calls_and_values = [
-            (mock.call(["ovs-vsctl", self.TO, "list-ports", self.BR_NAME],
-                       root_helper=self.root_helper),
-             '\n'.join((iface for iface, tag in data))),
-            (mock.call(["ovs-vsctl", self.TO, "--format=json",
-                        "--", "--columns=name,tag",
-                        "list", "Port"],
-                       root_helper=self.root_helper),
-             self._encode_ovs_json(headings, data)),
+            self._bridge_rows_call(['tag'], ['external_ids', 'ofport'],
+                                   ports),
         ]
         tools.setup_mock_calls(self.execute, expected_calls_and_values)
 
@@ -644,6 +647,29 @@ class OVS_Lib_Test(base.BaseTestCase):
              u'tape1400310-e6': 1}
         )
 
+    def test_get_port_snapshot(self):
+        ports = [('tap%d' % i, i % 4095 + 1,
+                  {'iface-id': 'tap%did' % i, 'attached-mac': 'mac%d' % i},
+                  i + 1)
+                 for i in range(300)]
+        expected_calls_and_values = [
+            self._bridge_rows_call(['tag'], ['external_ids', 'ofport'],
+                                   ports),
+        ]
+        tools.setup_mock_calls(self.execute, expected_calls_and_values)
+
+        snapshot = self.br.get_port_snapshot()
+        # A single ovs-vsctl command whatever the number of ports
+        tools.verify_mock_calls(self.execute, expected_calls_and_values)
+        self.assertEqual(set('tap%did' % i for i in range(300)),
+                         snapshot.get_vif_port_set())
+        self.assertEqual(300, len(snapshot.get_port_tag_dict()))
+        port = snapshot.get_vif_port_by_id('tap42id')
+        self.assertEqual('tap42', port.port_name)
+        self.assertEqual(43, port.ofport)
+        self.assertEqual('mac42', port.vif_mac)
+        self.assertIsNone(snapshot.get_vif_port_by_id('unknown'))
+
     def test_clear_db_attribute(self):
         pname = "tap77"
         self.br.clear_db_attribute("Port", pname, "tag")
@@ -704,14 +730,7 @@ class OVS_Lib_Test(base.BaseTestCase):
         ])
 
     def test_delete_neutron_ports_list_error(self):
-        expected_calls_and_values = [
-            (mock.call(["ovs-vsctl", self.TO, "list-ports", self.BR_NAME],
-                       root_helper=self.root_helper),
-             RuntimeError()),
-        ]
-        tools.setup_mock_calls(self.execute, expected_calls_and_values)
-        self.assertRaises(RuntimeError, self.br.delete_ports, all_ports=False)
-        tools.verify_mock_calls(self.execute, expected_calls_and_values)
+        self._test_list_ports_error(self.br.delete_ports, all_ports=False)
 
     def _test_get_bridges(self, exp_timeout=None):
         bridges = ['br-int', 'br-ex']
@@ -868,3 +887,160 @@ class OVS_Lib_Test(base.BaseTestCase):
         min_kernel_ver = constants.MINIMUM_LINUX_KERNEL_OVS_VXLAN
         self._check_ovs_vxlan_version(min_vxlan_ver, min_vxlan_ver,
                                       min_kernel_ver, expecting_ok=True)
+
+
+class FakeOvsdb(object):
+    """In-memory OVSDB answering select and update operations."""
+
+    SCHEMA = {'tables': {
+        'Port': {'columns': {'tag': {'type': {'key': {'type': 'integer'},
+                                              'min': 0, 'max': 1}}}},
+        'Interface': {'columns': {'external_ids': {'type': {
+            'key': 'string', 'value': 'string', 'min': 0,
+            'max': 'unlimited'}}}}}}
+
+    def __init__(self):
+        self.tables = {
+            'Bridge': [
+                {'_uuid': ['uuid', 'b1'], 'name': 'br-int',
+                 'datapath_id': '0000ca1f2e5ba2c8',
+                 'ports': ['set', [['uuid', 'p0'], ['uuid', 'p1'],
+                                   ['uuid', 'p2']]]},
+                {'_uuid': ['uuid', 'b2'], 'name': 'br-ex',
+                 'ports': ['uuid', 'p3']}],
+            'Port': [
+                self._port('p0', 'br-int', 'i0', ['set', []]),
+                self._port('p1', 'tap99', 'i1', 1),
+                self._port('p2', 'tun22', 'i2', ['set', []]),
+                self._port('p3', 'tap88', 'i3', ['set', []])],
+            'Interface': [
+                self._iface('i0', 'br-int', {}, 65534),
+                self._iface('i1', 'tap99', {'iface-id': 'tap99id',
+                                            'attached-mac': 'tap99mac'}, 1),
+                self._iface('i2', 'tun22', {}, 2),
+                self._iface('i3', 'tap88', {'iface-id': 'tap88id',
+                                            'attached-mac': 'tap88mac'}, 1)]}
+        self.transactions = []
+
+    def _port(self, uuid, name, iface_uuid, tag):
+        return {'_uuid': ['uuid', uuid], 'name': name,
+                'interfaces': ['uuid', iface_uuid], 'tag': tag}
+
+    def _iface(self, uuid, name, external_ids, ofport):
+        return {'_uuid': ['uuid', uuid], 'name': name, 'ofport': ofport,
+                'external_ids': ['map', sorted(external_ids.items())]}
+
+    def _match(self, row, where):
+        return all(row[column] == value for column, _op, value in where)
+
+    def call(self, method, params):
+        if method == 'echo':
+            return params
+        self.transactions.append(params[1:])
+        results = []
+        for op in params[1:]:
+            rows = [row for row in self.tables[op['table']]
+                    if self._match(row, op['where'])]
+            if op['op'] == 'select':
+                results.append({'rows': [
+                    dict((c, row[c]) for c in op['columns']) for row in rows]})
+            else:
+                for row in rows:
+                    row.update(op['row'])
+                results.append({'count': len(rows)})
+        return results
+
+
+class OVS_Lib_Native_Test(base.BaseTestCase):
+
+    def setUp(self):
+        super(OVS_Lib_Native_Test, self).setUp()
+        cfg.CONF.set_override('ovsdb_interface', 'native')
+        self.addCleanup(cfg.CONF.reset)
+        self.fake_db = FakeOvsdb()
+        conn = ovsdb_client.Connection('tcp:127.0.0.1:6640', 10)
+        conn.schema = self.fake_db.SCHEMA
+        conn.call = self.fake_db.call
+        mock.patch.object(ovsdb_client, 'get_connection',
+                          return_value=conn).start()
+        self.execute = mock.patch.object(
+            utils, "execute", spec=utils.execute).start()
+        self.br = ovs_lib.OVSBridge('br-int', 'sudo')
+
+    def tearDown(self):
+        # Nothing forks an ovs-vsctl command with the native interface
+        self.assertFalse(self.execute.called)
+        super(OVS_Lib_Native_Test, self).tearDown()
+
+    def test_get_port_name_list(self):
+        self.assertEqual(['tap99', 'tun22'], self.br.get_port_name_list())
+        self.assertEqual(1, len(self.fake_db.transactions))
+
+    def test_get_vif_port_set(self):
+        self.assertEqual(set(['tap99id']), self.br.get_vif_port_set())
+        self.assertEqual(1, len(self.fake_db.transactions))
+
+    def test_get_port_tag_dict(self):
+        self.assertEqual({'tap99': 1, 'tun22': []},
+                         self.br.get_port_tag_dict())
+
+    def test_get_vif_ports(self):
+        ports = self.br.get_vif_ports()
+        self.assertEqual(1, len(ports))
+        self.assertEqual('tap99', ports[0].port_name)
+        self.assertEqual('1', ports[0].ofport)
+        self.assertEqual('tap99id', ports[0].vif_id)
+        self.assertEqual('tap99mac', ports[0].vif_mac)
+        self.assertEqual(1, len(self.fake_db.transactions))
+
+    def test_get_vif_port_by_id(self):
+        port = self.br.get_vif_port_by_id('tap99id')
+        self.assertEqual('tap99', port.port_name)
+        self.assertEqual(1, port.ofport)
+        self.assertIsNone(self.br.get_vif_port_by_id('tap88id'))
+
+    def test_db_get_val(self):
+        self.assertEqual('1', self.br.get_port_ofport('tap99'))
+        self.assertEqual('[]', self.br.db_get_val('Port', 'tun22', 'tag'))
+        self.assertEqual('0000ca1f2e5ba2c8', self.br.get_datapath_id())
+        self.assertIsNone(self.br.db_get_val('Port', 'nope', 'tag'))
+
+    def test_db_get_map(self):
+        self.assertEqual({'iface-id': 'tap99id', 'attached-mac': 'tap99mac'},
+                         self.br.db_get_map('Interface', 'tap99',
+                                            'external_ids'))
+
+    def test_set_and_clear_db_attribute(self):
+        self.br.set_db_attribute('Port', 'tun22', 'tag', '5')
+        self.assertEqual('5', self.br.db_get_val('Port', 'tun22', 'tag'))
+        self.br.clear_db_attribute('Port', 'tun22', 'tag')
+        self.assertEqual('[]', self.br.db_get_val('Port', 'tun22', 'tag'))
+        self.br.clear_db_attribute('Interface', 'tap99', 'external_ids')
+        self.assertEqual({}, self.br.db_get_map('Interface', 'tap99',
+                                                'external_ids'))
+
+    def test_set_db_attribute_falls_back_to_vsctl(self):
+        with mock.patch.object(ovs_lib.LOG, 'warn') as warn:
+            # Map keys can not be set through OVSDB
+            self.br.set_db_attribute('Interface', 'tap99',
+                                     'external_ids:iface-id', 'x')
+        self.assertTrue(warn.called)
+        self.execute.assert_called_once_with(
+            ['ovs-vsctl', '--timeout=10', 'set', 'Interface', 'tap99',
+             'external_ids:iface-id=x'], root_helper='sudo')
+        self.execute.reset_mock()
+
+    def test_set_db_attribute_transaction_error(self):
+        self.fake_db.call = mock.Mock(
+            side_effect=ovsdb_client.OvsdbError(error='failed'))
+        self.br.ovsdb.call = self.fake_db.call
+        self.br.clear_db_attribute('Port', 'tun22', 'tag')
+        self.execute.assert_called_once_with(
+            ['ovs-vsctl', '--timeout=10', 'clear', 'Port', 'tun22', 'tag'],
+            root_helper='sudo')
+        self.execute.reset_mock()
+
+    def test_set_db_attribute_unknown_record(self):
+        with mock.patch.object(ovs_lib.LOG, 'error') as error:
+            self.br.set_db_attribute('Port', 'nope', 'tag', '5')
+        self.assertTrue(error.called)
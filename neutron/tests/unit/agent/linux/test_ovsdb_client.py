@@ -0,0 +1,142 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import socket
+
+import mock
+
+from neutron.agent.linux import ovsdb_client
+from neutron.openstack.common import jsonutils
+from neutron.tests import base
+
+SCHEMA = {'name': 'Open_vSwitch', 'tables': {}}
+
+
+class TestOvsdbValues(base.BaseTestCase):
+
+    def test_to_python(self):
+        self.assertEqual([], ovsdb_client.to_python(['set', []]))
+        self.assertEqual({'a': 'b'},
+                         ovsdb_client.to_python(['map', [['a', 'b']]]))
+        self.assertEqual('1234', ovsdb_client.to_python(['uuid', '1234']))
+        self.assertEqual(['1', '2'], ovsdb_client.to_list(
+            ['set', [['uuid', '1'], ['uuid', '2']]]))
+        self.assertEqual(['1'], ovsdb_client.to_list(['uuid', '1']))
+
+    def test_to_vsctl_str(self):
+        self.assertEqual('5', ovsdb_client.to_vsctl_str(5))
+        self.assertEqual('[]', ovsdb_client.to_vsctl_str(['set', []]))
+        self.assertEqual('br_int', ovsdb_client.to_vsctl_str('br_int'))
+        self.assertEqual('"0000ab"', ovsdb_client.to_vsctl_str('0000ab'))
+        self.assertEqual('true', ovsdb_client.to_vsctl_str(True))
+        self.assertEqual('{a="1.2", b=c}', ovsdb_client.to_vsctl_str(
+            ['map', [['b', 'c'], ['a', '1.2']]]))
+
+    def test_to_vsctl_map(self):
+        self.assertEqual({'rx_bytes': '10', 'mac': 'fa:16'},
+                         ovsdb_client.to_vsctl_map(
+                             ['map', [['rx_bytes', 10], ['mac', 'fa:16']]]))
+
+
+class TestOvsdbConnection(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestOvsdbConnection, self).setUp()
+        self.sock = mock.Mock()
+        self.socket = mock.patch.object(socket, 'socket',
+                                        return_value=self.sock).start()
+        self.conn = ovsdb_client.Connection('tcp:127.0.0.1:6640', 10)
+
+    def _sent(self):
+        return [jsonutils.loads(args[0])
+                for args, kwargs in self.sock.sendall.call_args_list]
+
+    def test_transact(self):
+        schema = jsonutils.dumps({'id': 1, 'result': SCHEMA, 'error': None})
+        self.sock.recv.side_effect = [
+            # A message may be split over several reads
+            schema[:10], schema[10:],
+            jsonutils.dumps({'id': 'echo', 'method': 'echo', 'params': []}),
+            jsonutils.dumps({'id': 2, 'result': [{'rows': []}],
+                             'error': None})]
+        op = ovsdb_client.select('Port', ['name'])
+        self.assertEqual([{'rows': []}], self.conn.transact(op))
+        self.sock.connect.assert_called_once_with(('127.0.0.1', 6640))
+        self.assertEqual(SCHEMA, self.conn.schema)
+        sent = self._sent()
+        self.assertEqual('get_schema', sent[0]['method'])
+        self.assertEqual(['Open_vSwitch', op], sent[1]['params'])
+        self.assertEqual({'id': 'echo', 'result': [], 'error': None},
+                         sent[2])
+
+    def test_messages_split_and_merged(self):
+        self.conn.schema = SCHEMA
+        result = [{'rows': [{'name': 'a}"[b\\'}]}]
+        reply = jsonutils.dumps({'id': 1, 'result': result, 'error': None})
+        notification = jsonutils.dumps({'id': None, 'method': 'update',
+                                        'params': ['{"]']})
+        data = notification + reply
+        self.sock.recv.side_effect = [data[:30], data[30:]]
+        self.assertEqual(result, self.conn.transact())
+
+    def test_malformed_message(self):
+        self.conn.schema = SCHEMA
+        self.sock.recv.return_value = '{"id": 1, result}'
+        self.assertRaises(ovsdb_client.OvsdbError, self.conn.transact)
+        self.assertEqual(2, self.socket.call_count)
+
+    def test_connection_is_reused(self):
+        self.conn.schema = SCHEMA
+        self.sock.recv.side_effect = [
+            jsonutils.dumps({'id': i, 'result': [], 'error': None})
+            for i in (1, 2)]
+        self.conn.transact()
+        self.conn.transact()
+        self.assertEqual(1, self.socket.call_count)
+
+    def test_reconnect_on_closed_connection(self):
+        self.conn.schema = SCHEMA
+        self.sock.recv.side_effect = [
+            '', jsonutils.dumps({'id': 2, 'result': [], 'error': None})]
+        self.assertEqual([], self.conn.transact())
+        self.assertEqual(2, self.socket.call_count)
+
+    def test_connection_failure(self):
+        self.sock.connect.side_effect = socket.error()
+        self.assertRaises(ovsdb_client.OvsdbError, self.conn.transact)
+        self.assertEqual(2, self.socket.call_count)
+
+    def test_transact_error(self):
+        self.conn.schema = SCHEMA
+        self.sock.recv.return_value = jsonutils.dumps(
+            {'id': 1, 'error': None,
+             'result': [{'error': 'constraint violation'}]})
+        self.assertRaises(ovsdb_client.OvsdbError, self.conn.transact)
+
+    def test_encode_value(self):
+        self.conn.schema = {'tables': {'Port': {'columns': {
+            'tag': {'type': {'key': {'type': 'integer'},
+                             'min': 0, 'max': 1}},
+            'name': {'type': 'string'},
+            'trunks': {'type': {'key': 'integer', 'min': 0,
+                                'max': 4096}}}}}}
+        self.assertEqual(5, self.conn.encode_value('Port', 'tag', '5'))
+        self.assertEqual(['set', []],
+                         self.conn.encode_value('Port', 'tag', None))
+        self.assertEqual('a', self.conn.encode_value('Port', 'name', '"a"'))
+        self.assertRaises(ovsdb_client.OvsdbError, self.conn.encode_value,
+                          'Port', 'name', None)
+        self.assertRaises(ovsdb_client.OvsdbError, self.conn.encode_value,
+                          'Port', 'trunks', '1')
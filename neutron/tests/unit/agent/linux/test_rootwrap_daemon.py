@@ -0,0 +1,144 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import sys
+
+import fixtures
+import mock
+from oslo.rootwrap import filters
+
+from neutron.agent.linux import rootwrap_daemon
+from neutron.tests import base
+
+EXEC_DIRS = ['/bin', '/usr/bin', '/sbin', '/usr/sbin']
+
+
+class TestRootwrapDaemon(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestRootwrapDaemon, self).setUp()
+        self.daemon = rootwrap_daemon.RootwrapDaemon(
+            [filters.IpNetnsExecFilter('ip', 'root'),
+             filters.CommandFilter('cat', 'root'),
+             filters.CommandFilter('missing-command', 'root')],
+            EXEC_DIRS)
+
+    def test_get_command(self):
+        namespace, command, env = self.daemon._get_command(['cat', 'a'])
+        self.assertIsNone(namespace)
+        self.assertEqual('cat', os.path.basename(command[0]))
+        self.assertEqual(['a'], command[1:])
+
+    def test_get_command_in_namespace(self):
+        namespace, command, env = self.daemon._get_command(
+            ['ip', 'netns', 'exec', 'qrouter-1', 'cat', 'a'])
+        self.assertEqual('qrouter-1', namespace)
+        self.assertEqual('cat', os.path.basename(command[0]))
+        self.assertEqual(['a'], command[1:])
+
+    def test_run_command(self):
+        self.assertEqual((0, 'data', ''),
+                         self.daemon.run_command(['cat'], 'data'))
+
+    def test_run_command_unauthorized(self):
+        returncode, stdout, stderr = self.daemon.run_command(['rm', 'a'])
+        self.assertEqual(rootwrap_daemon.RC_UNAUTHORIZED, returncode)
+        self.assertIn('Unauthorized command: rm a', stderr)
+
+    def test_run_command_in_namespace_unauthorized(self):
+        for args in (['ip', 'netns', 'exec', 'ns', 'rm', 'a'],
+                     ['ip', 'netns', 'exec', '../ns', 'cat']):
+            returncode, stdout, stderr = self.daemon.run_command(args)
+            self.assertEqual(rootwrap_daemon.RC_UNAUTHORIZED, returncode)
+
+    def test_run_command_not_executable(self):
+        returncode, stdout, stderr = self.daemon.run_command(
+            ['missing-command'])
+        self.assertEqual(rootwrap_daemon.RC_NOEXECFOUND, returncode)
+
+    def test_run_command_in_missing_namespace(self):
+        returncode, stdout, stderr = self.daemon.run_command(
+            ['ip', 'netns', 'exec', 'missing-namespace-%s' % os.getpid(),
+             'cat'])
+        self.assertEqual(1, returncode)
+        self.assertIn('Cannot open network namespace', stderr)
+
+
+class TestRootwrapDaemonClient(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestRootwrapDaemonClient, self).setUp()
+        temp_dir = self.useFixture(fixtures.TempDir()).path
+        filters_path = os.path.join(temp_dir, 'rootwrap.d')
+        os.mkdir(filters_path)
+        with open(os.path.join(filters_path, 'test.filters'), 'w') as f:
+            f.write('[Filters]\ncat: CommandFilter, cat, root\n')
+        config_file = os.path.join(temp_dir, 'rootwrap.conf')
+        with open(config_file, 'w') as f:
+            f.write('[DEFAULT]\nfilters_path=%s\nexec_dirs=%s\n' %
+                    (filters_path, ','.join(EXEC_DIRS)))
+        # The daemon is run without sudo, as the user running the tests
+        daemon_cmd = ('%s -c "from neutron.agent.linux import '
+                      'rootwrap_daemon; rootwrap_daemon.main()" %s' %
+                      (sys.executable, config_file))
+        self.client = rootwrap_daemon.RootwrapDaemonClient(daemon_cmd)
+        self.addCleanup(self.client._stop_daemon)
+
+    def test_execute(self):
+        data = ''.join(chr(i) for i in range(256))
+        self.assertEqual((0, data, ''), self.client.execute(['cat'], data))
+        self.assertEqual(rootwrap_daemon.RC_UNAUTHORIZED,
+                         self.client.execute(['rm', 'a'])[0])
+
+    def test_daemon_restarted(self):
+        self.client.execute(['cat'])
+        process = self.client._process
+        process.stdin.close()
+        process.wait()
+        self.assertEqual((0, 'a', ''), self.client.execute(['cat'], 'a'))
+        self.assertIsNot(process, self.client._process)
+
+    def test_daemon_not_started(self):
+        self.client.daemon_cmd = 'false'
+        self.assertRaises(rootwrap_daemon.RootwrapDaemonError,
+                          self.client.execute, ['cat'])
+        self.assertIsNone(self.client._process)
+
+    def test_request_failure_stops_daemon(self):
+        self.client.execute(['cat'])
+        os.unlink(self.client.socket_path)
+        self.assertRaises(rootwrap_daemon.RootwrapDaemonError,
+                          self.client.execute, ['cat'])
+        self.assertIsNone(self.client._process)
+
+    def test_response_failure_stops_daemon(self):
+        self.client.execute(['cat'])
+        with mock.patch.object(rootwrap_daemon.json, 'loads',
+                               side_effect=ValueError()):
+            self.assertRaises(rootwrap_daemon.RootwrapDaemonResponseError,
+                              self.client.execute, ['cat'])
+        self.assertIsNone(self.client._process)
+
+    def test_daemon_creates_and_removes_socket_dir(self):
+        self.client.execute(['cat'])
+        process = self.client._process
+        socket_dir = os.path.dirname(self.client.socket_path)
+        self.assertTrue(os.path.basename(socket_dir).startswith(
+            'neutron-rootwrap-'))
+        self.assertEqual(0o711, os.stat(socket_dir).st_mode & 0o777)
+        self.client._stop_daemon()
+        process.wait()
+        self.assertFalse(os.path.exists(socket_dir))
@@ -31,6 +31,8 @@ from neutron.db.loadbalancer import loadbalancer_db as ldb
 from neutron.db import servicetype_db as sdb
 import neutron.extensions
 from neutron.extensions import loadbalancer
+from neutron import manager
+from neutron.openstack.common import uuidutils
 from neutron.plugins.common import constants
 from neutron.services.loadbalancer import (
     plugin as loadbalancer_plugin
@@ -617,6 +619,29 @@ class TestLoadBalancer(LoadBalancerPluginDbTestCase):
                                                         (vip1, vip2, vip3),
                                                         ('name', 'asc'), 2, 2)
 
+    def test_list_vips_with_pagination_native(self):
+        with self.subnet() as subnet:
+            with contextlib.nested(self.vip(name='vip1', subnet=subnet),
+                                   self.vip(name='vip2', subnet=subnet)):
+                plugin = manager.NeutronManager.get_service_plugins()[
+                    constants.LOADBALANCER]
+                with mock.patch.object(plugin, 'get_vips',
+                                       wraps=plugin.get_vips) as get:
+                    req = self.new_list_request(
+                        'vips', params='limit=1&sort_key=name&sort_dir=asc')
+                    res = self.deserialize(self.fmt,
+                                           req.get_response(self.ext_api))
+                self.assertEqual(['vip1'], [vip['name']
+                                            for vip in res['vips']])
+                # The page is read from the database
+                self.assertEqual(1, get.call_args[1]['limit'])
+
+    def test_list_vips_with_unknown_marker(self):
+        req = self.new_list_request(
+            'vips', params='limit=1&marker=%s' % uuidutils.generate_uuid())
+        res = req.get_response(self.ext_api)
+        self.assertEqual(webob.exc.HTTPNotFound.code, res.status_int)
+
     def test_create_pool_with_invalid_values(self):
         name = 'pool3'
 
@@ -17,6 +17,8 @@
 # @author: Francois Eleouet, Orange
 # @author: Mathieu Rohon, Orange
 
+import contextlib
+
 import mock
 
 from neutron.common import constants
@@ -30,8 +32,10 @@ from neutron import manager
 from neutron.openstack.common import timeutils
 from neutron.plugins.ml2 import config as config
 from neutron.plugins.ml2.drivers.l2pop import constants as l2_consts
+from neutron.plugins.ml2.drivers.l2pop import rpc as l2pop_rpc
 from neutron.plugins.ml2 import managers
 from neutron.plugins.ml2 import rpc
+from neutron.tests import base
 from neutron.tests.unit import test_db_plugin as test_plugin
 
 HOST = 'my_l2_host'
@@ -93,6 +97,8 @@ class TestL2PopulationRpcTestCase(test_plugin.NeutronDbPluginV2TestCase):
                                      ['openvswitch', 'linuxbridge',
                                       'l2population'],
                                      'ml2')
+        # Send the fdb entries of each port change right away
+        config.cfg.CONF.set_override('fdb_aggregation_interval', 0, 'l2pop')
         super(TestL2PopulationRpcTestCase, self).setUp(PLUGIN_NAME)
 
         self.adminContext = context.get_admin_context()
@@ -187,6 +193,50 @@ class TestL2PopulationRpcTestCase(test_plugin.NeutronDbPluginV2TestCase):
                     self.mock_fanout.assert_called_with(
                         mock.ANY, expected, topic=self.fanout_topic)
 
+    def test_update_device_list_aggregates_fdb_entries(self):
+        self._register_ml2_agents()
+        config.cfg.CONF.set_override('fdb_aggregation_interval', 1, 'l2pop')
+
+        with self.subnet(network=self._network) as subnet:
+            host_arg = {portbindings.HOST_ID: HOST}
+            with contextlib.nested(
+                self.port(subnet=subnet, arg_list=(portbindings.HOST_ID,),
+                          **host_arg),
+                self.port(subnet=subnet, arg_list=(portbindings.HOST_ID,),
+                          **host_arg),
+                mock.patch('eventlet.spawn_after')
+            ) as (port1, port2, spawn_after):
+                p1 = port1['port']
+                p2 = port2['port']
+                devices = ['tap' + p1['id'], 'tap' + p2['id']]
+
+                self.mock_fanout.reset_mock()
+                result = self.callbacks.update_device_list(
+                    self.adminContext, agent_id=HOST, devices_up=devices,
+                    devices_down=[])
+                self.assertEqual(devices, result['devices_up'])
+                self.assertFalse(self.mock_fanout.called)
+                spawn_after.assert_called_once_with(
+                    1, l2pop_rpc.L2populationAgentNotify.flush_fanouts)
+
+                l2pop_rpc.L2populationAgentNotify.flush_fanouts()
+                expected = {'args':
+                            {'fdb_entries':
+                             {p1['network_id']:
+                              {'ports':
+                               {'20.0.0.1': [
+                                   constants.FLOODING_ENTRY,
+                                   [p1['mac_address'],
+                                    p1['fixed_ips'][0]['ip_address']],
+                                   [p2['mac_address'],
+                                    p2['fixed_ips'][0]['ip_address']]]},
+                               'network_type': 'vxlan',
+                               'segment_id': 1}}},
+                            'namespace': None,
+                            'method': 'add_fdb_entries'}
+                self.mock_fanout.assert_called_once_with(
+                    mock.ANY, expected, topic=self.fanout_topic)
+
     def test_fdb_add_not_called_type_local(self):
         self._register_ml2_agents()
 
@@ -722,3 +772,74 @@ class TestL2PopulationRpcTestCase(test_plugin.NeutronDbPluginV2TestCase):
 
                     self.mock_fanout.assert_called_with(
                         mock.ANY, expected, topic=self.fanout_topic)
+
+
+class TestL2PopulationAgentNotify(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestL2PopulationAgentNotify, self).setUp()
+        self.notifier = l2pop_rpc.L2populationAgentNotifyAPI()
+        self.fanout = mock.patch.object(self.notifier, 'fanout_cast').start()
+        self.spawn_after = mock.patch('eventlet.spawn_after').start()
+
+    def _fdb_entries(self, network_id, agent_ip, *entries):
+        return {network_id: {'segment_id': 1, 'network_type': 'vxlan',
+                             'ports': {agent_ip: list(entries)}}}
+
+    def _sent(self):
+        return [(args[1]['method'], args[1]['args']['fdb_entries'])
+                for args, kwargs in self.fanout.call_args_list]
+
+    def test_merge_fdb_entries(self):
+        seen = set()
+        merged = l2pop_rpc.merge_fdb_entries(
+            {}, seen, self._fdb_entries('net1', '1.1.1.1',
+                                        constants.FLOODING_ENTRY,
+                                        ['m1', 'ip1']))
+        l2pop_rpc.merge_fdb_entries(
+            merged, seen, self._fdb_entries('net1', '1.1.1.1',
+                                            constants.FLOODING_ENTRY,
+                                            ['m2', 'ip2']))
+        l2pop_rpc.merge_fdb_entries(
+            merged, seen, self._fdb_entries('net2', '1.1.1.1',
+                                            ['m3', 'ip3']))
+        expected = self._fdb_entries('net1', '1.1.1.1',
+                                     constants.FLOODING_ENTRY,
+                                     ['m1', 'ip1'], ['m2', 'ip2'])
+        expected.update(self._fdb_entries('net2', '1.1.1.1', ['m3', 'ip3']))
+        self.assertEqual(expected, merged)
+        self.assertEqual(4, len(seen))
+        self.assertIn(('net2', '1.1.1.1', 'm3', 'ip3'), seen)
+
+    def test_fanouts_without_aggregation(self):
+        config.cfg.CONF.set_override('fdb_aggregation_interval', 0, 'l2pop')
+        for i in range(2):
+            self.notifier.add_fdb_entries(
+                'ctx', self._fdb_entries('net1', '1.1.1.1', ['m', 'ip']))
+        self.assertEqual(2, self.fanout.call_count)
+        self.assertFalse(self.spawn_after.called)
+
+    def test_fanouts_are_aggregated_in_order(self):
+        config.cfg.CONF.set_override('fdb_aggregation_interval', 2, 'l2pop')
+        for i in range(3):
+            self.notifier.add_fdb_entries(
+                'ctx', self._fdb_entries('net1', '1.1.1.1', ['m%d' % i, 'ip']))
+        self.notifier.remove_fdb_entries(
+            'ctx', self._fdb_entries('net1', '1.1.1.1', ['m0', 'ip']))
+        self.notifier.remove_fdb_entries(
+            'ctx', self._fdb_entries('net2', '1.1.1.1', ['m9', 'ip']))
+        self.assertFalse(self.fanout.called)
+        self.spawn_after.assert_called_once_with(
+            2, self.notifier.flush_fanouts)
+
+        # Messages which are not aggregated are sent after the pending ones
+        self.notifier.update_fdb_entries('ctx', {'chg_ip': {}})
+        removed = self._fdb_entries('net1', '1.1.1.1', ['m0', 'ip'])
+        removed.update(self._fdb_entries('net2', '1.1.1.1', ['m9', 'ip']))
+        self.assertEqual(
+            [('add_fdb_entries',
+              self._fdb_entries('net1', '1.1.1.1', ['m0', 'ip'],
+                                ['m1', 'ip'], ['m2', 'ip'])),
+             ('remove_fdb_entries', removed),
+             ('update_fdb_entries', {'chg_ip': {}})],
+            self._sent())
@@ -0,0 +1,157 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import contextlib
+
+import mock
+import sqlalchemy as sa
+
+import neutron.db.api as db
+from neutron.plugins.ml2.drivers import helpers
+from neutron.plugins.ml2.drivers import type_vlan
+from neutron.tests import base
+
+PHYS_NET = 'physnet1'
+PHYS_NET_2 = 'physnet2'
+
+
+class HelpersTest(base.BaseTestCase):
+
+    def setUp(self):
+        super(HelpersTest, self).setUp()
+        db.configure_db()
+        self.session = db.get_session()
+        self.addCleanup(db.clear_db)
+
+    def _sync(self, ranges, physical_network=PHYS_NET):
+        helpers.sync_allocations(self.session, type_vlan.VlanAllocation,
+                                 type_vlan.VlanAllocation.vlan_id, ranges,
+                                 physical_network=physical_network)
+
+    def _get_allocations(self, physical_network=PHYS_NET):
+        allocs = self.session.query(type_vlan.VlanAllocation).filter_by(
+            physical_network=physical_network)
+        return dict((a.vlan_id, a.allocated) for a in allocs)
+
+    def _allocate(self, vlan_id, physical_network=PHYS_NET):
+        with self.session.begin(subtransactions=True):
+            self.session.query(type_vlan.VlanAllocation).filter_by(
+                physical_network=physical_network,
+                vlan_id=vlan_id).update({'allocated': True})
+
+    def test_sync_allocations_populates_ranges(self):
+        self._sync([(10, 12), (20, 21)])
+        self.assertEqual({10: False, 11: False, 12: False,
+                          20: False, 21: False},
+                         self._get_allocations())
+
+    def test_sync_allocations_updated_ranges(self):
+        self._sync([(10, 14)])
+        self._allocate(10)
+        self._sync([(12, 16)])
+        self.assertEqual({10: True, 12: False, 13: False, 14: False,
+                          15: False, 16: False},
+                         self._get_allocations())
+
+    def test_sync_allocations_fills_gaps(self):
+        self._sync([(1, 10)])
+        self._allocate(3)
+        self.session.query(type_vlan.VlanAllocation).filter(
+            type_vlan.VlanAllocation.vlan_id.in_([1, 5, 6, 10])).delete(
+                synchronize_session=False)
+        self._sync([(1, 10)])
+        expected = dict((vlan_id, False) for vlan_id in range(1, 11))
+        expected[3] = True
+        self.assertEqual(expected, self._get_allocations())
+
+    def test_sync_allocations_overlapping_ranges(self):
+        self._sync([(5, 8), (1, 6), (9, 9)])
+        self.assertEqual(dict((vlan_id, False) for vlan_id in range(1, 10)),
+                         self._get_allocations())
+
+    def test_sync_allocations_only_touches_own_pool(self):
+        self._sync([(10, 11)], physical_network=PHYS_NET_2)
+        self._sync([(20, 21)])
+        self.assertEqual({10: False, 11: False},
+                         self._get_allocations(PHYS_NET_2))
+
+    def test_sync_allocations_inserts_in_chunks(self):
+        with mock.patch.object(helpers, 'SYNC_CHUNK_SIZE', new=4):
+            with mock.patch.object(self.session, 'execute',
+                                   wraps=self.session.execute) as execute:
+                self._sync([(1, 10)])
+        inserts = [args[0] for args, kwargs in execute.call_args_list
+                   if isinstance(args[0], sa.sql.expression.Insert)]
+        self.assertEqual(3, len(inserts))
+        self.assertEqual(10, len(self._get_allocations()))
+
+    def test_sync_allocations_no_ranges(self):
+        self._sync([(10, 12)])
+        self._allocate(11)
+        self._sync([])
+        self.assertEqual({11: True}, self._get_allocations())
+
+    def test_delete_unallocated(self):
+        self._sync([(10, 11)])
+        self._sync([(10, 11)], physical_network=PHYS_NET_2)
+        self._allocate(10, physical_network=PHYS_NET_2)
+        helpers.delete_unallocated(self.session, type_vlan.VlanAllocation,
+                                   type_vlan.VlanAllocation.physical_network,
+                                   [PHYS_NET])
+        self.assertEqual({10: False, 11: False}, self._get_allocations())
+        self.assertEqual({10: True}, self._get_allocations(PHYS_NET_2))
+
+    def test_allocate_free_segment(self):
+        self._sync([(10, 11)])
+        allocated = set()
+        for i in range(2):
+            alloc = helpers.allocate_free_segment(
+                self.session, type_vlan.VlanAllocation)
+            self.assertTrue(alloc.allocated)
+            allocated.add(alloc.vlan_id)
+        self.assertEqual(set([10, 11]), allocated)
+        self.assertIsNone(helpers.allocate_free_segment(
+            self.session, type_vlan.VlanAllocation))
+
+    def test_allocate_free_segment_retries_on_conflict(self):
+        self._sync([(10, 10)])
+        update = mock.Mock(side_effect=[0, 1])
+        with mock.patch('sqlalchemy.orm.query.Query.update', new=update):
+            alloc = helpers.allocate_free_segment(
+                self.session, type_vlan.VlanAllocation)
+        self.assertEqual(10, alloc.vlan_id)
+        self.assertEqual(2, update.call_count)
+
+    def test_allocate_free_segment_retries_with_locking_read(self):
+        self._sync([(10, 10)])
+        with contextlib.nested(
+            mock.patch('sqlalchemy.orm.query.Query.update',
+                       side_effect=[0, 1]),
+            mock.patch('sqlalchemy.orm.query.Query.with_lockmode',
+                       autospec=True,
+                       side_effect=sa.orm.query.Query.with_lockmode)
+        ) as (update, with_lockmode):
+            helpers.allocate_free_segment(self.session,
+                                          type_vlan.VlanAllocation)
+        with_lockmode.assert_called_once_with(mock.ANY, 'update')
+
+    def test_allocate_free_segment_gives_up(self):
+        self._sync([(10, 10)])
+        with mock.patch('sqlalchemy.orm.query.Query.update',
+                        return_value=0) as update:
+            alloc = helpers.allocate_free_segment(
+                self.session, type_vlan.VlanAllocation)
+        self.assertIsNone(alloc)
+        self.assertEqual(helpers.ALLOCATION_RETRIES, update.call_count)
@@ -13,6 +13,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
+
 import mock
 
 from neutron import context
@@ -94,6 +96,27 @@ class PortBindingTestCase(test_plugin.NeutronDbPluginV2TestCase):
                                 portbindings.VIF_TYPE_OVS,
                                 True, True, 'ACTIVE')
 
+    def test_get_devices_details_list(self):
+        host_arg = {portbindings.HOST_ID: 'host-ovs-no_filter'}
+        with self.subnet() as subnet:
+            with contextlib.nested(
+                self.port(subnet=subnet, arg_list=(portbindings.HOST_ID,),
+                          **host_arg),
+                self.port(subnet=subnet, arg_list=(portbindings.HOST_ID,),
+                          **host_arg)) as (port1, port2):
+                port_ids = [port1['port']['id'], port2['port']['id']]
+                neutron_context = context.get_admin_context()
+                details = self.plugin.callbacks.get_devices_details_list(
+                    neutron_context, agent_id="theAgentId",
+                    # A device may be given as a prefix of the port id
+                    devices=[port_ids[0], port_ids[1][:11], 'unknown'])
+                self.assertEqual(3, len(details))
+                self.assertEqual(port_ids,
+                                 [d['port_id'] for d in details[:2]])
+                self.assertEqual(port_ids[1][:11], details[1]['device'])
+                self.assertEqual('local', details[0]['network_type'])
+                self.assertEqual({'device': 'unknown'}, details[2])
+
     def _test_update_port_binding(self, host, new_host=None):
         with mock.patch.object(self.plugin,
                                '_notify_port_updated') as notify_mock:
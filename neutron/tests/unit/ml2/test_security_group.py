@@ -14,9 +14,15 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from contextlib import nested
+
 import mock
+from oslo.config import cfg
 
 from neutron.api.v2 import attributes
+from neutron.common import constants as const
+from neutron import context
+from neutron.db import securitygroups_rpc_base as sg_db_rpc
 from neutron.extensions import securitygroup as ext_sg
 from neutron import manager
 from neutron.tests.unit import test_extension_security_group as test_sg
@@ -96,7 +102,41 @@ class TestMl2SecurityGroupsXML(TestMl2SecurityGroups):
 class TestMl2SGServerRpcCallBack(
     Ml2SecurityGroupsTestCase,
     test_sg_rpc.SGServerRpcCallBackMixinTestCase):
-    pass
+
+    def _get_rules(self, port):
+        self.rpc.devices = {port['id']: port.copy()}
+        ports_rpc = self.rpc.security_group_rules_for_devices(
+            context.get_admin_context(), devices=[port['id']])
+        return ports_rpc[port['id']]['security_group_rules']
+
+    def test_security_group_rules_for_devices_cache_invalidated(self):
+        cfg.CONF.set_override('cache_rpc_info', True, group='SECURITYGROUP')
+        self.addCleanup(sg_db_rpc.SG_INFO_CACHE.invalidate)
+        with self.network() as n:
+            with nested(self.subnet(n),
+                        self.security_group(),
+                        self.security_group()) as (subnet_v4, sg1, sg2):
+                sg1_id = sg1['security_group']['id']
+                sg2_id = sg2['security_group']['id']
+                port1, port2 = self._create_source_group_ports(n, sg1_id,
+                                                               sg2_id)
+                self.assertEqual(3, len(self._get_rules(port1)))
+
+                # A new member of the remote group is allowed
+                port3 = self._make_port(self.fmt, n['network']['id'],
+                                        security_groups=[sg2_id])['port']
+                self.assertEqual(4, len(self._get_rules(port1)))
+
+                # So is a new rule
+                rule = self._build_security_group_rule(
+                    sg1_id, 'ingress', const.PROTO_NAME_TCP, '22', '22')
+                self._make_security_group_rule(self.fmt, rule)
+                self.assertEqual(5, len(self._get_rules(port1)))
+
+                self._delete('ports', port3['id'])
+                self.assertEqual(4, len(self._get_rules(port1)))
+                for port in (port1, port2):
+                    self._delete('ports', port['id'])
 
 
 class TestMl2SGServerRpcCallBackXML(
@@ -35,6 +35,8 @@ from neutron.tests.unit.ofagent import fake_oflib
 
 NOTIFIER = ('neutron.plugins.ml2.rpc.AgentNotifierApi')
 OVS_LINUX_KERN_VERS_WITHOUT_VXLAN = "3.12.0"
+UPDATE_DEVICE_LIST_RESULT = {'devices_up': [], 'failed_devices_up': [],
+                             'devices_down': [], 'failed_devices_down': []}
 
 
 class OFAAgentTestCase(base.BaseTestCase):
@@ -326,7 +328,8 @@ class TestOFANeutronAgent(OFAAgentTestCase):
         self.assertEqual(expected, actual)
 
     def test_treat_devices_added_returns_true_for_missing_device(self):
-        with mock.patch.object(self.agent.plugin_rpc, 'get_device_details',
+        with mock.patch.object(self.agent.plugin_rpc,
+                               'get_devices_details_list',
                                side_effect=Exception()):
             self.assertTrue(self.agent.treat_devices_added([{}]))
 
@@ -339,13 +342,15 @@ class TestOFANeutronAgent(OFAAgentTestCase):
         :returns: whether the named function was called
         """
         with contextlib.nested(
-            mock.patch.object(self.agent.plugin_rpc, 'get_device_details',
-                              return_value=details),
+            mock.patch.object(self.agent.plugin_rpc,
+                              'get_devices_details_list',
+                              return_value=[details]),
             mock.patch.object(self.agent.int_br, 'get_vif_port_by_id',
                               return_value=port),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_up'),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              return_value=UPDATE_DEVICE_LIST_RESULT),
             mock.patch.object(self.agent, func_name)
-        ) as (get_dev_fn, get_vif_func, upd_dev_up, func):
+        ) as (get_dev_fn, get_vif_func, upd_dev_list, func):
             self.assertFalse(self.agent.treat_devices_added([{}]))
         return func.called
 
@@ -369,17 +374,18 @@ class TestOFANeutronAgent(OFAAgentTestCase):
                                                        'treat_vif_port'))
 
     def test_treat_devices_removed_returns_true_for_missing_device(self):
-        with mock.patch.object(self.agent.plugin_rpc, 'update_device_down',
+        with mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
                                side_effect=Exception()):
             self.assertTrue(self.agent.treat_devices_removed([{}]))
 
     def _mock_treat_devices_removed(self, port_exists):
-        details = dict(exists=port_exists)
-        with mock.patch.object(self.agent.plugin_rpc, 'update_device_down',
-                               return_value=details):
+        result = dict(UPDATE_DEVICE_LIST_RESULT,
+                      devices_down=[dict(device='dev1', exists=port_exists)])
+        with mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                               return_value=result):
             with mock.patch.object(self.agent, 'port_unbound') as port_unbound:
-                self.assertFalse(self.agent.treat_devices_removed([{}]))
-        self.assertTrue(port_unbound.called)
+                self.assertFalse(self.agent.treat_devices_removed(['dev1']))
+        port_unbound.assert_called_once_with('dev1')
 
     def test_treat_devices_removed_unbinds_port(self):
         self._mock_treat_devices_removed(True)
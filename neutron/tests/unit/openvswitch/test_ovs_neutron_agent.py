@@ -34,6 +34,8 @@ from neutron.tests import base
 NOTIFIER = ('neutron.plugins.openvswitch.'
             'ovs_neutron_plugin.AgentNotifierApi')
 OVS_LINUX_KERN_VERS_WITHOUT_VXLAN = "3.12.0"
+UPDATE_DEVICE_LIST_RESULT = {'devices_up': [], 'failed_devices_up': [],
+                             'devices_down': [], 'failed_devices_down': []}
 
 
 class CreateAgentConfigMap(base.BaseTestCase):
@@ -192,12 +194,10 @@ class TestOvsNeutronAgent(base.BaseTestCase):
                         updated_ports=None, port_tags_dict=None):
         if port_tags_dict is None:  # Because empty dicts evaluate as False.
             port_tags_dict = {}
-        with contextlib.nested(
-            mock.patch.object(self.agent.int_br, 'get_vif_port_set',
-                              return_value=vif_port_set),
-            mock.patch.object(self.agent.int_br, 'get_port_tag_dict',
-                              return_value=port_tags_dict)
-        ):
+        snapshot = ovs_lib.PortSnapshot(dict.fromkeys(vif_port_set),
+                                        port_tags_dict)
+        with mock.patch.object(self.agent.int_br, 'get_port_snapshot',
+                               return_value=snapshot):
             return self.agent.scan_ports(registered_ports, updated_ports)
 
     def test_scan_ports_returns_current_only_for_unchanged_ports(self):
@@ -271,12 +271,29 @@ class TestOvsNeutronAgent(base.BaseTestCase):
 
     def test_treat_devices_added_returns_true_for_missing_device(self):
         with contextlib.nested(
-            mock.patch.object(self.agent.plugin_rpc, 'get_device_details',
+            mock.patch.object(self.agent.plugin_rpc,
+                              'get_devices_details_list',
                               side_effect=Exception()),
             mock.patch.object(self.agent.int_br, 'get_vif_port_by_id',
                               return_value=mock.Mock())):
             self.assertTrue(self.agent.treat_devices_added_or_updated([{}]))
 
+    def test_treat_devices_added_uses_scanned_ports(self):
+        port = mock.Mock()
+        self.mock_scan_ports(set(), set())
+        self.agent.int_br_ports.vif_ports['dev1'] = port
+        with contextlib.nested(
+            mock.patch.object(self.agent.plugin_rpc,
+                              'get_devices_details_list',
+                              return_value=[{}]),
+            mock.patch.object(self.agent.int_br, 'get_vif_port_by_id'),
+            mock.patch.object(self.agent, 'port_dead')
+        ) as (get_dev_fn, get_vif_func, port_dead):
+            self.assertFalse(
+                self.agent.treat_devices_added_or_updated(['dev1']))
+        self.assertFalse(get_vif_func.called)
+        port_dead.assert_called_once_with(port)
+
     def _mock_treat_devices_added_updated(self, details, port, func_name):
         """Mock treat devices added or updated.
 
@@ -286,14 +303,15 @@ class TestOvsNeutronAgent(base.BaseTestCase):
         :returns: whether the named function was called
         """
         with contextlib.nested(
-            mock.patch.object(self.agent.plugin_rpc, 'get_device_details',
-                              return_value=details),
+            mock.patch.object(self.agent.plugin_rpc,
+                              'get_devices_details_list',
+                              return_value=[details]),
             mock.patch.object(self.agent.int_br, 'get_vif_port_by_id',
                               return_value=port),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_up'),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_down'),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              return_value=UPDATE_DEVICE_LIST_RESULT),
             mock.patch.object(self.agent, func_name)
-        ) as (get_dev_fn, get_vif_func, upd_dev_up, upd_dev_down, func):
+        ) as (get_dev_fn, get_vif_func, upd_dev_list, func):
             self.assertFalse(self.agent.treat_devices_added_or_updated([{}]))
         return func.called
 
@@ -311,10 +329,13 @@ class TestOvsNeutronAgent(base.BaseTestCase):
 
     def test_treat_devices_added_does_not_process_missing_port(self):
         with contextlib.nested(
-            mock.patch.object(self.agent.plugin_rpc, 'get_device_details'),
+            mock.patch.object(self.agent.plugin_rpc,
+                              'get_devices_details_list'),
             mock.patch.object(self.agent.int_br, 'get_vif_port_by_id',
                               return_value=None)
         ) as (get_dev_fn, get_vif_func):
+            self.assertFalse(
+                self.agent.treat_devices_added_or_updated(['dev1']))
             self.assertFalse(get_dev_fn.called)
 
     def test_treat_devices_added__updated_updates_known_port(self):
@@ -332,31 +353,60 @@ class TestOvsNeutronAgent(base.BaseTestCase):
                              'segmentation_id': 'bar',
                              'network_type': 'baz'}
         with contextlib.nested(
-            mock.patch.object(self.agent.plugin_rpc, 'get_device_details',
-                              return_value=fake_details_dict),
+            mock.patch.object(self.agent.plugin_rpc,
+                              'get_devices_details_list',
+                              return_value=[fake_details_dict]),
             mock.patch.object(self.agent.int_br, 'get_vif_port_by_id',
                               return_value=mock.MagicMock()),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_up'),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_down'),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              return_value=UPDATE_DEVICE_LIST_RESULT),
             mock.patch.object(self.agent, 'treat_vif_port')
-        ) as (get_dev_fn, get_vif_func, upd_dev_up,
-              upd_dev_down, treat_vif_port):
-            self.assertFalse(self.agent.treat_devices_added_or_updated([{}]))
+        ) as (get_dev_fn, get_vif_func, upd_dev_list, treat_vif_port):
+            self.assertFalse(self.agent.treat_devices_added_or_updated(
+                ['xxx']))
             self.assertTrue(treat_vif_port.called)
-            self.assertTrue(upd_dev_down.called)
+            upd_dev_list.assert_called_once_with(
+                self.agent.context, [], ['xxx'], self.agent.agent_id,
+                cfg.CONF.host)
+
+    def test_treat_devices_added_updated_reports_status_once(self):
+        details = {'admin_state_up': True, 'network_id': 'yyy',
+                   'physical_network': 'foo', 'segmentation_id': 'bar',
+                   'network_type': 'baz'}
+        devices = ['dev%d' % i for i in range(3)]
+        with contextlib.nested(
+            mock.patch.object(self.agent.plugin_rpc,
+                              'get_devices_details_list',
+                              return_value=[dict(details, port_id=device,
+                                                 device=device)
+                                            for device in devices]),
+            mock.patch.object(self.agent.int_br, 'get_vif_port_by_id',
+                              return_value=mock.MagicMock()),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              return_value=dict(UPDATE_DEVICE_LIST_RESULT,
+                                                failed_devices_up=['dev1'])),
+            mock.patch.object(self.agent, 'treat_vif_port')
+        ) as (get_dev_fn, get_vif_func, upd_dev_list, treat_vif_port):
+            # A device failing to be updated triggers a resync
+            self.assertTrue(self.agent.treat_devices_added_or_updated(
+                devices))
+        upd_dev_list.assert_called_once_with(
+            self.agent.context, devices, [], self.agent.agent_id,
+            cfg.CONF.host)
 
     def test_treat_devices_removed_returns_true_for_missing_device(self):
-        with mock.patch.object(self.agent.plugin_rpc, 'update_device_down',
+        with mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
                                side_effect=Exception()):
             self.assertTrue(self.agent.treat_devices_removed([{}]))
 
     def _mock_treat_devices_removed(self, port_exists):
-        details = dict(exists=port_exists)
-        with mock.patch.object(self.agent.plugin_rpc, 'update_device_down',
-                               return_value=details):
+        result = dict(UPDATE_DEVICE_LIST_RESULT,
+                      devices_down=[dict(device='dev1', exists=port_exists)])
+        with mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                               return_value=result):
             with mock.patch.object(self.agent, 'port_unbound') as port_unbound:
-                self.assertFalse(self.agent.treat_devices_removed([{}]))
-        self.assertTrue(port_unbound.called)
+                self.assertFalse(self.agent.treat_devices_removed(['dev1']))
+        port_unbound.assert_called_once_with('dev1')
 
     def test_treat_devices_removed_unbinds_port(self):
         self._mock_treat_devices_removed(True)
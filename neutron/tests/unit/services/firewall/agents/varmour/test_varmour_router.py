@@ -82,6 +82,7 @@ class TestVarmourRouter(base.BaseTestCase):
 
     def _create_router(self):
         router = varmour_router.vArmourL3NATAgent(HOSTNAME, self.conf)
+        self.addCleanup(router.namespace_collector.wait)
         router.rest.server = FAKE_DIRECTOR
         router.rest.user = 'varmour'
         router.rest.passwd = 'varmour'
@@ -82,6 +82,7 @@ class TestVPNAgent(base.BaseTestCase):
 
         self.fake_host = 'fake_host'
         self.agent = agent.VPNAgent(self.fake_host)
+        self.addCleanup(self.agent.namespace_collector.wait)
 
     def test_setup_drivers(self):
         self.assertEqual(1, len(self.agent.devices))
@@ -181,16 +182,26 @@ class TestVPNAgent(base.BaseTestCase):
         self.agent.devices = [device]
         self.agent._router_removed(router_id)
         device.destroy_router.assert_called_once_with(router_id)
+        self.agent.namespace_collector.wait()
 
     def test_process_routers(self):
         self.plugin_api.get_external_network_id.return_value = None
-        routers = [
-            {'id': _uuid(),
-             'admin_state_up': True,
-             'routes': [],
-             'external_gateway_info': {}}]
-
+        mock.patch(
+            'neutron.agent.linux.iptables_manager.IptablesManager').start()
+        router_id = _uuid()
+        routers = [{'id': router_id,
+                    'admin_state_up': True,
+                    'routes': [],
+                    'external_gateway_info': {}}]
         device = mock.Mock()
         self.agent.devices = [device]
+
+        def sync(context, routers):
+            # The router is created and processed before the devices sync
+            ri = self.agent.router_info[router_id]
+            self.assertEqual(routers[0], ri.router)
+        device.sync.side_effect = sync
+
         self.agent._process_routers(routers, False)
+        device.create_router.assert_called_once_with(router_id)
         device.sync.assert_called_once_with(mock.ANY, routers)
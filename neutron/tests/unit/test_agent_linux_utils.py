@@ -76,6 +76,55 @@ class AgentUtilsExecuteTest(base.BaseTestCase):
         self.assertEqual(result, expected)
 
 
+class AgentUtilsExecuteWithDaemonTest(base.BaseTestCase):
+    def setUp(self):
+        super(AgentUtilsExecuteWithDaemonTest, self).setUp()
+        mock.patch.object(utils, '_get_root_helper_daemon',
+                          return_value='sudo daemon').start()
+        self.client = mock.Mock()
+        mock.patch.object(utils.rootwrap_daemon, 'get_client',
+                          return_value=self.client).start()
+        self.create_process = mock.patch.object(
+            utils, 'create_process').start()
+
+    def test_with_helper(self):
+        self.client.execute.return_value = (0, 'out', '')
+        self.assertEqual('out', utils.execute(['ip', 'link'], 'sudo',
+                                              process_input='in'))
+        self.client.execute.assert_called_once_with(['ip', 'link'], 'in')
+        self.assertFalse(self.create_process.called)
+
+    def test_without_helper(self):
+        self.create_process.return_value = (mock.Mock(returncode=0),
+                                            ['ls'])
+        self.create_process.return_value[0].communicate.return_value = (
+            'out', '')
+        self.assertEqual('out', utils.execute(['ls']))
+        self.assertFalse(self.client.execute.called)
+
+    def test_exit_code(self):
+        self.client.execute.return_value = (1, '', 'error')
+        self.assertRaises(RuntimeError, utils.execute, ['ip', 'link'],
+                          'sudo')
+
+    def test_daemon_failure_uses_helper(self):
+        self.client.execute.side_effect = (
+            utils.rootwrap_daemon.RootwrapDaemonError(error='dead'))
+        obj = mock.Mock(returncode=0)
+        obj.communicate.return_value = ('out', '')
+        self.create_process.return_value = (obj, ['sudo', 'ip', 'link'])
+        self.assertEqual('out', utils.execute(['ip', 'link'], 'sudo'))
+        self.create_process.assert_called_once_with(
+            ['ip', 'link'], root_helper='sudo', addl_env=None)
+
+    def test_daemon_response_failure_not_retried(self):
+        self.client.execute.side_effect = (
+            utils.rootwrap_daemon.RootwrapDaemonResponseError(error='dead'))
+        self.assertRaises(RuntimeError, utils.execute, ['ip', 'link'],
+                          'sudo')
+        self.assertFalse(self.create_process.called)
+
+
 class AgentUtilsGetInterfaceMAC(base.BaseTestCase):
     def test_get_interface_mac(self):
         expect_val = '01:02:03:04:05:06'
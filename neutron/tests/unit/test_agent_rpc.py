@@ -19,6 +19,7 @@ import mock
 
 from neutron.agent import rpc
 from neutron.openstack.common import context
+from neutron.openstack.common.rpc import common as rpc_common
 from neutron.tests import base
 
 
@@ -45,6 +46,81 @@ class AgentRPCPluginApi(base.BaseTestCase):
     def test_tunnel_sync(self):
         self._test_rpc_call('tunnel_sync')
 
+    def test_get_devices_details_list(self):
+        agent = rpc.PluginApi('fake_topic')
+        ctxt = context.RequestContext('fake_user', 'fake_project')
+        with mock.patch.object(agent, 'call',
+                               return_value=['d1', 'd2']) as call:
+            self.assertEqual(['d1', 'd2'], agent.get_devices_details_list(
+                ctxt, ['dev1', 'dev2'], 'fake_agent_id'))
+        self.assertEqual(1, call.call_count)
+        self.assertEqual(rpc.DEVICES_DETAILS_LIST_VERSION,
+                         call.call_args[1]['version'])
+
+    def _test_get_devices_details_list_fallback(self, error):
+        agent = rpc.PluginApi('fake_topic')
+        ctxt = context.RequestContext('fake_user', 'fake_project')
+        with mock.patch.object(agent, 'call',
+                               side_effect=[error, 'd1', 'd2', 'd3']) as call:
+            self.assertEqual(['d1', 'd2'], agent.get_devices_details_list(
+                ctxt, ['dev1', 'dev2'], 'fake_agent_id'))
+            # The bulk call is not tried again
+            self.assertEqual(['d3'], agent.get_devices_details_list(
+                ctxt, ['dev3'], 'fake_agent_id'))
+        self.assertEqual(4, call.call_count)
+        self.assertEqual('get_device_details',
+                         call.call_args[0][1]['method'])
+
+    def test_get_devices_details_list_unsupported(self):
+        self._test_get_devices_details_list_fallback(
+            rpc_common.UnsupportedRpcVersion(version='1.3'))
+
+    def test_get_devices_details_list_remote_unsupported(self):
+        self._test_get_devices_details_list_fallback(
+            rpc_common.RemoteError(exc_type='UnsupportedRpcVersion'))
+
+    def test_get_devices_details_list_remote_error(self):
+        agent = rpc.PluginApi('fake_topic')
+        ctxt = context.RequestContext('fake_user', 'fake_project')
+        with mock.patch.object(agent, 'call',
+                               side_effect=rpc_common.RemoteError()):
+            self.assertRaises(rpc_common.RemoteError,
+                              agent.get_devices_details_list,
+                              ctxt, ['dev1'], 'fake_agent_id')
+        self.assertTrue(agent.use_devices_details_list)
+
+    def test_update_device_list(self):
+        agent = rpc.PluginApi('fake_topic')
+        ctxt = context.RequestContext('fake_user', 'fake_project')
+        with mock.patch.object(agent, 'call', return_value='foo') as call:
+            self.assertEqual('foo', agent.update_device_list(
+                ctxt, ['dev1'], ['dev2'], 'fake_agent_id', 'fake_host'))
+        self.assertEqual(
+            {'devices_up': ['dev1'], 'devices_down': ['dev2'],
+             'agent_id': 'fake_agent_id', 'host': 'fake_host'},
+            call.call_args[0][1]['args'])
+        self.assertEqual(rpc.UPDATE_DEVICE_LIST_VERSION,
+                         call.call_args[1]['version'])
+
+    def test_update_device_list_unsupported(self):
+        agent = rpc.PluginApi('fake_topic')
+        ctxt = context.RequestContext('fake_user', 'fake_project')
+        down = {'device': 'dev3', 'exists': True}
+        with mock.patch.object(agent, 'call', side_effect=[
+                rpc_common.UnsupportedRpcVersion(version='1.4'),
+                None, Exception(), down]) as call:
+            result = agent.update_device_list(
+                ctxt, ['dev1', 'dev2'], ['dev3'], 'fake_agent_id')
+        self.assertEqual({'devices_up': ['dev1'],
+                          'failed_devices_up': ['dev2'],
+                          'devices_down': [down],
+                          'failed_devices_down': []}, result)
+        self.assertEqual(['update_device_list', 'update_device_up',
+                          'update_device_up', 'update_device_down'],
+                         [args[1]['method']
+                          for args, kwargs in call.call_args_list])
+        self.assertFalse(agent.use_update_device_list)
+
 
 class AgentPluginReportState(base.BaseTestCase):
     def test_plugin_report_state_use_call(self):
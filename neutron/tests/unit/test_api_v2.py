@@ -1386,6 +1386,43 @@ class QuotaTest(APIv2TestBase):
         self.assertIn("Quota exceeded for resources",
                       res.json['NeutronError']['message'])
 
+    def test_create_networks_bulk_quota(self):
+        cfg.CONF.set_override('quota_network', 4, group='QUOTAS')
+        tenant_a, tenant_b = _uuid(), _uuid()
+        initial_input = {'networks': [
+            {'name': 'net%d' % i, 'tenant_id': tenant_a} for i in range(3)]}
+        initial_input['networks'].append({'name': 'net',
+                                          'tenant_id': tenant_b})
+
+        def side_effect(context, network):
+            return dict(network['network'], subnets=[])
+
+        instance = self.plugin.return_value
+        instance.create_network.side_effect = side_effect
+        instance.get_networks_count.return_value = 1
+        res = self.api.post_json(_get_path('networks'), initial_input)
+        self.assertEqual(exc.HTTPCreated.code, res.status_int)
+        # The networks of each tenant are counted once
+        self.assertEqual(2, instance.get_networks_count.call_count)
+        instance.get_networks_count.assert_any_call(
+            mock.ANY, filters={'tenant_id': [tenant_a]})
+        instance.get_networks_count.assert_any_call(
+            mock.ANY, filters={'tenant_id': [tenant_b]})
+
+    def test_create_networks_bulk_over_quota(self):
+        cfg.CONF.set_override('quota_network', 3, group='QUOTAS')
+        initial_input = {'networks': [
+            {'name': 'net%d' % i, 'tenant_id': _uuid()} for i in range(2)]}
+        initial_input['networks'].append(
+            dict(initial_input['networks'][0], name='net2'))
+        instance = self.plugin.return_value
+        instance.get_networks_count.return_value = 2
+        res = self.api.post_json(
+            _get_path('networks'), initial_input, expect_errors=True)
+        self.assertIn("Quota exceeded for resources",
+                      res.json['NeutronError']['message'])
+        self.assertFalse(instance.create_network.called)
+
     def test_create_network_quota_without_limit(self):
         cfg.CONF.set_override('quota_network', -1, group='QUOTAS')
         initial_input = {'network': {'name': 'net1', 'tenant_id': _uuid()}}
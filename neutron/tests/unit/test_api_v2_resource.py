@@ -324,6 +324,46 @@ class ResourceTestCase(base.BaseTestCase):
         res = resource.delete('', extra_environ=environ)
         self.assertEqual(res.status_int, 204)
 
+    def test_streamed_list(self):
+        controller = mock.MagicMock()
+        controller.test = lambda request: {'foo': (i for i in [1, 2])}
+
+        resource = webtest.TestApp(wsgi_resource.Resource(controller))
+
+        environ = {'wsgiorg.routing_args': (None, {'action': 'test'})}
+        res = resource.get('', extra_environ=environ)
+        self.assertEqual(res.status_int, 200)
+        self.assertEqual({'foo': [1, 2]}, res.json)
+
+    def test_streamed_list_with_xml(self):
+        controller = mock.MagicMock()
+        controller.test = lambda request: {'foos': (i for i in ['a', 'b'])}
+
+        resource = webtest.TestApp(wsgi_resource.Resource(controller))
+
+        environ = {'wsgiorg.routing_args': (None, {'action': 'test',
+                                                   'format': 'xml'})}
+        res = resource.get('', extra_environ=environ)
+        self.assertEqual(res.status_int, 200)
+        self.assertEqual(wsgi.XMLDictSerializer().serialize(
+            {'foos': ['a', 'b']}), res.body)
+
+    def test_streamed_list_error_logged(self):
+        def items():
+            yield 1
+            raise ValueError()
+
+        controller = mock.MagicMock()
+        controller.test = lambda request: {'foo': items()}
+
+        resource = webtest.TestApp(wsgi_resource.Resource(controller))
+
+        environ = {'wsgiorg.routing_args': (None, {'action': 'test'})}
+        with mock.patch.object(wsgi_resource, 'LOG') as log:
+            self.assertRaises(ValueError, resource.get, '',
+                              extra_environ=environ)
+        self.assertTrue(log.exception.called)
+
     def _test_error_log_level(self, map_webob_exc, expect_log_info=False,
                               use_fault_map=True):
         class TestException(n_exc.NeutronException):
@@ -20,6 +20,7 @@ import copy
 import os
 
 import mock
+import netaddr
 from oslo.config import cfg
 from testtools import matchers
 import webob.exc
@@ -30,6 +31,7 @@ from neutron.api.extensions import PluginAwareExtensionManager
 from neutron.api.v2 import attributes
 from neutron.api.v2.attributes import ATTR_NOT_SPECIFIED
 from neutron.api.v2.router import APIRouter
+from neutron.cmd import rebuild_ip_availability
 from neutron.common import config
 from neutron.common import constants
 from neutron.common import exceptions as n_exc
@@ -3722,17 +3724,13 @@ class TestNeutronDbPluginV2(base.BaseTestCase):
                 exception = n_exc.IpAddressGenerationFailure(net_id='n')
                 generate.side_effect = exception
 
-                # I want the side_effect to throw an exception once but I
-                # didn't see a way to do this.  So, let it throw twice and
-                # catch the second one.  Check below to ensure that
-                # _try_generate_ip was called twice.
-                try:
-                    db_base_plugin_v2.NeutronDbPluginV2._generate_ip('c', 's')
-                except n_exc.IpAddressGenerationFailure:
-                    pass
+                self.assertRaises(
+                    n_exc.IpAddressGenerationFailure,
+                    db_base_plugin_v2.NeutronDbPluginV2._generate_ip,
+                    'c', 's')
 
-        self.assertEqual(2, generate.call_count)
-        rebuild.assert_called_once_with('c', 's')
+        generate.assert_called_once_with('c', 's')
+        self.assertEqual(0, rebuild.call_count)
 
     def test_rebuild_availability_ranges(self):
         pools = [{'id': 'a',
@@ -3759,11 +3757,15 @@ class TestNeutronDbPluginV2(base.BaseTestCase):
         pool_qry.with_lockmode.return_value = pool_qry
         pool_qry.filter_by.return_value = pools
 
+        range_qry = mock.Mock()
+
         def return_queries_side_effect(*args, **kwargs):
             if args[0] == models_v2.IPAllocation:
                 return ip_qry
             if args[0] == models_v2.IPAllocationPool:
                 return pool_qry
+            if args[0] == models_v2.IPAvailabilityRange:
+                return range_qry
 
         context = mock.Mock()
         context.session.query.side_effect = return_queries_side_effect
@@ -3780,6 +3782,215 @@ class TestNeutronDbPluginV2(base.BaseTestCase):
                           ['a', '192.168.1.8', '192.168.1.10'],
                           ['b', '192.168.1.100', '192.168.1.109'],
                           ['b', '192.168.1.112', '192.168.1.120']], actual)
+        range_qry.filter_by.assert_has_calls(
+            [mock.call(allocation_pool_id='a'), mock.call().delete(),
+             mock.call(allocation_pool_id='b'), mock.call().delete()])
+
+    def test_try_generate_ip_optimistic_retries_on_conflict(self):
+        cfg.CONF.set_override('ip_allocation_strategy', 'optimistic')
+        context = mock.Mock()
+        range_qry = context.session.query.return_value.join.return_value
+        subnet_qry = range_qry.filter_by.return_value
+        subnet_qry.with_lockmode.return_value = subnet_qry
+        subnet_qry.all.return_value = [('a', '10.0.0.2', '10.0.0.10')]
+        subnets = [{'id': 's', 'cidr': '10.0.0.0/24', 'network_id': 'n'}]
+        with mock.patch.object(db_base_plugin_v2.NeutronDbPluginV2,
+                               '_claim_ip_from_range') as claim:
+            claim.side_effect = [None, '10.0.0.5']
+            result = db_base_plugin_v2.NeutronDbPluginV2._try_generate_ip(
+                context, subnets)
+
+        self.assertEqual({'ip_address': '10.0.0.5', 'subnet_id': 's'},
+                         result)
+        self.assertEqual(2, claim.call_count)
+        # The ranges are read again with a locking read after a lost race
+        subnet_qry.with_lockmode.assert_called_once_with('update')
+
+    def test_try_generate_ip_optimistic_exhausted(self):
+        cfg.CONF.set_override('ip_allocation_strategy', 'optimistic')
+        context = mock.Mock()
+        range_qry = context.session.query.return_value.join.return_value
+        range_qry.filter_by.return_value.all.return_value = []
+        subnets = [{'id': 's', 'cidr': '10.0.0.0/24', 'network_id': 'n'}]
+        self.assertRaises(
+            n_exc.IpAddressGenerationFailure,
+            db_base_plugin_v2.NeutronDbPluginV2._try_generate_ip,
+            context, subnets)
+
+    def _claim_ip(self, first_ip, last_ip, updated=1):
+        context = mock.Mock()
+        cas_qry = context.session.query.return_value.filter_by.return_value
+        cas_qry.update.return_value = updated
+        cas_qry.delete.return_value = updated
+        ip = db_base_plugin_v2.NeutronDbPluginV2._claim_ip_from_range(
+            context, 'a', first_ip, last_ip)
+        return ip, context, cas_qry
+
+    def test_claim_ip_from_single_address_range(self):
+        ip, context, cas_qry = self._claim_ip('10.0.0.2', '10.0.0.2')
+        self.assertEqual('10.0.0.2', ip)
+        cas_qry.delete.assert_called_once_with(synchronize_session=False)
+        context.session.query.return_value.filter_by.assert_called_once_with(
+            allocation_pool_id='a', first_ip='10.0.0.2', last_ip='10.0.0.2')
+
+    def test_claim_ip_from_range_splits_range(self):
+        with mock.patch('random.randint', return_value=3):
+            ip, context, cas_qry = self._claim_ip('10.0.0.2', '10.0.0.10')
+        self.assertEqual('10.0.0.5', ip)
+        cas_qry.update.assert_called_once_with(
+            {'last_ip': '10.0.0.4'}, synchronize_session=False)
+        added = context.session.add.call_args[0][0]
+        self.assertEqual(['a', '10.0.0.6', '10.0.0.10'],
+                         [added.allocation_pool_id, added.first_ip,
+                          added.last_ip])
+
+    def test_claim_ip_from_range_lost_race(self):
+        with mock.patch('random.randint', return_value=3):
+            ip, context, cas_qry = self._claim_ip('10.0.0.2', '10.0.0.10',
+                                                  updated=0)
+        self.assertIsNone(ip)
+        self.assertFalse(context.session.add.called)
+
+
+class TestIpRelease(NeutronDbPluginV2TestCase):
+
+    def _get_ranges(self, subnet_id):
+        ctx = context.get_admin_context()
+        ranges = (ctx.session.query(models_v2.IPAvailabilityRange).
+                  join(models_v2.IPAllocationPool).
+                  filter_by(subnet_id=subnet_id))
+        return sorted((netaddr.IPAddress(r['first_ip']),
+                       netaddr.IPAddress(r['last_ip'])) for r in ranges)
+
+    def _create_ports(self, net_id, count):
+        ports = []
+        for i in range(count):
+            res = self._create_port(self.fmt, net_id=net_id)
+            ports.append(self.deserialize(self.fmt, res)['port'])
+        return ports
+
+    def test_delete_port_coalesces_ranges(self):
+        with self.subnet(cidr='10.0.0.0/24') as subnet:
+            subnet_id = subnet['subnet']['id']
+            ports = self._create_ports(subnet['subnet']['network_id'], 3)
+            # Free the middle address first, then its neighbours
+            for port in (ports[1], ports[0], ports[2]):
+                self._delete('ports', port['id'])
+            self.assertEqual([(netaddr.IPAddress('10.0.0.2'),
+                               netaddr.IPAddress('10.0.0.254'))],
+                             self._get_ranges(subnet_id))
+
+    def test_update_port_releases_removed_ip(self):
+        with self.subnet(cidr='10.0.0.0/24') as subnet:
+            subnet_id = subnet['subnet']['id']
+            ports = self._create_ports(subnet['subnet']['network_id'], 2)
+            data = {'port': {'fixed_ips': [{'subnet_id': subnet_id,
+                                            'ip_address': '10.0.0.100'}]}}
+            req = self.new_update_request('ports', data, ports[0]['id'])
+            req.get_response(self.api)
+            self.assertEqual([(netaddr.IPAddress('10.0.0.2'),
+                               netaddr.IPAddress('10.0.0.2')),
+                              (netaddr.IPAddress('10.0.0.4'),
+                               netaddr.IPAddress('10.0.0.99')),
+                              (netaddr.IPAddress('10.0.0.101'),
+                               netaddr.IPAddress('10.0.0.254'))],
+                             self._get_ranges(subnet_id))
+            for port in ports:
+                self._delete('ports', port['id'])
+
+    def test_release_does_not_scan_pool(self):
+        with self.subnet(cidr='10.0.0.0/8') as subnet:
+            ports = self._create_ports(subnet['subnet']['network_id'], 1)
+            with contextlib.nested(
+                mock.patch.object(netaddr, 'IPSet'),
+                mock.patch.object(netaddr, 'iter_iprange')
+            ) as (ipset, iter_iprange):
+                self._delete('ports', ports[0]['id'])
+            self.assertFalse(ipset.called)
+            self.assertFalse(iter_iprange.called)
+            self.assertEqual([(netaddr.IPAddress('10.0.0.2'),
+                               netaddr.IPAddress('10.255.255.254'))],
+                             self._get_ranges(subnet['subnet']['id']))
+
+    def test_release_ip_outside_pool(self):
+        with self.subnet(cidr='10.0.0.0/24',
+                         allocation_pools=[{'start': '10.0.0.10',
+                                            'end': '10.0.0.20'}]) as subnet:
+            subnet_id = subnet['subnet']['id']
+            kwargs = {'fixed_ips': [{'subnet_id': subnet_id,
+                                     'ip_address': '10.0.0.100'}]}
+            res = self._create_port(self.fmt,
+                                    net_id=subnet['subnet']['network_id'],
+                                    **kwargs)
+            port = self.deserialize(self.fmt, res)
+            self._delete('ports', port['port']['id'])
+            self.assertEqual([(netaddr.IPAddress('10.0.0.10'),
+                               netaddr.IPAddress('10.0.0.20'))],
+                             self._get_ranges(subnet_id))
+
+    def test_rebuild_ip_availability(self):
+        with self.subnet(cidr='10.0.0.0/24') as subnet:
+            subnet_id = subnet['subnet']['id']
+            ports = self._create_ports(subnet['subnet']['network_id'], 2)
+            ctx = context.get_admin_context()
+            ctx.session.query(models_v2.IPAvailabilityRange).delete()
+            self.assertEqual(
+                1, rebuild_ip_availability.rebuild_subnets(ctx, [subnet_id]))
+            self.assertEqual([(netaddr.IPAddress('10.0.0.4'),
+                               netaddr.IPAddress('10.0.0.254'))],
+                             self._get_ranges(subnet_id))
+            for port in ports:
+                self._delete('ports', port['id'])
+
+
+class TestOptimisticIpAllocation(NeutronDbPluginV2TestCase):
+
+    def setUp(self):
+        super(TestOptimisticIpAllocation, self).setUp()
+        cfg.CONF.set_override('ip_allocation_strategy', 'optimistic')
+
+    def test_allocate_whole_pool(self):
+        with self.subnet(cidr='10.0.0.0/29') as subnet:
+            net_id = subnet['subnet']['network_id']
+            ports = []
+            for i in range(5):
+                res = self._create_port(self.fmt, net_id=net_id)
+                ports.append(self.deserialize(self.fmt, res)['port'])
+            allocated = set(p['fixed_ips'][0]['ip_address'] for p in ports)
+            self.assertEqual(set(['10.0.0.2', '10.0.0.3', '10.0.0.4',
+                                  '10.0.0.5', '10.0.0.6']), allocated)
+            res = self._create_port(self.fmt, net_id=net_id)
+            self.assertEqual(webob.exc.HTTPConflict.code, res.status_int)
+            for port in ports:
+                self._delete('ports', port['id'])
+
+    def test_allocate_after_lost_race(self):
+        cfg.CONF.set_override('ip_allocation_retries', 2)
+        claim = db_base_plugin_v2.NeutronDbPluginV2._claim_ip_from_range
+        claimed = []
+
+        def lose_first_race(context, pool_id, first_ip, last_ip):
+            if not claimed:
+                # Another allocation takes the first address of the range
+                # between the read of the range and its update
+                claimed.append(first_ip)
+                context.session.query(models_v2.IPAvailabilityRange).filter_by(
+                    allocation_pool_id=pool_id).update(
+                        {'first_ip': str(netaddr.IPAddress(first_ip) + 1)},
+                        synchronize_session=False)
+            return claim(context, pool_id, first_ip, last_ip)
+
+        with self.subnet(cidr='10.0.0.0/29') as subnet:
+            with mock.patch.object(db_base_plugin_v2.NeutronDbPluginV2,
+                                   '_claim_ip_from_range',
+                                   side_effect=lose_first_race) as m_claim:
+                res = self._create_port(self.fmt,
+                                        net_id=subnet['subnet']['network_id'])
+            port = self.deserialize(self.fmt, res)['port']
+            self.assertEqual(2, m_claim.call_count)
+            self.assertNotEqual('10.0.0.2',
+                                port['fixed_ips'][0]['ip_address'])
+            self._delete('ports', port['id'])
 
 
 class NeutronDbPluginV2AsMixinTestCase(base.BaseTestCase):
@@ -14,11 +14,14 @@
 # limitations under the License.
 
 import mock
+from oslo.config import cfg
 
 from neutron.common import constants
 from neutron.common import exceptions as n_exc
 from neutron.db import dhcp_rpc_base
+from neutron.db import l3_rpc_base
 from neutron.openstack.common.db import exception as db_exc
+from neutron.plugins.common import constants as plugin_constants
 from neutron.tests import base
 
 
@@ -47,6 +50,61 @@ class TestDhcpRpcCallbackMixin(base.BaseTestCase):
 
         self.assertEqual(len(self.log.mock_calls), 1)
 
+    def _setup_networks_info(self):
+        self.plugin.get_networks.return_value = [dict(id='a'), dict(id='b')]
+        self.plugin.get_subnets.return_value = [
+            dict(id='s1', network_id='a')]
+        self.plugin.get_ports.return_value = [
+            dict(id='p2', network_id='a'), dict(id='p1', network_id='a'),
+            dict(id='p3', network_id='b')]
+
+    def test_get_active_networks_info(self):
+        self._setup_networks_info()
+        networks = self.callbacks.get_active_networks_info(mock.Mock(),
+                                                           host='host')
+        self.assertEqual(
+            [dict(id='a', subnets=[dict(id='s1', network_id='a')],
+                  ports=[dict(id='p2', network_id='a'),
+                         dict(id='p1', network_id='a')]),
+             dict(id='b', subnets=[], ports=[dict(id='p3', network_id='b')])],
+            networks)
+        self.plugin.get_subnets.assert_called_once_with(
+            mock.ANY, filters=dict(network_id=['a', 'b'], enable_dhcp=[True]))
+
+    def test_get_active_networks_digest(self):
+        self._setup_networks_info()
+        digests = self.callbacks.get_active_networks_digest(mock.Mock(),
+                                                            host='host')
+        self.assertEqual(['a', 'b'], [d['id'] for d in digests])
+        self.assertNotEqual(digests[0]['digest'], digests[1]['digest'])
+
+        # The digest does not depend on the order of the ports
+        self.plugin.get_ports.return_value.reverse()
+        self.assertEqual(digests, self.callbacks.get_active_networks_digest(
+            mock.Mock(), host='host'))
+
+        self.plugin.get_ports.return_value[0]['mac_address'] = 'fa:16'
+        self.assertNotEqual(digests, self.callbacks.get_active_networks_digest(
+            mock.Mock(), host='host'))
+
+    def test_get_networks_info(self):
+        self._setup_networks_info()
+        digests = self.callbacks.get_active_networks_digest(mock.Mock(),
+                                                            host='host')
+        networks = self.callbacks.get_networks_info(
+            mock.Mock(), network_ids=['a', 'b'], host='host')
+        self.plugin.get_networks.assert_called_with(
+            mock.ANY, filters=dict(id=['a', 'b']))
+        self.assertEqual(digests,
+                         [dict(id=n['id'], digest=n['digest'])
+                          for n in networks])
+        self.assertEqual(['p2', 'p1'], [p['id'] for p in networks[0]['ports']])
+
+    def test_get_networks_info_no_network(self):
+        self.assertEqual([], self.callbacks.get_networks_info(
+            mock.Mock(), network_ids=[], host='host'))
+        self.assertFalse(self.plugin.get_networks.called)
+
     def _test__port_action_with_failures(self, exc=None, action=None):
         port = {
             'network_id': 'foo_network_id',
@@ -231,3 +289,88 @@ class TestDhcpRpcCallbackMixin(base.BaseTestCase):
                                                        device_id=['devid'])),
             mock.call.update_port(mock.ANY, 'port_id',
                                   dict(port=port_update))])
+
+
+class TestL3RpcCallbackMixin(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestL3RpcCallbackMixin, self).setUp()
+        mock.patch('neutron.manager.NeutronManager.get_plugin').start()
+        get_service_plugins = mock.patch(
+            'neutron.manager.NeutronManager.get_service_plugins').start()
+        self.l3plugin = mock.MagicMock()
+        get_service_plugins.return_value = {
+            plugin_constants.L3_ROUTER_NAT: self.l3plugin}
+        mock.patch.object(l3_rpc_base.L3RpcCallbackMixin,
+                          '_router_delta_cache', new=None).start()
+        self.callbacks = l3_rpc_base.L3RpcCallbackMixin()
+
+    def _router(self, interfaces=(), floating_ips=()):
+        return {'id': 'r1', 'admin_state_up': True,
+                constants.INTERFACE_KEY: [{'id': i} for i in interfaces],
+                constants.FLOATINGIP_KEY: [
+                    {'id': fip_id, 'fixed_ip_address': fixed_ip}
+                    for fip_id, fixed_ip in floating_ips]}
+
+    def _sync_routers(self, router, revisions=None):
+        self.l3plugin.get_sync_data.return_value = [router]
+        return self.callbacks.sync_routers(mock.Mock(), host='host',
+                                           revisions=revisions)[0]
+
+    def test_get_router_digest_ignores_order(self):
+        router = self._router(interfaces=['a', 'b'])
+        reordered = self._router(interfaces=['b', 'a'])
+        self.assertEqual(l3_rpc_base.get_router_digest(router),
+                         l3_rpc_base.get_router_digest(reordered))
+        changed = self._router(interfaces=['a'])
+        self.assertNotEqual(l3_rpc_base.get_router_digest(router),
+                            l3_rpc_base.get_router_digest(changed))
+
+    def test_sync_routers_full(self):
+        router = self._router(interfaces=['a'])
+        result = self._sync_routers(router)
+        self.assertEqual(dict(router,
+                              revision=l3_rpc_base.get_router_digest(router)),
+                         result)
+        self.assertNotIn('revision', router)
+
+    def test_sync_routers_delta(self):
+        revision = self._sync_routers(self._router(
+            interfaces=['a', 'b'],
+            floating_ips=[('f1', '10.0.0.1'), ('f2', '10.0.0.2')]))['revision']
+        router = self._router(
+            interfaces=['a'],
+            floating_ips=[('f1', '10.0.0.1'), ('f2', '10.0.0.3'),
+                          ('f3', '10.0.0.4')])
+        result = self._sync_routers(router, revisions={'r1': revision})
+        self.assertEqual(
+            {'id': 'r1', 'admin_state_up': True, 'delta': True,
+             'base_revision': revision,
+             'revision': l3_rpc_base.get_router_digest(router),
+             constants.INTERFACE_KEY: [],
+             constants.INTERFACE_KEY + constants.REMOVED_KEY_SUFFIX: ['b'],
+             constants.FLOATINGIP_KEY: router[constants.FLOATINGIP_KEY][1:],
+             constants.FLOATINGIP_KEY + constants.REMOVED_KEY_SUFFIX: []},
+            result)
+
+    def test_sync_routers_unknown_revision(self):
+        self._sync_routers(self._router(interfaces=['a']))
+        result = self._sync_routers(self._router(),
+                                    revisions={'r1': 'unknown'})
+        self.assertNotIn('delta', result)
+        self.assertEqual([], result[constants.INTERFACE_KEY])
+
+    def test_sync_routers_delta_cache_disabled(self):
+        cfg.CONF.set_override('router_delta_cache_size', 0)
+        self.addCleanup(cfg.CONF.clear_override, 'router_delta_cache_size')
+        revision = self._sync_routers(self._router())['revision']
+        result = self._sync_routers(self._router(),
+                                    revisions={'r1': revision})
+        self.assertNotIn('delta', result)
+
+    def test_router_delta_cache_size(self):
+        cache = l3_rpc_base.RouterDeltaCache(1)
+        revision = cache.get_delta({'id': 'r1'})['revision']
+        cache.get_delta({'id': 'r2'})
+        self.assertNotIn('delta', cache.get_delta({'id': 'r1'}, revision))
+        self.assertTrue(cache.get_delta({'id': 'r1'}, revision)['delta'])
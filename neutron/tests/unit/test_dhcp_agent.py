@@ -15,6 +15,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
 import copy
 import os
 import sys
@@ -249,6 +250,9 @@ class TestDhcpAgent(base.BaseTestCase):
     def _test_sync_state_helper(self, known_networks, active_networks):
         with mock.patch(DHCP_PLUGIN) as plug:
             mock_plugin = mock.Mock()
+            # The plugin does not support network digests
+            mock_plugin.get_active_networks_digest.side_effect = (
+                common.UnsupportedRpcVersion(version='1.5'))
             mock_plugin.get_active_networks_info.return_value = active_networks
             plug.return_value = mock_plugin
 
@@ -300,6 +304,7 @@ class TestDhcpAgent(base.BaseTestCase):
     def test_sync_state_plugin_error(self):
         with mock.patch(DHCP_PLUGIN) as plug:
             mock_plugin = mock.Mock()
+            mock_plugin.get_active_networks_digest.side_effect = Exception
             mock_plugin.get_active_networks_info.side_effect = Exception
             plug.return_value = mock_plugin
 
@@ -310,6 +315,57 @@ class TestDhcpAgent(base.BaseTestCase):
                 self.assertTrue(log.called)
                 self.assertTrue(dhcp.needs_resync)
 
+    def _test_sync_state_digest(self, digests, cached_digests):
+        cache = dhcp_agent.NetworkCache()
+        for network_id, digest in cached_digests.items():
+            cache.put(dhcp.NetModel(True, dict(id=network_id, digest=digest,
+                                               subnets=[], ports=[])))
+        with mock.patch(DHCP_PLUGIN) as plug:
+            mock_plugin = mock.Mock()
+            mock_plugin.get_active_networks_digest.return_value = [
+                {'id': network_id, 'digest': digest}
+                for network_id, digest in digests.items()]
+            mock_plugin.get_networks_info.side_effect = lambda ids: [
+                dhcp.NetModel(True, dict(id=network_id, subnets=[], ports=[]))
+                for network_id in ids]
+            plug.return_value = mock_plugin
+            dhcp_agent_obj = dhcp_agent.DhcpAgent(HOSTNAME)
+            dhcp_agent_obj.cache = cache
+            with contextlib.nested(
+                mock.patch.object(dhcp_agent_obj,
+                                  'safe_configure_dhcp_for_network'),
+                mock.patch.object(dhcp_agent_obj, 'disable_dhcp_helper')
+            ) as (configure, disable):
+                dhcp_agent_obj.sync_state()
+        self.assertFalse(dhcp_agent_obj.needs_resync)
+        self.assertFalse(mock_plugin.get_active_networks_info.called)
+        configured = [args[0].id for args, kwargs in configure.call_args_list]
+        disabled = [args[0] for args, kwargs in disable.call_args_list]
+        return mock_plugin.get_networks_info, configured, disabled
+
+    def test_sync_state_digest_unchanged_networks(self):
+        get_info, configured, disabled = self._test_sync_state_digest(
+            {'a': '1', 'b': '2'}, {'a': '1', 'b': '2'})
+        self.assertFalse(get_info.called)
+        self.assertEqual([], configured)
+        self.assertEqual([], disabled)
+
+    def test_sync_state_digest_changed_networks(self):
+        get_info, configured, disabled = self._test_sync_state_digest(
+            {'a': '1', 'b': '3', 'c': '4'}, {'a': '1', 'b': '2', 'd': '5'})
+        get_info.assert_called_once_with(['b', 'c'])
+        self.assertEqual(['b', 'c'], configured)
+        self.assertEqual(['d'], disabled)
+
+    def test_sync_state_digest_pages(self):
+        cfg.CONF.set_override('sync_networks_page_size', 2)
+        digests = dict((str(i), str(i)) for i in range(5))
+        get_info, configured, disabled = self._test_sync_state_digest(
+            digests, {})
+        self.assertEqual([mock.call(['0', '1']), mock.call(['2', '3']),
+                          mock.call(['4'])], get_info.call_args_list)
+        self.assertEqual(sorted(digests), configured)
+
     def test_periodic_resync(self):
         dhcp = dhcp_agent.DhcpAgent(HOSTNAME)
         with mock.patch.object(dhcp_agent.eventlet, 'spawn') as spawn:
@@ -645,6 +701,33 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
                 mock.call().disable()
             ])
 
+    def test_enable_isolated_metadata_proxy_shared(self):
+        self.dhcp.shared_metadata_proxy = mock.Mock()
+        class_path = 'neutron.agent.linux.external_process.ProcessManager'
+        with mock.patch(class_path) as ext_process:
+            self.dhcp.enable_isolated_metadata_proxy(fake_network)
+            # A proxy started for the network alone is stopped
+            self.assertTrue(ext_process.return_value.disable.called)
+            self.assertFalse(ext_process.return_value.enable.called)
+        self.dhcp.shared_metadata_proxy.add.assert_called_once_with(
+            'qdhcp-12345678-1234-5678-1234567890ab', dhcp.METADATA_PORT,
+            network_id='12345678-1234-5678-1234567890ab', router_id=None)
+
+    def test_enable_isolated_metadata_proxy_shared_with_metadata_network(
+            self):
+        cfg.CONF.set_override('enable_metadata_network', True)
+        self.dhcp.shared_metadata_proxy = mock.Mock()
+        self.dhcp.enable_isolated_metadata_proxy(fake_meta_network)
+        self.dhcp.shared_metadata_proxy.add.assert_called_once_with(
+            'qdhcp-12345678-1234-5678-1234567890ab', dhcp.METADATA_PORT,
+            network_id=None, router_id='forzanapoli')
+
+    def test_disable_isolated_metadata_proxy_shared(self):
+        self.dhcp.shared_metadata_proxy = mock.Mock()
+        self.dhcp.disable_isolated_metadata_proxy(fake_network)
+        self.dhcp.shared_metadata_proxy.remove.assert_called_once_with(
+            'qdhcp-12345678-1234-5678-1234567890ab')
+
     def test_enable_isolated_metadata_proxy_with_metadata_network(self):
         cfg.CONF.set_override('enable_metadata_network', True)
         cfg.CONF.set_override('debug', True)
@@ -677,26 +760,30 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
 
         with mock.patch.object(self.dhcp, 'enable_dhcp_helper') as enable:
             self.dhcp.network_create_end(None, payload)
-            enable.assertCalledOnceWith(fake_network.id)
+            self.dhcp.network_queue.wait()
+            enable.assert_called_once_with(fake_network.id)
 
     def test_network_update_end_admin_state_up(self):
         payload = dict(network=dict(id=fake_network.id, admin_state_up=True))
         with mock.patch.object(self.dhcp, 'enable_dhcp_helper') as enable:
             self.dhcp.network_update_end(None, payload)
-            enable.assertCalledOnceWith(fake_network.id)
+            self.dhcp.network_queue.wait()
+            enable.assert_called_once_with(fake_network.id)
 
     def test_network_update_end_admin_state_down(self):
         payload = dict(network=dict(id=fake_network.id, admin_state_up=False))
         with mock.patch.object(self.dhcp, 'disable_dhcp_helper') as disable:
             self.dhcp.network_update_end(None, payload)
-            disable.assertCalledOnceWith(fake_network.id)
+            self.dhcp.network_queue.wait()
+            disable.assert_called_once_with(fake_network.id)
 
     def test_network_delete_end(self):
         payload = dict(network_id=fake_network.id)
 
         with mock.patch.object(self.dhcp, 'disable_dhcp_helper') as disable:
             self.dhcp.network_delete_end(None, payload)
-            disable.assertCalledOnceWith(fake_network.id)
+            self.dhcp.network_queue.wait()
+            disable.assert_called_once_with(fake_network.id)
 
     def test_refresh_dhcp_helper_no_dhcp_enabled_networks(self):
         network = dhcp.NetModel(True, dict(id='net-id',
@@ -738,6 +825,7 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
         self.plugin.get_network_info.return_value = fake_network
 
         self.dhcp.subnet_update_end(None, payload)
+        self.dhcp.network_queue.wait()
 
         self.cache.assert_has_calls([mock.call.put(fake_network)])
         self.call_driver.assert_called_once_with('reload_allocations',
@@ -755,6 +843,7 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
         self.plugin.get_network_info.return_value = new_state
 
         self.dhcp.subnet_update_end(None, payload)
+        self.dhcp.network_queue.wait()
 
         self.cache.assert_has_calls([mock.call.put(new_state)])
         self.call_driver.assert_called_once_with('restart',
@@ -773,6 +862,7 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
         self.plugin.get_network_info.return_value = fake_network
 
         self.dhcp.subnet_delete_end(None, payload)
+        self.dhcp.network_queue.wait()
 
         self.cache.assert_has_calls([
             mock.call.get_network_by_subnet_id(
@@ -787,11 +877,14 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
         self.cache.get_network_by_id.return_value = fake_network
         self.cache.get_port_by_id.return_value = fake_port2
         self.dhcp.port_update_end(None, payload)
+        self.dhcp.network_queue.wait()
         self.cache.assert_has_calls(
             [mock.call.get_network_by_id(fake_port2.network_id),
              mock.call.put_port(mock.ANY)])
-        self.call_driver.assert_called_once_with('reload_allocations',
-                                                 fake_network)
+        self.call_driver.assert_called_once_with(
+            'reload_allocations', fake_network,
+            changed_ports=self.cache.pop_changed_ports.return_value)
+        self.cache.pop_changed_ports.assert_called_once_with(fake_network.id)
 
     def test_port_update_change_ip_on_port(self):
         payload = dict(port=vars(fake_port1))
@@ -800,11 +893,13 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
         updated_fake_port1.fixed_ips[0].ip_address = '172.9.9.99'
         self.cache.get_port_by_id.return_value = updated_fake_port1
         self.dhcp.port_update_end(None, payload)
+        self.dhcp.network_queue.wait()
         self.cache.assert_has_calls(
             [mock.call.get_network_by_id(fake_port1.network_id),
              mock.call.put_port(mock.ANY)])
         self.call_driver.assert_has_calls(
-            [mock.call.call_driver('reload_allocations', fake_network)])
+            [mock.call.call_driver('reload_allocations', fake_network,
+                                   changed_ports=mock.ANY)])
 
     def test_port_delete_end(self):
         payload = dict(port_id=fake_port2.id)
@@ -812,18 +907,33 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
         self.cache.get_port_by_id.return_value = fake_port2
 
         self.dhcp.port_delete_end(None, payload)
+        self.dhcp.network_queue.wait()
         self.cache.assert_has_calls(
             [mock.call.get_port_by_id(fake_port2.id),
              mock.call.get_network_by_id(fake_network.id),
              mock.call.remove_port(fake_port2)])
         self.call_driver.assert_has_calls(
-            [mock.call.call_driver('reload_allocations', fake_network)])
+            [mock.call.call_driver('reload_allocations', fake_network,
+                                   changed_ports=mock.ANY)])
+
+    def test_port_update_end_burst(self):
+        self.cache.get_network_by_id.return_value = fake_network
+        # The events are processed once the handlers have run
+        for port in (fake_port1, fake_port2, fake_port1):
+            self.dhcp.port_update_end(None, dict(port=vars(port)))
+        self.assertEqual(0, self.call_driver.call_count)
+        self.dhcp.network_queue.wait()
+        self.assertEqual(3, self.cache.put_port.call_count)
+        self.call_driver.assert_called_once_with('reload_allocations',
+                                                 fake_network,
+                                                 changed_ports=mock.ANY)
 
     def test_port_delete_end_unknown_port(self):
         payload = dict(port_id='unknown')
         self.cache.get_port_by_id.return_value = None
 
         self.dhcp.port_delete_end(None, payload)
+        self.dhcp.network_queue.wait()
 
         self.cache.assert_has_calls([mock.call.get_port_by_id('unknown')])
         self.assertEqual(self.call_driver.call_count, 0)
@@ -868,6 +978,21 @@ class TestDhcpPluginApiProxy(base.BaseTestCase):
         self.make_msg.assert_called_once_with('get_active_networks_info',
                                               host='foo')
 
+    def test_get_active_networks_digest(self):
+        self.proxy.get_active_networks_digest()
+        self.make_msg.assert_called_once_with('get_active_networks_digest',
+                                              host='foo')
+        self.assertEqual(dhcp_agent.NETWORKS_DIGEST_VERSION,
+                         self.call.call_args[1]['version'])
+
+    def test_get_networks_info(self):
+        self.call.return_value = [dict(id='netid', digest='d')]
+        retval = self.proxy.get_networks_info(['netid'])
+        self.assertEqual('d', retval[0].digest)
+        self.make_msg.assert_called_once_with('get_networks_info',
+                                              network_ids=['netid'],
+                                              host='foo')
+
     def test_create_dhcp_port(self):
         port_body = (
             {'port':
@@ -1031,12 +1156,109 @@ class TestNetworkCache(base.BaseTestCase):
         self.assertEqual(len(nc.port_lookup), 1)
         self.assertNotIn(fake_port2, fake_net.ports)
 
+    def test_pop_changed_ports(self):
+        fake_net = dhcp.NetModel(
+            True, dict(id='12345678-1234-5678-1234567890ab',
+                       tenant_id='aaaaaaaa-aaaa-aaaa-aaaaaaaaaaaa',
+                       subnets=[fake_subnet1],
+                       ports=[fake_port1]))
+        nc = dhcp_agent.NetworkCache()
+        self.assertIsNone(nc.pop_changed_ports(fake_net.id))
+        nc.put(fake_net)
+        nc.put_port(fake_port2)
+        nc.remove_port(fake_port1)
+        self.assertEqual(set([fake_port1.id, fake_port2.id]),
+                         nc.pop_changed_ports(fake_net.id))
+        self.assertEqual(set(), nc.pop_changed_ports(fake_net.id))
+        nc.put_port(fake_port1)
+        nc.put(fake_net)
+        self.assertEqual(set(), nc.pop_changed_ports(fake_net.id))
+
+    def test_digest(self):
+        fake_net = dhcp.NetModel(
+            True, dict(id='12345678-1234-5678-1234567890ab',
+                       tenant_id='aaaaaaaa-aaaa-aaaa-aaaaaaaaaaaa',
+                       subnets=[fake_subnet1],
+                       ports=[fake_port1, fake_port2],
+                       digest='abcd'))
+        nc = dhcp_agent.NetworkCache()
+        nc.put(fake_net)
+        self.assertEqual('abcd', nc.get_digest(fake_net.id))
+        # The cached network no longer matches the digest once modified
+        nc.remove_port(fake_port2)
+        self.assertIsNone(nc.get_digest(fake_net.id))
+        nc.put(fake_net)
+        nc.put_port(fake_port2)
+        self.assertIsNone(nc.get_digest(fake_net.id))
+        nc.put(fake_network)
+        self.assertIsNone(nc.get_digest(fake_network.id))
+
     def test_get_port_by_id(self):
         nc = dhcp_agent.NetworkCache()
         nc.put(fake_network)
         self.assertEqual(nc.get_port_by_id(fake_port1.id), fake_port1)
 
 
+class TestNetworkActionQueue(base.BaseTestCase):
+    def setUp(self):
+        super(TestNetworkActionQueue, self).setUp()
+        self.error_callback = mock.Mock()
+        self.queue = dhcp_agent.NetworkActionQueue(4, self.error_callback)
+        self.calls = []
+
+    def _action(self, name):
+        def action(*args):
+            self.calls.append((name,) + args)
+        return action
+
+    def _put(self, network_id, name):
+        self.queue.put(network_id, name, self._action(name), network_id)
+
+    def test_coalesce(self):
+        actions = [(name, None, (), 0) for name in
+                   ('enable', 'reload_allocations', 'disable', 'enable',
+                    'reload_allocations')]
+        self.assertEqual(['disable', 'enable'],
+                         [a[0] for a in self.queue.coalesce(actions)])
+        actions = [('reload_allocations', None, (), t) for t in range(3)]
+        self.assertEqual([actions[-1]], self.queue.coalesce(actions))
+
+    def test_actions_are_coalesced_per_network(self):
+        for name in ('reload_allocations', 'reload_allocations', 'refresh',
+                     'reload_allocations'):
+            self._put('net1', name)
+            self._put('net2', 'reload_allocations')
+        self.assertEqual({'queued_network_events': 8,
+                          'busy_networks': 2,
+                          'max_network_event_latency': 0},
+                         self.queue.get_state())
+        self.queue.wait()
+        self.assertEqual([('refresh', 'net1'),
+                          ('reload_allocations', 'net2')], self.calls)
+        state = self.queue.get_state()
+        self.assertEqual(0, state['queued_network_events'])
+        self.assertEqual(0, state['busy_networks'])
+
+    def test_actions_queued_while_busy(self):
+        def action(network_id):
+            self.calls.append(('first', network_id))
+            self._put(network_id, 'refresh')
+            self._put(network_id, 'refresh')
+        self.queue.put('net1', 'enable', action, 'net1')
+        self.queue.wait()
+        self.assertEqual([('first', 'net1'), ('refresh', 'net1')],
+                         self.calls)
+
+    def test_failing_action(self):
+        self.queue.put('net1', 'enable', mock.Mock(side_effect=Exception))
+        self._put('net1', 'refresh')
+        with mock.patch.object(dhcp_agent.LOG, 'exception') as log:
+            self.queue.wait()
+        self.assertTrue(log.called)
+        self.error_callback.assert_called_once_with()
+        self.assertEqual([('refresh', 'net1')], self.calls)
+
+
 class FakePort1:
     id = 'eeeeeeee-eeee-eeee-eeee-eeeeeeeeeeee'
 
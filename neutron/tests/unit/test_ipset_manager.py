@@ -0,0 +1,79 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from neutron.agent.linux import ipset_manager
+from neutron.tests import base
+
+IPSET_NAME = 'IPv4fake_sgid'
+
+
+class IpsetManagerTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(IpsetManagerTestCase, self).setUp()
+        self.execute = mock.patch(
+            'neutron.agent.linux.utils.execute').start()
+        self.ipset = ipset_manager.IpsetManager(root_helper='sudo')
+
+    def _assert_restore(self, lines):
+        self.execute.assert_called_once_with(
+            ['ipset', 'restore', '-exist'], root_helper='sudo',
+            process_input='\n'.join(lines) + '\n')
+        self.execute.reset_mock()
+
+    def test_get_name(self):
+        self.assertEqual('IPv6' + 'a' * 27,
+                         ipset_manager.get_name('a' * 36, 'IPv6'))
+
+    def test_set_members_creates_set(self):
+        self.ipset.set_members(IPSET_NAME, 'IPv4',
+                               ['10.0.0.3/32', '10.0.0.2/32'])
+        self._assert_restore(
+            ['create %s hash:net family inet -exist' % IPSET_NAME,
+             'flush %s' % IPSET_NAME,
+             'add %s 10.0.0.2/32' % IPSET_NAME,
+             'add %s 10.0.0.3/32' % IPSET_NAME])
+
+    def test_set_members_updates_in_place(self):
+        self.ipset.set_members(IPSET_NAME, 'IPv4',
+                               ['10.0.0.2/32', '10.0.0.3/32'])
+        self.execute.reset_mock()
+        self.ipset.set_members(IPSET_NAME, 'IPv4',
+                               ['10.0.0.3/32', '10.0.0.4/32'])
+        self._assert_restore(['add %s 10.0.0.4/32' % IPSET_NAME,
+                              'del %s 10.0.0.2/32' % IPSET_NAME])
+
+    def test_set_members_unchanged(self):
+        self.ipset.set_members(IPSET_NAME, 'IPv4', ['10.0.0.2/32'])
+        self.execute.reset_mock()
+        self.ipset.set_members(IPSET_NAME, 'IPv4', ['10.0.0.2/32'])
+        self.assertFalse(self.execute.called)
+
+    def test_destroy(self):
+        self.ipset.set_members(IPSET_NAME, 'IPv6', ['fe80::2/128'])
+        self.execute.reset_mock()
+        self.ipset.destroy(IPSET_NAME)
+        self.execute.assert_called_once_with(
+            ['ipset', 'destroy', IPSET_NAME], root_helper='sudo',
+            process_input=None)
+        self.assertEqual({}, self.ipset.ipsets)
+
+    def test_destroy_failure_keeps_set(self):
+        self.ipset.set_members(IPSET_NAME, 'IPv6', ['fe80::2/128'])
+        self.execute.side_effect = RuntimeError()
+        self.ipset.destroy(IPSET_NAME)
+        self.assertIn(IPSET_NAME, self.ipset.ipsets)
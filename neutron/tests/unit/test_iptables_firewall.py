@@ -1215,3 +1215,102 @@ class IptablesFirewallTestCase(base.BaseTestCase):
                  call.add_rule('ofake_dev', '-j $sg-fallback'),
                  call.add_rule('sg-chain', '-j ACCEPT')]
         self.v4filter_inst.assert_has_calls(calls)
+
+
+class IptablesFirewallIpsetTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(IptablesFirewallIpsetTestCase, self).setUp()
+        cfg.CONF.register_opts(a_cfg.ROOT_HELPER_OPTS, 'AGENT')
+        cfg.CONF.set_override('enable_ipset', True, group='SECURITYGROUP')
+        mock.patch('neutron.agent.linux.iptables_manager.'
+                   'IptablesManager').start()
+        mock.patch('neutron.agent.linux.ipset_manager.'
+                   'IpsetManager').start()
+        self.firewall = IptablesFirewallDriver()
+        self.iptables_inst = self.firewall.iptables
+        self.v4filter_inst = mock.Mock()
+        self.v6filter_inst = mock.Mock()
+        self.iptables_inst.ipv4 = {'filter': self.v4filter_inst}
+        self.iptables_inst.ipv6 = {'filter': self.v6filter_inst}
+        self.ipset_inst = self.firewall.ipset
+        self.ipset_inst.ipsets = {}
+        self.sg_id = _uuid()
+        self.ipset_name = ('IPv4' + self.sg_id)[:31]
+
+    def _fake_port(self, members):
+        rule = {'ethertype': 'IPv4',
+                'direction': 'ingress',
+                'protocol': 'tcp',
+                'port_range_min': 22,
+                'port_range_max': 22,
+                'remote_group_id': self.sg_id}
+        rules = [dict(rule, source_ip_prefix=member) for member in members]
+        return {'device': 'tapfake_dev',
+                'mac_address': 'ff:ff:ff:ff:ff:ff',
+                'fixed_ips': [FAKE_IP['IPv4']],
+                'security_group_source_groups': [self.sg_id] * len(members),
+                'security_group_rules': rules}
+
+    def test_prepare_port_filter_uses_ipset(self):
+        port = self._fake_port(['10.0.0.2/32', '10.0.0.3/32'])
+        self.firewall.prepare_port_filter(port)
+        rule = ('-p tcp -m tcp --dport 22 -m set --match-set %s src '
+                '-j RETURN' % self.ipset_name)
+        self.v4filter_inst.add_rule.assert_any_call('ifake_dev', rule)
+        rules = [args[1] for args, kwargs in
+                 self.v4filter_inst.add_rule.call_args_list
+                 if args[0] == 'ifake_dev']
+        self.assertEqual(1, len([r for r in rules if '--dport 22' in r]))
+        self.ipset_inst.set_members.assert_called_once_with(
+            self.ipset_name, 'IPv4', set(['10.0.0.2/32', '10.0.0.3/32']))
+
+    def test_prepare_port_filter_zero_prefix_member(self):
+        port = self._fake_port(['0.0.0.0/0'])
+        self.firewall.prepare_port_filter(port)
+        self.v4filter_inst.add_rule.assert_any_call(
+            'ifake_dev', '-s 0.0.0.0/0 -p tcp -m tcp --dport 22 -j RETURN')
+        self.assertFalse(self.ipset_inst.set_members.called)
+
+    def test_update_port_filter_members_only(self):
+        self.firewall.prepare_port_filter(
+            self._fake_port(['10.0.0.2/32']))
+        self.iptables_inst.reset_mock()
+        self.v4filter_inst.reset_mock()
+        self.firewall.update_port_filter(
+            self._fake_port(['10.0.0.2/32', '10.0.0.4/32']))
+        self.ipset_inst.set_members.assert_called_with(
+            self.ipset_name, 'IPv4', set(['10.0.0.2/32', '10.0.0.4/32']))
+        self.assertFalse(self.v4filter_inst.ensure_remove_chain.called)
+        self.assertFalse(self.iptables_inst.apply.called)
+
+    def test_update_port_filter_rules_changed(self):
+        self.firewall.prepare_port_filter(
+            self._fake_port(['10.0.0.2/32']))
+        self.iptables_inst.reset_mock()
+        port = self._fake_port(['10.0.0.2/32'])
+        port['security_group_rules'][0]['port_range_max'] = 23
+        port['security_group_rules'][0]['port_range_min'] = 23
+        self.firewall.update_port_filter(port)
+        self.v4filter_inst.add_rule.assert_any_call(
+            'ifake_dev', '-p tcp -m tcp --dport 23 -m set --match-set %s '
+            'src -j RETURN' % self.ipset_name)
+        self.iptables_inst.apply.assert_called_once_with()
+
+    def test_defer_apply_members_only_keeps_chains(self):
+        self.firewall.prepare_port_filter(
+            self._fake_port(['10.0.0.2/32']))
+        self.v4filter_inst.reset_mock()
+        with self.firewall.defer_apply():
+            self.firewall.update_port_filter(
+                self._fake_port(['10.0.0.4/32']))
+        self.assertFalse(self.v4filter_inst.ensure_remove_chain.called)
+        self.ipset_inst.set_members.assert_called_with(
+            self.ipset_name, 'IPv4', set(['10.0.0.4/32']))
+        self.iptables_inst.defer_apply_off.assert_called_once_with()
+
+    def test_remove_port_filter_destroys_unused_ipset(self):
+        port = self._fake_port(['10.0.0.2/32'])
+        self.firewall.prepare_port_filter(port)
+        self.ipset_inst.ipsets = {self.ipset_name: set(['10.0.0.2/32'])}
+        self.firewall.remove_port_filter(port)
+        self.ipset_inst.destroy.assert_called_once_with(self.ipset_name)
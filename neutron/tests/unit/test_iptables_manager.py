@@ -608,6 +608,79 @@ class IptablesManagerStateFulTestCase(base.BaseTestCase):
         tools.verify_mock_calls(self.execute, expected_calls_and_values)
 
 
+class IptablesManagerNoflushTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(IptablesManagerNoflushTestCase, self).setUp()
+        self.root_helper = 'sudo'
+        self.iptables = iptables_manager.IptablesManager(
+            root_helper=self.root_helper, noflush_apply=True)
+        self.execute = mock.patch.object(self.iptables, "execute",
+                                         return_value='').start()
+        self.filter = self.iptables.ipv4['filter']
+        self.filter.add_chain('big')
+        for i in range(1000):
+            self.filter.add_rule('big', '-s 10.0.%d.%d -j DROP' %
+                                 (i / 256, i % 256))
+        self.filter.add_chain('small')
+        self.filter.add_rule('INPUT', '-j $small')
+        self.iptables.apply()
+        self.execute.reset_mock()
+
+    def _assert_noflush_restore(self, lines):
+        self.execute.assert_called_once_with(
+            ['iptables-restore', '--noflush'],
+            process_input='\n'.join(lines) % IPTABLES_ARG + '\n',
+            root_helper=self.root_helper)
+
+    def test_first_apply_is_full(self):
+        iptables = iptables_manager.IptablesManager(
+            root_helper=self.root_helper, noflush_apply=True)
+        with mock.patch.object(iptables, "execute",
+                               return_value='') as execute:
+            iptables.apply()
+        execute.assert_any_call(['iptables-save', '-c'],
+                                root_helper=self.root_helper)
+
+    def test_apply_changed_chain_only(self):
+        self.filter.add_rule('small', '-j DROP')
+        self.iptables.apply()
+        # The 1000 rules of the unchanged chain are not applied again
+        self._assert_noflush_restore(['*filter',
+                                      ':%(bn)s-small - [0:0]',
+                                      '-A %(bn)s-small -j DROP',
+                                      'COMMIT'])
+
+    def test_apply_nothing_changed(self):
+        self.iptables.apply()
+        self.assertFalse(self.execute.called)
+
+    def test_apply_removed_chain(self):
+        self.filter.remove_chain('small')
+        self.iptables.apply()
+        self._assert_noflush_restore(['*filter',
+                                      ':%(bn)s-INPUT - [0:0]',
+                                      ':%(bn)s-small - [0:0]',
+                                      '-X %(bn)s-small',
+                                      'COMMIT'])
+
+    def test_apply_unwrapped_change_is_full(self):
+        self.filter.add_rule('FORWARD', '-j DROP', wrap=False)
+        self.iptables.apply()
+        self.execute.assert_any_call(['iptables-save', '-c'],
+                                     root_helper=self.root_helper)
+
+    def test_apply_after_failure_is_full(self):
+        self.filter.add_rule('small', '-j DROP')
+        self.execute.side_effect = RuntimeError()
+        self.assertRaises(RuntimeError, self.iptables.apply)
+        self.execute.reset_mock()
+        self.execute.side_effect = None
+        self.iptables.apply()
+        self.execute.assert_any_call(['iptables-save', '-c'],
+                                     root_helper=self.root_helper)
+
+
 class IptablesManagerStateLessTestCase(base.BaseTestCase):
 
     def setUp(self):
@@ -16,6 +16,7 @@
 import contextlib
 import copy
 
+import eventlet
 import mock
 from oslo.config import cfg
 from testtools import matchers
@@ -23,10 +24,10 @@ from testtools import matchers
 from neutron.agent.common import config as agent_config
 from neutron.agent import l3_agent
 from neutron.agent.linux import interface
+from neutron.agent.linux import ip_lib
 from neutron.common import config as base_config
 from neutron.common import constants as l3_constants
 from neutron.common import exceptions as n_exc
-from neutron.openstack.common import processutils
 from neutron.openstack.common import uuidutils
 from neutron.tests import base
 
@@ -91,6 +92,16 @@ class TestBasicRouterOperations(base.BaseTestCase):
             'neutron.openstack.common.loopingcall.FixedIntervalLoopingCall')
         self.looping_call_p.start()
 
+        collector_cls = l3_agent.NamespaceCollector
+
+        def new_collector(*args):
+            # Namespaces left by a test are destroyed before the next one
+            collector = collector_cls(*args)
+            self.addCleanup(collector.wait)
+            return collector
+        mock.patch('neutron.agent.l3_agent.NamespaceCollector',
+                   side_effect=new_collector).start()
+
     def test_router_info_create(self):
         id = _uuid()
         ri = l3_agent.RouterInfo(id, self.conf.root_helper,
@@ -274,6 +285,17 @@ class TestBasicRouterOperations(base.BaseTestCase):
     def test_routes_updated_no_namespace(self):
         self._test_routes_updated(namespace=False)
 
+    def _check_batch_executed(self, ri, commands):
+        if self.conf.use_namespaces:
+            cmd = ['ip', 'netns', 'exec', ri.ns_name, 'ip']
+        else:
+            cmd = ['ip']
+        args, kwargs = self.utils_exec.call_args
+        self.assertEqual(cmd + ['-force', '-batch', '-'], args[0])
+        self.assertEqual('sudo', kwargs['root_helper'])
+        self.assertEqual(sorted(commands),
+                         sorted(kwargs['process_input'].splitlines()))
+
     def _test_routes_updated(self, namespace=True):
         if not namespace:
             self.conf.set_override('use_namespaces', False)
@@ -294,28 +316,36 @@ class TestBasicRouterOperations(base.BaseTestCase):
         ri.router['routes'] = fake_new_routes
         agent.routes_updated(ri)
 
-        expected = [['ip', 'route', 'replace', 'to', '110.100.30.0/24',
-                    'via', '10.100.10.30'],
-                    ['ip', 'route', 'replace', 'to', '110.100.31.0/24',
-                     'via', '10.100.10.30']]
-
-        self._check_agent_method_called(agent, expected, namespace)
+        self._check_batch_executed(
+            ri, ['route replace to 110.100.30.0/24 via 10.100.10.30',
+                 'route replace to 110.100.31.0/24 via 10.100.10.30'])
 
         fake_new_routes = [{'destination': "110.100.30.0/24",
                             'nexthop': "10.100.10.30"}]
         ri.router['routes'] = fake_new_routes
         agent.routes_updated(ri)
-        expected = [['ip', 'route', 'delete', 'to', '110.100.31.0/24',
-                    'via', '10.100.10.30']]
 
-        self._check_agent_method_called(agent, expected, namespace)
+        self._check_batch_executed(
+            ri, ['route delete to 110.100.31.0/24 via 10.100.10.30'])
+
         fake_new_routes = []
         ri.router['routes'] = fake_new_routes
         agent.routes_updated(ri)
 
-        expected = [['ip', 'route', 'delete', 'to', '110.100.30.0/24',
-                    'via', '10.100.10.30']]
-        self._check_agent_method_called(agent, expected, namespace)
+        self._check_batch_executed(
+            ri, ['route delete to 110.100.30.0/24 via 10.100.10.30'])
+        self.assertEqual(3, self.utils_exec.call_count)
+        self.assertFalse(self.mock_ip.netns.execute.called)
+
+    def test_routes_updated_failure_ignored(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        ri = l3_agent.RouterInfo(_uuid(), self.conf.root_helper,
+                                 self.conf.use_namespaces,
+                                 {'routes': [{'destination': '10.0.0.0/8',
+                                              'nexthop': '1.2.3.4'}]})
+        self.utils_exec.side_effect = RuntimeError
+        agent.routes_updated(ri)
+        self.assertEqual(ri.router['routes'], ri.routes)
 
     def _verify_snat_rules(self, rules, router, negate=False):
         interfaces = router[l3_constants.INTERFACE_KEY]
@@ -445,7 +475,20 @@ class TestBasicRouterOperations(base.BaseTestCase):
             ri, {'id': _uuid()})
         self.assertEqual({fip_id: l3_constants.FLOATINGIP_STATUS_ACTIVE},
                          fip_statuses)
-        device.addr.add.assert_called_once_with(4, '15.1.2.3/32', '15.1.2.3')
+        device.addr.add.assert_called_once_with(4, '15.1.2.3/32', '15.1.2.3',
+                                                batch=mock.ANY)
+        self.send_arp.assert_called_once_with(ri, mock.ANY, '15.1.2.3')
+
+    def _fip_nat_rules(self, ri):
+        return set(str(rule) for rule in ri.iptables_manager.ipv4['nat'].rules
+                   if rule.tag == 'floating_ip')
+
+    def _expected_fip_nat_rules(self, agent, *addresses):
+        return set('-A %s-%s %s' % (l3_agent.iptables_manager.binary_name,
+                                    chain, rule)
+                   for floating_ip, fixed_ip in addresses
+                   for chain, rule in agent.floating_forward_rules(
+                       floating_ip, fixed_ip))
 
     def test_process_router_floating_ip_nat_rules_add(self):
         fip = {
@@ -456,16 +499,50 @@ class TestBasicRouterOperations(base.BaseTestCase):
 
         ri = mock.MagicMock()
         ri.router.get.return_value = [fip]
+        ri.floating_ip_nat_rules = {}
 
         agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
 
         agent.process_router_floating_ip_nat_rules(ri)
 
         nat = ri.iptables_manager.ipv4['nat']
-        nat.clear_rules_by_tag.assert_called_once_with('floating_ip')
         rules = agent.floating_forward_rules('15.1.2.3', '192.168.0.1')
         for chain, rule in rules:
             nat.add_rule.assert_any_call(chain, rule, tag='floating_ip')
+        self.assertFalse(nat.remove_rule.called)
+        self.assertEqual({fip['id']: ('15.1.2.3', '192.168.0.1')},
+                         ri.floating_ip_nat_rules)
+        ri.iptables_manager.apply.assert_called_once_with()
+
+    def test_process_router_floating_ip_nat_rules_changes_only(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        fips = [{'id': _uuid(), 'floating_ip_address': '15.1.2.%s' % i,
+                 'fixed_ip_address': '192.168.0.%s' % i}
+                for i in range(3)]
+        router = {'id': _uuid(), l3_constants.FLOATINGIP_KEY: fips}
+        ri = l3_agent.RouterInfo(router['id'], self.conf.root_helper,
+                                 self.conf.use_namespaces, router)
+        mock.patch.object(ri.iptables_manager, 'apply').start()
+        agent.process_router_floating_ip_nat_rules(ri)
+
+        # Remove the first floating IP and remap the second one
+        remapped = dict(fips[1], fixed_ip_address='192.168.0.9')
+        router[l3_constants.FLOATINGIP_KEY] = [remapped, fips[2]]
+        nat = ri.iptables_manager.ipv4['nat']
+        with contextlib.nested(
+                mock.patch.object(nat, 'add_rule', wraps=nat.add_rule),
+                mock.patch.object(nat, 'remove_rule', wraps=nat.remove_rule)
+        ) as (add_rule, remove_rule):
+            agent.process_router_floating_ip_nat_rules(ri)
+
+        self.assertEqual(
+            self._expected_fip_nat_rules(agent, ('15.1.2.1', '192.168.0.9'),
+                                         ('15.1.2.2', '192.168.0.2')),
+            self._fip_nat_rules(ri))
+        self.assertEqual(3, add_rule.call_count)
+        self.assertEqual(6, remove_rule.call_count)
+        self.assertEqual(set([remapped['id'], fips[2]['id']]),
+                         set(ri.floating_ip_nat_rules))
 
     @mock.patch('neutron.agent.linux.ip_lib.IPDevice')
     def test_process_router_floating_ip_addresses_remove(self, IPDevice):
@@ -480,19 +557,23 @@ class TestBasicRouterOperations(base.BaseTestCase):
         fip_statuses = agent.process_router_floating_ip_addresses(
             ri, {'id': _uuid()})
         self.assertEqual({}, fip_statuses)
-        device.addr.delete.assert_called_once_with(4, '15.1.2.3/32')
+        device.addr.delete.assert_called_once_with(4, '15.1.2.3/32',
+                                                   batch=mock.ANY)
 
     def test_process_router_floating_ip_nat_rules_remove(self):
         ri = mock.MagicMock()
         ri.router.get.return_value = []
+        ri.floating_ip_nat_rules = {_uuid(): ('15.1.2.3', '192.168.0.1')}
 
         agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
 
         agent.process_router_floating_ip_nat_rules(ri)
 
         nat = ri.iptables_manager.ipv4['nat']
-        nat = ri.iptables_manager.ipv4['nat`']
-        nat.clear_rules_by_tag.assert_called_once_with('floating_ip')
+        rules = agent.floating_forward_rules('15.1.2.3', '192.168.0.1')
+        for chain, rule in rules:
+            nat.remove_rule.assert_any_call(chain, rule)
+        self.assertEqual({}, ri.floating_ip_nat_rules)
 
     @mock.patch('neutron.agent.linux.ip_lib.IPDevice')
     def test_process_router_floating_ip_addresses_remap(self, IPDevice):
@@ -542,7 +623,6 @@ class TestBasicRouterOperations(base.BaseTestCase):
     @mock.patch('neutron.agent.linux.ip_lib.IPDevice')
     def test_process_router_floating_ip_with_device_add_error(self, IPDevice):
         IPDevice.return_value = device = mock.Mock()
-        device.addr.add.side_effect = processutils.ProcessExecutionError
         device.addr.list.return_value = []
         fip_id = _uuid()
         fip = {
@@ -555,12 +635,66 @@ class TestBasicRouterOperations(base.BaseTestCase):
 
         agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
 
-        fip_statuses = agent.process_router_floating_ip_addresses(
-            ri, {'id': _uuid()})
+        # The address is only added when the batch is run
+        with mock.patch.object(ip_lib.IpBatch, 'execute',
+                               side_effect=RuntimeError):
+            fip_statuses = agent.process_router_floating_ip_addresses(
+                ri, {'id': _uuid()})
 
         self.assertEqual({fip_id: l3_constants.FLOATINGIP_STATUS_ERROR},
                          fip_statuses)
 
+    def test_process_router_floating_ip_addresses_batch(self):
+        fips = [{'id': _uuid(), 'port_id': _uuid(),
+                 'floating_ip_address': '15.1.2.%d' % i,
+                 'fixed_ip_address': '192.168.0.%d' % i}
+                for i in range(3)]
+        ri = mock.MagicMock()
+        ri.router.get.return_value = fips
+        ri.ns_name = 'qrouter-1'
+        self.conf.set_override('use_namespaces', True)
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        ex_gw_port = {'id': _uuid()}
+        interface_name = agent.get_external_device_name(ex_gw_port['id'])
+        self.utils_exec.return_value = ('inet 15.1.2.9/32 scope global %s\n'
+                                        % interface_name)
+
+        fip_statuses = agent.process_router_floating_ip_addresses(
+            ri, ex_gw_port)
+
+        self.assertEqual(
+            dict((fip['id'], l3_constants.FLOATINGIP_STATUS_ACTIVE)
+                 for fip in fips), fip_statuses)
+        # One call to list the addresses and one for the batch
+        self.assertEqual(2, self.utils_exec.call_count)
+        self._check_batch_executed(
+            ri, ['addr add 15.1.2.%d/32 brd 15.1.2.%d scope global dev %s' %
+                 (i, i, interface_name) for i in range(3)] +
+            ['addr del 15.1.2.9/32 dev %s' % interface_name])
+        self.assertEqual(3, self.send_arp.call_count)
+
+    @mock.patch('neutron.agent.linux.ip_lib.IPDevice')
+    def test_process_router_floating_ip_with_batch_error(self, IPDevice):
+        IPDevice.return_value = device = mock.Mock()
+        device.addr.list.side_effect = [[], [{'cidr': '15.1.2.1/32'}]]
+        fips = [{'id': _uuid(), 'port_id': _uuid(),
+                 'floating_ip_address': '15.1.2.%d' % i,
+                 'fixed_ip_address': '192.168.0.%d' % i}
+                for i in range(1, 3)]
+        ri = mock.MagicMock()
+        ri.router.get.return_value = fips
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+
+        with mock.patch.object(ip_lib.IpBatch, 'execute',
+                               side_effect=RuntimeError):
+            fip_statuses = agent.process_router_floating_ip_addresses(
+                ri, {'id': _uuid()})
+
+        self.assertEqual({fips[0]['id']: l3_constants.FLOATINGIP_STATUS_ACTIVE,
+                          fips[1]['id']: l3_constants.FLOATINGIP_STATUS_ERROR},
+                         fip_statuses)
+        self.send_arp.assert_called_once_with(ri, mock.ANY, '15.1.2.1')
+
     def test_process_router_snat_disabled(self):
         agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
         router = self._prepare_router_data(enable_snat=True)
@@ -936,6 +1070,8 @@ class TestBasicRouterOperations(base.BaseTestCase):
         agent.router_deleted(None, router['id'])
         agent._process_router_delete()
         self.assertFalse(list(agent.removed_routers))
+        agent.router_queue.wait()
+        self.assertNotIn(router['id'], agent.router_info)
 
     def test_destroy_router_namespace_skips_ns_removal(self):
         agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
@@ -948,6 +1084,56 @@ class TestBasicRouterOperations(base.BaseTestCase):
         agent._destroy_router_namespace("fakens")
         self.mock_ip.netns.delete.assert_called_once_with("fakens")
 
+    def test_router_removed_destroys_namespace_in_background(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        router_id = _uuid()
+        agent._router_added(router_id, {'id': router_id, 'routes': []})
+        with contextlib.nested(
+            mock.patch.object(agent, '_destroy_router_namespace'),
+            mock.patch.object(l3_agent.os.path, 'exists', return_value=True)
+        ) as (destroy, exists):
+            agent._router_removed(router_id)
+            self.assertFalse(destroy.called)
+            agent.namespace_collector.wait()
+            destroy.assert_called_once_with(l3_agent.NS_PREFIX + router_id)
+        self.assertEqual(1, agent.namespace_collector.stats()['destroyed'])
+
+    def test_router_removed_forgets_timestamp(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        router_id = _uuid()
+        agent._router_added(router_id, {'id': router_id, 'routes': []})
+        agent.router_queue.timestamps[router_id] = 10
+        agent._router_removed(router_id)
+        agent.namespace_collector.wait()
+        self.assertNotIn(router_id, agent.router_queue.timestamps)
+
+    def test_router_added_cancels_namespace_cleanup(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        router_id = _uuid()
+        with mock.patch.object(agent,
+                               '_destroy_router_namespace') as destroy:
+            agent._destroy_stale_router_namespaces(
+                [l3_agent.NS_PREFIX + router_id])
+            agent._router_added(router_id, {'id': router_id, 'routes': []})
+            agent.namespace_collector.wait()
+        self.assertFalse(destroy.called)
+
+    def test_removed_unknown_router_namespace_cleaned(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        with contextlib.nested(
+            mock.patch.object(agent, '_destroy_router_namespace'),
+            mock.patch.object(l3_agent.os.path, 'exists',
+                              return_value=False)
+        ) as (destroy, exists):
+            agent._router_removed('unknown')
+            agent.namespace_collector.wait()
+        # Other green threads may check for paths while the collector is
+        # waited on
+        exists.assert_any_call(
+            '/var/run/netns/' + l3_agent.NS_PREFIX + 'unknown')
+        self.assertFalse(destroy.called)
+        self.assertFalse(self.mock_ip.netns.exists.called)
+
     def _configure_metadata_proxy(self, enableflag=True):
         if not enableflag:
             self.conf.set_override('enable_metadata_proxy', False)
@@ -974,6 +1160,20 @@ class TestBasicRouterOperations(base.BaseTestCase):
     def test_enable_metadata_proxy(self):
         self._configure_metadata_proxy()
 
+    def test_shared_metadata_proxy(self):
+        self.conf.set_override('metadata_proxy_shared', True)
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        with mock.patch.object(agent, 'shared_metadata_proxy') as client:
+            agent._spawn_metadata_proxy('r1', 'qrouter-r1')
+            client.add.assert_called_once_with('qrouter-r1', 9697,
+                                               router_id='r1')
+            agent._destroy_metadata_proxy('r1', 'qrouter-r1')
+            client.remove.assert_called_once_with('qrouter-r1')
+        pm = self.external_process.return_value
+        # The proxy the router may have had before is stopped
+        self.assertEqual(2, pm.disable.call_count)
+        self.assertFalse(pm.enable.called)
+
     def test_disable_metadata_proxy_spawn(self):
         self._configure_metadata_proxy(enableflag=False)
 
@@ -1011,6 +1211,7 @@ class TestBasicRouterOperations(base.BaseTestCase):
              'external_gateway_info': {'network_id': 'aaa'}}]
 
         agent._process_routers(routers)
+        agent.router_queue.wait()
         self.assertIn(routers[0]['id'], agent.router_info)
         self.plugin_api.get_external_network_id.assert_called_with(
             agent.context)
@@ -1027,6 +1228,7 @@ class TestBasicRouterOperations(base.BaseTestCase):
              'external_gateway_info': {'network_id': 'aaa'}}]
 
         agent._process_routers(routers)
+        agent.router_queue.wait()
         self.assertIn(routers[0]['id'], agent.router_info)
         self.assertFalse(self.plugin_api.get_external_network_id.called)
 
@@ -1042,6 +1244,7 @@ class TestBasicRouterOperations(base.BaseTestCase):
              'external_gateway_info': {'network_id': 'aaa'}}]
 
         agent._process_routers(routers)
+        agent.router_queue.wait()
         self.assertIn(routers[0]['id'], agent.router_info)
         self.plugin_api.get_external_network_id.assert_called_with(
             agent.context)
@@ -1080,6 +1283,7 @@ class TestBasicRouterOperations(base.BaseTestCase):
         agent.router_info = {}
         self.conf.set_override('gateway_external_network_id', 'aaa')
         agent._process_routers(routers)
+        agent.router_queue.wait()
         self.assertIn(routers[0]['id'], agent.router_info)
         self.assertNotIn(routers[1]['id'], agent.router_info)
 
@@ -1100,9 +1304,130 @@ class TestBasicRouterOperations(base.BaseTestCase):
         agent.router_info = {}
         self.conf.set_override('external_network_bridge', '')
         agent._process_routers(routers)
+        agent.router_queue.wait()
         self.assertIn(routers[0]['id'], agent.router_info)
         self.assertIn(routers[1]['id'], agent.router_info)
 
+    def test_process_routers_full_sync_removes_stale_routers(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        self.plugin_api.get_external_network_id.return_value = None
+        stale_router = {'id': _uuid(), 'routes': [],
+                        'external_gateway_info': {}}
+        agent._router_added(stale_router['id'], stale_router)
+        routers = [{'id': _uuid(), 'routes': [],
+                    'external_gateway_info': {}}]
+        with mock.patch.object(agent.router_queue, 'add') as add:
+            agent._process_routers(routers, all_routers=True)
+        updates = [args[0] for args, kwargs in add.call_args_list]
+        self.assertEqual([(routers[0]['id'], None),
+                          (stale_router['id'], l3_agent.DELETE_ROUTER)],
+                         [(u.router_id, u.action) for u in updates])
+        self.assertEqual([l3_agent.PRIORITY_SYNC_ROUTERS_TASK] * 2,
+                         [u.priority for u in updates])
+
+    def test_process_router_update_failure_sets_fullsync(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        self.plugin_api.get_external_network_id.return_value = None
+        agent.fullsync = False
+        routers = [{'id': _uuid(), 'routes': [],
+                    'external_gateway_info': {}}]
+        with mock.patch.object(agent, 'process_router',
+                               side_effect=RuntimeError):
+            agent._process_routers(routers)
+            agent.router_queue.wait()
+        self.assertTrue(agent.fullsync)
+
+    def _router_delta(self, ri, **kwargs):
+        delta = {'id': ri.router_id, 'routes': [],
+                 'external_gateway_info': {}, 'delta': True,
+                 'base_revision': ri.revision, 'revision': 'rev2'}
+        for key in (l3_constants.INTERFACE_KEY, l3_constants.FLOATINGIP_KEY):
+            delta[key] = []
+            delta[key + l3_constants.REMOVED_KEY_SUFFIX] = []
+        delta.update(kwargs)
+        return delta
+
+    def _add_router_with_revision(self, agent):
+        router = {'id': _uuid(), 'routes': [], 'external_gateway_info': {},
+                  'revision': 'rev1',
+                  l3_constants.FLOATINGIP_KEY: [
+                      {'id': 'fip1', 'fixed_ip_address': '10.0.0.1'},
+                      {'id': 'fip2', 'fixed_ip_address': '10.0.0.2'}]}
+        with mock.patch.object(agent, 'process_router'):
+            agent._process_routers([router])
+            agent.router_queue.wait()
+        return agent.router_info[router['id']]
+
+    def test_process_router_update_sets_revision(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        self.plugin_api.get_external_network_id.return_value = None
+        ri = self._add_router_with_revision(agent)
+        self.assertEqual('rev1', ri.revision)
+
+    def test_process_router_update_unchanged_revision(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        self.plugin_api.get_external_network_id.return_value = None
+        ri = self._add_router_with_revision(agent)
+        with mock.patch.object(agent, 'process_router') as process_router:
+            agent._process_routers([dict(ri.router)])
+            agent.router_queue.wait()
+        self.assertFalse(process_router.called)
+
+    def test_process_router_update_applies_delta(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        self.plugin_api.get_external_network_id.return_value = None
+        ri = self._add_router_with_revision(agent)
+        fip_key = l3_constants.FLOATINGIP_KEY
+        delta = self._router_delta(ri, **{
+            fip_key: [{'id': 'fip2', 'fixed_ip_address': '10.0.0.3'},
+                      {'id': 'fip3', 'fixed_ip_address': '10.0.0.4'}],
+            fip_key + l3_constants.REMOVED_KEY_SUFFIX: ['fip1']})
+        with mock.patch.object(agent, 'process_router') as process_router:
+            agent._process_routers([delta])
+            agent.router_queue.wait()
+        process_router.assert_called_once_with(ri)
+        self.assertEqual(
+            [{'id': 'fip2', 'fixed_ip_address': '10.0.0.3'},
+             {'id': 'fip3', 'fixed_ip_address': '10.0.0.4'}],
+            ri.router[fip_key])
+        self.assertEqual([], ri.router[l3_constants.INTERFACE_KEY])
+        self.assertNotIn('delta', ri.router)
+        self.assertNotIn(fip_key + l3_constants.REMOVED_KEY_SUFFIX,
+                         ri.router)
+        self.assertEqual('rev2', ri.revision)
+
+    def test_process_router_update_delta_from_other_revision(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        self.plugin_api.get_external_network_id.return_value = None
+        ri = self._add_router_with_revision(agent)
+        delta = self._router_delta(ri, base_revision='rev0')
+        with mock.patch.object(agent, 'process_router') as process_router:
+            agent._process_routers([delta])
+            agent.router_queue.wait()
+        self.assertFalse(process_router.called)
+        self.assertIsNone(ri.revision)
+        self.assertIn(ri.router_id, agent.updated_routers)
+
+    def test_process_router_update_failure_clears_revision(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        self.plugin_api.get_external_network_id.return_value = None
+        ri = self._add_router_with_revision(agent)
+        with mock.patch.object(agent, 'process_router',
+                               side_effect=RuntimeError):
+            agent._process_routers([dict(ri.router, revision='rev2')])
+            agent.router_queue.wait()
+        self.assertIsNone(ri.revision)
+
+    def test_rpc_loop_sends_revisions(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        self.plugin_api.get_external_network_id.return_value = None
+        ri = self._add_router_with_revision(agent)
+        agent.updated_routers.update([ri.router_id, FAKE_ID])
+        self.plugin_api.get_routers.return_value = []
+        agent._rpc_loop()
+        self.plugin_api.get_routers.assert_called_once_with(
+            mock.ANY, mock.ANY, revisions={ri.router_id: 'rev1'})
+
     def test_nonexistent_interface_driver(self):
         self.conf.set_override('interface_driver', None)
         with mock.patch.object(l3_agent, 'LOG') as log:
@@ -1150,7 +1475,10 @@ class TestBasicRouterOperations(base.BaseTestCase):
         pm.reset_mock()
 
         agent._destroy_router_namespace = mock.MagicMock()
-        agent._cleanup_namespaces(router_list)
+        with mock.patch.object(l3_agent.os.path, 'exists',
+                               return_value=True):
+            agent._cleanup_namespaces(router_list)
+            agent.namespace_collector.wait()
 
         self.assertEqual(pm.disable.call_count, len(stale_namespace_list))
         self.assertEqual(agent._destroy_router_namespace.call_count,
@@ -1194,6 +1522,141 @@ class TestBasicRouterOperations(base.BaseTestCase):
                                      other_namespaces)
 
 
+class TestRouterProcessingQueue(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestRouterProcessingQueue, self).setUp()
+        self.processed = []
+        self.queue = l3_agent.RouterProcessingQueue(1, self._process)
+
+    def _process(self, update):
+        self.processed.append((update.router_id, update.router))
+
+    def _add(self, router_id, priority, router=None, timestamp=None):
+        self.queue.add(l3_agent.RouterUpdate(router_id, priority,
+                                             router=router,
+                                             timestamp=timestamp))
+
+    def test_priority_order(self):
+        # The worker does not run until the queue is waited on
+        self._add('r1', l3_agent.PRIORITY_SYNC_ROUTERS_TASK)
+        self._add('r2', l3_agent.PRIORITY_SYNC_ROUTERS_TASK)
+        self._add('r3', l3_agent.PRIORITY_RPC)
+        self.queue.wait()
+        self.assertEqual(['r1', 'r3', 'r2'],
+                         [router_id for router_id, router in self.processed])
+
+    def test_updates_merged(self):
+        self._add('r1', l3_agent.PRIORITY_SYNC_ROUTERS_TASK)
+        self._add('r2', l3_agent.PRIORITY_SYNC_ROUTERS_TASK, 'old', 10)
+        self._add('r3', l3_agent.PRIORITY_SYNC_ROUTERS_TASK)
+        self._add('r2', l3_agent.PRIORITY_RPC, 'new', 20)
+        self._add('r2', l3_agent.PRIORITY_SYNC_ROUTERS_TASK, 'stale', 15)
+        # r1 is handed to the worker right away
+        self.assertEqual(2, len(self.queue))
+        self.queue.wait()
+        self.assertEqual(['r1', 'r2', 'r3'],
+                         [router_id for router_id, router in self.processed])
+        self.assertEqual(('r2', 'new'), self.processed[1])
+
+    def test_outdated_update_skipped(self):
+        self._add('r1', l3_agent.PRIORITY_RPC, 'new', 20)
+        self.queue.wait()
+        self._add('r1', l3_agent.PRIORITY_SYNC_ROUTERS_TASK, 'old', 10)
+        self.queue.wait()
+        self.assertEqual([('r1', 'new')], self.processed)
+
+    def test_forget(self):
+        self._add('r1', l3_agent.PRIORITY_RPC, 'new', 20)
+        self.queue.wait()
+        self.queue.forget('r1')
+        self.assertEqual({}, self.queue.timestamps)
+        self._add('r1', l3_agent.PRIORITY_SYNC_ROUTERS_TASK, 'old', 10)
+        self.queue.wait()
+        self.assertEqual([('r1', 'new'), ('r1', 'old')], self.processed)
+
+    def test_router_processed_by_one_worker(self):
+        queue = l3_agent.RouterProcessingQueue(4, self._process)
+        queue.busy.add('r1')
+        queue.add(l3_agent.RouterUpdate('r1', l3_agent.PRIORITY_RPC))
+        queue.wait()
+        self.assertEqual([], self.processed)
+        self.assertEqual(1, len(queue))
+
+    def test_error_callback(self):
+        callback = mock.Mock()
+        queue = l3_agent.RouterProcessingQueue(
+            1, mock.Mock(side_effect=RuntimeError), callback)
+        queue.add(l3_agent.RouterUpdate('r1', l3_agent.PRIORITY_RPC))
+        queue.add(l3_agent.RouterUpdate('r2', l3_agent.PRIORITY_RPC))
+        queue.wait()
+        self.assertEqual(2, callback.call_count)
+        self.assertEqual(0, len(queue))
+
+
+class TestNamespaceCollector(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestNamespaceCollector, self).setUp()
+        self.destroyed = []
+        self.collector = l3_agent.NamespaceCollector(2, 0, self._destroy)
+
+    def _destroy(self, namespace):
+        if namespace == 'bad':
+            raise RuntimeError()
+        eventlet.sleep(0)
+        self.destroyed.append(namespace)
+
+    def test_namespaces_destroyed(self):
+        for ns in ('ns1', 'bad', 'ns2', 'ns1'):
+            self.collector.add(ns)
+        self.assertEqual({'pending': 3, 'destroyed': 0, 'failed': 0},
+                         self.collector.stats())
+        self.collector.wait()
+        self.assertEqual(['ns1', 'ns2'], sorted(self.destroyed))
+        self.assertEqual({'pending': 0, 'destroyed': 2, 'failed': 1},
+                         self.collector.stats())
+
+    def test_bounded_workers(self):
+        running = []
+        max_running = []
+
+        def destroy(namespace):
+            running.append(namespace)
+            max_running.append(len(running))
+            eventlet.sleep(0)
+            running.remove(namespace)
+
+        collector = l3_agent.NamespaceCollector(2, 0, destroy)
+        for i in range(5):
+            collector.add('ns%d' % i)
+        collector.wait()
+        self.assertEqual(5, collector.stats()['destroyed'])
+        self.assertEqual(2, max(max_running))
+
+    def test_rate_limited(self):
+        collector = l3_agent.NamespaceCollector(2, 4, self._destroy)
+        with mock.patch('eventlet.sleep') as sleep:
+            collector.add('ns1')
+            collector.add('ns2')
+            collector.wait()
+        sleep.assert_has_calls([mock.call(0.25), mock.call(0.25)])
+
+    def test_cancel_pending(self):
+        self.collector.add('ns1')
+        self.collector.cancel('ns1')
+        self.collector.wait()
+        self.assertEqual([], self.destroyed)
+
+    def test_cancel_waits_for_destruction(self):
+        self.collector.add('ns1')
+        # Let the namespace be handed to a worker
+        eventlet.sleep(0)
+        self.assertIn('ns1', self.collector.busy)
+        self.collector.cancel('ns1')
+        self.assertEqual(['ns1'], self.destroyed)
+
+
 class TestL3AgentEventHandler(base.BaseTestCase):
 
     def setUp(self):
@@ -1233,6 +1696,7 @@ class TestL3AgentEventHandler(base.BaseTestCase):
             'neutron.openstack.common.loopingcall.FixedIntervalLoopingCall')
         looping_call_p.start()
         self.agent = l3_agent.L3NATAgent(HOSTNAME)
+        self.addCleanup(self.agent.namespace_collector.wait)
 
     def test_spawn_metadata_proxy(self):
         router_id = _uuid()
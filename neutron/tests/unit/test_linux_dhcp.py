@@ -15,6 +15,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
 import os
 
 import mock
@@ -376,7 +377,7 @@ class LocalChild(dhcp.DhcpLocalProcess):
         super(LocalChild, self).__init__(*args, **kwargs)
         self.called = []
 
-    def reload_allocations(self):
+    def reload_allocations(self, changed_ports=None):
         self.called.append('reload')
 
     def restart(self):
@@ -408,6 +409,7 @@ class TestBase(base.BaseTestCase):
         self.execute_p = mock.patch('neutron.agent.linux.utils.execute')
         self.safe = self.replace_p.start()
         self.execute = self.execute_p.start()
+        mock.patch.dict(dhcp.Dnsmasq._indexes, clear=True).start()
 
 
 class TestDhcpBase(TestBase):
@@ -1067,6 +1069,67 @@ tag:tag1,249,%s,%s""".lstrip() % (fake_v6,
             ])
             mock_open.assert_called_once_with('/proc/5/cmdline', 'r')
 
+    def _reload_allocations(self, network, changed_ports=None):
+        with contextlib.nested(
+            mock.patch.object(dhcp.Dnsmasq, 'active'),
+            mock.patch.object(dhcp.Dnsmasq, 'pid'),
+            mock.patch.object(dhcp.Dnsmasq, '_make_subnet_interface_ip_map',
+                              return_value={}),
+            mock.patch.object(dhcp.Dnsmasq, '_release_lease')
+        ) as (active, pid, ip_map, release):
+            active.__get__ = mock.Mock(return_value=True)
+            pid.__get__ = mock.Mock(return_value=5)
+            dm = dhcp.Dnsmasq(self.conf, network, version=float(2.59))
+            dm.reload_allocations(changed_ports)
+        return release
+
+    def _written_files(self):
+        return [os.path.basename(args[0])
+                for args, kwargs in self.safe.call_args_list]
+
+    def test_reload_allocations_unchanged(self):
+        network = FakeDualNetwork()
+        self._reload_allocations(network)
+        self.safe.reset_mock()
+        self.execute.reset_mock()
+        self.mock_mgr.reset_mock()
+
+        self._reload_allocations(network, changed_ports=set())
+        self._reload_allocations(network,
+                                 changed_ports=set([FakePort1.id]))
+
+        self.assertFalse(self.safe.called)
+        self.assertFalse(self.execute.called)
+        self.assertFalse(self.mock_mgr.return_value.update.called)
+
+    def test_reload_allocations_changed_ports(self):
+        network = FakeDualNetwork()
+        network.ports = list(network.ports)
+        self._reload_allocations(network)
+        self.safe.reset_mock()
+        self.execute.reset_mock()
+
+        port = network.ports.pop(0)
+        release = self._reload_allocations(network,
+                                           changed_ports=set([port.id]))
+
+        release.assert_called_once_with(port.mac_address,
+                                        port.fixed_ips[0].ip_address)
+        self.assertEqual(['host', 'addn_hosts'], self._written_files())
+        self.assertNotIn(port.mac_address, self.safe.call_args_list[0][0][1])
+        self.execute.assert_called_once_with(['kill', '-HUP', 5], 'sudo')
+
+    def test_reload_allocations_after_disable(self):
+        network = FakeDualNetwork()
+        self._reload_allocations(network)
+        dhcp.Dnsmasq(self.conf, network)._remove_config_files()
+        self.safe.reset_mock()
+
+        self._reload_allocations(network, changed_ports=set())
+
+        self.assertEqual(['host', 'addn_hosts', 'opts'],
+                         self._written_files())
+
     def test_release_unused_leases(self):
         dnsmasq = dhcp.Dnsmasq(self.conf, FakeDualNetwork())
 
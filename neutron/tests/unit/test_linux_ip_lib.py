@@ -18,6 +18,7 @@
 import mock
 
 from neutron.agent.linux import ip_lib
+from neutron.agent.linux import ip_netlink
 from neutron.common import exceptions
 from neutron.tests import base
 
@@ -406,6 +407,43 @@ class TestIpWrapper(base.BaseTestCase):
         self.assertEqual(dev.mock_calls, [])
 
 
+class TestIpBatch(base.BaseTestCase):
+    def setUp(self):
+        super(TestIpBatch, self).setUp()
+        self.execute = mock.patch.object(ip_lib.utils, 'execute').start()
+
+    def test_execute(self):
+        batch = ip_lib.IpBatch('sudo', 'ns')
+        batch.add('route', 'replace', 'to', '10.0.0.0/8', 'via', '1.2.3.4')
+        ip_lib.IPDevice('tap0').addr.add(4, '1.2.3.5/32', '1.2.3.5',
+                                         batch=batch)
+        batch.execute()
+        self.execute.assert_called_once_with(
+            ['ip', 'netns', 'exec', 'ns', 'ip', '-force', '-batch', '-'],
+            root_helper='sudo',
+            process_input='route replace to 10.0.0.0/8 via 1.2.3.4\n'
+                          'addr add 1.2.3.5/32 brd 1.2.3.5 scope global '
+                          'dev tap0\n')
+        self.assertEqual([], batch.commands)
+
+    def test_execute_no_namespace(self):
+        batch = ip_lib.IpBatch('sudo')
+        batch.add('addr', 'del', '1.2.3.5/32', 'dev', 'tap0')
+        batch.execute()
+        self.execute.assert_called_once_with(
+            ['ip', '-force', '-batch', '-'], root_helper='sudo',
+            process_input='addr del 1.2.3.5/32 dev tap0\n')
+
+    def test_execute_empty(self):
+        ip_lib.IpBatch('sudo', 'ns').execute()
+        self.assertFalse(self.execute.called)
+
+    def test_execute_requires_root_helper(self):
+        batch = ip_lib.IpBatch()
+        batch.add('addr', 'del', '1.2.3.5/32', 'dev', 'tap0')
+        self.assertRaises(exceptions.SudoRequired, batch.execute)
+
+
 class TestIPDevice(base.BaseTestCase):
     def test_eq_same_name(self):
         dev1 = ip_lib.IPDevice('tap0')
@@ -483,6 +521,7 @@ class TestIPCmdBase(base.BaseTestCase):
         self.parent = mock.Mock()
         self.parent.name = 'eth0'
         self.parent.root_helper = 'sudo'
+        self.parent._use_netlink.return_value = False
 
     def _assert_call(self, options, args):
         self.parent.assert_has_calls([
@@ -801,6 +840,114 @@ class TestDeviceExists(base.BaseTestCase):
             self.assertFalse(ip_lib.ensure_device_is_ready("eth0"))
 
 
+class TestIpLibNetlink(base.BaseTestCase):
+    def setUp(self):
+        super(TestIpLibNetlink, self).setUp()
+        self.execute = mock.patch.object(ip_lib.SubProcessBase,
+                                         '_execute').start()
+        self.get_link = mock.patch.object(
+            ip_netlink, 'get_link',
+            return_value={'index': 2, 'name': 'tap0', 'flags': 0,
+                          'type': ip_netlink.ARPHRD_ETHER,
+                          'address': 'fa:16:3e:00:00:01',
+                          'broadcast': 'ff:ff:ff:ff:ff:ff',
+                          'mtu': 1500, 'qdisc': 'noqueue',
+                          'state': 'UP'}).start()
+        self.device = ip_lib.IPDevice('tap0', 'sudo', 'ns')
+        self.device.use_netlink = True
+        self.can_query = mock.patch.object(ip_netlink, 'can_query',
+                                           return_value=True).start()
+
+    def test_get_devices(self):
+        wrapper = ip_lib.IPWrapper('sudo', 'ns')
+        wrapper.use_netlink = True
+        with mock.patch.object(ip_netlink, 'get_links',
+                               return_value=[{'name': 'lo'},
+                                             {'name': 'tap0'}]) as get_links:
+            devices = wrapper.get_devices(exclude_loopback=True)
+        self.assertEqual(['tap0'], [d.name for d in devices])
+        self.assertEqual('ns', devices[0].namespace)
+        get_links.assert_called_once_with('ns')
+        self.assertFalse(self.execute.called)
+
+    def test_link_attributes(self):
+        self.assertEqual({'mtu': 1500, 'qdisc': 'noqueue', 'state': 'UP',
+                          'link/ether': 'fa:16:3e:00:00:01',
+                          'brd': 'ff:ff:ff:ff:ff:ff'},
+                         self.device.link.attributes)
+        self.get_link.assert_called_once_with('tap0', 'ns')
+        self.assertFalse(self.execute.called)
+
+    def test_link_attributes_missing_device(self):
+        self.get_link.return_value = None
+        self.assertRaises(RuntimeError, getattr, self.device.link,
+                          'attributes')
+
+    def test_addr_list(self):
+        with mock.patch.object(ip_netlink, 'get_addresses') as get_addresses:
+            get_addresses.return_value = [
+                {'index': 2, 'ip_version': 4, 'cidr': '172.16.77.240/24',
+                 'broadcast': None, 'scope': 'global', 'dynamic': False},
+                {'index': 2, 'ip_version': 4, 'cidr': '10.0.0.2/24',
+                 'broadcast': '10.0.0.255', 'scope': 'global',
+                 'dynamic': True},
+                {'index': 2, 'ip_version': 6, 'cidr': 'fe80::1/64',
+                 'broadcast': None, 'scope': 'link', 'dynamic': False}]
+            self.assertEqual(
+                [dict(cidr='172.16.77.240/24', broadcast='172.16.77.255',
+                      scope='global', ip_version=4, dynamic=False),
+                 dict(cidr='fe80::1/64', broadcast='::', scope='link',
+                      ip_version=6, dynamic=False)],
+                self.device.addr.list(filters=['permanent']))
+            self.assertEqual(
+                ['10.0.0.2/24'],
+                [a['cidr'] for a in self.device.addr.list(
+                    scope='global', to='10.0.0.0/24')])
+            get_addresses.assert_called_with(2, 'ns')
+        self.assertFalse(self.execute.called)
+
+    def test_addr_list_with_filters_runs_ip(self):
+        self.execute.return_value = ''
+        with mock.patch.object(ip_netlink, 'get_addresses') as get_addresses:
+            self.device.addr.list(filters=['dynamic'])
+        self.assertFalse(get_addresses.called)
+        self.assertTrue(self.execute.called)
+
+    def test_get_gateway(self):
+        routes = [
+            {'dst': '10.0.0.0/24', 'gateway': None, 'oif': 2,
+             'metric': None, 'table': ip_netlink.RT_TABLE_MAIN,
+             'scope': 'link'},
+            {'dst': 'default', 'gateway': '10.0.1.1', 'oif': 3,
+             'metric': None, 'table': ip_netlink.RT_TABLE_MAIN,
+             'scope': 'global'},
+            {'dst': 'default', 'gateway': '10.0.0.1', 'oif': 2,
+             'metric': 50, 'table': ip_netlink.RT_TABLE_MAIN,
+             'scope': 'global'}]
+        with mock.patch.object(ip_netlink, 'get_routes',
+                               return_value=routes) as get_routes:
+            self.assertEqual(dict(gateway='10.0.0.1', metric=50),
+                             self.device.route.get_gateway())
+            get_routes.assert_called_once_with(namespace='ns')
+            routes.pop()
+            self.assertIsNone(self.device.route.get_gateway())
+        self.assertFalse(self.execute.called)
+
+    def test_namespace_not_queryable_runs_ip(self):
+        self.can_query.return_value = False
+        self.execute.return_value = LINK_SAMPLE[1]
+        self.device.link.attributes
+        self.assertFalse(self.get_link.called)
+        self.assertTrue(self.execute.called)
+
+    def test_force_root_runs_ip(self):
+        self.device.force_root = True
+        self.execute.return_value = LINK_SAMPLE[1]
+        self.device.link.attributes
+        self.assertFalse(self.get_link.called)
+        self.assertTrue(self.execute.called)
+
+
 class TestIpNeighCommand(TestIPCmdBase):
     def setUp(self):
         super(TestIpNeighCommand, self).setUp()
@@ -0,0 +1,199 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import socket
+import tempfile
+
+import eventlet
+import mock
+
+from neutron.agent.metadata import shared_proxy
+from neutron.tests import base
+
+
+class FakeConf(object):
+    metadata_proxy_socket = '/state/metadata_proxy'
+    metadata_proxy_control_socket = None
+    state_path = '/state'
+
+
+class TestSharedMetadataProxy(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestSharedMetadataProxy, self).setUp()
+        self.in_namespace = mock.patch(
+            'neutron.agent.linux.ip_netlink.in_namespace').start()
+        self.listen = mock.patch('eventlet.listen').start()
+        self.spawn = mock.patch('eventlet.spawn').start()
+        self.proxy = shared_proxy.SharedMetadataProxy('/control')
+
+    def test_add(self):
+        self.proxy.add('qrouter-r1', 9697, router_id='r1')
+        self.in_namespace.assert_called_once_with('qrouter-r1')
+        self.listen.assert_called_once_with(('0.0.0.0', 9697))
+        handler = self.spawn.call_args[0][2]
+        self.assertEqual('r1', handler.router_id)
+        self.assertIsNone(handler.network_id)
+        # The connections to the metadata agent are shared
+        self.assertIs(self.proxy.http_pool, handler.http_pool)
+
+    def test_add_registered_namespace(self):
+        self.proxy.add('qrouter-r1', 9697, router_id='r1')
+        self.proxy.add('qrouter-r1', 9697, router_id='r1')
+        self.assertEqual(1, self.listen.call_count)
+        self.proxy.add('qrouter-r1', 9697, router_id='r2')
+        self.assertEqual(2, self.listen.call_count)
+        self.assertTrue(self.listen.return_value.close.called)
+
+    def test_remove(self):
+        self.proxy.add('qrouter-r1', 9697, router_id='r1')
+        self.proxy.remove('qrouter-r1')
+        self.proxy.remove('qrouter-r1')
+        self.spawn.return_value.kill.assert_called_once_with()
+        self.listen.return_value.close.assert_called_once_with()
+        self.assertEqual({}, self.proxy.servers)
+
+    def test_handle(self):
+        with mock.patch.object(self.proxy, 'add') as add:
+            self.proxy.handle({'action': 'add', 'namespace': 'qdhcp-n1',
+                               'port': 80, 'network_id': 'n1'})
+            add.assert_called_once_with('qdhcp-n1', 80, network_id='n1',
+                                        router_id=None, owner=None)
+        self.assertRaises(ValueError, self.proxy.handle, {'action': 'foo'})
+
+    def test_sync(self):
+        self.proxy.add('qrouter-r1', 9697, router_id='r1', owner='l3')
+        self.proxy.add('qrouter-r2', 9697, router_id='r2', owner='l3')
+        self.proxy.add('qdhcp-n1', 80, network_id='n1', owner='dhcp')
+        self.proxy.sync('l3', [{'namespace': 'qrouter-r2', 'port': 9697,
+                                'router_id': 'r2', 'owner': 'l3'},
+                               {'namespace': 'qrouter-r3', 'port': 9697,
+                                'router_id': 'r3', 'owner': 'l3'}])
+        # Only the stale namespaces of the agent are removed
+        self.assertEqual(set(['qrouter-r2', 'qrouter-r3', 'qdhcp-n1']),
+                         set(self.proxy.servers))
+        self.assertEqual(4, self.listen.call_count)
+
+    def test_sync_error(self):
+        self.in_namespace.side_effect = [mock.MagicMock(), OSError]
+        self.assertRaises(shared_proxy.SharedMetadataProxyError,
+                          self.proxy.sync, 'l3',
+                          [{'namespace': 'qrouter-r1', 'port': 9697,
+                            'router_id': 'r1'},
+                           {'namespace': 'qrouter-r2', 'port': 9697,
+                            'router_id': 'r2'}])
+        self.assertEqual(['qrouter-r1'], list(self.proxy.servers))
+
+
+class TestSharedMetadataProxyControl(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestSharedMetadataProxyControl, self).setUp()
+        self.state_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.state_path)
+        self.conf = FakeConf()
+        self.conf.metadata_proxy_control_socket = os.path.join(
+            self.state_path, 'metadata_proxy_control')
+        self.proxy = shared_proxy.SharedMetadataProxy(
+            self.conf.metadata_proxy_control_socket)
+        self.server = eventlet.spawn(self.proxy.run)
+        self.addCleanup(self.server.kill)
+        self.addCleanup(self._remove_servers)
+        self.pm = mock.patch('neutron.agent.linux.external_process.'
+                             'ProcessManager').start().return_value
+        self.client = shared_proxy.SharedMetadataProxyClient(self.conf,
+                                                             'sudo', 'l3')
+
+    def _remove_servers(self):
+        for namespace in list(self.proxy.servers):
+            self.proxy.remove(namespace)
+
+    def test_add_and_remove(self):
+        self.client.add(None, 0, network_id='n1')
+        self.assertTrue(self.pm.enable.called)
+        registration, sock, thread = self.proxy.servers[None]
+        self.assertEqual('n1', registration['network_id'])
+        self.assertEqual(0o600, os.stat(
+            self.conf.metadata_proxy_control_socket).st_mode & 0o777)
+        self.client.remove(None)
+        self.assertEqual({}, self.proxy.servers)
+
+    def test_add_error(self):
+        self.assertRaises(shared_proxy.SharedMetadataProxyError,
+                          self.client.add, 'no-such-namespace', 0,
+                          network_id='n1')
+        self.assertEqual({}, self.proxy.servers)
+
+    def test_registrations_synced_after_restart(self):
+        self.client.add(None, 0, network_id='n1')
+        # The proxy restarted and lost its registrations
+        self.proxy.servers.clear()
+        self.client._proxy_pid = -1
+        with mock.patch.object(self.proxy, 'add') as add:
+            self.client.add('qdhcp-n2', 0, network_id='n2')
+        self.assertEqual(3, add.call_count)
+        add.assert_any_call(None, 0, network_id='n1', router_id=None,
+                            owner='l3')
+
+    def test_stale_registrations_dropped_after_agent_restart(self):
+        self.client.add(None, 0, network_id='n1')
+        # A new agent does not register the namespace again
+        client = shared_proxy.SharedMetadataProxyClient(self.conf, 'sudo',
+                                                        'l3')
+        with mock.patch.object(self.proxy, 'add'):
+            client.add('qdhcp-n2', 0, network_id='n2')
+        self.assertEqual({}, self.proxy.servers)
+
+    def test_control_path_not_a_socket(self):
+        with open(self.conf.metadata_proxy_control_socket + '.file',
+                  'w') as f:
+            f.write('data')
+        proxy = shared_proxy.SharedMetadataProxy(f.name)
+        self.assertRaises(shared_proxy.SharedMetadataProxyError,
+                          proxy._listen_control)
+        with open(f.name) as f:
+            self.assertEqual('data', f.read())
+
+    def test_control_socket_in_use(self):
+        self.client.add(None, 0, network_id='n1')
+        proxy = shared_proxy.SharedMetadataProxy(
+            self.conf.metadata_proxy_control_socket)
+        self.assertRaises(shared_proxy.SharedMetadataProxyError,
+                          proxy._listen_control)
+        # The running proxy is still reachable
+        self.client.remove(None)
+        self.assertEqual({}, self.proxy.servers)
+
+    def test_stale_control_socket_replaced(self):
+        path = self.conf.metadata_proxy_control_socket + '.stale'
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        sock.close()
+        proxy = shared_proxy.SharedMetadataProxy(path)
+        proxy._listen_control().close()
+
+    def test_proxy_started_under_external_lock(self):
+        with mock.patch.object(shared_proxy.lockutils, 'lock') as lock:
+            self.client.add(None, 0, network_id='n1')
+        lock.assert_called_once_with(shared_proxy.SHARED_PROXY_UUID,
+                                     'neutron-', True)
+
+    def test_remove_without_proxy(self):
+        self.pm.active = False
+        with mock.patch.object(self.proxy, 'remove') as remove:
+            self.client.remove('qdhcp-n1')
+        self.assertFalse(remove.called)
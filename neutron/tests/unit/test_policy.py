@@ -459,6 +459,64 @@ class NeutronPolicyTestCase(base.BaseTestCase):
             result = policy.enforce(self.context, action, target)
             self.assertTrue(result)
 
+    def test_checker_prepares_credentials_once(self):
+        policy.init()
+        with mock.patch.object(self.context, 'to_dict',
+                               wraps=self.context.to_dict) as to_dict:
+            checker = policy.PolicyChecker(self.context)
+            for i in range(10):
+                self.assertTrue(checker.check('get_network',
+                                              {'tenant_id': 'fake'}))
+        self.assertEqual(1, to_dict.call_count)
+
+    def test_checker_compiles_match_rule_once(self):
+        policy.init()
+        checker = policy.PolicyChecker(self.context)
+        with mock.patch.object(policy, '_build_match_rule',
+                               wraps=policy._build_match_rule) as build:
+            for i in range(10):
+                self.assertTrue(checker.check(
+                    'create_network', {'tenant_id': 'fake', 'shared': False,
+                                       'name': 'net%d' % i}))
+            self.assertFalse(checker.check(
+                'create_network', {'tenant_id': 'fake', 'shared': True}))
+        # Once per action and set of attributes explicitly set
+        self.assertEqual(2, build.call_count)
+
+    def test_checker_caches_role_decisions(self):
+        policy.init()
+        other_ctx = context.Context('other', 'other', roles=['User'])
+        with mock.patch.object(common_policy.RoleCheck, '__call__',
+                               return_value=False) as role_check:
+            checker = policy.PolicyChecker(self.context)
+            for tenant_id in ('fake', 'other'):
+                self.assertFalse(checker.check('create_network:shared',
+                                               {'tenant_id': tenant_id}))
+            # The decision is shared by the contexts with the same roles
+            self.assertFalse(policy.check(other_ctx, 'create_network:shared',
+                                          {}))
+            self.assertEqual(1, role_check.call_count)
+        admin_ctx = context.Context('admin', 'admin', roles=['admin'])
+        self.assertTrue(policy.check(admin_ctx, 'create_network:shared', {}))
+
+    def test_checker_does_not_cache_target_decisions(self):
+        policy.init()
+        checker = policy.PolicyChecker(self.context)
+        self.assertTrue(checker.check('get_network', {'tenant_id': 'fake'}))
+        self.assertFalse(checker.check('get_network', {'tenant_id': 'other'}))
+        self.assertTrue(checker.check('get_network', {'tenant_id': 'other',
+                                                      'shared': True}))
+
+    def test_checker_rules_changed(self):
+        policy.init()
+        self.assertFalse(policy.check(self.context, 'create_network:shared',
+                                      {}))
+        self.rules['context_is_admin'] = common_policy.parse_rule(
+            'role:user')
+        policy.init()
+        self.assertTrue(policy.check(self.context, 'create_network:shared',
+                                     {}))
+
     def test_tenant_id_check_no_target_field_raises(self):
         # Try and add a bad rule
         self.assertRaises(
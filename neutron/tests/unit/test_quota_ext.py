@@ -15,23 +15,28 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
 import sys
 
 import mock
 from oslo.config import cfg
 import testtools
+import webob.exc
 import webtest
 
 from neutron.api import extensions
 from neutron.api.v2 import attributes
 from neutron.common import config
+from neutron.common import constants
 from neutron.common import exceptions
 from neutron import context
 from neutron.db import api as db
 from neutron.db import quota_db
+from neutron import manager
 from neutron import quota
 from neutron.tests import base
 from neutron.tests.unit import test_api_v2
+from neutron.tests.unit import test_db_plugin
 from neutron.tests.unit import test_extensions
 from neutron.tests.unit import testlib_api
 
@@ -429,6 +434,164 @@ class TestQuotaDriverLoad(base.BaseTestCase):
         self._test_quota_driver('neutron.db.quota_db.DbQuotaDriver',
                                 'ConfDriver', False)
 
+    def test_quota_tracked_db_driver(self):
+        self._test_quota_driver('neutron.db.quota_db.TrackedDbQuotaDriver',
+                                'TrackedDbQuotaDriver', True)
+
     def test_quota_conf_driver(self):
         self._test_quota_driver('neutron.quota.ConfDriver',
                                 'ConfDriver', True)
+
+
+class TestTrackedDbQuotaDriver(test_db_plugin.NeutronDbPluginV2TestCase):
+
+    def setUp(self):
+        cfg.CONF.set_override('quota_driver',
+                              'neutron.db.quota_db.TrackedDbQuotaDriver',
+                              group='QUOTAS')
+        super(TestTrackedDbQuotaDriver, self).setUp()
+        quota.QUOTAS._driver = None
+        self.addCleanup(setattr, quota.QUOTAS, '_driver', None)
+        self.driver = quota.QUOTAS.get_driver()
+        self.ctx = context.get_admin_context()
+
+    def _usage(self, resource, tenant_id=None):
+        usage = self.ctx.session.query(quota_db.QuotaUsage).filter_by(
+            tenant_id=tenant_id or self._tenant_id, resource=resource).first()
+        return usage and usage.in_use
+
+    def _reserve(self, **deltas):
+        count = mock.Mock(return_value=0)
+        return self.driver.make_reservation(self.ctx, self._tenant_id,
+                                            quota.QUOTAS.resources, deltas,
+                                            count)
+
+    def test_usage_counted_once(self):
+        plugin = manager.NeutronManager.get_plugin()
+        with mock.patch.object(plugin, 'get_networks_count') as count:
+            with contextlib.nested(self.network(), self.network()):
+                self.assertEqual(2, self._usage('network'))
+                res = self._create_network(self.fmt, 'net3', True)
+                self.assertEqual(webob.exc.HTTPCreated.code, res.status_int)
+                self.assertEqual(3, self._usage('network'))
+                net = self.deserialize(self.fmt, res)['network']
+                self._delete('networks', net['id'])
+                self.assertEqual(2, self._usage('network'))
+            self.assertEqual(0, self._usage('network'))
+            self.assertFalse(count.called)
+        # Reservations are released once the networks are created
+        self.assertEqual(0, self.ctx.session.query(
+            quota_db.Reservation).count())
+
+    def test_port_usage_after_create_delete_cycles(self):
+        with self.subnet() as subnet:
+            for i in range(2):
+                with contextlib.nested(self.port(subnet=subnet),
+                                       self.port(subnet=subnet)):
+                    self.assertEqual(2, self._usage('port'))
+                self.assertEqual(0, self._usage('port'))
+
+    def test_subnet_usage_after_create_delete_cycles(self):
+        with self.network() as network:
+            for i in range(2):
+                with contextlib.nested(
+                    self.subnet(network=network),
+                    self.subnet(network=network, cidr='10.0.1.0/24')):
+                    self.assertEqual(2, self._usage('subnet'))
+                self.assertEqual(0, self._usage('subnet'))
+
+    def test_usages_after_network_delete(self):
+        with self.network(do_delete=False) as network:
+            net_id = network['network']['id']
+            self._make_subnet(self.fmt, network, '10.0.0.1', '10.0.0.0/24')
+            self._make_port(self.fmt, net_id,
+                            device_owner=constants.DEVICE_OWNER_DHCP)
+            self.assertEqual(1, self._usage('subnet'))
+            self.assertEqual(1, self._usage('port'))
+        # The subnets and the DHCP ports of the network are deleted with it
+        self._delete('networks', net_id)
+        self.assertEqual(0, self._usage('network'))
+        self.assertEqual(0, self._usage('subnet'))
+        self.assertEqual(0, self._usage('port'))
+
+    def test_create_over_quota(self):
+        cfg.CONF.set_override('quota_network', 1, group='QUOTAS')
+        with self.network():
+            res = self._create_network(self.fmt, 'net2', True)
+            self.assertEqual(webob.exc.HTTPConflict.code, res.status_int)
+            self.assertEqual(1, self._usage('network'))
+        self.assertEqual(0, self.ctx.session.query(
+            quota_db.Reservation).count())
+
+    def test_create_failure_cancels_reservation(self):
+        plugin = manager.NeutronManager.get_plugin()
+        with mock.patch.object(plugin, 'create_network',
+                               side_effect=ValueError):
+            res = self._create_network(self.fmt, 'net', True)
+            self.assertEqual(webob.exc.HTTPInternalServerError.code,
+                             res.status_int)
+        self.assertEqual(0, self._usage('network'))
+        self.assertEqual(0, self.ctx.session.query(
+            quota_db.Reservation).count())
+
+    def test_reservations_are_checked(self):
+        cfg.CONF.set_override('quota_network', 3, group='QUOTAS')
+        reservation_id = self._reserve(network=2)
+        self.assertRaises(exceptions.OverQuota, self._reserve, network=2)
+        self.driver.cancel_reservation(self.ctx, reservation_id)
+        self.assertIsNotNone(self._reserve(network=2))
+
+    def test_expired_reservations_are_ignored(self):
+        cfg.CONF.set_override('quota_network', 3, group='QUOTAS')
+        cfg.CONF.set_override('reservation_expiration', 0, group='QUOTAS')
+        self._reserve(network=2)
+        self._reserve(network=2)
+        self.driver.reconcile_usages(self.ctx)
+        self.assertEqual(0, self.ctx.session.query(
+            quota_db.Reservation).count())
+
+    def test_unlimited_quota_is_not_reserved(self):
+        cfg.CONF.set_override('quota_network', -1, group='QUOTAS')
+        self.assertIsNone(self._reserve(network=1))
+        self.assertIsNone(self._usage('network'))
+
+    def test_untracked_resource_is_counted(self):
+        cfg.CONF.set_override('quota_network', 1, group='QUOTAS')
+        with mock.patch.dict(quota.QUOTAS.resources,
+                             {'router': quota.CountableResource(
+                                 'router', None, 'quota_network')}):
+            count = mock.Mock(return_value=1)
+            self.assertRaises(exceptions.OverQuota,
+                              self.driver.make_reservation, self.ctx,
+                              self._tenant_id, quota.QUOTAS.resources,
+                              {'router': 1}, count)
+        count.assert_called_once_with('router')
+
+    def test_reconcile_usages(self):
+        with self.network():
+            self.assertEqual(1, self._usage('network'))
+            with self.ctx.session.begin():
+                self.ctx.session.query(quota_db.QuotaUsage).update(
+                    {'in_use': 5})
+            self.driver.reconcile_usages(self.ctx)
+            self.assertEqual(1, self._usage('network'))
+            self.assertEqual(1, self.driver.reconcile_usages(self.ctx))
+
+    def test_reconcile_usages_of_tenant(self):
+        with contextlib.nested(self.network(),
+                               self.network(tenant_id='other')):
+            with self.ctx.session.begin():
+                self.ctx.session.query(quota_db.QuotaUsage).update(
+                    {'in_use': 5})
+            self.assertEqual(1, self.driver.reconcile_usages(self.ctx,
+                                                             ['other']))
+            self.assertEqual(5, self._usage('network'))
+            self.assertEqual(1, self._usage('network', 'other'))
+
+    def test_first_usage_counted_with_locking_read(self):
+        with mock.patch.object(self.driver, '_count_objects',
+                               return_value=1) as count:
+            self._reserve(network=1)
+        count.assert_called_once_with(mock.ANY, self._tenant_id, 'network',
+                                      lockmode='read')
+        self.assertEqual(1, self._usage('network'))
@@ -21,6 +21,8 @@ from contextlib import nested
 import mock
 from mock import call
 from oslo.config import cfg
+import sqlalchemy as sa
+from sqlalchemy import orm
 from testtools import matchers
 import webob.exc
 
@@ -36,6 +38,7 @@ from neutron.db import securitygroups_rpc_base as sg_db_rpc
 from neutron.extensions import allowedaddresspairs as addr_pair
 from neutron.extensions import securitygroup as ext_sg
 from neutron.manager import NeutronManager
+from neutron.openstack.common.rpc import common as rpc_common
 from neutron.openstack.common.rpc import proxy
 from neutron.tests import base
 from neutron.tests.unit import test_extension_security_group as test_sg
@@ -293,8 +296,10 @@ class SGServerRpcCallBackMixinTestCase(test_sg.SecurityGroupDBTestCase):
                              'remote_group_id': sg2_id,
                              'security_group_id': sg1_id},
                             ]
-                self.assertEqual(port_rpc['security_group_rules'],
-                                 expected)
+                # The rules of a port are grouped by security group, in no
+                # particular order
+                self.assertEqual(sorted(port_rpc['security_group_rules']),
+                                 sorted(expected))
                 self._delete('ports', port_id1)
                 self._delete('ports', port_id2)
 
@@ -739,16 +744,183 @@ class SGServerRpcCallBackMixinTestCase(test_sg.SecurityGroupDBTestCase):
                              'source_ip_prefix': fake_gateway,
                              'source_port_range_min': const.ICMPV6_TYPE_RA},
                             ]
-                self.assertEqual(port_rpc['security_group_rules'],
-                                 expected)
+                # The rules of a port are grouped by security group, in no
+                # particular order
+                self.assertEqual(sorted(port_rpc['security_group_rules']),
+                                 sorted(expected))
                 self._delete('ports', port_id1)
                 self._delete('ports', port_id2)
 
+    def _create_source_group_ports(self, n, sg1_id, sg2_id):
+        rule1 = self._build_security_group_rule(
+            sg1_id,
+            'ingress', const.PROTO_NAME_TCP, '24',
+            '25', remote_group_id=sg2_id)
+        rules = {
+            'security_group_rules': [rule1['security_group_rule']]}
+        self._make_security_group_rule(self.fmt, rules)
+        port1 = self._make_port(self.fmt, n['network']['id'],
+                                security_groups=[sg1_id])['port']
+        port2 = self._make_port(self.fmt, n['network']['id'],
+                                security_groups=[sg2_id])['port']
+        self.rpc.devices = {port1['id']: port1.copy()}
+        return port1, port2
+
+    def test_security_group_info_for_devices(self):
+        with self.network() as n:
+            with nested(self.subnet(n),
+                        self.security_group(),
+                        self.security_group()) as (subnet_v4,
+                                                   sg1,
+                                                   sg2):
+                sg1_id = sg1['security_group']['id']
+                sg2_id = sg2['security_group']['id']
+                port1, port2 = self._create_source_group_ports(n, sg1_id,
+                                                               sg2_id)
+                ctx = context.get_admin_context()
+                info = self.rpc.security_group_info_for_devices(
+                    ctx, devices=[port1['id'], 'no_exist_device'])
+
+                self.assertEqual([port1['id']], info['devices'].keys())
+                port_rpc = info['devices'][port1['id']]
+                self.assertEqual([sg1_id], port_rpc['security_groups'])
+                self.assertEqual([], port_rpc['security_group_rules'])
+                self.assertEqual([sg1_id], info['security_groups'].keys())
+                expected = [{'direction': 'egress', 'ethertype': const.IPv4,
+                             'security_group_id': sg1_id},
+                            {'direction': 'egress', 'ethertype': const.IPv6,
+                             'security_group_id': sg1_id},
+                            {'direction': u'ingress',
+                             'protocol': const.PROTO_NAME_TCP,
+                             'ethertype': const.IPv4,
+                             'port_range_max': 25, 'port_range_min': 24,
+                             'remote_group_id': sg2_id,
+                             'security_group_id': sg1_id}]
+                self.assertEqual(sorted(expected),
+                                 sorted(info['security_groups'][sg1_id]))
+                self.assertEqual(
+                    {sg2_id: {const.IPv4: [
+                        port2['fixed_ips'][0]['ip_address']],
+                        const.IPv6: []}},
+                    info['sg_member_ips'])
+                self._delete('ports', port1['id'])
+                self._delete('ports', port2['id'])
+
+    def test_security_group_rules_for_devices_cached(self):
+        cfg.CONF.set_override('cache_rpc_info', True, group='SECURITYGROUP')
+        self.addCleanup(sg_db_rpc.SG_INFO_CACHE.invalidate)
+        with self.network() as n:
+            with nested(self.subnet(n),
+                        self.security_group(),
+                        self.security_group()) as (subnet_v4,
+                                                   sg1,
+                                                   sg2):
+                sg1_id = sg1['security_group']['id']
+                sg2_id = sg2['security_group']['id']
+                port1, port2 = self._create_source_group_ports(n, sg1_id,
+                                                               sg2_id)
+                ctx = context.get_admin_context()
+                with nested(
+                    mock.patch.object(
+                        self.rpc, '_make_rule_dict_for_agent',
+                        wraps=self.rpc._make_rule_dict_for_agent),
+                    mock.patch.object(
+                        self.rpc, '_select_ips_for_remote_group_from_db',
+                        wraps=self.rpc._select_ips_for_remote_group_from_db)
+                ) as (make_rule, select_ips):
+                    first = self.rpc.security_group_rules_for_devices(
+                        ctx, devices=[port1['id']])
+                    # get_port_from_device of the fake updates the port
+                    self.rpc.devices = {port1['id']: port1.copy()}
+                    second = self.rpc.security_group_rules_for_devices(
+                        ctx, devices=[port1['id']])
+                self.assertEqual(first, second)
+                self.assertEqual(3, make_rule.call_count)
+                self.assertEqual(1, select_ips.call_count)
+                self._delete('ports', port1['id'])
+                self._delete('ports', port2['id'])
+
 
 class SGServerRpcCallBackMixinTestCaseXML(SGServerRpcCallBackMixinTestCase):
     fmt = 'xml'
 
 
+class SecurityGroupInfoCacheTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(SecurityGroupInfoCacheTestCase, self).setUp()
+        cfg.CONF.set_override('cache_rpc_info', True, group='SECURITYGROUP')
+        self.cache = sg_db_rpc.SecurityGroupInfoCache()
+
+    def test_get_put(self):
+        self.cache.put(self.cache.rules, {'sg1': ['rule1']},
+                       self.cache.generation)
+        self.assertEqual(({'sg1': ['rule1']}, ['sg2']),
+                         self.cache.get(self.cache.rules, ['sg1', 'sg2']))
+
+    def test_put_after_invalidate_is_dropped(self):
+        generation = self.cache.generation
+        self.cache.invalidate(['sg1'])
+        self.cache.put(self.cache.rules, {'sg1': ['rule1']}, generation)
+        self.assertEqual(({}, ['sg1']),
+                         self.cache.get(self.cache.rules, ['sg1']))
+
+    def test_invalidate_members_only(self):
+        generation = self.cache.generation
+        self.cache.put(self.cache.rules, {'sg1': ['rule1']}, generation)
+        self.cache.put(self.cache.member_ips, {'sg1': ['10.0.0.2']},
+                       generation)
+        self.cache.invalidate(['sg1'], rules=False)
+        self.assertEqual({'sg1': ['rule1']}, self.cache.rules)
+        self.assertEqual({}, self.cache.member_ips)
+
+    def test_invalidate_on_commit_outside_transaction(self):
+        self.cache.put(self.cache.rules, {'sg1': ['rule1']},
+                       self.cache.generation)
+        self.cache.invalidate_on_commit(mock.Mock(transaction=None), ['sg1'])
+        self.assertEqual({}, self.cache.rules)
+
+    def test_invalidate_on_commit(self):
+        session = mock.Mock()
+        generation = self.cache.generation
+        self.cache.put(self.cache.rules, {'sg1': ['rule1']}, generation)
+        self.cache.invalidate_on_commit(session, ['sg1'])
+        self.assertEqual({'sg1': ['rule1']}, self.cache.rules)
+        self.cache.after_commit(session)
+        self.assertEqual({}, self.cache.rules)
+        # Values read before the commit are not cached
+        self.cache.put(self.cache.rules, {'sg1': ['rule1']}, generation)
+        self.assertEqual({}, self.cache.rules)
+
+    def test_invalidate_on_commit_rolled_back(self):
+        session = mock.Mock()
+        self.cache.put(self.cache.rules, {'sg1': ['rule1']},
+                       self.cache.generation)
+        self.cache.invalidate_on_commit(session, ['sg1'])
+        self.cache.after_rollback(session)
+        self.cache.after_commit(session)
+        self.assertEqual({'sg1': ['rule1']}, self.cache.rules)
+
+    def test_invalidated_once_session_committed(self):
+        cache = sg_db_rpc.SG_INFO_CACHE
+        self.addCleanup(cache.invalidate)
+        cache.put(cache.rules, {'sg1': ['rule1']}, cache.generation)
+        session = orm.sessionmaker(bind=sa.create_engine('sqlite://'),
+                                   autocommit=True)()
+        with session.begin():
+            cache.invalidate_on_commit(session, ['sg1'])
+            self.assertIn('sg1', cache.rules)
+        self.assertNotIn('sg1', cache.rules)
+
+    def test_disabled_with_workers(self):
+        cfg.CONF.import_opt('api_workers', 'neutron.service')
+        cfg.CONF.set_override('api_workers', 2)
+        self.assertFalse(self.cache.enabled)
+        self.cache.put(self.cache.rules, {'sg1': ['rule1']},
+                       self.cache.generation)
+        self.assertEqual(({}, ['sg1']),
+                         self.cache.get(self.cache.rules, ['sg1']))
+
+
 class SGAgentRpcCallBackMixinTestCase(base.BaseTestCase):
     def setUp(self):
         super(SGAgentRpcCallBackMixinTestCase, self).setUp()
@@ -801,6 +973,7 @@ class SecurityGroupAgentRpcTestCase(base.BaseTestCase):
         self.agent.firewall = self.firewall
         rpc = mock.Mock()
         self.agent.plugin_rpc = rpc
+        self.agent.use_sg_info_rpc = False
         self.fake_device = {'device': 'fake_device',
                             'security_groups': ['fake_sgid1', 'fake_sgid2'],
                             'security_group_source_groups': ['fake_sgid2'],
@@ -878,6 +1051,77 @@ class SecurityGroupAgentRpcTestCase(base.BaseTestCase):
         self.agent.refresh_firewall([])
         self.firewall.assert_has_calls([])
 
+    def _fake_security_group_info(self):
+        security_groups = {
+            'fake_sgid1': [{'security_group_id': 'fake_sgid1',
+                            'direction': 'ingress',
+                            'ethertype': const.IPv4,
+                            'remote_group_id': 'fake_sgid2'}],
+            'fake_sgid2': [{'security_group_id': 'fake_sgid2',
+                            'direction': 'egress',
+                            'ethertype': const.IPv4}]}
+        sg_member_ips = {
+            'fake_sgid2': {const.IPv4: ['10.0.0.2', '10.0.0.3'],
+                           const.IPv6: []}}
+        device = {'device': 'fake_device',
+                  'fixed_ips': ['10.0.0.2'],
+                  'security_groups': ['fake_sgid1', 'fake_sgid2'],
+                  'security_group_source_groups': [],
+                  'security_group_rules': [{'direction': 'ingress',
+                                            'ethertype': const.IPv4,
+                                            'protocol': 'udp'}]}
+        return {'security_groups': security_groups,
+                'sg_member_ips': sg_member_ips,
+                'devices': {'fake_device': device}}
+
+    def test_prepare_devices_filter_with_sg_info_rpc(self):
+        self.agent.use_sg_info_rpc = True
+        self.agent.plugin_rpc.security_group_info_for_devices.return_value = (
+            self._fake_security_group_info())
+        self.agent.prepare_devices_filter(['fake_device'])
+        expected = {'device': 'fake_device',
+                    'fixed_ips': ['10.0.0.2'],
+                    'security_groups': ['fake_sgid1', 'fake_sgid2'],
+                    'security_group_source_groups': ['fake_sgid2'],
+                    'security_group_rules': [
+                        {'security_group_id': 'fake_sgid1',
+                         'direction': 'ingress',
+                         'ethertype': const.IPv4,
+                         'remote_group_id': 'fake_sgid2',
+                         'source_ip_prefix': '10.0.0.3/32'},
+                        {'security_group_id': 'fake_sgid2',
+                         'direction': 'egress',
+                         'ethertype': const.IPv4},
+                        {'direction': 'ingress',
+                         'ethertype': const.IPv4,
+                         'protocol': 'udp'}]}
+        self.firewall.prepare_port_filter.assert_called_once_with(expected)
+        self.assertFalse(
+            self.agent.plugin_rpc.security_group_rules_for_devices.called)
+
+    def test_prepare_devices_filter_sg_info_rpc_unsupported(self):
+        self.agent.use_sg_info_rpc = True
+        rpc = self.agent.plugin_rpc
+        rpc.security_group_info_for_devices.side_effect = (
+            rpc_common.RemoteError('UnsupportedRpcVersion'))
+        self.agent.prepare_devices_filter(['fake_device'])
+        self.agent.prepare_devices_filter(['fake_device'])
+        self.assertFalse(self.agent.use_sg_info_rpc)
+        rpc.security_group_info_for_devices.assert_called_once_with(
+            None, ['fake_device'])
+        self.assertEqual(2, rpc.security_group_rules_for_devices.call_count)
+        self.firewall.prepare_port_filter.assert_called_with(
+            self.fake_device)
+
+    def test_prepare_devices_filter_sg_info_rpc_error(self):
+        self.agent.use_sg_info_rpc = True
+        rpc = self.agent.plugin_rpc
+        rpc.security_group_info_for_devices.side_effect = (
+            rpc_common.RemoteError('DBError'))
+        self.assertRaises(rpc_common.RemoteError,
+                          self.agent.prepare_devices_filter, ['fake_device'])
+        self.assertTrue(self.agent.use_sg_info_rpc)
+
 
 class SecurityGroupAgentRpcWithDeferredRefreshTestCase(
     SecurityGroupAgentRpcTestCase):
@@ -1103,6 +1347,17 @@ class SecurityGroupServerRpcApiTestCase(base.BaseTestCase):
              version=sg_rpc.SG_RPC_VERSION,
              topic='fake_topic')])
 
+    def test_security_group_info_for_devices(self):
+        self.rpc.security_group_info_for_devices(None, ['fake_device'])
+        self.rpc.call.assert_has_calls(
+            [call(None,
+             {'args':
+                 {'devices': ['fake_device']},
+              'method': 'security_group_info_for_devices',
+              'namespace': None},
+             version=sg_rpc.SG_INFO_RPC_VERSION,
+             topic='fake_topic')])
+
 
 class FakeSGNotifierAPI(proxy.RpcProxy,
                         sg_rpc.SecurityGroupAgentRpcApiMixin):
@@ -1742,6 +1997,7 @@ class TestSecurityGroupAgentWithIptables(base.BaseTestCase):
 
         self.rpc = mock.Mock()
         self.agent.plugin_rpc = self.rpc
+        self.agent.use_sg_info_rpc = False
         rule1 = [{'direction': 'ingress',
                   'protocol': const.PROTO_NAME_UDP,
                   'ethertype': const.IPv4,
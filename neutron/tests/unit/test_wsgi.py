@@ -28,6 +28,7 @@ import webob.exc
 from neutron.api.v2 import attributes
 from neutron.common import constants
 from neutron.common import exceptions as exception
+from neutron.openstack.common import jsonutils
 from neutron.tests import base
 from neutron import wsgi
 
@@ -574,6 +575,14 @@ class DictSerializerTest(base.BaseTestCase):
         self.assertEqual(
             serializer.serialize({}, 'NonExistentAction'), '')
 
+    def test_serialize_iter(self):
+        serializer = wsgi.DictSerializer()
+        with mock.patch.object(serializer, 'serialize',
+                               return_value='') as serialize:
+            self.assertEqual(
+                [''], serializer.serialize_iter({'a': (i for i in [1, 2])}))
+        serialize.assert_called_once_with({'a': [1, 2]}, action='default')
+
 
 class JSONDictSerializerTest(base.BaseTestCase):
 
@@ -604,6 +613,32 @@ class JSONDictSerializerTest(base.BaseTestCase):
 
         self.assertEqual(result, expected_json)
 
+    def test_serialize_iter(self):
+        input_dict = {'servers': (server for server in
+                                  [{'id': 1}, {'id': u'\u7f51'}]),
+                      'links': []}
+        serializer = wsgi.JSONDictSerializer()
+        result = ''.join(serializer.serialize_iter(input_dict))
+        self.assertEqual(
+            {'servers': [{'id': 1}, {'id': u'\u7f51'}], 'links': []},
+            jsonutils.loads(result))
+
+    def test_serialize_iter_empty(self):
+        serializer = wsgi.JSONDictSerializer()
+        result = ''.join(serializer.serialize_iter(
+            {'servers': (server for server in [])}))
+        self.assertEqual({'servers': []}, jsonutils.loads(result))
+
+    def test_serialize_iter_in_chunks(self):
+        servers = [{'id': i} for i in range(10)]
+        serializer = wsgi.JSONDictSerializer()
+        with mock.patch.object(wsgi, 'STREAM_CHUNK_SIZE', new=20):
+            chunks = list(serializer.serialize_iter(
+                {'servers': (server for server in servers)}))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual({'servers': servers},
+                         jsonutils.loads(''.join(chunks)))
+
 
 class TextDeserializerTest(base.BaseTestCase):
 
@@ -26,6 +26,7 @@ import socket
 import ssl
 import sys
 import time
+import types
 from xml.etree import ElementTree as etree
 from xml.parsers import expat
 
@@ -83,6 +84,9 @@ CONF.register_opts(socket_opts)
 
 LOG = logging.getLogger(__name__)
 
+# Size, in bytes, of the chunks in which the streamed responses are written
+STREAM_CHUNK_SIZE = 65536
+
 
 class WorkerService(object):
     """Wraps a worker to be handled by ProcessLauncher"""
@@ -380,12 +384,31 @@ class ActionDispatcher(object):
         raise NotImplementedError()
 
 
+def is_streamed(data):
+    """Whether data holds collections given as iterators."""
+    return isinstance(data, dict) and any(
+        isinstance(value, types.GeneratorType) for value in data.itervalues())
+
+
 class DictSerializer(ActionDispatcher):
     """Default request body serialization."""
 
     def serialize(self, data, action='default'):
         return self.dispatch(data, action=action)
 
+    def serialize_iter(self, data, action='default'):
+        """Serialize data into an iterable of chunks.
+
+        The collections given as generators are read before being
+        serialized.
+        """
+        if is_streamed(data):
+            data = dict((key, list(value)
+                         if isinstance(value, types.GeneratorType)
+                         else value)
+                        for key, value in data.iteritems())
+        return [self.serialize(data, action=action)]
+
     def default(self, data):
         return ""
 
@@ -398,6 +421,48 @@ class JSONDictSerializer(DictSerializer):
             return unicode(obj)
         return jsonutils.dumps(data, default=sanitizer)
 
+    def serialize_iter(self, data, action='default'):
+        """Serialize data into an iterable of chunks.
+
+        The collections given as generators are written as JSON arrays as
+        they are read, in chunks of about STREAM_CHUNK_SIZE bytes, so that
+        neither the collections nor their JSON are held in memory.
+        """
+        if action != 'default' or not is_streamed(data):
+            return super(JSONDictSerializer, self).serialize_iter(data,
+                                                                  action)
+        return self._iter_chunks(data)
+
+    def _iter_parts(self, data):
+        yield '{'
+        for i, (key, value) in enumerate(data.iteritems()):
+            if i:
+                yield ', '
+            yield self.default(key) + ': '
+            if isinstance(value, types.GeneratorType):
+                yield '['
+                for j, item in enumerate(value):
+                    if j:
+                        yield ', '
+                    yield self.default(item)
+                yield ']'
+            else:
+                yield self.default(value)
+        yield '}'
+
+    def _iter_chunks(self, data):
+        chunk = []
+        size = 0
+        for part in self._iter_parts(data):
+            chunk.append(part)
+            size += len(part)
+            if size >= STREAM_CHUNK_SIZE:
+                yield ''.join(chunk)
+                chunk = []
+                size = 0
+        if chunk:
+            yield ''.join(chunk)
+
 
 class XMLDictSerializer(DictSerializer):
 